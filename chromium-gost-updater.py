@@ -19,6 +19,9 @@ Python tray updater for Chromium Gost (single-file).
 
 import sys
 import os
+import asyncio
+import base64
+import errno
 import re
 import subprocess
 import shlex
@@ -26,22 +29,166 @@ import time
 import threading
 import json
 import atexit
+import ctypes
+import select
+import socket
+import socketserver
+import hashlib
+import http.client
+import ssl
+import gzip
+import io
+import struct
+import tarfile
+import shutil
+import ipaddress
 import random
+import math
 import webbrowser
+from concurrent.futures import CancelledError as FutureCancelledError, Future
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from email.message import Message
-from urllib.request import urlopen, Request
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import unquote, urljoin, urlparse
+from urllib.request import getproxies, proxy_bypass
 from pathlib import Path
 from itertools import chain
+from xml.sax.saxutils import escape as xml_escape, quoteattr as xml_quoteattr
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 IS_WINDOWS = sys.platform == "win32"
 MIN_ARTIFACT_SIZE = 100 * 1024
 DOWNLOAD_RETRY_BASE_DELAY_SEC = 2.0
+# Платформы (расширения дистрибутивов), которые скачивает --fetch-all
+FETCH_ALL_PLATFORMS = ("deb", "rpm", "exe")
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PROGRESS_REPORT_INTERVAL_SEC = 0.25
+PROGRESS_RATE_WINDOW_SEC = 5.0
+PROGRESS_LOG_INTERVAL_SEC = 5.0
+# Таймауты по умолчанию, пока нет истории замеров сети
+DEFAULT_CONNECT_TIMEOUT_SEC = 15.0
+DEFAULT_READ_TIMEOUT_SEC = 30.0
+CONNECT_TIMEOUT_BOUNDS_SEC = (3.0, 30.0)
+READ_TIMEOUT_BOUNDS_SEC = (10.0, 60.0)
+MIRROR_PROBE_TIMEOUT_SEC = 3.0
+# Оценки зеркал старше этого срока обновляются пробным запросом
+MIRROR_SCORES_TTL_SEC = 3600
+# Зеркала сравниваются по ожидаемому времени скачивания файла такого размера
+MIRROR_REFERENCE_SIZE = 100 * 1024 * 1024
+MIRROR_SCORE_ALPHA = 0.3
+# Как часто проверять отмену, ожидая блокировку общего кэша
+SHARED_CACHE_LOCK_POLL_SEC = 1.0
+# ioctl FICLONE (linux/fs.h): reflink-копия файла на btrfs/xfs
+FICLONE = 0x40049409
+# Как часто тонкий клиент (трэй) опрашивает системную службу
+DAEMON_POLL_INTERVAL_SEC = 60
+# Одновременно выполняемые действия трея (проверка, форум, установка)
+TRAY_TASK_WORKERS = 2
+# Пачка изменений файлов (dpkg пишет status несколько раз) сводится в одно
+# событие после стольких секунд тишины
+FS_WATCH_DEBOUNCE_SEC = 2.0
+# Запас ведра токенов ([download] max_rate) в секундах передачи и самая длинная
+# пауза ожидания, после которой перечитывается скорость
+TOKEN_BUCKET_BURST_SEC = 0.05
+TOKEN_BUCKET_MAX_SLEEP_SEC = 0.25
+# Сколько выход ждёт остановки потока скачивания после отмены
+QUIT_JOIN_TIMEOUT_SEC = 0.5
+# [io] low_impact: прибавка к nice фоновых потоков и через сколько записанных
+# байт дистрибутив сбрасывается на диск и убирается из page cache
+LOW_IMPACT_NICE = 10
+PAGE_CACHE_DROP_BYTES = 8 * 1024 * 1024
+# [gui] native_io: .part пишется в пуле задач; если запись отстала на столько
+# байт, чтение из сети встаёт на паузу
+NATIVE_WRITE_BACKLOG_BYTES = 4 * 1024 * 1024
+# Ожидание ответа busctl (NetworkManager, UPower) для политики скачивания
+POLICY_PROBE_TIMEOUT_SEC = 2.0
+# --import: одновременные проверки принятых дистрибутивов; имя манифеста
+# в архиве --export (идёт первым, до файлов)
+IMPORT_VALIDATE_WORKERS = 4
+EXPORT_MANIFEST_NAME = "cache.toml"
+DAEMON_REQUEST_TIMEOUT_SEC = 60.0
 GRAPHICAL_SESSION_BOOT_WAIT_SEC = 180
 GRAPHICAL_SESSION_POLL_INTERVAL_SEC = 15
+PROFILE_ENV_VAR = "CHROMIUM_GOST_UPDATER_PROFILE"
+
+
+# -------------------------
+# Замеры времени: начало
+# -------------------------
+
+# Накопленные замеры по фазам за текущий запуск: имя фазы -> счётчики
+_PHASE_TIMINGS: dict[str, dict[str, float]] = {}
+_PHASE_TIMINGS_LOCK = threading.Lock()
+
+
+@contextmanager
+def timed_span(name: str):
+    """
+    Замерить стеночное и процессорное время участка кода.
+    Процессорное время — только текущего потока: потоки движка, пула и GUI,
+    работающие параллельно, в замер фазы не попадают.
+    Работает и как контекстный менеджер, и как декоратор.
+    Итог по всем фазам пишется в лог через log_timing_summary().
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        with _PHASE_TIMINGS_LOCK:
+            stats = _PHASE_TIMINGS.setdefault(
+                name, {"count": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0}
+            )
+            stats["count"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            stats["max_wall"] = max(stats["max_wall"], wall)
+
+
+def get_phase_timings() -> dict[str, dict[str, float]]:
+    """Копия накопленных замеров по фазам."""
+    with _PHASE_TIMINGS_LOCK:
+        return {name: dict(stats) for name, stats in _PHASE_TIMINGS.items()}
+
+
+def format_timing_summary() -> str:
+    """Однострочная сводка по фазам, упорядоченная по суммарному времени."""
+    timings = get_phase_timings()
+    parts = [
+        f"{name}: n={int(stats['count'])} wall={stats['wall']:.3f}s "
+        f"cpu={stats['cpu']:.3f}s max={stats['max_wall']:.3f}s"
+        for name, stats in sorted(
+            timings.items(), key=lambda item: item[1]["wall"], reverse=True
+        )
+    ]
+    return f"timing summary session={SESSION_ID}: " + ("; ".join(parts) or "no spans")
+
+
+def log_timing_summary() -> None:
+    """Записать сводку замеров в лог (вызывается при завершении процесса)."""
+    log_debug(format_timing_summary())
+    counters = read_proc_io(process=True)
+    if counters:
+        log_debug(f"io summary session={SESSION_ID}: {format_io_counters(counters)}")
+
+
+# -------------------------
+# Замеры времени: конец
+# -------------------------
 
 
 # Detect Desktop Environment
+@timed_span("detect_desktop_environment")
 def detect_desktop_environment() -> str:
     """Detect current desktop environment."""
     # Check XDG_CURRENT_DESKTOP first
@@ -123,10 +270,10 @@ CACHE_PACKAGES_DIR = CACHE_DIR / "packages"
 CACHE_MANIFEST_FILE = CACHE_PACKAGES_DIR / "cache.toml"
 STATE_FILE = CACHE_DIR / "state.json"
 LOCK_FILE = CACHE_DIR / "gui_instance.lock"
+# Кэш системной службы (--daemon), если не задан [paths] shared_cache_dir
+SYSTEM_CACHE_DIR = Path("/var/cache/chromium-gost-updater")
 
 REMOTE_BASE_URL = "https://update.cryptopro.ru/get/chromium-gost"
-REMOTE_VERSION_CHECK_URL = f"{REMOTE_BASE_URL}/version"
-WINDOWS_INSTALLER_URL = f"{REMOTE_BASE_URL}/windows/386/installer"
 
 # Генерируем случайный положительный long идентификатор сессии
 SESSION_ID = random.randint(1, 2**63 - 1)
@@ -195,6 +342,116 @@ def _is_html_response(content_type: str | None, data: bytes) -> bool:
     return start.startswith(b"<") or start.startswith(b"<!doctype")
 
 
+def _content_length(headers) -> int | None:
+    """Размер тела ответа из Content-Length или None, если сервер его не сообщил."""
+    value = headers.get("Content-Length") if headers is not None else None
+    try:
+        length = int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+    return length if length is not None and length >= 0 else None
+
+
+def _content_range_start(response) -> int:
+    """Смещение начала тела для ответа 206 (Content-Range: bytes N-M/T), иначе 0."""
+    if response.status != 206:
+        return 0
+    match = re.match(r"\s*bytes\s+(\d+)-", response.headers.get("Content-Range") or "")
+    return int(match.group(1)) if match else 0
+
+
+def _partial_path(dest: Path) -> Path:
+    """Файл, в который принимается dest до завершения скачивания."""
+    return dest.with_name(dest.name + ".part")
+
+
+def _committed_path(part: Path) -> Path:
+    """Имя, под которым принятый в .part файл попадает в кэш."""
+    return part.with_name(part.name.removesuffix(".part"))
+
+
+def _validator_path(part: Path) -> Path:
+    """
+    Файл рядом с .part с валидатором ответа (ETag или Last-Modified), по которому
+    докачка отправляет If-Range: изменившийся на сервере файл придёт целиком.
+    """
+    return part.with_name(part.name + ".validator")
+
+
+def _response_validator(headers) -> str | None:
+    """Валидатор для If-Range: сильный ETag, иначе Last-Modified."""
+    etag = (headers.get("ETag") or "").strip()
+    if etag and not etag.startswith("W/"):
+        return etag
+    return (headers.get("Last-Modified") or "").strip() or None
+
+
+def _read_validator(part: Path) -> str | None:
+    try:
+        return _validator_path(part).read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+
+def _save_validator(part: Path, validator: str | None) -> None:
+    """Запомнить валидатор принимаемого в part ответа (None — убрать прежний)."""
+    path = _validator_path(part)
+    if validator is None:
+        path.unlink(missing_ok=True)
+    else:
+        path.write_text(validator + "\n", encoding="utf-8")
+
+
+def _discard_partial(part: Path) -> None:
+    """Удалить .part вместе с его валидатором, ошибки игнорируются."""
+    for path in (part, _validator_path(part)):
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+def _preallocate(f, offset: int, total: int | None) -> None:
+    """
+    Зарезервировать место под файл целиком (posix_fallocate), если размер известен:
+    меньше фрагментов и обновлений метаданных, нехватка места видна сразу.
+    """
+    if total is None or total <= offset or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), offset, total - offset)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        log_debug(f"cache: posix_fallocate failed: {e}")
+
+
+def _commit_partial(part: Path) -> Path:
+    """
+    Положить проверенный файл из .part в кэш под постоянным именем (os.replace):
+    читатели кэша видят либо прежнее состояние, либо файл целиком.
+    [download] durability: data — данные на диске до переименования,
+    full — и запись в каталоге, none — сброс на диск решает ОС.
+    """
+    dest = _committed_path(part)
+    durability = CONFIG.download_durability()
+    if durability != "none":
+        with part.open("r+b") as f:
+            if durability == "full" or not hasattr(os, "fdatasync"):
+                os.fsync(f.fileno())
+            else:
+                os.fdatasync(f.fileno())
+    os.replace(part, dest)
+    _validator_path(part).unlink(missing_ok=True)
+    if durability == "full" and not IS_WINDOWS:
+        fd = os.open(dest.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return dest
+
+
 def _filename_from_content_disposition(header_value: str | None) -> str | None:
     if not header_value:
         return None
@@ -267,10 +524,12 @@ def validate_linux_package_file(path: Path, extension: str) -> bool:
         return False
 
 
+@timed_span("validate_artifact")
 def validate_artifact(path: Path, extension: str) -> bool:
-    if IS_WINDOWS:
-        return validate_pe_artifact(path)
-    return validate_linux_package_file(path, extension)
+    with low_impact_io(f"validate {path.name}"):
+        if extension == "exe":
+            return validate_pe_artifact(path)
+        return validate_linux_package_file(path, extension)
 
 
 def open_installer_folder(package_path: Path) -> None:
@@ -405,6 +664,24 @@ class Config:
         except ValueError:
             return default
 
+    def __list_or_default(self, section: str, key: str, default: list[str]) -> list[str]:
+        value = self.__delegate.get(section, {}).get(key)
+        if value is None:
+            return default
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list):
+            return default
+        return [str(item).strip() for item in value if str(item).strip()]
+
+    def shared_cache_dir(self) -> Path | None:
+        """
+        Возвращаем общий для пользователей хоста каталог кэша дистрибутивов
+        или None, если общий кэш не используется.
+        """
+        value = self.__str_or_default("paths", "shared_cache_dir", "").strip()
+        return Path(value).expanduser() if value else None
+
     def tmp_dir(self) -> Path:
         """
         Возвращаем путь к временной директории.
@@ -417,6 +694,12 @@ class Config:
         """
         return self.__int_or_default("download", "retries", 5)
 
+    def download_retry_max_delay(self) -> int:
+        """
+        Возвращаем максимальную паузу (в секундах) между попытками загрузки.
+        """
+        return self.__int_or_default("download", "retry_max_delay", 60)
+
     def auth_password_attempts(self) -> int:
         """
         Возвращаем количество попыток ввода пароля при установке пакета.
@@ -429,12 +712,220 @@ class Config:
         """
         return self.__int_or_default("timing", "check_remote_interval", 3600)
 
+    def timing_spread(self) -> int:
+        """
+        Возвращаем разброс (в секундах) для сдвига проверок хоста внутри периода;
+        0 — без сдвига. Не больше периода проверки.
+        """
+        spread = self.__int_or_default("timing", "spread", 0)
+        return max(0, min(spread, self.timing_check_remote_interval()))
+
     def keep_cached_distributive_in_days(self) -> int:
         """
         Возвращаем количество дней, в течение которых хранить кэшированные дистрибутивы.
         """
         return self.__int_or_default("download", "keep_cached_distributive_in_days", 30)
 
+    def download_max_rate(self) -> int:
+        """
+        Возвращаем ограничение скорости скачивания (байт/с); 0 — без ограничения.
+        """
+        return self.__int_or_default("download", "max_rate", 0)
+
+    def download_max_rate_shared(self) -> bool:
+        """
+        Возвращаем, делят ли одновременные скачивания процесса (--fetch-all)
+        один бюджет max_rate, а не получают его каждое.
+        """
+        return self.__int_or_default("download", "max_rate_shared", 1) != 0
+
+    def download_stall_min_rate(self) -> int:
+        """
+        Возвращаем минимальную скорость скачивания (байт/с) по скользящему окну,
+        ниже которой передача считается зависшей.
+        """
+        return self.__int_or_default("download", "stall_min_rate", 1024)
+
+    def download_stall_window(self) -> int:
+        """
+        Возвращаем длину окна (в секундах) для обнаружения зависшей передачи.
+        """
+        return self.__int_or_default("download", "stall_window", 30)
+
+    def download_durability(self) -> str:
+        """
+        Возвращаем, что сбрасывать на диск перед тем, как скачанный файл займёт
+        своё место в кэше: none, data (содержимое) или full (содержимое и каталог).
+        """
+        value = self.__str_or_default("download", "durability", "data")
+        value = value.strip().lower()
+        return value if value in ("none", "data", "full") else "data"
+
+    def __action_or_default(self, section: str, key: str, default: str) -> str:
+        value = self.__str_or_default(section, key, default).strip().lower()
+        return value if value in ("allow", "slow", "defer") else default
+
+    def schedule_metered(self) -> str:
+        """
+        Возвращаем, что делать со скачиванием на лимитном подключении
+        (NetworkManager Metered): allow, slow или defer.
+        """
+        return self.__action_or_default("schedule", "metered", "defer")
+
+    def schedule_battery(self) -> str:
+        """
+        Возвращаем, что делать со скачиванием при питании от батареи (UPower OnBattery).
+        """
+        return self.__action_or_default("schedule", "battery", "slow")
+
+    def schedule_busy(self) -> str:
+        """
+        Возвращаем, что делать со скачиванием под высокой нагрузкой (max_load_percent,
+        max_pressure).
+        """
+        return self.__action_or_default("schedule", "busy", "slow")
+
+    def schedule_max_load_percent(self) -> int:
+        """
+        Возвращаем порог загрузки: loadavg за минуту на одно ядро, в процентах;
+        0 — не учитывать.
+        """
+        return self.__int_or_default("schedule", "max_load_percent", 150)
+
+    def schedule_max_pressure(self) -> int:
+        """
+        Возвращаем порог PSI (some avg10 из /proc/pressure/cpu и io, проценты);
+        0 — не учитывать.
+        """
+        return self.__int_or_default("schedule", "max_pressure", 40)
+
+    def schedule_slow_rate(self) -> int:
+        """
+        Возвращаем скорость (байт/с), до которой замедляется скачивание в режиме slow.
+        """
+        return self.__int_or_default("schedule", "slow_rate", 256 * 1024)
+
+    def schedule_recheck_interval(self) -> int:
+        """
+        Возвращаем, как часто (секунды) перепроверять условия, пока скачивание
+        отложено или идёт.
+        """
+        return self.__int_or_default("schedule", "recheck_interval", 300)
+
+    def io_low_impact(self) -> bool:
+        """
+        Возвращаем, работать ли с диском в фоне бережно: класс ввода-вывода idle,
+        nice для фоновых потоков, дистрибутив не задерживается в page cache.
+        """
+        return self.__int_or_default("io", "low_impact", 0) != 0
+
+    def circuit_breaker_failure_threshold(self) -> int:
+        """
+        Возвращаем число ошибок подряд, после которого запросы к серверу приостанавливаются.
+        """
+        return self.__int_or_default("circuit_breaker", "failure_threshold", 3)
+
+    def circuit_breaker_open_seconds(self) -> int:
+        """
+        Возвращаем начальную паузу (в секундах) после размыкания; растёт вдвое при повторах.
+        """
+        return self.__int_or_default("circuit_breaker", "open_seconds", 300)
+
+    def circuit_breaker_max_open_seconds(self) -> int:
+        """
+        Возвращаем максимальную паузу (в секундах) после размыкания.
+        """
+        return self.__int_or_default("circuit_breaker", "max_open_seconds", 3600)
+
+    def server_bind(self) -> str:
+        """
+        Возвращаем адрес, на котором режим --serve раздаёт кэш.
+        """
+        return self.__str_or_default("server", "bind", "0.0.0.0")
+
+    def server_port(self) -> int:
+        """
+        Возвращаем порт HTTP-сервера режима --serve.
+        """
+        return self.__int_or_default("server", "port", 8080)
+
+    def gui_native_io(self) -> bool:
+        """
+        Возвращаем, выполнять ли проверки и скачивания трея средствами главного
+        цикла GUI (QNetworkAccessManager/QTimer) вместо отдельных потоков.
+        """
+        return self.__int_or_default("gui", "native_io", 0) != 0
+
+    def repo_enabled(self) -> bool:
+        """
+        Возвращаем, поддерживать ли в каталоге кэша индексы репозиториев apt (Packages,
+        Release) и yum/dnf (repodata/) для установки штатным менеджером пакетов.
+        """
+        return self.__int_or_default("repo", "enabled", 0) != 0
+
+    def daemon_socket(self) -> Path:
+        """
+        Возвращаем путь к unix-сокету, через который системная служба (--daemon)
+        публикует результат проверки для трэев пользователей.
+        """
+        return Path(
+            self.__str_or_default(
+                "daemon", "socket", "/run/chromium-gost-updater/daemon.sock"
+            )
+        )
+
+    def p2p_enabled(self) -> bool:
+        """
+        Возвращаем, включён ли обмен дистрибутивами с соседними машинами ([p2p] enabled).
+        """
+        return self.__int_or_default("p2p", "enabled", 0) != 0
+
+    def p2p_group(self) -> str:
+        """
+        Возвращаем multicast-группу для поиска соседей с нужным дистрибутивом.
+        """
+        return self.__str_or_default("p2p", "group", "239.255.77.77")
+
+    def p2p_port(self) -> int:
+        """
+        Возвращаем UDP-порт для запросов и ответов о наличии дистрибутива.
+        """
+        return self.__int_or_default("p2p", "port", 47677)
+
+    def p2p_http_port(self) -> int:
+        """
+        Возвращаем порт HTTP-сервера, с которого соседи скачивают наш кэш.
+        """
+        return self.__int_or_default("p2p", "http_port", 47678)
+
+    def p2p_discovery_timeout_ms(self) -> int:
+        """
+        Возвращаем время ожидания ответов соседей (миллисекунды).
+        """
+        return self.__int_or_default("p2p", "discovery_timeout_ms", 500)
+
+    def p2p_trust_peers(self) -> bool:
+        """
+        Возвращаем, можно ли принимать файл соседа по SHA-256 из его же ответа
+        ([p2p] trust_peers), когда сверить хеш не с чем: сервер не отдаёт
+        <файл>.sha256, а общего кэша нет.
+        """
+        return self.__int_or_default("p2p", "trust_peers", 0) != 0
+
+    def mirror_urls(self) -> list[str]:
+        """
+        Возвращаем базовые адреса зеркал (аналоги REMOTE_BASE_URL) из [mirrors] urls.
+        """
+        return self.__list_or_default("mirrors", "urls", [])
+
+    def metrics_textfile_dir(self) -> Path | None:
+        """
+        Возвращаем директорию textfile collector node_exporter для файла .prom
+        или None, если экспорт метрик выключен.
+        """
+        value = self.__str_or_default("metrics", "textfile_dir", "").strip()
+        return Path(value).expanduser() if value else None
+
 
 CONFIG: Config = Config()
 
@@ -443,6 +934,173 @@ CONFIG: Config = Config()
 # -------------------------
 
 
+# -------------------------
+# Ввод-вывод с низким приоритетом: начало
+# -------------------------
+
+# linux/ioprio.h
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_IDLE = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+# Номера системных вызовов (ioprio_set, ioprio_get) по архитектурам
+_IOPRIO_SYSCALLS = {
+    "x86_64": (251, 252),
+    "i386": (289, 290),
+    "i686": (289, 290),
+    "aarch64": (30, 31),
+    "riscv64": (30, 31),
+    "loongarch64": (30, 31),
+    "armv7l": (314, 315),
+    "ppc64le": (273, 274),
+    "s390x": (282, 283),
+}
+_PROC_IO_FIELDS = (
+    "rchar",
+    "wchar",
+    "read_bytes",
+    "write_bytes",
+    "cancelled_write_bytes",
+)
+# Потоки, которым уже понижен nice (повысить обратно без прав нельзя)
+_NICED_THREADS: set[int] = set()
+_NICED_THREADS_LOCK = threading.Lock()
+
+
+def _ioprio_call(index: int, *args: int) -> int | None:
+    """ioprio_set (index 0) или ioprio_get (1) для текущего потока; None — не вышло."""
+    numbers = _IOPRIO_SYSCALLS.get(os.uname().machine) if hasattr(os, "uname") else None
+    if numbers is None:
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        result = libc.syscall(numbers[index], IOPRIO_WHO_PROCESS, 0, *args)
+    except (OSError, AttributeError):
+        return None
+    return result if result >= 0 else None
+
+
+def _lower_thread_nice() -> None:
+    if threading.current_thread() is threading.main_thread():
+        # Главный поток ведёт GUI; nice обратно не поднять
+        return
+    thread_id = threading.get_native_id()
+    with _NICED_THREADS_LOCK:
+        if thread_id in _NICED_THREADS:
+            return
+        _NICED_THREADS.add(thread_id)
+    try:
+        os.nice(LOW_IMPACT_NICE)
+    except (OSError, AttributeError):
+        pass
+
+
+def read_proc_io(process: bool = False) -> dict[str, int]:
+    """
+    Счётчики ввода-вывода текущего потока (/proc/thread-self/io, на старых
+    ядрах — /proc/self/io) или, с process=True, всего процесса.
+    """
+    paths = ("/proc/thread-self/io", "/proc/self/io")
+    for path in paths[1:] if process else paths:
+        try:
+            text = Path(path).read_text(encoding="ascii")
+        except OSError:
+            continue
+        counters = {}
+        for line in text.splitlines():
+            name, _, value = line.partition(":")
+            if name in _PROC_IO_FIELDS and value.strip().isdigit():
+                counters[name] = int(value)
+        return counters
+    return {}
+
+
+def format_io_counters(counters: dict[str, int]) -> str:
+    return " ".join(
+        f"{name}={counters[name]}" for name in _PROC_IO_FIELDS if name in counters
+    )
+
+
+@contextmanager
+def io_report(name: str):
+    """
+    Записать в лог, сколько участок прочитал и записал (/proc/self/io):
+    rchar/wchar — всего, с учётом page cache; read_bytes/write_bytes — с диска
+    и на диск; разница показывает, сколько осело в page cache.
+    """
+    before = read_proc_io()
+    try:
+        yield
+    finally:
+        if before:
+            after = read_proc_io()
+            delta = {key: after[key] - before.get(key, 0) for key in after}
+            log_debug(f"io {name}: {format_io_counters(delta)}")
+
+
+@contextmanager
+def low_impact_io(name: str):
+    """
+    Фоновая работа с диском ([io] low_impact): на время участка класс
+    ввода-вывода потока — idle, фоновому потоку ещё и nice +LOW_IMPACT_NICE.
+    """
+    if not CONFIG.io_low_impact() or IS_WINDOWS:
+        with io_report(name):
+            yield
+        return
+    previous = _ioprio_call(1)
+    changed = previous not in (None, IOPRIO_IDLE) and _ioprio_call(0, IOPRIO_IDLE) == 0
+    _lower_thread_nice()
+    try:
+        with io_report(name):
+            yield
+    finally:
+        if changed:
+            _ioprio_call(0, previous)
+
+
+def _low_impact_thread() -> None:
+    """Инициализатор фонового потока для диска: класс idle и nice насовсем."""
+    if CONFIG.io_low_impact() and not IS_WINDOWS:
+        _ioprio_call(0, IOPRIO_IDLE)
+        _lower_thread_nice()
+
+
+def advise_sequential(f) -> None:
+    """Подсказка ядру: файл читается подряд (больше упреждающего чтения)."""
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except (AttributeError, OSError):
+        pass
+
+
+def drop_page_cache(f, start: int = 0, end: int | None = None) -> int:
+    """
+    [io] low_impact: записать на диск и убрать из page cache байты файла f
+    с start до end (по умолчанию — до текущей позиции), чтобы дистрибутив
+    не вытеснял рабочие данные пользователя. Возвращает end.
+    """
+    if f.writable():
+        f.flush()
+    if end is None:
+        end = f.tell()
+    if not CONFIG.io_low_impact() or end <= start:
+        return end
+    try:
+        if f.writable():
+            # Грязные страницы DONTNEED не выбрасывает: сначала на диск
+            os.fdatasync(f.fileno())
+        os.posix_fadvise(f.fileno(), start, end - start, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError) as e:
+        log_debug(f"io: posix_fadvise failed: {e}")
+    return end
+
+
+# -------------------------
+# Ввод-вывод с низким приоритетом: конец
+# -------------------------
+
+
 # -------------------------
 # state functions
 # -------------------------
@@ -460,9 +1118,68 @@ def load_state() -> dict:
 
 
 def save_state(state: dict) -> None:
-    STATE_FILE.write_text(
-        json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    """
+    Записать state.json атомарно: временный файл + os.replace, чтобы другой
+    процесс (демон, второй экземпляр) не прочитал файл наполовину записанным.
+    """
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_name(f".{STATE_FILE.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_text(
+            json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        os.replace(tmp, STATE_FILE)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+_STATE_LOCK = threading.RLock()
+_state_lock_depth = 0
+
+
+@contextmanager
+def _state_file_lock():
+    """
+    Межпроцессная блокировка state.json: flock на соседнем файле state.json.lock.
+    Внутри процесса её дополняет _STATE_LOCK (flock привязан к открытому файлу,
+    а не к потоку); повторный захват тем же потоком не блокируется.
+    Без fcntl (Windows) — только блокировка внутри процесса.
+    """
+    global _state_lock_depth
+    with _STATE_LOCK:
+        if fcntl is None or _state_lock_depth:
+            _state_lock_depth += 1
+            try:
+                yield
+            finally:
+                _state_lock_depth -= 1
+            return
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = STATE_FILE.with_name(STATE_FILE.name + ".lock")
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            _state_lock_depth = 1
+            try:
+                yield
+            finally:
+                _state_lock_depth = 0
+        finally:
+            os.close(fd)
+
+
+def update_state(mutator) -> dict:
+    """
+    Перечитать state.json, изменить его функцией mutator(state) и сохранить.
+    Так разные части программы и разные процессы обновляют свои разделы,
+    не затирая чужие: чтение-изменение-запись идёт под _state_file_lock.
+    """
+    with _state_file_lock():
+        state = load_state()
+        mutator(state)
+        save_state(state)
+        return state
 
 
 # -------------------------
@@ -524,7 +1241,12 @@ class PackageManager:
         """
         raise NotImplementedError
 
+    def database_paths(self) -> list[Path]:
+        """Файлы базы установленных пакетов: их изменение — установка или удаление."""
+        return []
+
     @classmethod
+    @timed_span("package_manager_detect")
     def create(cls) -> "PackageManager":
         """
         Метод-фабрика для создания реализации менеджера пакетов.
@@ -612,6 +1334,9 @@ class DebPackageManager(PackageManager):
     def get_extension(self) -> str:
         return "deb"
 
+    def database_paths(self) -> list[Path]:
+        return [Path("/var/lib/dpkg/status")]
+
 
 class RpmPackageManager(PackageManager):
     """
@@ -655,6 +1380,15 @@ class RpmPackageManager(PackageManager):
     def get_extension(self) -> str:
         return "rpm"
 
+    def database_paths(self) -> list[Path]:
+        # rpm >= 4.16 хранит базу в sqlite, старые версии — в Berkeley DB
+        candidates = [
+            Path("/usr/lib/sysimage/rpm/rpmdb.sqlite"),
+            Path("/var/lib/rpm/rpmdb.sqlite"),
+            Path("/var/lib/rpm/Packages"),
+        ]
+        return [path for path in candidates if path.parent.is_dir()]
+
 
 class WindowsPackageManager(PackageManager):
     """Версия браузера из реестра Windows, скачивание .exe инсталлера."""
@@ -742,28 +1476,474 @@ PACKAGE_MANAGER: PackageManager = PackageManager.create()
 # -------------------------
 
 # -------------------------
-# Загрузчик пакетов: начало
+# Сетевой движок asyncio: начало
 # -------------------------
 
-_CACHE_PKG_DEB_PATTERN = re.compile(
-    r"^chromium-gost-(.+)-linux-amd64\.(deb|rpm)$", re.IGNORECASE
-)
-_CACHE_PKG_EXE_PATTERN = re.compile(
-    r"^chromium-gost-(.+)-installer\.exe$", re.IGNORECASE
-)
+_HTTP_MAX_REDIRECTS = 10
+_HTTP_MAX_HEADER_LINES = 100
 
 
-def _toml_quote_string(value: str) -> str:
-    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
-    return f'"{escaped}"'
+class DownloadCancelledError(Exception):
+    """Сетевая операция отменена (выход из приложения или отмена скачивания)."""
 
 
-def _toml_quote_table_key(key: str) -> str:
+class CancelToken:
+    """
+    Кооперативная отмена: cancel() будит ожидающих (паузы между попытками,
+    ожидание блокировки общего кэша) и вызывает обработчики on_cancel, например
+    отмену сетевой операции в NETWORK_ENGINE. Токен отменяется вместе с любым
+    из родителей. is_set/wait совместимы с threading.Event.
+    """
+
+    def __init__(self, *parents: "CancelToken | None"):
+        self.__event = threading.Event()
+        self.__lock = threading.Lock()
+        self.__callbacks: list = []
+        self.__detach = [
+            parent.on_cancel(self.cancel) for parent in parents if parent is not None
+        ]
+
+    def is_set(self) -> bool:
+        return self.__event.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.__event.wait(timeout)
+
+    def cancel(self) -> None:
+        with self.__lock:
+            if self.__event.is_set():
+                return
+            self.__event.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log_debug(f"cancel: callback failed: {e}")
+
+    def on_cancel(self, callback):
+        """
+        Вызвать callback() при отмене (сразу, если уже отменён).
+        Возвращает функцию, снимающую обработчик.
+        """
+        with self.__lock:
+            if not self.__event.is_set():
+                self.__callbacks.append(callback)
+
+                def remove() -> None:
+                    with self.__lock:
+                        if callback in self.__callbacks:
+                            self.__callbacks.remove(callback)
+
+                return remove
+        callback()
+        return lambda: None
+
+    def close(self) -> None:
+        """Отвязаться от родителей, когда операция завершена."""
+        for detach in self.__detach:
+            detach()
+        self.__detach = []
+
+
+async def _read_response_head(reader) -> tuple[int, str, "http.client.HTTPMessage"]:
+    """Прочитать строку статуса и заголовки ответа; промежуточные 1xx пропускаются."""
+    while True:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed before response")
+        parts = status_line.decode("iso-8859-1").rstrip("\r\n").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+            raise ConnectionError(f"bad status line: {status_line[:80]!r}")
+        raw = b""
+        for _ in range(_HTTP_MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            raw += line
+        else:
+            raise ConnectionError("too many response headers")
+        status = int(parts[1])
+        if 100 <= status < 200:
+            continue
+        headers = http.client.parse_headers(io.BytesIO(raw + b"\r\n"))
+        return status, parts[2] if len(parts) > 2 else "", headers
+
+
+def _proxy_for(url: str) -> str | None:
+    """Прокси для url из переменных окружения (http_proxy, https_proxy, no_proxy)."""
+    parts = urlparse(url)
+    proxy = getproxies().get(parts.scheme)
+    if not proxy or proxy_bypass(parts.hostname or ""):
+        return None
+    return proxy if "://" in proxy else f"http://{proxy}"
+
+
+def _proxy_authorization(proxy: str) -> str | None:
+    parts = urlparse(proxy)
+    if parts.username is None:
+        return None
+    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+    return "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+
+class AsyncHttpResponse:
+    """
+    Ответ HTTP/1.1 поверх потоков asyncio: статус, заголовки и тело с учётом
+    Content-Length и chunked. read() отдаёт то, что уже пришло, не дожидаясь
+    полного блока. Каждое чтение ограничено read_timeout.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        reason: str,
+        headers,
+        reader,
+        writer,
+        method: str,
+    ):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.read_timeout: float | None = None
+        self.__reader = reader
+        self.__writer = writer
+        self.__chunked = "chunked" in (headers.get("Transfer-Encoding") or "").lower()
+        self.__remaining = None if self.__chunked else _content_length(headers)
+        self.__chunk_left = 0
+        self.__eof = method == "HEAD" or status in (204, 304) or self.__remaining == 0
+
+    async def __wait(self, awaitable):
+        try:
+            return await asyncio.wait_for(awaitable, self.read_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"read timed out after {self.read_timeout}s") from None
+
+    async def read(self, size: int = DOWNLOAD_CHUNK_SIZE) -> bytes:
+        """Прочитать до size байт тела; b"" — тело закончилось."""
+        if self.__eof:
+            return b""
+        if self.__chunked:
+            return await self.__read_chunked(size)
+        if self.__remaining is None:
+            data = await self.__wait(self.__reader.read(size))
+            self.__eof = not data
+            return data
+        data = await self.__wait(self.__reader.read(min(size, self.__remaining)))
+        if not data:
+            raise ConnectionError(f"connection closed, {self.__remaining} bytes missing")
+        self.__remaining -= len(data)
+        self.__eof = self.__remaining == 0
+        return data
+
+    async def __read_chunked(self, size: int) -> bytes:
+        if self.__chunk_left == 0:
+            line = await self.__wait(self.__reader.readline())
+            try:
+                self.__chunk_left = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise ConnectionError(f"bad chunk header: {line[:40]!r}") from None
+            if self.__chunk_left == 0:
+                # Завершающие заголовки (trailer) до пустой строки
+                trailer = await self.__wait(self.__reader.readline())
+                while trailer not in (b"\r\n", b"\n", b""):
+                    trailer = await self.__wait(self.__reader.readline())
+                self.__eof = True
+                return b""
+        data = await self.__wait(self.__reader.read(min(size, self.__chunk_left)))
+        if not data:
+            raise ConnectionError("connection closed inside chunk")
+        self.__chunk_left -= len(data)
+        if self.__chunk_left == 0:
+            await self.__wait(self.__reader.readline())
+        return data
+
+    async def read_all(self) -> bytes:
+        parts = []
+        while chunk := await self.read():
+            parts.append(chunk)
+        return b"".join(parts)
+
+    def close(self) -> None:
+        self.__writer.close()
+
+    async def __aenter__(self) -> "AsyncHttpResponse":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+
+class NetworkEngine:
+    """
+    Сетевой ввод-вывод на asyncio (только stdlib): проверки версии, пробы зеркал
+    и скачивания — корутины в одном фоновом потоке с циклом событий, сколько бы
+    передач ни шло одновременно. Синхронный код (Downloader) получает результат
+    через submit(...).result(); cancel() прерывает корутину на ближайшем await.
+    Прокси берутся из окружения, как у urlopen.
+    """
+
+    def __init__(self):
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__thread: threading.Thread | None = None
+        self.__lock = threading.Lock()
+        self.__ssl_context: ssl.SSLContext | None = None
+        # future -> задача в цикле; используется только из потока цикла
+        self.__tasks: dict[Future, asyncio.Task] = {}
+        self.__disk: ThreadPoolExecutor | None = None
+
+    def __ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self.__lock:
+            if self.__loop is None or self.__loop.is_closed():
+                loop = asyncio.new_event_loop()
+
+                def run() -> None:
+                    # Здесь же пишутся скачиваемые файлы: [io] low_impact
+                    with low_impact_io("network-loop"):
+                        loop.run_forever()
+
+                self.__thread = threading.Thread(
+                    target=run, name="network-loop", daemon=True
+                )
+                self.__thread.start()
+                self.__loop = loop
+            return self.__loop
+
+    def submit(self, coro) -> Future:
+        """
+        Запустить корутину в цикле движка; возвращает concurrent.futures.Future.
+        Отменённая через cancel() операция завершается DownloadCancelledError.
+        """
+        if threading.current_thread() is self.__thread:
+            coro.close()
+            raise RuntimeError("blocking call from the network loop thread")
+        future: Future = Future()
+        loop = self.__ensure_loop()
+
+        def done(task: asyncio.Task) -> None:
+            self.__tasks.pop(future, None)
+            if task.cancelled():
+                future.set_exception(DownloadCancelledError("network operation cancelled"))
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        def start() -> None:
+            if not future.set_running_or_notify_cancel():
+                coro.close()
+                return
+            task = loop.create_task(coro)
+            self.__tasks[future] = task
+            task.add_done_callback(done)
+
+        loop.call_soon_threadsafe(start)
+        return future
+
+    async def run_blocking(self, fn):
+        """
+        Выполнить fn() (fdatasync, state.json под flock и другие долгие вызовы)
+        в отдельном потоке, не останавливая цикл событий. При отмене дожидаемся
+        завершения fn: файл, с которым она работает, закрывается только после неё.
+        """
+        with self.__lock:
+            if self.__disk is None:
+                # Несколько потоков: ожидание flock state.json одной передачей
+                # не задерживает сброс page cache остальных
+                self.__disk = ThreadPoolExecutor(
+                    max_workers=4,
+                    thread_name_prefix="network-disk",
+                    initializer=_low_impact_thread,
+                )
+            executor = self.__disk
+        future = asyncio.get_running_loop().run_in_executor(executor, fn)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    def cancel(self, future: Future) -> None:
+        """
+        Отменить операцию. Future завершается, когда корутина обработала
+        CancelledError (закрыла соединение, удалила недокачанный файл).
+        """
+        if future.cancel():
+            return
+        loop = self.__loop
+        if loop is None or loop.is_closed():
+            return
+
+        def cancel_task() -> None:
+            task = self.__tasks.get(future)
+            if task is not None:
+                task.cancel()
+
+        loop.call_soon_threadsafe(cancel_task)
+
+    def close(self) -> None:
+        """Остановить цикл; незавершённые корутины не продолжаются."""
+        with self.__lock:
+            loop, self.__loop = self.__loop, None
+            disk, self.__disk = self.__disk, None
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(loop.stop)
+        if disk is not None:
+            disk.shutdown(wait=False)
+
+    def __ssl(self) -> ssl.SSLContext:
+        if self.__ssl_context is None:
+            self.__ssl_context = ssl.create_default_context()
+        return self.__ssl_context
+
+    async def open(
+        self,
+        url: str,
+        method: str = "GET",
+        headers: dict[str, str] | None = None,
+        timeout: float | None = None,
+    ) -> AsyncHttpResponse:
+        """
+        Выполнить запрос и вернуть ответ, когда пришли заголовки (timeout — на
+        соединение и заголовки). Редиректы отслеживаются; статус >= 400 — HTTPError,
+        как у urlopen, чтобы Retry-After и предохранитель работали по-прежнему.
+        """
+        for _ in range(_HTTP_MAX_REDIRECTS + 1):
+            try:
+                response = await asyncio.wait_for(
+                    self.__request(url, method, headers or {}), timeout
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"timed out after {timeout}s: {url}") from None
+            location = response.headers.get("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.close()
+                url = urljoin(url, location)
+                if response.status == 303 and method != "HEAD":
+                    method = "GET"
+                continue
+            if response.status >= 400:
+                response.close()
+                raise HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+            return response
+        raise HTTPError(url, response.status, "too many redirects", response.headers, None)
+
+    async def __request(self, url: str, method: str, headers: dict[str, str]):
+        parts = urlparse(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"unsupported URL: {url}")
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        authority = parts.netloc.rpartition("@")[2]
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        request_headers = {
+            "Host": authority,
+            "Accept-Encoding": "identity",
+            "Connection": "close",
+            **headers,
+        }
+
+        proxy = _proxy_for(url)
+        if proxy is None:
+            reader, writer = await asyncio.open_connection(
+                parts.hostname,
+                port,
+                ssl=self.__ssl() if secure else None,
+                server_hostname=parts.hostname if secure else None,
+            )
+        else:
+            proxy_parts = urlparse(proxy)
+            authorization = _proxy_authorization(proxy)
+            reader, writer = await asyncio.open_connection(
+                proxy_parts.hostname, proxy_parts.port or 80
+            )
+            if not secure:
+                target = url
+                if authorization:
+                    request_headers["Proxy-Authorization"] = authorization
+            else:
+                # HTTPS через прокси: туннель CONNECT, затем TLS поверх него
+                connect = f"CONNECT {parts.hostname}:{port} HTTP/1.1\r\n"
+                connect += f"Host: {parts.hostname}:{port}\r\n"
+                if authorization:
+                    connect += f"Proxy-Authorization: {authorization}\r\n"
+                writer.write((connect + "\r\n").encode("iso-8859-1"))
+                status, reason, _ = await _read_response_head(reader)
+                if status != 200:
+                    writer.close()
+                    raise ConnectionError(f"proxy CONNECT failed: {status} {reason}")
+                await writer.start_tls(self.__ssl(), server_hostname=parts.hostname)
+
+        try:
+            head = f"{method} {target} HTTP/1.1\r\n" + "".join(
+                f"{key}: {value}\r\n" for key, value in request_headers.items()
+            )
+            writer.write((head + "\r\n").encode("iso-8859-1"))
+            await writer.drain()
+            status, reason, response_headers = await _read_response_head(reader)
+        except BaseException:
+            writer.close()
+            raise
+        return AsyncHttpResponse(
+            url, status, reason, response_headers, reader, writer, method
+        )
+
+
+NETWORK_ENGINE = NetworkEngine()
+
+# -------------------------
+# Сетевой движок asyncio: конец
+# -------------------------
+
+# -------------------------
+# Загрузчик пакетов: начало
+# -------------------------
+
+_CACHE_PKG_DEB_PATTERN = re.compile(
+    r"^chromium-gost-(.+)-linux-amd64\.(deb|rpm)$", re.IGNORECASE
+)
+_CACHE_PKG_EXE_PATTERN = re.compile(
+    r"^chromium-gost-(.+)-installer\.exe$", re.IGNORECASE
+)
+
+
+def _toml_quote_string(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _toml_quote_table_key(key: str) -> str:
     if re.fullmatch(r"[A-Za-z0-9_-]+", key):
         return key
     return _toml_quote_string(key)
 
 
+def _serialize_manifest_entry(info: dict) -> list[str]:
+    lines: list[str] = []
+    for field in ("file", "downloaded_at", "status", "sha256"):
+        if field not in info:
+            continue
+        val = info[field]
+        if isinstance(val, str):
+            lines.append(f"{field} = {_toml_quote_string(val)}")
+    if "size" in info:
+        try:
+            lines.append(f"size = {int(info['size'])}")
+        except (TypeError, ValueError):
+            pass
+    if "failed_attempts" in info:
+        try:
+            lines.append(f"failed_attempts = {int(info['failed_attempts'])}")
+        except (TypeError, ValueError):
+            pass
+    return lines
+
+
 def _serialize_cache_manifest(manifest: dict) -> str:
     """Сериализовать манифест кэша в TOML без внешних зависимостей."""
     packages = manifest.get("packages", {})
@@ -776,783 +1956,5683 @@ def _serialize_cache_manifest(manifest: dict) -> str:
             continue
         table_key = _toml_quote_table_key(str(version))
         lines.append(f"[packages.{table_key}]")
-        for field in ("file", "downloaded_at", "status"):
-            if field not in info:
-                continue
-            val = info[field]
-            if isinstance(val, str):
-                lines.append(f"{field} = {_toml_quote_string(val)}")
-        if "size" in info:
-            try:
-                lines.append(f"size = {int(info['size'])}")
-            except (TypeError, ValueError):
-                pass
-        if "failed_attempts" in info:
-            try:
-                lines.append(f"failed_attempts = {int(info['failed_attempts'])}")
-            except (TypeError, ValueError):
-                pass
+        lines.extend(_serialize_manifest_entry(info))
         lines.append("")
 
+    # Артефакты --fetch-all: [platforms.<версия>.<deb|rpm|exe>]
+    platforms = manifest.get("platforms", {})
+    if not isinstance(platforms, dict):
+        platforms = {}
+    for version, by_platform in sorted(platforms.items()):
+        if not isinstance(by_platform, dict):
+            continue
+        version_key = _toml_quote_table_key(str(version))
+        for platform, info in sorted(by_platform.items()):
+            if not isinstance(info, dict):
+                continue
+            lines.append(
+                f"[platforms.{version_key}.{_toml_quote_table_key(str(platform))}]"
+            )
+            lines.extend(_serialize_manifest_entry(info))
+            lines.append("")
+
     if not lines:
         return "[packages]\n"
     return "\n".join(lines).rstrip() + "\n"
 
 
-class Downloader:
-
-    HEADERS = {"User-Agent": "chromium-gost-updater/1.0"}
-
-    def _get_cache_dir(self) -> Path:
-        """Получить путь к директории кэша пакетов."""
-        cache_dir = CACHE_PACKAGES_DIR
-        cache_dir.mkdir(parents=True, exist_ok=True)
-        return cache_dir
-
-    def _get_cache_manifest_path(self) -> Path:
-        """Получить путь к файлу манифеста кэша."""
-        return CACHE_MANIFEST_FILE
+def _manifest_items(manifest: dict):
+    """Записи манифеста кэша: (версия, платформа или None для packages, запись)."""
+    packages = manifest.get("packages", {})
+    if isinstance(packages, dict):
+        for version, info in packages.items():
+            if isinstance(info, dict):
+                yield str(version), None, info
+    platforms = manifest.get("platforms", {})
+    if isinstance(platforms, dict):
+        for version, by_platform in platforms.items():
+            if not isinstance(by_platform, dict):
+                continue
+            for platform, info in by_platform.items():
+                if isinstance(info, dict):
+                    yield str(version), str(platform), info
 
-    def _load_cache_manifest(self) -> dict:
-        """Загрузить манифест кэша из toml файла."""
-        manifest_path = self._get_cache_manifest_path()
-        if not manifest_path.exists():
-            return {"packages": {}}
 
-        # Try tomllib (py3.11), else toml (pip), else empty dict
+def _parse_cache_manifest(data: bytes) -> dict:
+    """Разобрать cache.toml из архива --export или каталога --import."""
+    try:
         try:
             import tomllib as toml_loader  # Python 3.11+
-        except Exception:
-            try:
-                import toml as toml_loader  # type: ignore[import] -- pip install toml
-            except Exception:
-                log_warn("cache: toml loader not available, returning empty manifest")
-                return {"packages": {}}
-
-        try:
-            # tomllib (Python 3.11+) требует бинарный режим
-            # toml (pip) может работать с обоими режимами, но предпочтительно бинарный
-            try:
-                with manifest_path.open("rb") as f:
-                    data = toml_loader.load(f)
-            except (TypeError, AttributeError):
-                # Fallback для старых версий toml (pip), которые требуют текстовый режим
-                with manifest_path.open("r", encoding="utf-8") as f:
-                    data = toml_loader.load(f)
-            return data if isinstance(data, dict) else {"packages": {}}
-        except Exception as e:
-            log_warn(f"cache: failed to load manifest: {e}")
-            return {"packages": {}}
+        except ImportError:
+            import toml as toml_loader  # type: ignore[import] -- pip install toml
+        manifest = toml_loader.loads(data.decode("utf-8"))
+    except Exception as e:
+        log_warn(f"cache: failed to parse manifest: {e}")
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
 
-    def _save_cache_manifest(self, manifest: dict) -> None:
-        """Сохранить манифест кэша в toml файл."""
-        manifest_path = self._get_cache_manifest_path()
-        manifest_path.parent.mkdir(parents=True, exist_ok=True)
 
-        saved = False
+def _artifact_from_filename(filename: str) -> tuple[str, str] | None:
+    """Версия и платформа (deb, rpm, exe) по имени файла дистрибутива."""
+    match = _CACHE_PKG_DEB_PATTERN.match(filename)
+    if match:
+        return match.group(1), match.group(2).lower()
+    match = _CACHE_PKG_EXE_PATTERN.match(filename)
+    return (match.group(1), "exe") if match else None
+
+
+def _copy_with_sha256(src, dst, size: int | None = None) -> str:
+    """Скопировать поток src в файл dst, посчитав SHA-256 за тот же проход."""
+    digest = hashlib.sha256()
+    _preallocate(dst, 0, size)
+    for block in iter(lambda: src.read(1024 * 1024), b""):
+        digest.update(block)
+        dst.write(block)
+    dst.truncate()
+    return digest.hexdigest()
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with low_impact_io(f"sha256 {path.name}"), path.open("rb") as f:
+        advise_sequential(f)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+        drop_page_cache(f)
+    return digest.hexdigest()
+
+
+def _link_or_copy(
+    src: Path,
+    dest: Path,
+    hardlink: bool = True,
+    mode: int | None = None,
+    copy: bool = True,
+) -> str | None:
+    """
+    Поместить src в dest без лишней копии данных: hardlink, затем reflink (FICLONE),
+    затем обычное копирование. dest заменяется атомарно. Возвращает способ.
+    hardlink=False — только новый inode (reflink или копия) с правами mode:
+    изменение dest не затронет src, и наоборот.
+    copy=False — без копирования: если не вышли ни hardlink, ни reflink,
+    dest не создаётся и возвращается None.
+    """
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    method = "copy"
+    if hardlink:
         try:
-            import toml as toml_dumper  # type: ignore[import] -- python3-toml / pip
+            os.link(src, tmp)
+            method = "hardlink"
+        except OSError:
+            pass
+    if method == "copy" and fcntl is not None:
+        try:
+            with src.open("rb") as fsrc, tmp.open("wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            method = "reflink"
+        except OSError:
+            tmp.unlink(missing_ok=True)
+    if method == "copy":
+        if not copy:
+            return None
+        shutil.copyfile(src, tmp)
+    if mode is not None and method != "hardlink":
+        os.chmod(tmp, mode)
+    os.replace(tmp, dest)
+    return method
 
-            with manifest_path.open("w", encoding="utf-8") as f:
-                toml_dumper.dump(manifest, f)
-            saved = True
-            log_debug(f"cache: manifest saved to {manifest_path} (toml)")
-        except Exception as e:
-            log_debug(f"cache: toml.dump unavailable or failed ({e}), using builtin serializer")
 
-        if not saved:
-            try:
-                manifest_path.write_text(
-                    _serialize_cache_manifest(manifest), encoding="utf-8"
-                )
-                log_debug(f"cache: manifest saved to {manifest_path} (builtin)")
-            except Exception as e:
-                log_warn(f"cache: failed to save manifest: {e}")
+def _format_megabytes(value: float) -> str:
+    return f"{value / (1024 * 1024):.1f}"
 
-    def _version_from_cached_filename(self, filename: str) -> str | None:
-        if IS_WINDOWS:
-            match = _CACHE_PKG_EXE_PATTERN.match(filename)
-        else:
-            match = _CACHE_PKG_DEB_PATTERN.match(filename)
-        return match.group(1) if match else None
 
-    def rebuild_cache_manifest_if_missing(self) -> None:
-        """Восстановить cache.toml из уже скачанных файлов в каталоге кэша."""
-        manifest_path = self._get_cache_manifest_path()
-        if manifest_path.exists():
-            packages = self._load_cache_manifest().get("packages", {})
-            if isinstance(packages, dict) and packages:
-                return
+class DownloadProgress:
+    """Снимок хода скачивания: принято байт, всего, скорость и оценка оставшегося времени."""
 
-        cache_dir = self._get_cache_dir()
-        ext = PACKAGE_MANAGER.get_extension()
-        rebuilt = False
-        for path in sorted(cache_dir.iterdir()):
-            if not path.is_file():
-                continue
-            version = self._version_from_cached_filename(path.name)
-            if not version:
-                continue
-            if not validate_artifact(path, ext):
-                log_debug(
-                    f"cache: skip rebuild for {path.name}, validation failed"
-                )
-                continue
-            downloaded_at = datetime.fromtimestamp(path.stat().st_mtime).isoformat()
-            self._register_in_cache(
-                version,
-                path.name,
-                path,
-                "ok",
-                failed_attempts=0,
-                downloaded_at=downloaded_at,
-            )
-            rebuilt = True
-            log_debug(f"cache: rebuilt manifest entry for version {version}")
+    def __init__(
+        self,
+        received: int,
+        total: int | None,
+        rate: float,
+        eta: float | None,
+        done: bool = False,
+    ):
+        self.received = received
+        self.total = total
+        self.rate = rate
+        self.eta = eta
+        self.done = done
+
+    def format(self) -> str:
+        """Человекочитаемая строка для трея и лога."""
+        text = _format_megabytes(self.received)
+        if self.total:
+            text += f" из {_format_megabytes(self.total)}"
+        text += " МБ"
+        text += f", {_format_megabytes(self.rate)} МБ/с"
+        if self.eta is not None and not self.done:
+            minutes, seconds = divmod(int(self.eta + 0.5), 60)
+            text += f", осталось ~{minutes}:{seconds:02d}"
+        return text
 
-        if rebuilt:
-            log_debug("cache: manifest rebuilt from files on disk")
+    def as_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "total": self.total,
+            "rate": round(self.rate, 1),
+            "eta": round(self.eta, 1) if self.eta is not None else None,
+            "done": self.done,
+        }
 
-    def _resolve_cached_file(
-        self, version: str, package_info: dict, extension: str
-    ) -> Path | None:
-        filename = package_info.get("file")
-        if not filename:
-            log_debug(f"cache: no filename in package info for version {version}")
-            return None
+    def __str__(self) -> str:
+        return f"DownloadProgress({self.format()})"
 
-        cache_dir = self._get_cache_dir()
-        cached_file = cache_dir / filename
 
-        if not cached_file.exists():
-            log_debug(f"cache: file {filename} not found in cache directory")
-            return None
+class DownloadStalledError(Exception):
+    """Передача идёт медленнее допустимого минимума на всём окне наблюдения."""
 
-        expected_size = package_info.get("size")
-        if expected_size:
-            actual_size = cached_file.stat().st_size
-            if actual_size != expected_size:
-                log_debug(
-                    f"cache: size mismatch for {filename}: expected {expected_size}, got {actual_size}"
-                )
-                return None
 
-        status = package_info.get("status")
-        if status == "error":
-            if self.get_failed_attempts(version) >= self.get_retries_count():
-                log_debug(
-                    f"cache: version {version} marked as error, download attempts exhausted"
-                )
-            else:
-                log_debug(f"cache: version {version} marked as error in manifest")
-            return None
+class StallDetector:
+    """
+    Отличает медленную, но идущую передачу от зависшей: за каждые window секунд
+    должно прийти не меньше min_rate * window байт.
+    """
 
-        if status != "ok":
-            if validate_artifact(cached_file, extension):
-                self._register_in_cache(
-                    version, filename, cached_file, "ok", failed_attempts=0
-                )
-                return cached_file
-            failed_attempts = min(
-                self.get_failed_attempts(version) + 1, self.get_retries_count()
+    def __init__(self, min_rate: float, window: float, now: float | None = None):
+        self.min_rate = min_rate
+        self.window = window
+        self.__samples: list[tuple[float, int]] = [
+            (time.monotonic() if now is None else now, 0)
+        ]
+
+    def check(self, received: int, now: float | None = None) -> None:
+        """Учесть принятый объём; бросить DownloadStalledError при зависании."""
+        now = time.monotonic() if now is None else now
+        self.__samples.append((now, received))
+        # Оставляем самый свежий замер, который не моложе окна, как его начало
+        while len(self.__samples) > 2 and now - self.__samples[1][0] >= self.window:
+            self.__samples.pop(0)
+        start_time, start_received = self.__samples[0]
+        elapsed = now - start_time
+        if elapsed < self.window:
+            return
+        rate = (received - start_received) / elapsed
+        if rate < self.min_rate:
+            raise DownloadStalledError(
+                f"transfer stalled: {rate:.0f} B/s over {elapsed:.0f}s "
+                f"(minimum {self.min_rate:.0f} B/s)"
             )
-            self._register_in_cache(
-                version, filename, cached_file, "error", failed_attempts=failed_attempts
-            )
-            return None
-
-        if not validate_artifact(cached_file, extension):
-            log_debug(f"cache: cached file {filename} failed validation")
-            failed_attempts = min(
-                self.get_failed_attempts(version) + 1, self.get_retries_count()
-            )
-            self._register_in_cache(
-                version, filename, cached_file, "error", failed_attempts=failed_attempts
-            )
-            return None
 
-        log_debug(f"cache: found valid cached file {filename} for version {version}")
-        return cached_file
 
-    def _check_cache(self, version: str, extension: str) -> Path | None:
-        """
-        Проверить наличие файла в кэше.
-        Возвращает путь к файлу, если он есть и валиден (status=ok), иначе None.
-        """
-        manifest = self._load_cache_manifest()
-        packages = manifest.get("packages", {})
+class TransferMonitor:
+    """
+    Считает принятые байты и скорость по скользящему окну, вызывает
+    progress_callback не чаще PROGRESS_REPORT_INTERVAL_SEC и проверяет
+    передачу на зависание через StallDetector.
+    """
 
-        if version not in packages:
-            log_debug(f"cache: version {version} not found in manifest")
-            return None
+    def __init__(
+        self,
+        total: int | None,
+        progress_callback=None,
+        stall_detector: StallDetector | None = None,
+        received: int = 0,
+    ):
+        self.total = total
+        # received > 0 — докачка: принятое раньше не входит в скорость
+        self.received = received
+        self.__initial = received
+        self.started = time.monotonic()
+        self.__callback = progress_callback
+        self.__stall_detector = stall_detector
+        self.__samples: list[tuple[float, int]] = [(self.started, received)]
+        self.__last_report = 0.0
+
+    def rate(self, now: float | None = None) -> float:
+        """Скорость в байтах/с по окну PROGRESS_RATE_WINDOW_SEC."""
+        now = time.monotonic() if now is None else now
+        first_time, first_received = self.__samples[0]
+        elapsed = now - first_time
+        if elapsed <= 0:
+            return 0.0
+        return (self.received - first_received) / elapsed
+
+    def snapshot(self, done: bool = False) -> DownloadProgress:
+        rate = self.rate()
+        eta = None
+        if self.total and rate > 0:
+            eta = max(self.total - self.received, 0) / rate
+        return DownloadProgress(self.received, self.total, rate, eta, done=done)
+
+    def on_chunk(self, size: int) -> None:
+        now = time.monotonic()
+        self.received += size
+        self.__samples.append((now, self.received))
+        window_start = now - PROGRESS_RATE_WINDOW_SEC
+        while len(self.__samples) > 2 and self.__samples[1][0] <= window_start:
+            self.__samples.pop(0)
+        if self.__stall_detector is not None:
+            self.__stall_detector.check(self.received - self.__initial, now)
+        if self.__callback and now - self.__last_report >= PROGRESS_REPORT_INTERVAL_SEC:
+            self.__last_report = now
+            self.__report(self.snapshot())
+
+    def finish(self) -> None:
+        if self.__callback:
+            self.__report(self.snapshot(done=True))
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def __report(self, progress: DownloadProgress) -> None:
+        try:
+            self.__callback(progress)
+        except Exception as e:
+            log_debug(f"download progress callback failed: {e}")
 
-        package_info = packages[version]
-        if not isinstance(package_info, dict):
-            log_debug(f"cache: invalid package info for version {version}")
-            return None
 
-        return self._resolve_cached_file(version, package_info, extension)
+class _PartialDownload:
+    """
+    Приём тела ответа в .part рядом с dest: докачка по Range/If-Range, имя
+    из Content-Disposition, резерв места, прогресс, обнаружение зависания
+    и сброс page cache. Общий для Downloader._download_async и NativeUpdateFlow.
+    """
 
-    def get_valid_cached_package(self, version: str) -> Path | None:
-        """Публичная обёртка для получения валидного файла из кэша."""
-        ext = PACKAGE_MANAGER.get_extension()
-        return self._check_cache(version, ext)
+    def __init__(self, dest: Path, progress_callback=None):
+        self.dest = dest
+        self.part = _partial_path(dest)
+        self.offset = self.part.stat().st_size if self.part.exists() else 0
+        self.validator = _read_validator(self.part) if self.offset else None
+        if self.offset and self.validator is None:
+            log_debug(f"cache: no validator for {self.part.name}, restarting download")
+            self.offset = 0
+        self.monitor: TransferMonitor | None = None
+        self.stats: dict | None = None
+        self.__progress_callback = progress_callback
+        self.__file = None
+        # Граница записанного и уже убранного из page cache
+        self.__dropped = 0
+
+    def request_headers(self) -> dict[str, str]:
+        """
+        Заголовки для докачки. If-Range с валидатором прежнего ответа: если файл
+        на сервере сменился, придёт 200 с файлом целиком, а не хвост другого файла.
+        """
+        if not self.offset:
+            return {}
+        return {"Range": f"bytes={self.offset}-", "If-Range": self.validator}
 
-    def cleanup_old_cache_files(self, max_age_days: int | None = None) -> None:
+    def open(self, response, first_chunk: bytes) -> bool:
         """
-        Удалить файлы из кэша, которые старше max_age_days дней.
-        Если max_age_days не указан, используется значение из конфига.
+        Пришли заголовки ответа (status, headers) и первая порция: открыть .part.
+        False — вместо дистрибутива пришла HTML-страница.
         """
-        if max_age_days is None:
-            max_age_days = CONFIG.keep_cached_distributive_in_days()
-        manifest = self._load_cache_manifest()
-        packages = manifest.get("packages", {})
-        if not packages:
-            return
+        total = _content_length(response.headers)
+        if self.offset and _content_range_start(response) != self.offset:
+            # Сервер не поддерживает Range или файл изменился (If-Range)
+            log_debug(f"cache: server sent full file, restarting {self.dest.name}")
+            self.offset = 0
+        if self.offset:
+            log_debug(f"cache: resuming {self.dest.name} from {self.offset} bytes")
+            total = self.offset + total if total is not None else None
+
+        if _is_html_response(response.headers.get("Content-Type"), first_chunk):
+            log_debug("cache: download returned HTML instead of package")
+            return False
 
-        cache_dir = self._get_cache_dir()
-        current_time = time.time()
-        max_age_seconds = max_age_days * 24 * 60 * 60
-        removed_count = 0
+        if self.dest.suffix == ".exe":
+            cd_name = _filename_from_content_disposition(
+                response.headers.get("Content-Disposition")
+            )
+            if cd_name:
+                self.dest = self.dest.parent / cd_name
+
+        self.dest.parent.mkdir(parents=True, exist_ok=True)
+        if not self.offset:
+            _save_validator(self.part, _response_validator(response.headers))
+        self.monitor = TransferMonitor(
+            total,
+            self.__progress_callback,
+            StallDetector(
+                CONFIG.download_stall_min_rate(), CONFIG.download_stall_window()
+            ),
+            self.offset,
+        )
+        self.__file = self.part.open("r+b" if self.offset else "wb")
+        self.__file.seek(self.offset)
+        _preallocate(self.__file, self.offset, total)
+        self.__dropped = self.offset
+        return True
 
-        packages_to_remove = []
-        for version, package_info in list(packages.items()):
-            if not isinstance(package_info, dict):
-                continue
+    def write(self, chunk: bytes) -> bool:
+        """Записать порцию; True — принятое пора убрать из page cache."""
+        self.__file.write(chunk)
+        self.monitor.on_chunk(len(chunk))
+        return self.monitor.received - self.__dropped >= PAGE_CACHE_DROP_BYTES
 
-            downloaded_at_str = package_info.get("downloaded_at")
-            if not downloaded_at_str:
-                # Если нет даты, считаем файл старым
-                packages_to_remove.append(version)
-                continue
+    def drop_page_cache(self) -> None:
+        """Сбросить принятое на диск и из page cache (fdatasync: не в цикле событий)."""
+        if self.__file is not None:
+            self.__dropped = drop_page_cache(self.__file, self.__dropped)
 
+    def close(self) -> None:
+        """
+        Закрыть .part. Зарезервированный, но не принятый хвост отрезается:
+        он не должен попасть ни в докачку, ни в проверку.
+        """
+        f, self.__file = self.__file, None
+        if f is not None:
             try:
-                # Парсим дату в формате ISO (например, "2024-01-01T12:00:00")
-                downloaded_at = datetime.fromisoformat(downloaded_at_str).timestamp()
-                age_seconds = current_time - downloaded_at
+                f.truncate()
+            finally:
+                f.close()
 
-                if age_seconds > max_age_seconds:
-                    packages_to_remove.append(version)
-                    log_debug(
-                        f"cache: marking version {version} for removal (age: {age_seconds / 86400:.1f} days)"
-                    )
-            except Exception as e:
-                log_debug(f"cache: failed to parse date for version {version}: {e}")
-                packages_to_remove.append(version)
+    def finish(self) -> Path | None:
+        """
+        Тело принято целиком: .part (под именем из Content-Disposition, если
+        оно пришло) или None, если файл слишком мал для дистрибутива.
+        В кэш файл кладёт вызывающий (_commit_partial) после проверки.
+        """
+        self.close()
+        self.monitor.finish()
+        if self.part != _partial_path(self.dest):
+            # Имя из Content-Disposition: .part переезжает вслед за ним
+            target = _partial_path(self.dest)
+            os.replace(self.part, target)
+            if _validator_path(self.part).exists():
+                os.replace(_validator_path(self.part), _validator_path(target))
+            self.part = target
+        duration = self.monitor.elapsed()
+        received = self.monitor.received - self.offset
+        self.stats = {
+            "bytes": received,
+            "duration": duration,
+            "throughput": received / duration if duration > 0 else 0.0,
+        }
+        if self.part.stat().st_size >= MIN_ARTIFACT_SIZE:
+            return self.part
+        _discard_partial(self.part)
+        return None
 
-        # Удаляем файлы и записи из манифеста
-        for version in packages_to_remove:
-            package_info = packages.get(version)
-            if isinstance(package_info, dict):
-                filename = package_info.get("file")
-                if filename:
-                    file_path = cache_dir / filename
-                    try:
-                        if file_path.exists():
-                            file_path.unlink()
-                            log_debug(f"cache: removed old file {filename}")
-                            removed_count += 1
-                    except Exception as e:
-                        log_debug(f"cache: failed to remove file {filename}: {e}")
 
-            del packages[version]
+class TokenBucket:
+    """
+    Ограничитель скорости «ведро токенов»: rate байт/с, запас не больше burst
+    (TOKEN_BUCKET_BURST_SEC от rate, но не меньше порции чтения). Один экземпляр
+    можно делить между одновременными передачами — тогда rate их общий бюджет.
+    set_rate действует сразу, в том числе на ждущие передачи. rate None — без
+    ограничения. clock — источник времени в секундах (подменяется в тестах).
+    """
 
-        if packages_to_remove:
-            manifest["packages"] = packages
-            self._save_cache_manifest(manifest)
-            log_debug(f"cache: cleanup completed, removed {removed_count} old files")
+    def __init__(self, rate: int | None = None, clock=time.monotonic):
+        self.__lock = threading.Lock()
+        self.__clock = clock
+        self.__rate = rate or None
+        self.__tokens = 0.0
+        self.__updated = clock()
+
+    @property
+    def rate(self) -> int | None:
+        return self.__rate
+
+    def set_rate(self, rate: int | None) -> None:
+        with self.__lock:
+            self.__refill(self.__clock())
+            self.__rate = rate or None
+            self.__tokens = min(self.__tokens, self.__burst())
+
+    def __burst(self) -> float:
+        if not self.__rate:
+            return 0.0
+        return max(self.__rate * TOKEN_BUCKET_BURST_SEC, DOWNLOAD_CHUNK_SIZE)
+
+    def __refill(self, now: float) -> None:
+        if self.__rate:
+            self.__tokens = min(
+                self.__burst(), self.__tokens + (now - self.__updated) * self.__rate
+            )
+        self.__updated = now
 
-    def get_remote_version(self) -> str | None:
+    def take(self, amount: int) -> float:
         """
-        Запрашиваем удалённую версию (строка вида "142.0.7444.176")
-        Возвращаем строку с версией или None, если не удалось.
+        Списать amount, если токенов хватает (0); иначе ничего не списывать
+        и вернуть, сколько ещё ждать.
         """
-        version_check_timeout = 15
-        try:
-            req = Request(REMOTE_VERSION_CHECK_URL, headers=self.HEADERS)
-            with urlopen(req, timeout=version_check_timeout) as r:
-                text = r.read().decode("utf-8").strip()
-                return text
-        except Exception:
-            return None
+        with self.__lock:
+            if not self.__rate:
+                return 0.0
+            self.__refill(self.__clock())
+            # Порция больше запаса проходит при полном ведре, уводя его в минус
+            need = min(amount, self.__burst())
+            if self.__tokens >= need:
+                self.__tokens -= amount
+                return 0.0
+            return (need - self.__tokens) / self.__rate
+
+    async def consume(self, amount: int) -> None:
+        """Дождаться права передать amount байт."""
+        while True:
+            delay = self.take(amount)
+            if delay <= 0:
+                return
+            # Короткими паузами, чтобы новая скорость из set_rate подхватывалась сразу
+            await asyncio.sleep(min(delay, TOKEN_BUCKET_MAX_SLEEP_SEC))
 
-    def get_retries_count(self) -> int:
-        return CONFIG.download_retries()
 
-    def _get_manifest_entry(self, version: str) -> dict | None:
-        manifest = self._load_cache_manifest()
-        package_info = manifest.get("packages", {}).get(version)
-        if isinstance(package_info, dict):
-            return package_info
+def _retry_after_seconds(error: Exception) -> float | None:
+    """
+    Извлечь паузу из заголовка Retry-After ответа 429/503:
+    либо число секунд, либо HTTP-дата.
+    """
+    if not isinstance(error, HTTPError) or error.code not in (429, 503):
+        return None
+    value = error.headers.get("Retry-After") if error.headers else None
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
         return None
+    return max(0.0, retry_at.timestamp() - time.time())
 
-    def get_failed_attempts(self, version: str) -> int:
-        entry = self._get_manifest_entry(version)
-        if not entry:
-            return 0
-        try:
-            return int(entry.get("failed_attempts", 0))
-        except (TypeError, ValueError):
-            return 0
 
-    def has_exhausted_download_attempts(self, version: str) -> bool:
-        return self.get_failed_attempts(version) >= self.get_retries_count()
+class RetryScheduler:
+    """
+    Паузы между попытками скачивания: экспоненциальный рост с полным джиттером
+    (равномерно от 0 до base * 2^(n-1), не больше max_delay) и учёт Retry-After
+    (тоже не дольше max_delay).
+    Ожидание прерывается через wake(), чтобы выход или ручная проверка
+    срабатывали сразу, а не после сна.
+    """
 
-    def _reset_failed_attempts(self, version: str) -> None:
-        manifest = self._load_cache_manifest()
-        packages = manifest.get("packages", {})
-        if version in packages and isinstance(packages[version], dict):
-            packages[version]["failed_attempts"] = 0
-            manifest["packages"] = packages
-            self._save_cache_manifest(manifest)
+    def __init__(
+        self, base_delay: float, max_delay: float, rng: random.Random | None = None
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.__rng = rng or random.Random()
+        self.__wakeup = threading.Event()
+
+    def next_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Пауза перед попыткой attempt + 1 (attempt начинается с 1)."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** max(attempt - 1, 0))
+        delay = self.__rng.uniform(0, ceiling)
+        if retry_after is not None:
+            # Сервер назвал время сам; джиттер сверху разводит хосты во времени.
+            # Дольше retry_max_delay не ждём, чтобы не уснуть на сутки
+            delay = retry_after + self.__rng.uniform(0, self.base_delay)
+            delay = min(delay, self.max_delay)
+        return delay
+
+    def wait(self, delay: float) -> bool:
+        """Подождать delay секунд. True, если ожидание прервано через wake()."""
+        woken = self.__wakeup.wait(delay)
+        self.__wakeup.clear()
+        return woken
+
+    def wake(self) -> None:
+        """Прервать текущее (или ближайшее) ожидание."""
+        self.__wakeup.set()
+
+    def reset(self) -> None:
+        """Сбросить необработанный сигнал пробуждения перед новой серией попыток."""
+        self.__wakeup.clear()
+
+
+def _clamp(value: float, bounds: tuple[float, float]) -> float:
+    return max(bounds[0], min(bounds[1], value))
+
+
+def _percentile(values: list[float], fraction: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
 
-    def _get_download_target(self, version: str, ext: str) -> tuple[str, str]:
-        if IS_WINDOWS:
-            filename = f"chromium-gost-{version}-installer.exe"
-            return WINDOWS_INSTALLER_URL, filename
-        filename = f"chromium-gost-{version}-linux-amd64.{ext}"
-        url = f"{REMOTE_BASE_URL}/linux/amd64/{filename}"
-        return url, filename
 
-    def get_package_filename(self, version: str) -> str:
-        ext = PACKAGE_MANAGER.get_extension()
-        _, filename = self._get_download_target(version, ext)
-        return filename
+class NetworkStats:
+    """
+    История наблюдаемой скорости скачивания и задержки ответа сервера,
+    хранится в state.json (раздел network). По ней выбираются таймауты.
+    """
+
+    HISTORY_LIMIT = 20
+
+    def _section(self, state: dict) -> dict:
+        network = state.get("network")
+        if not isinstance(network, dict):
+            network = {}
+            state["network"] = network
+        return network
 
-    def download_package(self, version: str, force: bool = False) -> Path | None:
+    def record_throughput(self, received: int, duration: float) -> None:
+        """Добавить замер скорости (байт/с) в историю."""
+        if received <= 0 or duration <= 0:
+            return
+        sample = {"at": time.time(), "bytes": received, "bps": received / duration}
+
+        def mutate(state: dict) -> None:
+            history = self._section(state).setdefault("throughput_history", [])
+            history.append(sample)
+            del history[: -self.HISTORY_LIMIT]
+
+        try:
+            update_state(mutate)
+        except Exception as e:
+            log_debug(f"network stats: failed to save throughput: {e}")
+
+    def record_rtt(self, seconds: float) -> None:
         """
-        Загружаем дистрибутив с повторами.
-        Сначала проверяем кэш, если файл есть и валиден (status=ok) — используем его.
-        Невалидный артефакт (не deb/rpm/PE): не более get_retries_count() попыток суммарно,
-        с удвоением паузы между попытками. После исчерпания лимита сервер не дёргаем.
+        Добавить замер задержки ответа: от начала запроса до получения заголовков
+        (соединение, TLS и обработка на сервере — несколько RTT).
         """
-        ext = PACKAGE_MANAGER.get_extension()
-        max_attempts = self.get_retries_count()
+        if seconds <= 0:
+            return
 
-        cached_file = self._check_cache(version, ext)
-        if cached_file:
-            log_debug(f"cache: using cached file for version {version}")
-            return cached_file
+        def mutate(state: dict) -> None:
+            history = self._section(state).setdefault("rtt_history", [])
+            history.append(round(seconds, 4))
+            del history[: -self.HISTORY_LIMIT]
 
-        prior_failures = self.get_failed_attempts(version)
-        if not force and prior_failures >= max_attempts:
-            log_debug(
-                f"cache: download skipped for {version}, "
-                f"failed_attempts={prior_failures} >= {max_attempts}"
-            )
-            return None
+        try:
+            update_state(mutate)
+        except Exception as e:
+            log_debug(f"network stats: failed to save rtt: {e}")
 
-        if force:
-            self._reset_failed_attempts(version)
-            prior_failures = 0
+    def _float_history(self, key: str, field: str | None = None) -> list[float]:
+        history = self._section(load_state()).get(key, [])
+        result = []
+        for sample in history if isinstance(history, list) else []:
+            try:
+                result.append(float(sample[field] if field else sample))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return result
 
-        cache_dir = self._get_cache_dir()
-        url, filename = self._get_download_target(version, ext)
-        dest = cache_dir / filename
+    def throughput_history(self) -> list[float]:
+        return self._float_history("throughput_history", "bps")
 
-        log_debug(f"cache: downloading {version} from {url}")
-        attempt = prior_failures
-        delay_sec = DOWNLOAD_RETRY_BASE_DELAY_SEC
+    def rtt_history(self) -> list[float]:
+        return self._float_history("rtt_history")
 
-        while attempt < max_attempts:
-            attempt += 1
-            try:
-                downloaded_file = self.__do_download_package(url, dest)
-                if not downloaded_file:
-                    log_debug(
-                        f"cache: download attempt {attempt}/{max_attempts} "
-                        f"returned no file for {version}"
-                    )
-                    self._register_in_cache(
-                        version, filename, dest, "error", failed_attempts=attempt
-                    )
-                else:
-                    filename = downloaded_file.name
-                    if validate_artifact(downloaded_file, ext):
-                        self._register_in_cache(
-                            version, filename, downloaded_file, "ok", failed_attempts=0
-                        )
-                        return downloaded_file
-                    log_debug(
-                        f"cache: validation failed for {filename} "
-                        f"(attempt {attempt}/{max_attempts})"
-                    )
-                    self._register_in_cache(
-                        version, filename, downloaded_file, "error", failed_attempts=attempt
-                    )
-                    self.__unlink(downloaded_file)
-            except Exception as e:
-                log_debug(
-                    f"cache: download attempt {attempt}/{max_attempts} failed: {e}"
-                )
-                self._register_in_cache(
-                    version, filename, dest, "error", failed_attempts=attempt
-                )
+    def median_throughput(self) -> float | None:
+        return _percentile(self.throughput_history(), 0.5)
 
-            if attempt < max_attempts:
-                log_debug(f"cache: waiting {delay_sec:.0f}s before next download attempt")
-                time.sleep(delay_sec)
-                delay_sec *= 2
+    def connect_timeout(self) -> float:
+        """
+        Таймаут на соединение и получение заголовков: 4 × p90 задержки ответа
+        плюс запас, в пределах CONNECT_TIMEOUT_BOUNDS_SEC.
+        """
+        rtt = _percentile(self.rtt_history(), 0.9)
+        if rtt is None:
+            return DEFAULT_CONNECT_TIMEOUT_SEC
+        return _clamp(4 * rtt + 2, CONNECT_TIMEOUT_BOUNDS_SEC)
 
-        return None
+    def read_timeout(self) -> float:
+        """
+        Таймаут ожидания очередного блока данных: если за это время не пришло
+        ни байта, соединение считаем мёртвым. Учитываем задержку ответа и время
+        передачи одного блока на медленной (p10) наблюдавшейся скорости.
+        """
+        rtt = _percentile(self.rtt_history(), 0.9)
+        slow_rate = _percentile(self.throughput_history(), 0.1)
+        if rtt is None and slow_rate is None:
+            return DEFAULT_READ_TIMEOUT_SEC
+        chunk_time = DOWNLOAD_CHUNK_SIZE / slow_rate if slow_rate else 0.0
+        return _clamp(4 * (rtt or 0.0) + 4 * chunk_time + 5, READ_TIMEOUT_BOUNDS_SEC)
 
-    def _register_in_cache(
-        self,
-        version: str,
-        filename: str,
-        file_path: Path,
-        status: str,
-        failed_attempts: int | None = None,
-        downloaded_at: str | None = None,
-    ) -> None:
-        """Зарегистрировать скачанный файл в манифесте кэша."""
-        manifest = self._load_cache_manifest()
-        packages = manifest.setdefault("packages", {})
 
-        file_size = file_path.stat().st_size if file_path.exists() else 0
-        if downloaded_at is None:
-            downloaded_at = datetime.now().isoformat()
+NETWORK_STATS = NetworkStats()
 
-        entry: dict = {
-            "file": filename,
-            "downloaded_at": downloaded_at,
-            "size": file_size,
-            "status": status,
-        }
-        if failed_attempts is not None:
-            entry["failed_attempts"] = failed_attempts
 
-        packages[version] = entry
+class CircuitOpenError(Exception):
+    """Запрос не выполнялся: сервер недавно был недоступен, предохранитель разомкнут."""
 
-        manifest["packages"] = packages
-        self._save_cache_manifest(manifest)
-        log_debug(
-            f"cache: registered version {version} status={status} "
-            f"failed_attempts={failed_attempts} (file: {filename}, size: {file_size})"
+    def __init__(self, host: str, retry_at: float):
+        super().__init__(
+            f"circuit open for {host} until {datetime.fromtimestamp(retry_at).isoformat()}"
         )
+        self.host = host
+        self.retry_at = retry_at
 
-    def __do_download_package(self, url: str, dest: Path) -> Path | None:
-        req = Request(url, headers=self.HEADERS)
-        timeout = 120 if IS_WINDOWS else 60
-        with urlopen(req, timeout=timeout) as r:
-            content_type = r.headers.get("Content-Type")
-            content_disposition = r.headers.get("Content-Disposition")
-            # Допустимо читать целиком: размер артефактов ограничен и проверяется ниже.
-            data = r.read()
 
-        if _is_html_response(content_type, data):
-            log_debug("cache: download returned HTML instead of package")
-            return None
+class CircuitBreaker:
+    """
+    Предохранитель сетевых запросов к одному хосту; состояние хранится в state.json
+    (раздел circuit_breakers), поэтому переживает перезапуски по таймеру.
 
-        if IS_WINDOWS:
-            cd_name = _filename_from_content_disposition(content_disposition)
-            if cd_name:
-                dest = dest.parent / cd_name
+    closed — запросы идут; после failure_threshold ошибок подряд — open: запросы
+    сразу отклоняются до open_until. Затем half_open: пропускается одна проба.
+    Успех замыкает цепь, ошибка снова размыкает её на вдвое большее окно.
 
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        with dest.open("wb") as f:
-            f.write(data)
+    Переходы выполняются через update_state, то есть под межпроцессной
+    блокировкой state.json: трэй и демон не выдадут две пробы одновременно
+    и не затрут счётчики ошибок друг друга.
+    """
 
-        if dest.exists() and dest.stat().st_size >= MIN_ARTIFACT_SIZE:
-            return dest
-        self.__unlink(dest)
-        return None
+    # Сколько ждать результата пробы, прежде чем разрешить следующую
+    PROBE_TIMEOUT_SEC = 120.0
 
-    def __unlink(self, dest: Path) -> None:
-        try:
-            dest.unlink()
-        except Exception:
-            pass
+    def __init__(self, host: str, clock=time.time):
+        self.host = host
+        self.__clock = clock
 
+    def _read(self) -> dict:
+        breakers = load_state().get("circuit_breakers", {})
+        entry = breakers.get(self.host) if isinstance(breakers, dict) else None
+        return dict(entry) if isinstance(entry, dict) else {}
 
-DOWNLOADER: Downloader = Downloader()
+    def _write(self, mutator) -> dict:
+        """
+        Изменить запись хоста функцией mutator(entry) под _state_file_lock;
+        mutator видит состояние, перечитанное уже под блокировкой.
+        """
+        result: dict = {}
+
+        def mutate(state: dict) -> None:
+            breakers = state.get("circuit_breakers")
+            if not isinstance(breakers, dict):
+                breakers = {}
+                state["circuit_breakers"] = breakers
+            entry = breakers.get(self.host)
+            entry = dict(entry) if isinstance(entry, dict) else {}
+            mutator(entry)
+            breakers[self.host] = entry
+            result.update(entry)
+
+        update_state(mutate)
+        return result
 
-# -------------------------
-# Загрузчик пакетов: конец
-# -------------------------
+    def state(self) -> str:
+        return self._read().get("state", "closed")
 
+    def retry_at(self) -> float | None:
+        """Время, после которого будет пропущена проба, если цепь разомкнута."""
+        entry = self._read()
+        if entry.get("state") != "open":
+            return None
+        return float(entry.get("open_until", 0))
+
+    def _blocked(self, entry: dict, now: float) -> bool:
+        """Запрос запрещён: окно размыкания не истекло или проба уже выполняется."""
+        state = entry.get("state", "closed")
+        if state == "open":
+            return now < float(entry.get("open_until", 0))
+        if state == "half_open":
+            probe_age = now - float(entry.get("probe_started_at", 0))
+            return probe_age < self.PROBE_TIMEOUT_SEC
+        return False
 
-def cleanup_old_package_files(keep_current: str | None = None) -> None:
-    """
-    Remove old package files (.deb or .rpm) from tmp_dir, optionally keeping the current one.
-    Также очищает старые файлы из кэш-директории (старше месяца).
-    """
-    # Очистка старых файлов из кэша (используется значение из конфига)
-    try:
-        DOWNLOADER.cleanup_old_cache_files()
-    except Exception as e:
-        log_debug(f"cleanup_old_package_files: failed to cleanup cache: {e}")
+    def allow_request(self) -> bool:
+        """Разрешить запрос; при разрешённой пробе переводит цепь в half_open."""
+        entry = self._read()
+        if entry.get("state", "closed") == "closed":
+            return True
+        now = self.__clock()
+        if self._blocked(entry, now):
+            return False
 
-    # Очистка старых файлов из tmp_dir (для обратной совместимости)
-    tmp_dir = CONFIG.tmp_dir()
-    if not tmp_dir.exists():
-        return
-    try:
-        old_packages = chain(
-            tmp_dir.glob("chromium-gost-*.deb"), tmp_dir.glob("chromium-gost-*.rpm")
-        )
-    except Exception:
-        return
+        granted = {"value": False}
 
-    current_file = str(Path(keep_current).resolve()) if keep_current else None
-    for pkg_file in old_packages:
-        if keep_current and str(pkg_file.resolve()) == current_file:
-            continue
-        try:
-            pkg_file.unlink()
-            log_debug(
-                f"cleanup_old_package_files: removed old file from tmp_dir: {pkg_file.name}"
+        def mutate(current: dict) -> None:
+            # Перепроверяем под блокировкой: пробу получает только один запрос
+            if current.get("state", "closed") == "closed":
+                granted["value"] = True
+                return
+            if self._blocked(current, now):
+                return
+            current["state"] = "half_open"
+            current["probe_started_at"] = now
+            granted["value"] = True
+
+        self._write(mutate)
+        if granted["value"]:
+            log_debug(f"circuit_breaker[{self.host}]: half-open probe allowed")
+        return granted["value"]
+
+    def check(self) -> None:
+        """Бросить CircuitOpenError, если запрос сейчас не разрешён."""
+        if not self.allow_request():
+            raise CircuitOpenError(self.host, self.retry_at() or self.__clock())
+
+    def record_success(self) -> None:
+        entry = self._read()
+        if entry.get("state", "closed") == "closed" and not entry.get("failures"):
+            return
+        def mutate(current: dict) -> None:
+            current.clear()
+            current["state"] = "closed"
+
+        self._write(mutate)
+        log_debug(f"circuit_breaker[{self.host}]: closed after success")
+
+    def record_failure(self) -> None:
+        now = self.__clock()
+        threshold = max(1, CONFIG.circuit_breaker_failure_threshold())
+
+        def mutate(current: dict) -> None:
+            failures = int(current.get("failures", 0)) + 1
+            current["failures"] = failures
+            if current.get("state") != "half_open" and failures < threshold:
+                return
+            trips = int(current.get("trips", 0)) + 1
+            window = min(
+                CONFIG.circuit_breaker_open_seconds() * 2 ** (trips - 1),
+                CONFIG.circuit_breaker_max_open_seconds(),
+            )
+            current["trips"] = trips
+            current["state"] = "open"
+            current["open_until"] = now + window
+            current.pop("probe_started_at", None)
+
+        entry = self._write(mutate)
+        if entry.get("state") == "open":
+            log_warn(
+                f"circuit_breaker[{self.host}]: open for "
+                f"{entry['open_until'] - now:.0f}s after {entry['failures']} failures"
             )
-        except Exception:
-            pass
 
 
-def session_has_graphical_display() -> bool:
-    """Проверить, заданы ли переменные графической сессии DISPLAY или WAYLAND_DISPLAY."""
-    if IS_WINDOWS:
-        return True
-    display = os.environ.get("DISPLAY", "").strip()
-    wayland = os.environ.get("WAYLAND_DISPLAY", "").strip()
-    return bool(display) or bool(wayland)
+def _is_server_failure(error: Exception) -> bool:
+    """Ошибка говорит о недоступности сервера (а не о нашем запросе)."""
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (OSError, DownloadStalledError))
 
 
-def _x11_display_socket_exists(display: str) -> bool:
-    try:
-        display_num = display.lstrip(":").split(".")[0]
-        socket = Path(f"/tmp/.X11-unix/X{display_num}")
-        return socket.exists()
-    except Exception:
-        return False
+def _ewma(previous, sample: float) -> float:
+    if previous is None:
+        return sample
+    return (1 - MIRROR_SCORE_ALPHA) * float(previous) + MIRROR_SCORE_ALPHA * sample
 
 
-def _x11_display_usable() -> bool:
-    display = os.environ.get("DISPLAY", "").strip()
-    if not display:
-        return False
-    for cmd in (["xset", "q"], ["xdpyinfo"]):
+class MirrorSelector:
+    """
+    Выбор сервера для проверки версии и скачивания: зеркала из [mirrors] urls
+    и основной сервер ранжируются по задержке ответа и скорости скачивания.
+    Оценки хранятся в state.json (раздел mirrors), поэтому следующий запуск
+    сразу начинает с лучшего зеркала; пробы повторяются раз в MIRROR_SCORES_TTL_SEC.
+    """
+
+    def __init__(self, open_url, run, spawn=None, clock=time.time):
+        # open_url(url, timeout, method=...) — корутина Downloader._open_url
+        # с предохранителем, run(coro) — выполнить её в NETWORK_ENGINE,
+        # spawn(coro) — запустить там же, не дожидаясь результата
+        self.__open_url = open_url
+        self.__run = run
+        self.__spawn = spawn
+        self.__clock = clock
+        # Зеркала, которые сейчас опрашиваются в фоне
+        self.__probing: set[str] = set()
+        self.__lock = threading.Lock()
+
+    def primary(self) -> str:
+        return REMOTE_BASE_URL.rstrip("/")
+
+    def base_urls(self) -> list[str]:
+        """Зеркала в порядке из конфига, основной сервер — последним."""
+        result: list[str] = []
+        for url in CONFIG.mirror_urls() + [self.primary()]:
+            url = url.rstrip("/")
+            if url and url not in result:
+                result.append(url)
+        return result
+
+    def scores(self) -> dict:
+        mirrors = load_state().get("mirrors", {})
+        return dict(mirrors) if isinstance(mirrors, dict) else {}
+
+    def _update(self, base_url: str, mutator) -> None:
+        def mutate(state: dict) -> None:
+            mirrors = state.get("mirrors")
+            if not isinstance(mirrors, dict):
+                mirrors = {}
+                state["mirrors"] = mirrors
+            entry = mirrors.get(base_url)
+            entry = dict(entry) if isinstance(entry, dict) else {}
+            mutator(entry)
+            mirrors[base_url] = entry
+
         try:
-            result = subprocess.run(
-                cmd,
-                env=os.environ,
-                capture_output=True,
-                timeout=3,
+            update_state(mutate)
+        except Exception as e:
+            log_debug(f"mirrors: failed to save score for {base_url}: {e}")
+
+    @staticmethod
+    def expected_time(entry: dict, default_throughput: float | None = None) -> float:
+        """
+        Ожидаемое время скачивания эталонного файла: RTT + размер / скорость.
+        Для зеркал, с которых ещё не скачивали, берём default_throughput.
+        """
+        rtt = entry.get("rtt")
+        throughput = entry.get("throughput") or default_throughput
+        if rtt is None and not entry.get("throughput"):
+            return float("inf")
+        expected = float(rtt or 0.0)
+        if throughput:
+            expected += MIRROR_REFERENCE_SIZE / float(throughput)
+        return expected
+
+    def record_probe(self, base_url: str, rtt: float | None) -> None:
+        now = self.__clock()
+
+        def mutate(entry: dict) -> None:
+            entry["probed_at"] = now
+            if rtt is None:
+                entry["failures"] = int(entry.get("failures", 0)) + 1
+                return
+            entry["rtt"] = round(_ewma(entry.get("rtt"), rtt), 4)
+            entry["failures"] = 0
+
+        self._update(base_url, mutate)
+
+    def record_download(self, base_url: str, received: int, duration: float) -> None:
+        if received <= 0 or duration <= 0:
+            return
+
+        def mutate(entry: dict) -> None:
+            entry["throughput"] = round(
+                _ewma(entry.get("throughput"), received / duration), 1
             )
-            if result.returncode == 0:
-                return True
-        except (FileNotFoundError, subprocess.TimeoutExpired, OSError):
-            continue
-    return _x11_display_socket_exists(display)
+            entry["failures"] = 0
 
+        self._update(base_url, mutate)
 
-def _wayland_display_usable() -> bool:
-    wayland = os.environ.get("WAYLAND_DISPLAY", "").strip()
-    if not wayland:
-        return False
-    runtime = os.environ.get("XDG_RUNTIME_DIR", "").strip()
-    if runtime:
-        return (Path(runtime) / wayland).exists()
-    return True
+    def record_failure(self, base_url: str) -> None:
+        def mutate(entry: dict) -> None:
+            entry["failures"] = int(entry.get("failures", 0)) + 1
 
+        self._update(base_url, mutate)
 
-def graphical_session_ready() -> bool:
-    """Проверить, что графическая сессия доступна (не только переменные окружения)."""
-    if IS_WINDOWS:
-        return True
-    if os.environ.get("WAYLAND_DISPLAY", "").strip():
-        return _wayland_display_usable()
-    if os.environ.get("DISPLAY", "").strip():
-        return _x11_display_usable()
-    return False
+    async def probe(self, base_url: str) -> float | None:
+        """
+        Замерить задержку ответа зеркала HEAD-запросом к файлу версии.
+        Если HEAD не поддерживается, запрашиваем первый байт через Range.
+        """
+        url = f"{base_url}/version"
+        started = time.monotonic()
+        try:
+            try:
+                response = await self.__open_url(
+                    url, MIRROR_PROBE_TIMEOUT_SEC, method="HEAD"
+                )
+            except HTTPError as e:
+                if e.code not in (405, 501):
+                    raise
+                response = await self.__open_url(
+                    url, MIRROR_PROBE_TIMEOUT_SEC, headers={"Range": "bytes=0-0"}
+                )
+            async with response:
+                rtt = time.monotonic() - started
+        except Exception as e:
+            log_debug(f"mirrors: probe {base_url} failed: {e}")
+            return None
+        log_debug(f"mirrors: probe {base_url} rtt={rtt * 1000:.0f}ms")
+        return rtt
 
+    async def __probe_many(self, base_urls: list[str]) -> list[float | None]:
+        return await asyncio.gather(*(self.probe(url) for url in base_urls))
 
-def wait_for_graphical_session(
-    max_wait_sec: int = GRAPHICAL_SESSION_BOOT_WAIT_SEC,
-    poll_interval_sec: int = GRAPHICAL_SESSION_POLL_INTERVAL_SEC,
-) -> bool:
-    """Подождать появления графической сессии (например, после загрузки системы)."""
-    if graphical_session_ready():
-        return True
-    log_debug(
-        f"Graphical session not ready, waiting up to {max_wait_sec}s "
-        f"(poll every {poll_interval_sec}s)"
-    )
-    deadline = time.time() + max_wait_sec
-    while time.time() < deadline:
-        remaining = deadline - time.time()
-        if remaining <= 0:
-            break
-        time.sleep(min(poll_interval_sec, remaining))
-        if graphical_session_ready():
-            log_debug("Graphical session became ready")
-            return True
-    log_debug("Graphical session still not ready after wait")
-    return False
+    def probe_all(self, base_urls: list[str]) -> None:
+        """Опросить зеркала одновременно (корутинами в одном потоке движка)."""
+        try:
+            rtts = self.__run(self.__probe_many(base_urls))
+        except DownloadCancelledError:
+            return
+        for base_url, rtt in zip(base_urls, rtts):
+            self.record_probe(base_url, rtt)
 
+    def probe_in_background(self, base_urls: list[str]) -> None:
+        """
+        Опросить зеркала, не дожидаясь ответов: новые оценки достанутся
+        следующему ranked(). Зеркала, которые уже опрашиваются, пропускаются.
+        """
+        if self.__spawn is None:
+            return
+        with self.__lock:
+            base_urls = [url for url in base_urls if url not in self.__probing]
+            self.__probing.update(base_urls)
+        if not base_urls:
+            return
 
-def is_gui_running() -> bool:
-    """
-    Check if GUI instance is already running by checking lock file and process.
-    """
-    if not LOCK_FILE.exists():
-        return False
+        async def probe_and_record() -> None:
+            try:
+                rtts = await self.__probe_many(base_urls)
+                # state.json пишем вне цикла событий
+                await NETWORK_ENGINE.run_blocking(
+                    lambda: [
+                        self.record_probe(url, rtt) for url, rtt in zip(base_urls, rtts)
+                    ]
+                )
+            finally:
+                with self.__lock:
+                    self.__probing.difference_update(base_urls)
 
-    try:
-        # Check if process from lock file is still running
-        pid = int(LOCK_FILE.read_text().strip())
-        os.kill(pid, 0)  # Check if process exists (doesn't kill, just checks)
-        return True
-    except (OSError, ValueError):
-        # Process doesn't exist, remove stale lock file
         try:
-            LOCK_FILE.unlink()
-        except Exception:
-            pass
-        return False
+            self.__spawn(probe_and_record())
+        except Exception as e:
+            log_debug(f"mirrors: background probe not started: {e}")
+            with self.__lock:
+                self.__probing.difference_update(base_urls)
+
+    def ranked(self, probe: bool = True, background: bool = False) -> list[str]:
+        """
+        Серверы в порядке обращения: сначала без недавних ошибок, по ожидаемому
+        времени скачивания; при равенстве — в порядке из конфига.
+        probe=False — без проб устаревших оценок (вызов из главного цикла GUI);
+        с background=True они опрашиваются в фоне, а порядок — по сохранённым.
+        """
+        base_urls = self.base_urls()
+        if len(base_urls) == 1:
+            return base_urls
+        scores = self.scores()
+        now = self.__clock()
+        stale = [
+            url
+            for url in base_urls
+            if now - float(scores.get(url, {}).get("probed_at", 0))
+            > MIRROR_SCORES_TTL_SEC
+        ]
+        if stale and probe:
+            self.probe_all(stale)
+            scores = self.scores()
+        elif stale and background:
+            self.probe_in_background(stale)
+        known_throughput = _percentile(
+            [
+                float(scores[url]["throughput"])
+                for url in base_urls
+                if isinstance(scores.get(url), dict) and scores[url].get("throughput")
+            ],
+            0.5,
+        )
 
+        def key(item: tuple[int, str]):
+            index, url = item
+            entry = scores.get(url, {})
+            expected = self.expected_time(entry, known_throughput)
+            return (int(entry.get("failures", 0)) > 0, expected, index)
 
-def launch_gui_version(script_path: str | None = None) -> bool:
+        ranked = [url for _, url in sorted(enumerate(base_urls), key=key)]
+        log_debug(f"mirrors: ranked {ranked}")
+        return ranked
+
+
+class PeerExchange:
     """
-    Launch GUI version of the script with proper DISPLAY/XAUTHORITY.
-    Tries multiple methods:
-    1. Check if GUI is already running (avoid duplicates)
-    2. systemd-run with environment from active session
-    3. Direct execution with environment variables
+    Обмен дистрибутивами между машинами одной сети ([p2p] enabled).
+
+    Перед скачиванием с сервера клиент рассылает в multicast-группу запрос who_has
+    с версией и именем файла. Машины, у которых этот файл лежит в кэше со status=ok,
+    отвечают версией, SHA-256 из манифеста и портом своего HTTP-сервера (CacheServer).
+    Файл скачивается у первого ответившего соседа и принимается, только если
+    SHA-256 совпал с доверенным и артефакт прошёл проверку; иначе — следующий сосед
+    и в конце концов основной сервер.
+
+    Ответы приходят по multicast без аутентификации, поэтому SHA-256 из ответа
+    сам по себе ничего не доказывает: доверенный хеш берётся из манифеста общего
+    кэша или из <файл>.sha256 на сервере (зеркале). Хеш из ответа соседа
+    принимается, только если сверить не с чем и это явно разрешено
+    ([p2p] trust_peers).
     """
-    if script_path is None:
-        script_path = sys.argv[0]
 
-    # Check if GUI instance is already running
-    if is_gui_running():
-        return True
+    MAGIC = "chromium-gost-updater/p2p/1"
+    MAX_MESSAGE_SIZE = 2048
 
-    # Try to get DISPLAY/WAYLAND and XAUTHORITY from active user session
-    display = None
-    wayland_display = None
-    xauthority = None
+    def __init__(self, downloader: "Downloader"):
+        self.__downloader = downloader
+        self.__stop = threading.Event()
 
-    # Method 1: Check environment of systemd user session
-    try:
-        result = subprocess.run(
-            ["systemctl", "--user", "show-environment"],
-            capture_output=True,
-            text=True,
-            timeout=2,
-        )
-        if result.returncode == 0:
-            for line in result.stdout.splitlines():
-                if line.startswith("DISPLAY="):
-                    display = line.split("=", 1)[1]
-                elif line.startswith("WAYLAND_DISPLAY="):
-                    wayland_display = line.split("=", 1)[1]
-                elif line.startswith("XAUTHORITY="):
-                    xauthority = line.split("=", 1)[1]
-    except Exception:
-        pass
+    def _query(self, version: str, filename: str) -> bytes:
+        message = {"magic": self.MAGIC, "type": "who_has", "version": version}
+        message["file"] = filename
+        return json.dumps(message).encode("utf-8")
 
-    # Method 2: Check common X11 locations
-    if not display:
+    def answer(self, data: bytes, http_port: int) -> bytes | None:
+        """Ответ на запрос who_has, если запрошенный файл есть в нашем кэше."""
         try:
-            x11_dir = Path("/tmp/.X11-unix")
-            if x11_dir.exists():
-                sockets = list(x11_dir.glob("X*"))
-                if sockets:
-                    display = f":{sockets[0].name[1:]}"
-                    xauth_path = Path.home() / ".Xauthority"
-                    if xauth_path.exists():
-                        xauthority = str(xauth_path)
-        except Exception:
-            pass
+            message = json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            return None
+        if not isinstance(message, dict) or message.get("magic") != self.MAGIC:
+            return None
+        if message.get("type") != "who_has":
+            return None
+        version = str(message.get("version", ""))
+        filename = str(message.get("file", ""))
+        entry = self.__downloader._get_manifest_entry(version)
+        if not entry or entry.get("status") != "ok" or entry.get("file") != filename:
+            return None
+        if not entry.get("sha256"):
+            return None
+        if filename not in {p.name for p in self.__downloader.cached_artifacts().values()}:
+            return None
+        reply = {
+            "magic": self.MAGIC,
+            "type": "have",
+            "version": version,
+            "file": filename,
+            "sha256": entry["sha256"],
+            "port": http_port,
+        }
+        return json.dumps(reply).encode("utf-8")
 
-    # Method 3: Try systemd-run with user environment
-    if display or wayland_display:
+    def find_peers(self, version: str, filename: str) -> list[dict]:
+        """
+        Разослать who_has и собрать ответы за discovery_timeout_ms.
+        Возвращает соседей (host, port, sha256) в порядке ответа.
+        """
+        group, port = CONFIG.p2p_group(), CONFIG.p2p_port()
+        deadline = time.monotonic() + CONFIG.p2p_discovery_timeout_ms() / 1000
+        peers: list[dict] = []
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            try:
+                sock.sendto(self._query(version, filename), (group, port))
+            except OSError as e:
+                log_debug(f"p2p: who_has {version} not sent: {e}")
+                return []
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data, (host, _) = sock.recvfrom(self.MAX_MESSAGE_SIZE)
+                except (socket.timeout, OSError):
+                    break
+                peer = self._parse_reply(data, version, filename)
+                if peer:
+                    peer["host"] = host
+                    peers.append(peer)
+        log_debug(f"p2p: {len(peers)} peer(s) have {filename}")
+        return peers
+
+    def _parse_reply(self, data: bytes, version: str, filename: str) -> dict | None:
         try:
-            env_vars = {}
-            if display:
-                env_vars["DISPLAY"] = display
-            if wayland_display:
-                env_vars["WAYLAND_DISPLAY"] = wayland_display
-            if xauthority:
-                env_vars["XAUTHORITY"] = xauthority
-            if "DBUS_SESSION_BUS_ADDRESS" in os.environ:
-                env_vars["DBUS_SESSION_BUS_ADDRESS"] = os.environ[
-                    "DBUS_SESSION_BUS_ADDRESS"
-                ]
+            reply = json.loads(data.decode("utf-8"))
+            if (
+                reply.get("magic") == self.MAGIC
+                and reply.get("type") == "have"
+                and reply.get("version") == version
+                and reply.get("file") == filename
+            ):
+                return {"port": int(reply["port"]), "sha256": str(reply["sha256"])}
+        except (UnicodeDecodeError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+        return None
 
-            env_args = []
-            for k, v in env_vars.items():
-                env_args.extend([f"--setenv={k}={v}"])
+    def _bind_responder(self) -> socket.socket:
+        group, port = CONFIG.p2p_group(), CONFIG.p2p_port()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            # Несколько пользователей одного хоста слушают общий порт
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        multicast = ipaddress.ip_address(group).is_multicast
+        sock.bind(("" if multicast else group, port))
+        if multicast:
+            membership = socket.inet_aton(group) + socket.inet_aton("0.0.0.0")
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.settimeout(1.0)
+        return sock
+
+    def start(self, http_port: int) -> None:
+        """Отвечать на запросы соседей, раздавая кэш с HTTP-порта http_port."""
+        sock = self._bind_responder()
+        log_debug(f"p2p: responder on {sock.getsockname()}, http port {http_port}")
+
+        def loop() -> None:
+            with sock:
+                while not self.__stop.is_set():
+                    try:
+                        data, address = sock.recvfrom(self.MAX_MESSAGE_SIZE)
+                    except socket.timeout:
+                        continue
+                    except OSError:
+                        return
+                    reply = self.answer(data, http_port)
+                    if reply:
+                        sock.sendto(reply, address)
 
-            cmd = (
-                ["systemd-run", "--user", "--collect", "--no-block"]
-                + env_args
-                + [script_path]
-            )
-            proc = subprocess.Popen(
-                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
-            # Note: We can't reliably get PID from systemd-run, so skip lock file
-            return True
-        except Exception:
-            pass
+        threading.Thread(target=loop, name="p2p-responder", daemon=True).start()
 
-    # Fallback: Try direct execution with environment
-    try:
-        env = os.environ.copy()
-        if display:
+    def stop(self) -> None:
+        self.__stop.set()
+
+
+class Downloader:
+
+    HEADERS = {"User-Agent": "chromium-gost-updater/1.0"}
+    MANIFEST_LOCK = ".cache.toml.lock"
+
+    def __init__(self):
+        # Статистика последнего скачивания (байты, длительность, скорость) для метрик
+        self.last_download_stats: dict | None = None
+        self._retry_scheduler = RetryScheduler(
+            DOWNLOAD_RETRY_BASE_DELAY_SEC, CONFIG.download_retry_max_delay()
+        )
+        # Отменяется в shutdown(); токены отдельных скачиваний — его потомки
+        self._shutdown = CancelToken()
+        self.mirrors = MirrorSelector(self._open_url, self._run, self._spawn)
+        self.peers = PeerExchange(self)
+        # Зеркала, отдавшие версию, отличную от основного сервера: для скачивания
+        # их не используем, пока не догонят
+        self._lagging_mirrors: set[str] = set()
+        # Записи манифеста обновляются из нескольких потоков (--fetch-all)
+        # и процессов (--import, --serve, трэй): см. _manifest_transaction
+        self._manifest_lock = threading.RLock()
+        # Глубина захвата flock-блокировок кэша текущим потоком (_flock)
+        self.__held = threading.local()
+        # Скорость скачивания: [download] max_rate и лимит политики (set_rate_limit),
+        # действует меньший. Ведро общее для одновременных передач процесса
+        # ([download] max_rate_shared), иначе у каждой передачи своё
+        self._max_rate: int | None = CONFIG.download_max_rate() or None
+        self._rate_limit: int | None = None
+        self._bucket = TokenBucket(self._max_rate)
+        self._transfer_buckets: set[TokenBucket] = set()
+        self._rate_lock = threading.Lock()
+
+    def set_max_rate(self, rate: int | None) -> None:
+        """Изменить [download] max_rate (байт/с); действует и на идущие передачи."""
+        self._max_rate = rate or None
+        self.__apply_rate()
+
+    def set_rate_limit(self, rate: int | None) -> None:
+        """Ограничение скорости от политики скачивания; None — снять."""
+        self._rate_limit = rate or None
+        self.__apply_rate()
+
+    def _effective_rate(self) -> int | None:
+        rates = [rate for rate in (self._max_rate, self._rate_limit) if rate]
+        return min(rates) if rates else None
+
+    def __apply_rate(self) -> None:
+        with self._rate_lock:
+            rate = self._effective_rate()
+            if rate != self._bucket.rate:
+                log_debug(f"cache: rate limit {rate or 'off'}")
+            self._bucket.set_rate(rate)
+            for bucket in self._transfer_buckets:
+                bucket.set_rate(rate)
+
+    def _transfer_bucket(self) -> TokenBucket:
+        """Ведро для новой передачи: общее или своё (max_rate_shared = 0)."""
+        if CONFIG.download_max_rate_shared():
+            return self._bucket
+        with self._rate_lock:
+            bucket = TokenBucket(self._effective_rate())
+            self._transfer_buckets.add(bucket)
+            return bucket
+
+    def _release_bucket(self, bucket: TokenBucket) -> None:
+        with self._rate_lock:
+            self._transfer_buckets.discard(bucket)
+
+    def circuit_breaker(self, url: str) -> CircuitBreaker:
+        """Предохранитель для хоста, к которому обращается url."""
+        return CircuitBreaker(urlparse(url).netloc)
+
+    def circuit_retry_at(self, url: str | None = None) -> float | None:
+        """
+        Когда будет следующая попытка обратиться к серверу, если он признан недоступным.
+        Без url — к любому из серверов (зеркал); None, если какой-то из них доступен.
+        """
+        if url:
+            return self.circuit_breaker(url).retry_at()
+        retry_times = [
+            self.circuit_breaker(base_url).retry_at()
+            for base_url in self.mirrors.base_urls()
+        ]
+        if any(retry_at is None for retry_at in retry_times):
+            return None
+        return min(retry_times)
+
+    def _run(self, coro, cancel: CancelToken | None = None):
+        """
+        Синхронный фасад: выполнить корутину в NETWORK_ENGINE и дождаться результата.
+        При отмене cancel (по умолчанию — shutdown()) операция прерывается
+        на ближайшем await — DownloadCancelledError.
+        """
+        future = NETWORK_ENGINE.submit(coro)
+        remove = (cancel or self._shutdown).on_cancel(
+            lambda: NETWORK_ENGINE.cancel(future)
+        )
+        try:
+            return future.result()
+        except FutureCancelledError:
+            raise DownloadCancelledError("network operation cancelled") from None
+        finally:
+            remove()
+
+    def _spawn(self, coro) -> Future:
+        """
+        Запустить корутину в NETWORK_ENGINE, не дожидаясь результата
+        (фоновые пробы зеркал). shutdown() её отменяет.
+        """
+        future = NETWORK_ENGINE.submit(coro)
+        remove = self._shutdown.on_cancel(lambda: NETWORK_ENGINE.cancel(future))
+        future.add_done_callback(lambda _: remove())
+        return future
+
+    async def _open_url(
+        self,
+        url: str,
+        timeout: float,
+        method: str | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> AsyncHttpResponse:
+        """
+        Запрос через предохранитель: при разомкнутой цепи сразу CircuitOpenError.
+        Состояние предохранителя (state.json под flock) читается и пишется
+        вне потока цикла.
+        """
+        breaker = self.circuit_breaker(url)
+        await NETWORK_ENGINE.run_blocking(breaker.check)
+        try:
+            response = await NETWORK_ENGINE.open(
+                url, method or "GET", {**self.HEADERS, **(headers or {})}, timeout
+            )
+        except Exception as e:
+            if _is_server_failure(e):
+                await NETWORK_ENGINE.run_blocking(breaker.record_failure)
+            else:
+                await NETWORK_ENGINE.run_blocking(breaker.record_success)
+            raise
+        await NETWORK_ENGINE.run_blocking(breaker.record_success)
+        return response
+
+    @staticmethod
+    async def _network_timeouts() -> tuple[float, float]:
+        """Таймауты connect и read из NETWORK_STATS (state.json — вне потока цикла)."""
+        return await NETWORK_ENGINE.run_blocking(
+            lambda: (NETWORK_STATS.connect_timeout(), NETWORK_STATS.read_timeout())
+        )
+
+    def wake_retry(self) -> None:
+        """Не ждать паузу между попытками, повторить скачивание сразу."""
+        log_debug("cache: retry wait interrupted, retrying now")
+        self._retry_scheduler.wake()
+
+    def shutdown(self) -> None:
+        """Прекратить повторы и отменить идущие сетевые операции (выход из приложения)."""
+        log_debug("cache: shutdown requested")
+        self._shutdown.cancel()
+        self._retry_scheduler.wake()
+
+    def _get_cache_dir(self) -> Path:
+        """Получить путь к директории кэша пакетов."""
+        cache_dir = CACHE_PACKAGES_DIR
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return cache_dir
+
+    def _get_cache_manifest_path(self) -> Path:
+        """Получить путь к файлу манифеста кэша."""
+        return CACHE_MANIFEST_FILE
+
+    @staticmethod
+    def _make_group_writable(path: Path, mode: int = 0o664) -> None:
+        """Личный кэш остаётся за владельцем; группе его открывает SharedCache."""
+
+    @contextmanager
+    def _flock(self, name: str, shared: bool = False, cancel=None):
+        """
+        flock на файле блокировки в каталоге кэша; повторный захват тем же потоком
+        не блокируется. При cancel (Event) ждём с опросом и отдаём False, если отменили.
+        """
+        if fcntl is None:
+            # Windows: остаётся только блокировка внутри процесса
+            yield True
+            return
+        depth = getattr(self.__held, name, 0)
+        if depth:
+            setattr(self.__held, name, depth + 1)
+            try:
+                yield True
+            finally:
+                setattr(self.__held, name, depth)
+            return
+
+        lock_path = self._get_cache_dir() / name
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o664)
+        try:
+            self._make_group_writable(lock_path)
+            mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            if cancel is None:
+                fcntl.flock(fd, mode)
+            else:
+                while True:
+                    try:
+                        fcntl.flock(fd, mode | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if cancel.wait(SHARED_CACHE_LOCK_POLL_SEC):
+                            yield False
+                            return
+            setattr(self.__held, name, 1)
+            try:
+                yield True
+            finally:
+                setattr(self.__held, name, 0)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _manifest_transaction(self):
+        """
+        Чтение-изменение-запись cache.toml: _manifest_lock между потоками,
+        flock на .cache.toml.lock между процессами (--import, --serve, трэй).
+        """
+        with self._manifest_lock, self._flock(self.MANIFEST_LOCK):
+            yield
+
+    @timed_span("manifest_load")
+    def _load_cache_manifest(self) -> dict:
+        """Загрузить манифест кэша из toml файла."""
+        manifest_path = self._get_cache_manifest_path()
+        if not manifest_path.exists():
+            return {"packages": {}}
+
+        # Try tomllib (py3.11), else toml (pip), else empty dict
+        try:
+            import tomllib as toml_loader  # Python 3.11+
+        except Exception:
+            try:
+                import toml as toml_loader  # type: ignore[import] -- pip install toml
+            except Exception:
+                log_warn("cache: toml loader not available, returning empty manifest")
+                return {"packages": {}}
+
+        try:
+            # tomllib (Python 3.11+) требует бинарный режим
+            # toml (pip) может работать с обоими режимами, но предпочтительно бинарный
+            try:
+                with manifest_path.open("rb") as f:
+                    data = toml_loader.load(f)
+            except (TypeError, AttributeError):
+                # Fallback для старых версий toml (pip), которые требуют текстовый режим
+                with manifest_path.open("r", encoding="utf-8") as f:
+                    data = toml_loader.load(f)
+            return data if isinstance(data, dict) else {"packages": {}}
+        except Exception as e:
+            log_warn(f"cache: failed to load manifest: {e}")
+            return {"packages": {}}
+
+    @timed_span("manifest_save")
+    def _save_cache_manifest(self, manifest: dict) -> None:
+        """
+        Сохранить манифест кэша в toml файл. Пишем во временный файл и подменяем
+        os.replace: другой процесс не увидит cache.toml наполовину записанным.
+        """
+        manifest_path = self._get_cache_manifest_path()
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = manifest_path.with_name(f".{manifest_path.name}.{os.getpid()}.tmp")
+
+        saved = False
+        try:
+            import toml as toml_dumper  # type: ignore[import] -- python3-toml / pip
+
+            with tmp.open("w", encoding="utf-8") as f:
+                toml_dumper.dump(manifest, f)
+            os.replace(tmp, manifest_path)
+            saved = True
+            log_debug(f"cache: manifest saved to {manifest_path} (toml)")
+        except Exception as e:
+            log_debug(f"cache: toml.dump unavailable or failed ({e}), using builtin serializer")
+
+        if not saved:
+            try:
+                tmp.write_text(_serialize_cache_manifest(manifest), encoding="utf-8")
+                os.replace(tmp, manifest_path)
+                log_debug(f"cache: manifest saved to {manifest_path} (builtin)")
+            except Exception as e:
+                log_warn(f"cache: failed to save manifest: {e}")
+        tmp.unlink(missing_ok=True)
+
+    def _version_from_cached_filename(self, filename: str) -> str | None:
+        if IS_WINDOWS:
+            match = _CACHE_PKG_EXE_PATTERN.match(filename)
+        else:
+            match = _CACHE_PKG_DEB_PATTERN.match(filename)
+        return match.group(1) if match else None
+
+    def rebuild_cache_manifest_if_missing(self) -> None:
+        """Восстановить cache.toml из уже скачанных файлов в каталоге кэша."""
+        manifest_path = self._get_cache_manifest_path()
+        if manifest_path.exists():
+            packages = self._load_cache_manifest().get("packages", {})
+            if isinstance(packages, dict) and packages:
+                return
+
+        cache_dir = self._get_cache_dir()
+        ext = PACKAGE_MANAGER.get_extension()
+        rebuilt = False
+        with low_impact_io("manifest_rebuild"):
+            for path in sorted(cache_dir.iterdir()):
+                if not path.is_file():
+                    continue
+                version = self._version_from_cached_filename(path.name)
+                if not version:
+                    continue
+                if not validate_artifact(path, ext):
+                    log_debug(
+                        f"cache: skip rebuild for {path.name}, validation failed"
+                    )
+                    continue
+                mtime = path.stat().st_mtime
+                downloaded_at = datetime.fromtimestamp(mtime).isoformat()
+                self._register_in_cache(
+                    version,
+                    path.name,
+                    path,
+                    "ok",
+                    failed_attempts=0,
+                    downloaded_at=downloaded_at,
+                )
+                rebuilt = True
+                log_debug(f"cache: rebuilt manifest entry for version {version}")
+
+        if rebuilt:
+            log_debug("cache: manifest rebuilt from files on disk")
+
+    def _resolve_cached_file(
+        self, version: str, package_info: dict, extension: str
+    ) -> Path | None:
+        filename = package_info.get("file")
+        if not filename:
+            log_debug(f"cache: no filename in package info for version {version}")
+            return None
+
+        if package_info.get("status") == "partial":
+            log_debug(f"cache: version {version} partially downloaded, will resume")
+            return None
+
+        cache_dir = self._get_cache_dir()
+        cached_file = cache_dir / filename
+
+        if not cached_file.exists():
+            log_debug(f"cache: file {filename} not found in cache directory")
+            return None
+
+        expected_size = package_info.get("size")
+        if expected_size:
+            actual_size = cached_file.stat().st_size
+            if actual_size != expected_size:
+                log_debug(
+                    f"cache: size mismatch for {filename}: expected {expected_size}, got {actual_size}"
+                )
+                return None
+
+        status = package_info.get("status")
+        if status == "error":
+            if self.get_failed_attempts(version) >= self.get_retries_count():
+                log_debug(
+                    f"cache: version {version} marked as error, download attempts exhausted"
+                )
+            else:
+                log_debug(f"cache: version {version} marked as error in manifest")
+            return None
+
+        if status != "ok":
+            if validate_artifact(cached_file, extension):
+                self._register_in_cache(
+                    version, filename, cached_file, "ok", failed_attempts=0
+                )
+                return cached_file
+            failed_attempts = min(
+                self.get_failed_attempts(version) + 1, self.get_retries_count()
+            )
+            self._register_in_cache(
+                version, filename, cached_file, "error", failed_attempts=failed_attempts
+            )
+            return None
+
+        if not validate_artifact(cached_file, extension):
+            log_debug(f"cache: cached file {filename} failed validation")
+            failed_attempts = min(
+                self.get_failed_attempts(version) + 1, self.get_retries_count()
+            )
+            self._register_in_cache(
+                version, filename, cached_file, "error", failed_attempts=failed_attempts
+            )
+            return None
+
+        log_debug(f"cache: found valid cached file {filename} for version {version}")
+        return cached_file
+
+    def _check_cache(self, version: str, extension: str) -> Path | None:
+        """
+        Проверить наличие файла в кэше.
+        Возвращает путь к файлу, если он есть и валиден (status=ok), иначе None.
+        """
+        manifest = self._load_cache_manifest()
+        packages = manifest.get("packages", {})
+
+        if version not in packages:
+            log_debug(f"cache: version {version} not found in manifest")
+            return None
+
+        package_info = packages[version]
+        if not isinstance(package_info, dict):
+            log_debug(f"cache: invalid package info for version {version}")
+            return None
+
+        return self._resolve_cached_file(version, package_info, extension)
+
+    def cached_artifacts(self) -> dict[str, Path]:
+        """Версии с валидным (status=ok) файлом в кэше: версия -> путь к файлу."""
+        cache_dir = self._get_cache_dir()
+        packages = self._load_cache_manifest().get("packages", {})
+        result: dict[str, Path] = {}
+        for version, package_info in packages.items():
+            if not isinstance(package_info, dict) or package_info.get("status") != "ok":
+                continue
+            filename = package_info.get("file")
+            if filename and (cache_dir / filename).is_file():
+                result[version] = cache_dir / filename
+        return result
+
+    def get_valid_cached_package(self, version: str) -> Path | None:
+        """
+        Публичная обёртка для получения валидного файла из кэша.
+        Сначала смотрим общий кэш хоста: найденный там файл связываем
+        с пользовательским или, если связать нельзя, отдаём как есть.
+        """
+        ext = PACKAGE_MANAGER.get_extension()
+        shared = self._shared_cache()
+        if shared is not None:
+            linked = self._link_from_shared(shared, version, ext)
+            if linked:
+                return linked
+        return self._check_cache(version, ext)
+
+    def verify_package_digest(self, path: Path) -> bool:
+        """
+        Непосредственно перед установкой: SHA-256 файла совпадает с записанным
+        в манифест его кэша (пользовательского, общего или службы), когда файл
+        скачивали и проверяли. Файл без записи с SHA-256 не проходит.
+        """
+        if path.parent == self._get_cache_dir():
+            manifest = self._load_cache_manifest()
+        else:
+            try:
+                manifest = _parse_cache_manifest(
+                    (path.parent / CACHE_MANIFEST_FILE.name).read_bytes()
+                )
+            except OSError as e:
+                log_warn(f"cache: no manifest for {path}: {e}")
+                return False
+        expected = {
+            info.get("sha256")
+            for _, _, info in _manifest_items(manifest)
+            if info.get("file") == path.name and info.get("status") == "ok"
+        } - {None}
+        try:
+            actual = _file_sha256(path)
+        except OSError as e:
+            log_warn(f"cache: failed to hash {path}: {e}")
+            return False
+        if actual in expected:
+            return True
+        log_warn(f"cache: SHA-256 of {path} does not match the manifest")
+        return False
+
+    def _shared_cache(self) -> "SharedCache | None":
+        return SHARED_CACHE
+
+    def _link_from_shared(
+        self, shared: "SharedCache", version: str, ext: str
+    ) -> Path | None:
+        """
+        Связать файл версии из общего кэша с пользовательским (hardlink или reflink)
+        и зарегистрировать его в пользовательском манифесте. Копию не делаем:
+        чужой файл связать нельзя (fs.protected_hardlinks), и без reflink
+        отдаём файл общего кэша как есть — место на диске не растёт
+        с числом пользователей. SHA-256 перед установкой сверяет
+        verify_package_digest.
+        """
+        shared_file = shared._check_cache(version, ext)
+        if not shared_file:
+            return None
+        sha256 = (shared._get_manifest_entry(version) or {}).get("sha256")
+        dest = self._get_cache_dir() / shared_file.name
+        local = self._get_manifest_entry(version) or {}
+        if (
+            local.get("status") == "ok"
+            and local.get("file") == dest.name
+            and sha256
+            and local.get("sha256") == sha256
+            and dest.exists()
+        ):
+            return dest
+        try:
+            method = _link_or_copy(shared_file, dest, copy=False)
+        except OSError as e:
+            log_warn(f"shared cache: failed to link {shared_file.name}: {e}")
+            return None
+        if method is None:
+            log_debug(f"shared cache: using {shared_file} in place")
+            return shared_file
+        if sha256 and _file_sha256(dest) != sha256:
+            log_warn(f"shared cache: SHA-256 mismatch for {shared_file.name}, ignoring")
+            _unlink_quietly(dest)
+            return None
+        log_debug(f"shared cache: {shared_file.name} linked into user cache ({method})")
+        self._register_in_cache(
+            version, dest.name, dest, "ok", failed_attempts=0, sha256=sha256
+        )
+        return dest
+
+    def cleanup_old_cache_files(self, max_age_days: int | None = None) -> None:
+        """
+        Удалить файлы из кэша, которые старше max_age_days дней.
+        Если max_age_days не указан, используется значение из конфига.
+        """
+        if max_age_days is None:
+            max_age_days = CONFIG.keep_cached_distributive_in_days()
+        with self._manifest_transaction():
+            removed = self._remove_expired(max_age_days)
+        if removed:
+            self._update_repository()
+
+    def _remove_expired(self, max_age_days: int) -> bool:
+        """Удалить устаревшие файлы и их записи; True, если манифест изменился."""
+        manifest = self._load_cache_manifest()
+        packages = manifest.get("packages", {})
+        platforms = manifest.get("platforms", {})
+        if not isinstance(platforms, dict):
+            platforms = {}
+        if not packages and not platforms:
+            return False
+
+        cache_dir = self._get_cache_dir()
+        current_time = time.time()
+        max_age_seconds = max_age_days * 24 * 60 * 60
+        removed_count = 0
+
+        packages_to_remove = []
+        for version, package_info in list(packages.items()):
+            if not isinstance(package_info, dict):
+                continue
+
+            downloaded_at_str = package_info.get("downloaded_at")
+            if not downloaded_at_str:
+                # Если нет даты, считаем файл старым
+                packages_to_remove.append(version)
+                continue
+
+            try:
+                # Парсим дату в формате ISO (например, "2024-01-01T12:00:00")
+                downloaded_at = datetime.fromisoformat(downloaded_at_str).timestamp()
+                age_seconds = current_time - downloaded_at
+
+                if age_seconds > max_age_seconds:
+                    packages_to_remove.append(version)
+                    log_debug(
+                        f"cache: marking version {version} for removal (age: {age_seconds / 86400:.1f} days)"
+                    )
+            except Exception as e:
+                log_debug(f"cache: failed to parse date for version {version}: {e}")
+                packages_to_remove.append(version)
+
+        # Удаляем файлы и записи из манифеста
+        for version in packages_to_remove:
+            package_info = packages.get(version)
+            if isinstance(package_info, dict):
+                filename = package_info.get("file")
+                if filename:
+                    file_path = cache_dir / filename
+                    try:
+                        if file_path.exists():
+                            file_path.unlink()
+                            log_debug(f"cache: removed old file {filename}")
+                            removed_count += 1
+                        _discard_partial(_partial_path(file_path))
+                    except Exception as e:
+                        log_debug(f"cache: failed to remove file {filename}: {e}")
+
+            del packages[version]
+
+        # Артефакты --fetch-all удаляем, когда устарели все платформы версии
+        platforms_to_remove = [
+            version
+            for version, by_platform in platforms.items()
+            if not isinstance(by_platform, dict)
+            or all(
+                self._is_expired(info, current_time, max_age_seconds)
+                for info in by_platform.values()
+            )
+        ]
+        for version in platforms_to_remove:
+            by_platform = platforms[version]
+            for info in by_platform.values() if isinstance(by_platform, dict) else ():
+                filename = info.get("file") if isinstance(info, dict) else None
+                if filename and (cache_dir / filename).exists():
+                    try:
+                        (cache_dir / filename).unlink()
+                        removed_count += 1
+                    except Exception as e:
+                        log_debug(f"cache: failed to remove file {filename}: {e}")
+            del platforms[version]
+
+        if packages_to_remove or platforms_to_remove:
+            manifest["packages"] = packages
+            self._save_cache_manifest(manifest)
+            log_debug(f"cache: cleanup completed, removed {removed_count} old files")
+            return True
+        return False
+
+    @staticmethod
+    def _is_expired(info, now: float, max_age_seconds: float) -> bool:
+        try:
+            downloaded_at = datetime.fromisoformat(info["downloaded_at"]).timestamp()
+        except Exception:
+            return True
+        return now - downloaded_at > max_age_seconds
+
+    async def _read_version(self, base_url: str) -> str:
+        connect_timeout, read_timeout = await self._network_timeouts()
+        started = time.monotonic()
+        async with await self._open_url(f"{base_url}/version", connect_timeout) as r:
+            rtt = time.monotonic() - started
+            await NETWORK_ENGINE.run_blocking(lambda: NETWORK_STATS.record_rtt(rtt))
+            r.read_timeout = read_timeout
+            return (await r.read_all()).decode("utf-8").strip()
+
+    async def _read_sha256(self, url: str) -> str | None:
+        """SHA-256 из файла <url>.sha256 (формат sha256sum или только хеш)."""
+        connect_timeout, read_timeout = await self._network_timeouts()
+        async with await self._open_url(f"{url}.sha256", connect_timeout) as r:
+            r.read_timeout = read_timeout
+            fields = (await r.read_all()).decode("ascii", "replace").split()
+        digest = fields[0].lower() if fields else ""
+        if len(digest) == 64 and all(c in "0123456789abcdef" for c in digest):
+            return digest
+        return None
+
+    def _trusted_sha256(self, version: str, ext: str, filename: str) -> str | None:
+        """
+        SHA-256 дистрибутива из доверенного источника: манифест общего кэша,
+        затем <файл>.sha256 на серверах скачивания. None, если сверить не с чем.
+        """
+        shared = self._shared_cache()
+        if shared is not None:
+            entry = shared._get_manifest_entry(version) or {}
+            if entry.get("file") == filename and entry.get("sha256"):
+                return str(entry["sha256"])
+        for base_url in self._download_base_urls(probe=False):
+            url = self._get_download_target(version, ext, base_url)[0]
+            try:
+                digest = self._run(self._read_sha256(url))
+            except Exception as e:
+                # Сервер может и не публиковать хеши: это не сбой зеркала
+                log_debug(f"p2p: no SHA-256 for {filename} at {base_url}: {e}")
+                continue
+            if digest:
+                return digest
+        return None
+
+    def _fetch_version(self, base_url: str) -> str | None:
+        try:
+            return self._run(self._read_version(base_url))
+        except CircuitOpenError as e:
+            log_debug(f"get_remote_version: {base_url} skipped, {e}")
+            return None
+        except DownloadCancelledError:
+            return None
+        except Exception as e:
+            log_debug(f"get_remote_version: {base_url} failed: {e}")
+            self.mirrors.record_failure(base_url)
+            return None
+
+    def _cross_check_version(self, base_url: str, version: str) -> str:
+        """
+        Сверить версию зеркала с основным сервером. Если основной недоступен —
+        доверяем зеркалу; если версии расходятся — верим основному серверу.
+        """
+        primary_version = self._fetch_version(self.mirrors.primary())
+        return self._reconcile_versions(base_url, version, primary_version)
+
+    def _reconcile_versions(
+        self, base_url: str, version: str, primary_version: str | None
+    ) -> str:
+        if primary_version is None:
+            log_debug(f"get_remote_version: primary unreachable, using {base_url}")
+            return version
+        if primary_version != version:
+            log_warn(
+                f"get_remote_version: mirror {base_url} reports {version}, "
+                f"primary reports {primary_version}"
+            )
+            self._lagging_mirrors.add(base_url)
+            return primary_version
+        self._lagging_mirrors.discard(base_url)
+        return version
+
+    @timed_span("get_remote_version")
+    def get_remote_version(self) -> str | None:
+        """
+        Запрашиваем удалённую версию (строка вида "142.0.7444.176") у лучшего
+        доступного зеркала, по очереди переходя к следующим при ошибке.
+        Порядок — по сохранённым оценкам: устаревшие обновляются в фоне,
+        проверка версии пробы не ждёт.
+        Возвращаем строку с версией или None, если не удалось.
+        """
+        primary = self.mirrors.primary()
+        for base_url in self.mirrors.ranked(probe=False, background=True):
+            version = self._fetch_version(base_url)
+            if version is None:
+                continue
+            if base_url != primary:
+                version = self._cross_check_version(base_url, version)
+            return version
+        return None
+
+    def get_retries_count(self) -> int:
+        return CONFIG.download_retries()
+
+    def _get_manifest_entry(self, version: str) -> dict | None:
+        manifest = self._load_cache_manifest()
+        package_info = manifest.get("packages", {}).get(version)
+        if isinstance(package_info, dict):
+            return package_info
+        return None
+
+    def get_failed_attempts(self, version: str) -> int:
+        entry = self._get_manifest_entry(version)
+        if not entry:
+            return 0
+        try:
+            return int(entry.get("failed_attempts", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def has_exhausted_download_attempts(self, version: str) -> bool:
+        return self.get_failed_attempts(version) >= self.get_retries_count()
+
+    def _reset_failed_attempts(self, version: str) -> None:
+        with self._manifest_transaction():
+            manifest = self._load_cache_manifest()
+            packages = manifest.get("packages", {})
+            if version in packages and isinstance(packages[version], dict):
+                packages[version]["failed_attempts"] = 0
+                manifest["packages"] = packages
+                self._save_cache_manifest(manifest)
+
+    def _get_download_target(
+        self, version: str, ext: str, base_url: str | None = None
+    ) -> tuple[str, str]:
+        base_url = base_url or REMOTE_BASE_URL
+        if ext == "exe":
+            filename = f"chromium-gost-{version}-installer.exe"
+            return f"{base_url}/windows/386/installer", filename
+        filename = f"chromium-gost-{version}-linux-amd64.{ext}"
+        url = f"{base_url}/linux/amd64/{filename}"
+        return url, filename
+
+    def _download_base_urls(self, probe: bool = True) -> list[str]:
+        """Серверы для скачивания в порядке обращения, без отстающих зеркал."""
+        return [
+            url
+            for url in self.mirrors.ranked(probe)
+            if url not in self._lagging_mirrors
+        ]
+
+    def get_package_filename(self, version: str) -> str:
+        ext = PACKAGE_MANAGER.get_extension()
+        _, filename = self._get_download_target(version, ext)
+        return filename
+
+    def download_package(
+        self,
+        version: str,
+        force: bool = False,
+        progress_callback=None,
+        cancel: CancelToken | None = None,
+    ) -> Path | None:
+        """
+        Загружаем дистрибутив с повторами.
+        progress_callback(DownloadProgress) вызывается по ходу скачивания.
+        cancel (или shutdown()) прерывает передачу на ближайшей порции данных
+        и паузу между попытками; принятое остаётся в .part для докачки
+        (status=partial в манифесте).
+        Сначала проверяем кэш, если файл есть и валиден (status=ok) — используем его.
+        Невалидный артефакт (не deb/rpm/PE): не более get_retries_count() попыток суммарно,
+        паузы между попытками выбирает RetryScheduler. После исчерпания лимита сервер не дёргаем.
+        При общем кэше ([paths] shared_cache_dir) версию на хосте скачивает один процесс,
+        остальные ждут и берут файл из общего кэша.
+        """
+        ext = PACKAGE_MANAGER.get_extension()
+
+        cached_file = self._check_cache(version, ext)
+        if cached_file:
+            log_debug(f"cache: using cached file for version {version}")
+            return cached_file
+
+        token = CancelToken(self._shutdown, cancel)
+        try:
+            shared = self._shared_cache()
+            if shared is None:
+                return self._fetch_package(
+                    version, ext, force, progress_callback, token
+                )
+
+            filename = self._get_download_target(version, ext)[1]
+            with shared.download_lock(filename, token) as acquired:
+                if not acquired:
+                    return None
+                linked = self._link_from_shared(shared, version, ext)
+                if linked:
+                    return linked
+                downloaded = self._fetch_package(
+                    version, ext, force, progress_callback, token
+                )
+                if downloaded:
+                    entry = self._get_manifest_entry(version) or {}
+                    shared.publish(version, downloaded, entry.get("sha256"))
+                return downloaded
+        finally:
+            token.close()
+
+    def download_package_when_allowed(
+        self,
+        version: str,
+        progress_callback=None,
+        cancel: CancelToken | None = None,
+        on_defer=None,
+    ) -> Path | None:
+        """
+        download_package по правилам DOWNLOAD_POLICY: на лимитном подключении,
+        от батареи или под нагрузкой скачивание откладывается или замедляется
+        и продолжается само, когда условия позволят.
+        """
+        token = CancelToken(self._shutdown, cancel)
+        try:
+            return DOWNLOAD_POLICY.run(
+                lambda attempt: self.download_package(
+                    version, progress_callback=progress_callback, cancel=attempt
+                ),
+                self.set_rate_limit,
+                token,
+                on_defer,
+            )
+        finally:
+            token.close()
+
+    def _fetch_package(
+        self,
+        version: str,
+        ext: str,
+        force: bool,
+        progress_callback=None,
+        cancel: CancelToken | None = None,
+    ) -> Path | None:
+        """Скачать дистрибутив (соседи, затем зеркала) в пользовательский кэш."""
+        cancel = cancel or self._shutdown
+        max_attempts = self.get_retries_count()
+        prior_failures = self.get_failed_attempts(version)
+        if not force and prior_failures >= max_attempts:
+            log_debug(
+                f"cache: download skipped for {version}, "
+                f"failed_attempts={prior_failures} >= {max_attempts}"
+            )
+            return None
+
+        if force:
+            self._reset_failed_attempts(version)
+            prior_failures = 0
+
+        cache_dir = self._get_cache_dir()
+        filename = self._get_download_target(version, ext)[1]
+        dest = cache_dir / filename
+
+        if CONFIG.p2p_enabled() and self._download_from_peers(
+            version, ext, dest, progress_callback, cancel
+        ):
+            return dest
+
+        base_urls = self._download_base_urls()
+
+        log_debug(f"cache: downloading {version} from {base_urls}")
+        attempt = prior_failures
+        self._retry_scheduler.reset()
+        stop_waking = cancel.on_cancel(self._retry_scheduler.wake)
+        try:
+            return self.__fetch_attempts(
+                version,
+                ext,
+                dest,
+                base_urls,
+                attempt,
+                self._retry_scheduler,
+                cancel,
+                progress_callback,
+            )
+        finally:
+            stop_waking()
+
+    def __fetch_attempts(
+        self,
+        version: str,
+        ext: str,
+        dest: Path,
+        base_urls: list[str],
+        attempt: int,
+        scheduler: "RetryScheduler",
+        cancel: CancelToken,
+        progress_callback=None,
+        platform: bool = False,
+    ) -> Path | None:
+        """
+        Попытки скачать артефакт ext, начиная после attempt уже неудачных:
+        в каждой зеркала перебираются по порядку, между попытками — пауза
+        scheduler. Итог попытки записывает _accept_download: в packages или,
+        при platform=True (--fetch-all), в platforms. Передачи --fetch-all идут
+        параллельно, поэтому в NETWORK_STATS они не учитываются.
+        """
+        max_attempts = self.get_retries_count()
+        while attempt < max_attempts and not cancel.is_set():
+            attempt += 1
+            retry_after = None
+            downloaded_file = None
+            source = None
+            stats: dict = {}
+            circuit_open = 0
+            # В пределах одной попытки перебираем зеркала по порядку
+            for base_url in base_urls:
+                url = self._get_download_target(version, ext, base_url)[0]
+                try:
+                    downloaded_file = self.__do_download_package(
+                        url,
+                        dest,
+                        progress_callback,
+                        record_network_stats=not platform,
+                        cancel=cancel,
+                        stats=stats,
+                    )
+                except CircuitOpenError as e:
+                    log_debug(f"cache: {base_url} skipped, {e}")
+                    circuit_open += 1
+                    continue
+                except DownloadCancelledError:
+                    log_debug(f"cache: download of {dest.name} cancelled")
+                    if not platform:
+                        self._register_partial(version, dest)
+                    return None
+                except Exception as e:
+                    log_debug(
+                        f"cache: download attempt {attempt}/{max_attempts} "
+                        f"from {base_url} failed: {e}"
+                    )
+                    retry_after = _retry_after_seconds(e) or retry_after
+                    self.mirrors.record_failure(base_url)
+                    continue
+                if downloaded_file:
+                    source = base_url
+                    break
+                log_debug(
+                    f"cache: download attempt {attempt}/{max_attempts} "
+                    f"from {base_url} returned no file for {version}"
+                )
+                self.mirrors.record_failure(base_url)
+
+            if circuit_open == len(base_urls):
+                # Все серверы признаны недоступными: попытку версии не засчитываем
+                # и не ждём
+                log_debug(f"cache: download skipped for {dest.name}, all circuits open")
+                return None
+
+            accepted = self._accept_download(
+                version, ext, dest, downloaded_file, attempt, source, stats, platform
+            )
+            if accepted:
+                return accepted
+            if source:
+                # Файл не прошёл проверку: следующая попытка — сначала с других
+                base_urls = [url for url in base_urls if url != source] + [source]
+
+            if attempt < max_attempts and not cancel.is_set():
+                delay_sec = scheduler.next_delay(attempt, retry_after)
+                log_debug(
+                    f"cache: waiting {delay_sec:.1f}s before next download attempt "
+                    f"(Retry-After: {retry_after})"
+                )
+                if scheduler.wait(delay_sec):
+                    log_debug("cache: retry wait interrupted")
+
+        return None
+
+    def _accept_download(
+        self,
+        version: str,
+        ext: str,
+        dest: Path,
+        downloaded: Path | None,
+        attempt: int,
+        base_url: str | None = None,
+        stats: dict | None = None,
+        platform: bool = False,
+    ) -> Path | None:
+        """
+        Итог попытки скачивания: проверенный .part кладётся в кэш (status=ok),
+        иначе попытка засчитывается (status=error, failed_attempts=attempt).
+        base_url — сервер, отдавший файл: скорость скачивания (stats передачи,
+        по умолчанию last_download_stats) идёт в его оценку только после
+        проверки, испорченный файл считается его ошибкой. SHA-256 считается
+        здесь же, по проверенному файлу. platform=True — запись в platforms.
+        """
+        if not downloaded:
+            self._register_attempt(version, ext, dest, "error", attempt, platform)
+            return None
+        if validate_artifact(downloaded, ext):
+            if base_url:
+                if stats is None:
+                    stats = self.last_download_stats or {}
+                self.mirrors.record_download(
+                    base_url, stats.get("bytes", 0), stats.get("duration", 0.0)
+                )
+            try:
+                sha256 = _file_sha256(downloaded)
+            except OSError as e:
+                log_debug(f"cache: failed to hash {downloaded.name}: {e}")
+                sha256 = None
+            downloaded = _commit_partial(downloaded)
+            self._register_attempt(version, ext, downloaded, "ok", 0, platform, sha256)
+            return downloaded
+        log_debug(
+            f"cache: validation failed for {_committed_path(downloaded).name} "
+            f"(attempt {attempt}/{self.get_retries_count()})"
+        )
+        if base_url:
+            self.mirrors.record_failure(base_url)
+        self._register_attempt(version, ext, downloaded, "error", attempt, platform)
+        _discard_partial(downloaded)
+        return None
+
+    def _register_attempt(
+        self,
+        version: str,
+        ext: str,
+        path: Path,
+        status: str,
+        failed_attempts: int,
+        platform: bool,
+        sha256: str | None = None,
+    ) -> None:
+        """Записать итог попытки: в packages под именем без .part или в platforms."""
+        if platform:
+            self._register_platform(
+                version, ext, path, status, sha256, failed_attempts=failed_attempts
+            )
+            return
+        self._register_in_cache(
+            version,
+            _committed_path(path).name,
+            path,
+            status,
+            failed_attempts=failed_attempts,
+            sha256=sha256,
+        )
+
+    def _download_from_peers(
+        self,
+        version: str,
+        ext: str,
+        dest: Path,
+        progress_callback=None,
+        cancel: CancelToken | None = None,
+    ) -> bool:
+        """
+        Скачать дистрибутив у соседней машины (p2p) и зарегистрировать его в кэше.
+        Файл принимается только при совпадении SHA-256 с доверенным (см. PeerExchange);
+        без доверенного хеша — с объявленным соседом, если [p2p] trust_peers.
+        """
+        peers = self.peers.find_peers(version, dest.name)
+        if not peers:
+            return False
+        trusted = self._trusted_sha256(version, ext, dest.name)
+        if trusted is None and not CONFIG.p2p_trust_peers():
+            log_warn(
+                f"p2p: no trusted SHA-256 for {dest.name}, peers skipped "
+                "([p2p] trust_peers = 0)"
+            )
+            return False
+        for peer in peers:
+            expected = trusted or peer["sha256"]
+            if peer["sha256"] != expected:
+                log_warn(
+                    f"p2p: {peer['host']} announced a wrong SHA-256 for {dest.name}"
+                )
+                continue
+            base_url = f"http://{peer['host']}:{peer['port']}"
+            url = f"{base_url}{CacheServer.LINUX_PREFIX}{dest.name}"
+            try:
+                downloaded = self.__do_download_package(
+                    url,
+                    dest,
+                    progress_callback,
+                    record_network_stats=False,
+                    cancel=cancel,
+                )
+            except DownloadCancelledError:
+                self._register_partial(version, dest)
+                return False
+            except Exception as e:
+                log_debug(f"p2p: download from {peer['host']} failed: {e}")
+                continue
+            if not downloaded:
+                continue
+            if (
+                downloaded != _partial_path(dest)
+                or _file_sha256(downloaded) != expected
+            ):
+                log_warn(f"p2p: SHA-256 mismatch for {dest.name} from {peer['host']}")
+            elif validate_artifact(downloaded, ext):
+                log_debug(f"p2p: {dest.name} downloaded from {peer['host']}")
+                _commit_partial(downloaded)
+                self._register_in_cache(
+                    version,
+                    dest.name,
+                    dest,
+                    "ok",
+                    failed_attempts=0,
+                    sha256=expected,
+                )
+                return True
+            _discard_partial(downloaded)
+        return False
+
+    def _register_in_cache(
+        self,
+        version: str,
+        filename: str,
+        file_path: Path,
+        status: str,
+        failed_attempts: int | None = None,
+        downloaded_at: str | None = None,
+        sha256: str | None = None,
+    ) -> None:
+        """
+        Зарегистрировать скачанный файл в манифесте кэша.
+        Для валидного файла (status=ok) сохраняется SHA-256: по нему файл раздаётся
+        соседним машинам (p2p). Если не передан, вычисляется по файлу.
+        """
+        with self._manifest_transaction():
+            manifest = self._load_cache_manifest()
+            packages = manifest.setdefault("packages", {})
+            entry = self._manifest_entry(
+                filename, file_path, status, downloaded_at, sha256
+            )
+            file_size = entry["size"]
+            if failed_attempts is not None:
+                entry["failed_attempts"] = failed_attempts
+            packages[version] = entry
+
+            manifest["packages"] = packages
+            self._save_cache_manifest(manifest)
+        log_debug(
+            f"cache: registered version {version} status={status} "
+            f"failed_attempts={failed_attempts} (file: {filename}, size: {file_size})"
+        )
+        self._update_repository()
+
+    def _register_partial(self, version: str, dest: Path) -> None:
+        """
+        Скачивание отменено: записать status=partial с размером принятого,
+        счётчик неудачных попыток не меняется.
+        """
+        part = _partial_path(dest)
+        if not part.exists() or part.stat().st_size == 0:
+            return
+        self._register_in_cache(
+            version,
+            dest.name,
+            part,
+            "partial",
+            failed_attempts=self.get_failed_attempts(version),
+        )
+
+    @staticmethod
+    def _manifest_entry(
+        filename: str,
+        file_path: Path,
+        status: str,
+        downloaded_at: str | None = None,
+        sha256: str | None = None,
+    ) -> dict:
+        file_size = file_path.stat().st_size if file_path.exists() else 0
+        entry: dict = {
+            "file": filename,
+            "downloaded_at": downloaded_at or datetime.now().isoformat(),
+            "size": file_size,
+            "status": status,
+        }
+        if status == "ok" and file_size:
+            try:
+                entry["sha256"] = sha256 or _file_sha256(file_path)
+            except OSError as e:
+                log_debug(f"cache: failed to hash {filename}: {e}")
+        return entry
+
+    def _update_repository(self) -> None:
+        """Обновить индексы apt/yum в каталоге кэша по текущему манифесту."""
+        if not CONFIG.repo_enabled():
+            return
+        artifacts = set(self.cached_artifacts().values())
+        artifacts.update(self.platform_artifacts().values())
+        try:
+            with low_impact_io("repo_update"):
+                LocalRepository(self._get_cache_dir()).update(artifacts)
+        except Exception as e:
+            log_warn(f"repo: index update failed: {e}")
+
+    def platform_artifacts(self) -> dict[tuple[str, str], Path]:
+        """Артефакты --fetch-all со status=ok: (версия, платформа) -> путь к файлу."""
+        cache_dir = self._get_cache_dir()
+        platforms = self._load_cache_manifest().get("platforms", {})
+        result: dict[tuple[str, str], Path] = {}
+        if not isinstance(platforms, dict):
+            return result
+        for version, by_platform in platforms.items():
+            if not isinstance(by_platform, dict):
+                continue
+            for platform, info in by_platform.items():
+                if not isinstance(info, dict) or info.get("status") != "ok":
+                    continue
+                filename = info.get("file")
+                if filename and (cache_dir / filename).is_file():
+                    result[(version, platform)] = cache_dir / filename
+        return result
+
+    def _register_platform(
+        self,
+        version: str,
+        platform: str,
+        file_path: Path,
+        status: str,
+        sha256: str | None = None,
+        failed_attempts: int | None = None,
+    ) -> dict:
+        """
+        Записать артефакт платформы в таблицу platforms манифеста кэша.
+        failed_attempts — неудачные попытки скачивания, как в packages.
+        """
+        filename = _committed_path(file_path).name
+        with self._manifest_transaction():
+            manifest = self._load_cache_manifest()
+            platforms = manifest.setdefault("platforms", {})
+            by_platform = platforms.setdefault(version, {})
+            entry = self._manifest_entry(filename, file_path, status, sha256=sha256)
+            if failed_attempts is not None:
+                entry["failed_attempts"] = failed_attempts
+            by_platform[platform] = entry
+            self._save_cache_manifest(manifest)
+        log_debug(
+            f"cache: registered {platform} artifact of {version} status={status} "
+            f"(file: {filename}, size: {entry['size']})"
+        )
+        self._update_repository()
+        return entry
+
+    def _cached_platform_artifact(self, version: str, platform: str) -> Path | None:
+        info = (self._load_cache_manifest().get("platforms", {}).get(version) or {}).get(
+            platform
+        )
+        if not isinstance(info, dict) or info.get("status") != "ok":
+            return None
+        path = self._get_cache_dir() / str(info.get("file", ""))
+        if not path.is_file() or path.stat().st_size != info.get("size"):
+            return None
+        return path if validate_artifact(path, platform) else None
+
+    def fetch_platform(self, version: str, platform: str) -> tuple[Path | None, str]:
+        """
+        Скачать артефакт платформы (deb, rpm, exe) для --fetch-all.
+        Возвращает путь (или None) и источник: cache, download или error.
+        Артефакт своей платформы берётся через download_package, чтобы запись
+        в packages (трэй, --serve, общий кэш) оставалась согласованной.
+        """
+        cached = self._cached_platform_artifact(version, platform)
+        if cached:
+            return cached, "cache"
+        if platform == PACKAGE_MANAGER.get_extension():
+            path = self.download_package(version)
+            if not path:
+                return None, "error"
+            sha256 = (self._get_manifest_entry(version) or {}).get("sha256")
+            self._register_platform(version, platform, path, "ok", sha256)
+            return path, "download"
+
+        dest = self._get_cache_dir() / self._get_download_target(version, platform)[1]
+        platforms = self._load_cache_manifest().get("platforms", {})
+        info = (platforms.get(version) or {}).get(platform) or {}
+        try:
+            prior_failures = int(info.get("failed_attempts", 0))
+        except (TypeError, ValueError):
+            prior_failures = 0
+        if prior_failures >= self.get_retries_count():
+            log_debug(
+                f"fetch-all: {platform} of {version} skipped, "
+                f"failed_attempts={prior_failures}"
+            )
+            return None, "error"
+        # Свой планировщик пауз: платформы качаются параллельно
+        scheduler = RetryScheduler(
+            DOWNLOAD_RETRY_BASE_DELAY_SEC, CONFIG.download_retry_max_delay()
+        )
+        stop_waking = self._shutdown.on_cancel(scheduler.wake)
+        try:
+            path = self.__fetch_attempts(
+                version,
+                platform,
+                dest,
+                self._download_base_urls(),
+                prior_failures,
+                scheduler,
+                self._shutdown,
+                platform=True,
+            )
+        finally:
+            stop_waking()
+        return (path, "download") if path else (None, "error")
+
+    def fetch_all(self, version: str | None = None) -> dict[str, dict]:
+        """
+        Скачать дистрибутивы всех платформ (FETCH_ALL_PLATFORMS) параллельно.
+        Возвращает отчёт: платформа -> {status, source, file, size, seconds}.
+        """
+        version = version or self.get_remote_version()
+        if not version:
+            return {}
+
+        def fetch(platform: str) -> dict:
+            started = time.monotonic()
+            try:
+                path, source = self.fetch_platform(version, platform)
+            except Exception as e:
+                log_warn(f"fetch-all: {platform} failed: {e}")
+                path, source = None, "error"
+            return {
+                "version": version,
+                "status": "ok" if path else "error",
+                "source": source,
+                "file": path.name if path else None,
+                "size": path.stat().st_size if path else 0,
+                "seconds": time.monotonic() - started,
+            }
+
+        with ThreadPoolExecutor(max_workers=len(FETCH_ALL_PLATFORMS)) as pool:
+            results = pool.map(fetch, FETCH_ALL_PLATFORMS)
+            return dict(zip(FETCH_ALL_PLATFORMS, results))
+
+    def _verified_entries(self, manifest: dict):
+        """
+        Записи манифеста со status=ok, чей файл лежит в кэше с тем же размером:
+        (версия, платформа или None для packages, запись).
+        """
+        cache_dir = self._get_cache_dir()
+        for version, platform, info in _manifest_items(manifest):
+            if info.get("status") != "ok" or not info.get("file"):
+                continue
+            path = cache_dir / str(info["file"])
+            if path.is_file() and path.stat().st_size == info.get("size"):
+                yield version, platform, info
+
+    def export_cache(self, target: Path) -> list[str]:
+        """
+        Режим --export: записать в tar-архив target манифест (size, sha256, status)
+        и следом файлы со status=ok, чтобы --import прочитал всё за один проход.
+        Архив появляется под именем target только целиком. Возвращает имена файлов.
+        """
+        cache_dir = self._get_cache_dir()
+        exported: dict = {"packages": {}, "platforms": {}}
+        files: dict[str, Path] = {}
+        for version, platform, info in self._verified_entries(
+            self._load_cache_manifest()
+        ):
+            entry = dict(info)
+            path = cache_dir / str(entry["file"])
+            entry["sha256"] = entry.get("sha256") or _file_sha256(path)
+            if platform is None:
+                exported["packages"][version] = entry
+            else:
+                exported["platforms"].setdefault(version, {})[platform] = entry
+            files[path.name] = path
+
+        manifest = _serialize_cache_manifest(exported).encode("utf-8")
+        part = _partial_path(target)
+        try:
+            with tarfile.open(part, "w") as tar:
+                member = tarfile.TarInfo(EXPORT_MANIFEST_NAME)
+                member.size = len(manifest)
+                member.mtime = int(time.time())
+                tar.addfile(member, io.BytesIO(manifest))
+                for name, path in files.items():
+                    tar.add(path, arcname=name)
+        except BaseException:
+            _unlink_quietly(part)
+            raise
+        _commit_partial(part)
+        log_debug(f"export: {len(files)} files to {target}")
+        return sorted(files)
+
+    @staticmethod
+    def _import_members(source: Path):
+        """
+        Файлы источника --import по порядку: (имя, запись его манифеста или None,
+        фактический размер, функция, открывающая содержимое). Архив читается
+        потоком, без распаковки.
+        """
+
+        def by_file(manifest: dict) -> dict[str, dict]:
+            entries: dict[str, dict] = {}
+            for version, platform, info in _manifest_items(manifest):
+                if info.get("status") != "ok" or not info.get("file"):
+                    continue
+                entry = entries.setdefault(
+                    str(info["file"]), dict(info, version=version, platforms=set())
+                )
+                if platform is not None:
+                    entry["platforms"].add(platform)
+            return entries
+
+        if source.is_dir():
+            manifest_path = source / EXPORT_MANIFEST_NAME
+            entries = (
+                by_file(_parse_cache_manifest(manifest_path.read_bytes()))
+                if manifest_path.is_file()
+                else {}
+            )
+            for path in sorted(source.iterdir()):
+                if path.is_file() and path.name != EXPORT_MANIFEST_NAME:
+                    yield path.name, entries.get(path.name), path.stat().st_size, (
+                        lambda p=path: p.open("rb")
+                    )
+            return
+
+        entries = {}
+        with tarfile.open(source, "r|*") as tar:
+            for member in tar:
+                if member.name == EXPORT_MANIFEST_NAME:
+                    data = tar.extractfile(member).read()
+                    entries = by_file(_parse_cache_manifest(data))
+                elif member.isfile() and Path(member.name).name == member.name:
+                    yield member.name, entries.get(member.name), member.size, (
+                        lambda m=member: tar.extractfile(m)
+                    )
+
+    @staticmethod
+    def _import_item(name: str, entry: dict | None, own_ext: str) -> dict | None:
+        """
+        Что записать в манифест для файла name: version, ext, own (в packages —
+        дистрибутив своей платформы) и platforms (в таблицу артефактов --fetch-all).
+        """
+        ext = Path(name).suffix.lstrip(".").lower()
+        parsed = _artifact_from_filename(name)
+        if ext not in FETCH_ALL_PLATFORMS or (entry is None and parsed is None):
+            log_debug(f"import: skip {name}, not a cached artifact")
+            return None
+        item = dict(entry) if entry else {"version": parsed[0], "platforms": set()}
+        if ext != own_ext:
+            item["platforms"] = set(item["platforms"]) | {ext}
+        item.update(ext=ext, own=ext == own_ext)
+        return item
+
+    def import_cache(self, source: Path) -> dict[str, int]:
+        """
+        Режим --import: принять дистрибутивы из каталога или архива --export.
+        Файл копируется в .part с подсчётом SHA-256 за тот же проход; уже лежащий
+        в кэше с тем же SHA-256 пропускается (известный по манифесту источника —
+        не читая). Проверки идут параллельно с копированием следующих файлов,
+        в манифест принятое записывается одной транзакцией. При сбое чтения
+        источника (OSError, TarError) проверенные до него файлы всё равно
+        регистрируются, а недопроверенные .part удаляются.
+        Возвращает счётчики imported, skipped, failed.
+        """
+        cache_dir = self._get_cache_dir()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        own_ext = PACKAGE_MANAGER.get_extension()
+        local = {
+            str(info["file"]): info.get("sha256")
+            for _, _, info in self._verified_entries(self._load_cache_manifest())
+        }
+        report = dict.fromkeys(("imported", "skipped", "failed"), 0)
+        imported: list[dict] = []
+        pending = []
+        try:
+            with ThreadPoolExecutor(max_workers=IMPORT_VALIDATE_WORKERS) as pool:
+                for name, entry, size, open_member in self._import_members(source):
+                    item = self._import_item(name, entry, own_ext)
+                    if item is None:
+                        continue
+                    if item.get("sha256") and local.get(name) == item["sha256"]:
+                        report["skipped"] += 1
+                        continue
+                    part = _partial_path(cache_dir / name)
+                    try:
+                        # Место резервируется по фактическому размеру файла,
+                        # а не по size из манифеста источника
+                        with open_member() as src, part.open("wb") as f:
+                            sha256 = _copy_with_sha256(src, f, size)
+                    except BaseException:
+                        _unlink_quietly(part)
+                        raise
+                    if item.get("sha256") not in (None, sha256):
+                        log_warn(f"import: SHA-256 mismatch for {name}")
+                        _unlink_quietly(part)
+                        report["failed"] += 1
+                        continue
+                    if local.get(name) == sha256:
+                        _unlink_quietly(part)
+                        report["skipped"] += 1
+                        continue
+                    item["sha256"] = sha256
+                    pending.append(
+                        (pool.submit(validate_artifact, part, item["ext"]), part, item)
+                    )
+        finally:
+            # Пул уже дождался проверок: принимаем прошедшие их и при сбое источника
+            for future, part, item in pending:
+                try:
+                    valid = future.result()
+                except Exception as e:
+                    log_warn(f"import: validation of {part.name} failed: {e}")
+                    valid = False
+                if valid:
+                    item["path"] = _commit_partial(part)
+                    imported.append(item)
+                    continue
+                log_warn(f"import: validation failed for {part.name}")
+                _unlink_quietly(part)
+                report["failed"] += 1
+            if imported:
+                self._register_imported(imported)
+        report["imported"] = len(imported)
+        return report
+
+    def _register_imported(self, imported: list[dict]) -> None:
+        """Записать принятые --import файлы в манифест одной транзакцией."""
+        with self._manifest_transaction():
+            manifest = self._load_cache_manifest()
+            packages = manifest.setdefault("packages", {})
+            platforms = manifest.setdefault("platforms", {})
+            for item in imported:
+                path = item["path"]
+                downloaded_at = item.get("downloaded_at")
+                entry = self._manifest_entry(
+                    path.name,
+                    path,
+                    "ok",
+                    str(downloaded_at) if downloaded_at else None,
+                    item["sha256"],
+                )
+                if item["own"]:
+                    packages[item["version"]] = dict(entry, failed_attempts=0)
+                for platform in sorted(item["platforms"]):
+                    platforms.setdefault(item["version"], {})[platform] = dict(entry)
+            self._save_cache_manifest(manifest)
+        log_debug(f"cache: registered {len(imported)} imported files")
+        self._update_repository()
+
+    @timed_span("download")
+    def __do_download_package(
+        self,
+        url: str,
+        dest: Path,
+        progress_callback=None,
+        record_network_stats=True,
+        cancel: CancelToken | None = None,
+        stats: dict | None = None,
+    ) -> Path | None:
+        return self._run(
+            self._download_async(
+                url, dest, progress_callback, record_network_stats, stats
+            ),
+            cancel,
+        )
+
+    async def _download_async(
+        self,
+        url: str,
+        dest: Path,
+        progress_callback=None,
+        record_network_stats=True,
+        stats: dict | None = None,
+    ) -> Path | None:
+        """
+        Скачать url в .part рядом с dest. Статистика передачи — в
+        last_download_stats и, для параллельных передач, в свой словарь stats.
+        Работа с диском и state.json (stat/mkdir/резерв места .part, rename,
+        предохранитель, статистика сети) — через run_blocking, вне потока цикла.
+        """
+        connect_timeout, read_timeout = await self._network_timeouts()
+        log_debug(
+            f"cache: timeouts connect={connect_timeout:.1f}s read={read_timeout:.1f}s"
+        )
+        # Данные принимаются в .part рядом с dest: после отмены или обрыва
+        # следующая попытка докачивает остаток запросом Range
+        transfer = await NETWORK_ENGINE.run_blocking(
+            lambda: _PartialDownload(dest, progress_callback)
+        )
+        started = time.monotonic()
+        try:
+            response = await self._open_url(
+                url, connect_timeout, headers=transfer.request_headers()
+            )
+        except HTTPError as e:
+            if e.code == 416 and transfer.offset:
+                # Принятое не сходится с файлом на сервере: начнём заново
+                await NETWORK_ENGINE.run_blocking(
+                    lambda: _discard_partial(transfer.part)
+                )
+            raise
+        async with response as r:
+            if record_network_stats:
+                rtt = time.monotonic() - started
+                await NETWORK_ENGINE.run_blocking(lambda: NETWORK_STATS.record_rtt(rtt))
+            # Соединение и заголовки ждём connect-таймаут, дальше каждое чтение — read
+            r.read_timeout = read_timeout
+            # read отдаёт то, что уже пришло, не дожидаясь полного блока:
+            # так прогресс и обнаружение зависания работают и на медленных каналах
+            first_chunk = await r.read(DOWNLOAD_CHUNK_SIZE)
+            if not await NETWORK_ENGINE.run_blocking(
+                lambda: transfer.open(r, first_chunk)
+            ):
+                return None
+
+            bucket = self._transfer_bucket()
+            try:
+                # Отмена (asyncio.CancelledError) приходит в await r.read:
+                # передача останавливается в пределах одной порции, .part остаётся
+                with io_report(f"download {transfer.dest.name}"):
+                    try:
+                        chunk = first_chunk
+                        while chunk:
+                            if transfer.write(chunk):
+                                # fdatasync — вне потока цикла: он ведёт все передачи
+                                await NETWORK_ENGINE.run_blocking(
+                                    transfer.drop_page_cache
+                                )
+                            await bucket.consume(len(chunk))
+                            chunk = await r.read(DOWNLOAD_CHUNK_SIZE)
+                        await NETWORK_ENGINE.run_blocking(transfer.drop_page_cache)
+                    finally:
+                        transfer.close()
+            except Exception as e:
+                if _is_server_failure(e):
+                    await NETWORK_ENGINE.run_blocking(
+                        self.circuit_breaker(url).record_failure
+                    )
+                raise
+            finally:
+                self._release_bucket(bucket)
+            part = await NETWORK_ENGINE.run_blocking(transfer.finish)
+
+        self.last_download_stats = transfer.stats
+        if stats is not None:
+            stats.update(transfer.stats)
+        if record_network_stats:
+            await NETWORK_ENGINE.run_blocking(
+                lambda: NETWORK_STATS.record_throughput(
+                    transfer.stats["bytes"], transfer.stats["duration"]
+                )
+            )
+        return part
+
+
+class SharedCache(Downloader):
+    """
+    Общий для всех пользователей хоста кэш дистрибутивов ([paths] shared_cache_dir,
+    например /var/cache/chromium-gost-updater). Формат тот же, что у пользовательского
+    кэша (cache.toml и файлы); манифест читается и меняется под flock, каталог и файлы
+    доступны на запись группе. Пользовательские кэши ссылаются на его файлы.
+    """
+
+    def __init__(self, root: Path):
+        super().__init__()
+        self.root = root
+
+    @classmethod
+    def create(cls) -> "SharedCache | None":
+        root = CONFIG.shared_cache_dir()
+        if root is None or fcntl is None:
+            return None
+        try:
+            root.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            log_warn(f"shared cache: {root} unavailable: {e}")
+            return None
+        # setgid: новые файлы наследуют группу каталога
+        cls._make_group_writable(root, 0o2775)
+        return cls(root)
+
+    def _shared_cache(self) -> "SharedCache | None":
+        return None
+
+    def _get_cache_dir(self) -> Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root
+
+    def _get_cache_manifest_path(self) -> Path:
+        return self.root / "cache.toml"
+
+    @staticmethod
+    def _make_group_writable(path: Path, mode: int = 0o664) -> None:
+        try:
+            os.chmod(path, mode)
+        except OSError:
+            pass  # файл другого пользователя: права выставил он
+
+    def download_lock(self, filename: str, cancel=None):
+        """Блокировка скачивания файла: на хосте его качает только один процесс."""
+        return self._flock(f".{filename}.lock", cancel=cancel)
+
+    def _load_cache_manifest(self) -> dict:
+        with self._flock(self.MANIFEST_LOCK, shared=True):
+            return super()._load_cache_manifest()
+
+    def _save_cache_manifest(self, manifest: dict) -> None:
+        with self._flock(self.MANIFEST_LOCK):
+            super()._save_cache_manifest(manifest)
+        self._make_group_writable(self._get_cache_manifest_path())
+
+    def publish(self, version: str, path: Path, sha256: str | None = None) -> None:
+        """
+        Положить скачанный пользователем файл в общий кэш. Файл становится
+        только для чтения (0644): участники группы общего кэша могут заменить
+        запись в каталоге, но не сам inode, поэтому личная копия и общая —
+        один файл (hardlink), а на другой файловой системе — reflink или копия.
+        """
+        dest = self._get_cache_dir() / path.name
+        try:
+            os.chmod(path, 0o644)
+            method = _link_or_copy(path, dest, mode=0o644)
+            self._register_in_cache(
+                version, dest.name, dest, "ok", failed_attempts=0, sha256=sha256
+            )
+        except OSError as e:
+            log_warn(f"shared cache: failed to publish {path.name}: {e}")
+            return
+        log_debug(f"shared cache: published {path.name} ({method})")
+
+
+DOWNLOADER: Downloader = Downloader()
+SHARED_CACHE: SharedCache | None = SharedCache.create()
+
+# -------------------------
+# Загрузчик пакетов: конец
+# -------------------------
+
+
+# -------------------------
+# Политика скачивания: начало
+# -------------------------
+
+# NMMetered: 1 — yes, 3 — guess-yes (0 unknown, 2 no, 4 guess-no)
+_NM_METERED_VALUES = (1, 3)
+_PRESSURE_FILES = (Path("/proc/pressure/cpu"), Path("/proc/pressure/io"))
+
+
+def _busctl_property(service: str, path: str, interface: str, name: str) -> str | None:
+    """Значение свойства на системной шине D-Bus («u 4», «b true») или None."""
+    try:
+        result = subprocess.run(
+            ["busctl", "--system", "get-property", service, path, interface, name],
+            capture_output=True,
+            text=True,
+            timeout=POLICY_PROBE_TIMEOUT_SEC,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        log_debug(f"policy: busctl {service} {name} failed: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def probe_metered_network() -> bool | None:
+    """Лимитное ли подключение по NetworkManager; None — неизвестно."""
+    value = _busctl_property(
+        "org.freedesktop.NetworkManager",
+        "/org/freedesktop/NetworkManager",
+        "org.freedesktop.NetworkManager",
+        "Metered",
+    )
+    parts = (value or "").split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        return None
+    return int(parts[1]) in _NM_METERED_VALUES
+
+
+def probe_on_battery() -> bool | None:
+    """Работает ли машина от батареи по UPower; None — неизвестно."""
+    value = _busctl_property(
+        "org.freedesktop.UPower",
+        "/org/freedesktop/UPower",
+        "org.freedesktop.UPower",
+        "OnBattery",
+    )
+    parts = (value or "").split()
+    if len(parts) != 2 or parts[0] != "b":
+        return None
+    return parts[1] == "true"
+
+
+def probe_system_load() -> float | None:
+    """loadavg за минуту на одно ядро, в процентах."""
+    try:
+        return os.getloadavg()[0] * 100 / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+def probe_pressure() -> float | None:
+    """Наибольшее some avg10 из PSI процессора и ввода-вывода, в процентах."""
+    values = []
+    for path in _PRESSURE_FILES:
+        try:
+            text = path.read_text(encoding="ascii")
+        except OSError:
+            continue
+        match = re.search(r"^some avg10=([\d.]+)", text, re.M)
+        if match:
+            values.append(float(match.group(1)))
+    return max(values) if values else None
+
+
+class PolicyDecision:
+    """Решение политики: allow, slow (лимит rate байт/с) или defer, и причины."""
+
+    ALLOW = "allow"
+    SLOW = "slow"
+    DEFER = "defer"
+    __ORDER = (ALLOW, SLOW, DEFER)
+
+    def __init__(self, action: str = ALLOW, reasons: list[str] | None = None):
+        self.action = action
+        self.reasons = reasons or []
+        self.rate = CONFIG.schedule_slow_rate() if action == self.SLOW else None
+
+    def reason(self) -> str:
+        return ", ".join(self.reasons)
+
+    @classmethod
+    def combine(cls, verdicts: list[tuple[str, str]]) -> "PolicyDecision":
+        """Самое строгое из (action, причина); причины — только у него."""
+        action = max((a for a, _ in verdicts), key=cls.__ORDER.index, default=cls.ALLOW)
+        if action == cls.ALLOW:
+            return cls()
+        return cls(action, [reason for a, reason in verdicts if a == action])
+
+    def __repr__(self) -> str:
+        return f"PolicyDecision({self.action!r}, {self.reasons!r})"
+
+
+class DownloadPolicy:
+    """
+    Когда и как быстро скачивать: лимитное подключение (NetworkManager),
+    питание от батареи (UPower) и нагрузка (loadavg, PSI) по правилам [schedule].
+    Пробы подменяются через probes (тесты); недоступная проба (None) не мешает.
+    """
+
+    def __init__(self, probes: dict | None = None):
+        self.__probes = {
+            "metered": probe_metered_network,
+            "on_battery": probe_on_battery,
+            "load": probe_system_load,
+            "pressure": probe_pressure,
+            **(probes or {}),
+        }
+
+    def conditions(self) -> dict:
+        result = {}
+        for name, probe in self.__probes.items():
+            try:
+                result[name] = probe()
+            except Exception as e:
+                log_debug(f"policy: probe {name} failed: {e}")
+                result[name] = None
+        return result
+
+    def decide(self, conditions: dict | None = None) -> PolicyDecision:
+        conditions = self.conditions() if conditions is None else conditions
+        verdicts = []
+        if conditions.get("metered"):
+            verdicts.append((CONFIG.schedule_metered(), "лимитное подключение"))
+        if conditions.get("on_battery"):
+            verdicts.append((CONFIG.schedule_battery(), "питание от батареи"))
+        max_load = CONFIG.schedule_max_load_percent()
+        load = conditions.get("load")
+        max_pressure = CONFIG.schedule_max_pressure()
+        pressure = conditions.get("pressure")
+        if (max_load > 0 and load is not None and load >= max_load) or (
+            max_pressure > 0 and pressure is not None and pressure >= max_pressure
+        ):
+            verdicts.append((CONFIG.schedule_busy(), "высокая нагрузка"))
+        decision = PolicyDecision.combine(verdicts)
+        log_debug(f"policy: {conditions} -> {decision}")
+        return decision
+
+    def run(self, download, limiter, cancel: CancelToken, on_defer=None):
+        """
+        Выполнить download(token) по правилам: пока скачивание отложено, ждать,
+        перепроверяя условия раз в recheck_interval; во время скачивания так же
+        перепроверять, менять лимит скорости (limiter(rate | None)) и при запрете
+        прерывать передачу — принятое докачается, когда запрет снимется.
+        on_defer(причина) — скачивание отложено, on_defer(None) — началось.
+        Возвращает результат download или None при отмене.
+        """
+        while True:
+            decision = self.decide()
+            if decision.action == PolicyDecision.DEFER:
+                log_debug(f"policy: download deferred ({decision.reason()})")
+                if on_defer is not None:
+                    on_defer(decision.reason())
+                if cancel.wait(CONFIG.schedule_recheck_interval()):
+                    return None
+                continue
+
+            if on_defer is not None:
+                on_defer(None)
+            limiter(decision.rate)
+            token = CancelToken(cancel)
+            finished = threading.Event()
+            deferred = threading.Event()
+
+            def watch() -> None:
+                while not finished.wait(CONFIG.schedule_recheck_interval()):
+                    current = self.decide()
+                    if current.action == PolicyDecision.DEFER:
+                        log_debug(f"policy: pausing download ({current.reason()})")
+                        deferred.set()
+                        token.cancel()
+                        return
+                    limiter(current.rate)
+
+            watcher = threading.Thread(target=watch, name="policy-watch", daemon=True)
+            watcher.start()
+            try:
+                result = download(token)
+            finally:
+                finished.set()
+                token.close()
+                limiter(None)
+            watcher.join()
+            if result is not None or not deferred.is_set() or cancel.is_set():
+                return result
+
+
+DOWNLOAD_POLICY = DownloadPolicy()
+
+# -------------------------
+# Политика скачивания: конец
+# -------------------------
+
+
+# -------------------------
+# Локальный репозиторий apt/yum: начало
+# -------------------------
+
+_RPM_LEAD_SIZE = 96
+_RPM_HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+_RPM_TAGS = {
+    "name": 1000,
+    "version": 1001,
+    "release": 1002,
+    "epoch": 1003,
+    "summary": 1004,
+    "description": 1005,
+    "buildtime": 1006,
+    "buildhost": 1007,
+    "size": 1009,
+    "vendor": 1011,
+    "license": 1014,
+    "packager": 1015,
+    "group": 1016,
+    "url": 1020,
+    "arch": 1022,
+    "archivesize": 1046,
+    "sourcerpm": 1044,
+    "providename": 1047,
+    "requireflags": 1048,
+    "requirename": 1049,
+    "requireversion": 1050,
+    "provideflags": 1112,
+    "provideversion": 1113,
+    "dirindexes": 1116,
+    "basenames": 1117,
+    "dirnames": 1118,
+}
+# Флаги зависимостей RPMSENSE_LESS/GREATER/EQUAL -> обозначение в primary.xml
+_RPM_SENSE_FLAGS = {2: "LT", 4: "GT", 8: "EQ", 10: "LE", 12: "GE"}
+_DEB_INDEX_FIELDS = ("Filename", "Size", "MD5sum", "SHA1", "SHA256")
+
+
+def _file_digests(path: Path) -> dict[str, str]:
+    """MD5, SHA-1 и SHA-256 файла за один проход."""
+    digests = {"md5": hashlib.md5(), "sha1": hashlib.sha1(), "sha256": hashlib.sha256()}
+    with path.open("rb") as f:
+        advise_sequential(f)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            for digest in digests.values():
+                digest.update(block)
+        drop_page_cache(f)
+    return {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+def _parse_control_fields(text: str) -> list[tuple[str, str]]:
+    """Поля deb822 (control) в порядке следования; продолжения строк сохраняются."""
+    fields: list[tuple[str, str]] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line[0] in " \t" and fields:
+            key, value = fields[-1]
+            fields[-1] = (key, f"{value}\n{line}")
+            continue
+        key, _, value = line.partition(":")
+        fields.append((key.strip(), value.strip()))
+    return fields
+
+
+def read_deb_control(path: Path) -> list[tuple[str, str]]:
+    """Прочитать control из .deb: ar-архив, член control.tar.{gz,xz,zst}."""
+    with path.open("rb") as f:
+        if f.read(8) != b"!<arch>\n":
+            raise ValueError(f"{path.name}: not an ar archive")
+        while True:
+            header = f.read(60)
+            if len(header) < 60:
+                break
+            name = header[:16].decode("ascii", "replace").strip().rstrip("/")
+            size = int(header[48:58].decode("ascii").strip())
+            if not name.startswith("control.tar"):
+                f.seek(size + size % 2, os.SEEK_CUR)
+                continue
+            data = f.read(size)
+            try:
+                tar = tarfile.open(fileobj=io.BytesIO(data), mode="r:*")
+            except tarfile.TarError as e:
+                raise ValueError(f"{path.name}: unsupported {name}: {e}") from e
+            with tar:
+                for member in tar:
+                    if member.isfile() and member.name.lstrip("./") == "control":
+                        control = tar.extractfile(member)
+                        if control is not None:
+                            return _parse_control_fields(control.read().decode("utf-8"))
+            break
+    raise ValueError(f"{path.name}: control file not found")
+
+
+def _rpm_value(kind: int, store: bytes, offset: int, count: int):
+    if kind in (6, 8, 9):
+        # STRING, STRING_ARRAY, I18NSTRING: строки, завершённые нулём
+        values = []
+        for _ in range(1 if kind == 6 else count):
+            end = store.index(b"\0", offset)
+            values.append(store[offset:end].decode("utf-8", "replace"))
+            offset = end + 1
+        return values[0] if kind == 6 else values
+    formats = {2: "B", 3: "H", 4: "I", 5: "Q"}
+    if kind in formats:
+        fmt = f">{count}{formats[kind]}"
+        return list(struct.unpack_from(fmt, store, offset))
+    return store[offset : offset + count]
+
+
+def _read_rpm_header_struct(f) -> dict[int, object]:
+    intro = f.read(16)
+    if len(intro) < 16 or intro[:4] != _RPM_HEADER_MAGIC:
+        raise ValueError("bad rpm header magic")
+    nindex, hsize = struct.unpack(">II", intro[8:16])
+    index = f.read(16 * nindex)
+    store = f.read(hsize)
+    tags: dict[int, object] = {}
+    for i in range(nindex):
+        tag, kind, offset, count = struct.unpack_from(">iiii", index, 16 * i)
+        tags[tag] = _rpm_value(kind, store, offset, count)
+    return tags
+
+
+def read_rpm_header(path: Path) -> dict:
+    """
+    Прочитать основной заголовок .rpm (после lead и заголовка подписи).
+    Возвращает поля по именам из _RPM_TAGS и границы заголовка (header_start/end).
+    """
+    with path.open("rb") as f:
+        lead = f.read(_RPM_LEAD_SIZE)
+        if len(lead) < _RPM_LEAD_SIZE or lead[:4] != b"\xed\xab\xee\xdb":
+            raise ValueError(f"{path.name}: not an rpm package")
+        _read_rpm_header_struct(f)
+        # Заголовок подписи выровнен на 8 байт
+        f.seek((f.tell() + 7) // 8 * 8)
+        header_start = f.tell()
+        tags = _read_rpm_header_struct(f)
+        header_end = f.tell()
+    result: dict = {"header_start": header_start, "header_end": header_end}
+    for name, tag in _RPM_TAGS.items():
+        if tag in tags:
+            value = tags[tag]
+            if isinstance(value, list) and name in (
+                "epoch", "buildtime", "size", "archivesize", "summary",
+                "description", "group",
+            ):
+                value = value[0] if value else None
+            result[name] = value
+    return result
+
+
+def _split_evr(evr: str) -> tuple[str, str, str]:
+    epoch, _, rest = evr.rpartition(":") if ":" in evr else ("0", "", evr)
+    version, _, release = rest.partition("-")
+    return epoch or "0", version, release
+
+
+def _rpm_dependency_xml(tag: str, names, flags, versions) -> str:
+    entries = []
+    for i, name in enumerate(names or []):
+        if name.startswith("rpmlib("):
+            continue
+        attrs = f"name={xml_quoteattr(name)}"
+        flag = _RPM_SENSE_FLAGS.get((flags or [0] * (i + 1))[i] & 0x0F)
+        version = (versions or [""] * (i + 1))[i]
+        if flag and version:
+            epoch, ver, rel = _split_evr(version)
+            attrs += f' flags="{flag}" epoch="{epoch}" ver={xml_quoteattr(ver)}'
+            if rel:
+                attrs += f" rel={xml_quoteattr(rel)}"
+        entries.append(f"      <rpm:entry {attrs}/>")
+    if not entries:
+        return ""
+    return f"    <rpm:{tag}>\n" + "\n".join(entries) + f"\n    </rpm:{tag}>\n"
+
+
+class LocalRepository:
+    """
+    Индексы репозиториев над каталогом кэша: плоский репозиторий apt (Packages,
+    Packages.gz, Release с контрольными суммами) и repodata/ для yum/dnf.
+    Поля пакетов читаются из самих файлов (read_deb_control, read_rpm_header)
+    и запоминаются в .repo-index.json: при добавлении или удалении версии
+    разбираются только новые файлы, индексы собираются из сохранённых записей.
+
+    Подключение на клиентах (каталог раздаётся любым HTTP-сервером):
+      deb [trusted=yes] http://<хост>/<путь>/ ./
+      [chromium-gost] baseurl=http://<хост>/<путь>/ gpgcheck=0
+    """
+
+    STATE_FILE = ".repo-index.json"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _load(self) -> dict:
+        try:
+            data = json.loads((self.root / self.STATE_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write(self, relative: str, data: bytes) -> None:
+        path = self.root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def update(self, artifacts) -> bool:
+        """
+        Привести индексы к набору файлов artifacts (валидные файлы кэша).
+        Возвращает True, если индексы переписаны.
+        """
+        index = self._load()
+        changed = False
+        for kind in ("deb", "rpm"):
+            entries = index.get(kind)
+            entries = dict(entries) if isinstance(entries, dict) else {}
+            wanted = {p.name: p for p in artifacts if p.suffix == f".{kind}"}
+            for name in set(entries) - set(wanted):
+                log_debug(f"repo: dropping {name} from {kind} index")
+                del entries[name]
+                changed = True
+            for name, path in sorted(wanted.items()):
+                stat = path.stat()
+                signature = [stat.st_size, stat.st_mtime_ns]
+                entry = entries.get(name)
+                if isinstance(entry, dict) and entry.get("signature") == signature:
+                    continue
+                try:
+                    entry = self._describe(kind, path)
+                except (OSError, ValueError, struct.error) as e:
+                    log_warn(f"repo: cannot index {name}: {e}")
+                    continue
+                entry["signature"] = signature
+                entries[name] = entry
+                log_debug(f"repo: indexed {name}")
+                changed = True
+            index[kind] = entries
+
+        if not changed and self._indexes_present(index):
+            return False
+        if index.get("deb") or (self.root / "Packages").exists():
+            self._write_apt(index.get("deb", {}))
+        if index.get("rpm") or (self.root / "repodata").exists():
+            self._write_yum(index.get("rpm", {}))
+        self._write(self.STATE_FILE, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+        return True
+
+    def _indexes_present(self, index: dict) -> bool:
+        if index.get("deb") and not (self.root / "Release").exists():
+            return False
+        if index.get("rpm") and not (self.root / "repodata" / "repomd.xml").exists():
+            return False
+        return True
+
+    def _describe(self, kind: str, path: Path) -> dict:
+        digests = _file_digests(path)
+        size = path.stat().st_size
+        if kind == "deb":
+            fields = [
+                (key, value)
+                for key, value in read_deb_control(path)
+                if key not in _DEB_INDEX_FIELDS
+            ]
+            fields += [
+                ("Filename", f"./{path.name}"),
+                ("Size", str(size)),
+                ("MD5sum", digests["md5"]),
+                ("SHA1", digests["sha1"]),
+                ("SHA256", digests["sha256"]),
+            ]
+            return {"stanza": "\n".join(f"{key}: {value}" for key, value in fields)}
+        return self._describe_rpm(path, size, digests["sha256"])
+
+    def _describe_rpm(self, path: Path, size: int, sha256: str) -> dict:
+        h = read_rpm_header(path)
+        name, arch = h.get("name", ""), h.get("arch", "")
+        version_xml = (
+            f'<version epoch="{h.get("epoch") or 0}" ver={xml_quoteattr(h.get("version", ""))}'
+            f' rel={xml_quoteattr(h.get("release", ""))}/>'
+        )
+
+        def text(key: str) -> str:
+            return xml_escape(str(h.get(key) or ""))
+
+        primary = (
+            '<package type="rpm">\n'
+            f"  <name>{xml_escape(name)}</name>\n"
+            f"  <arch>{xml_escape(arch)}</arch>\n"
+            f"  {version_xml}\n"
+            f'  <checksum type="sha256" pkgid="YES">{sha256}</checksum>\n'
+            f"  <summary>{text('summary')}</summary>\n"
+            f"  <description>{text('description')}</description>\n"
+            f"  <packager>{text('packager')}</packager>\n"
+            f"  <url>{text('url')}</url>\n"
+            f'  <time file="{int(path.stat().st_mtime)}" build="{h.get("buildtime") or 0}"/>\n'
+            f'  <size package="{size}" installed="{h.get("size") or 0}"'
+            f' archive="{h.get("archivesize") or 0}"/>\n'
+            f"  <location href={xml_quoteattr(path.name)}/>\n"
+            "  <format>\n"
+            f"    <rpm:license>{text('license')}</rpm:license>\n"
+            f"    <rpm:vendor>{text('vendor')}</rpm:vendor>\n"
+            f"    <rpm:group>{text('group')}</rpm:group>\n"
+            f"    <rpm:buildhost>{text('buildhost')}</rpm:buildhost>\n"
+            f"    <rpm:sourcerpm>{text('sourcerpm')}</rpm:sourcerpm>\n"
+            f'    <rpm:header-range start="{h["header_start"]}" end="{h["header_end"]}"/>\n'
+            + _rpm_dependency_xml(
+                "provides", h.get("providename"), h.get("provideflags"),
+                h.get("provideversion"),
+            )
+            + _rpm_dependency_xml(
+                "requires", h.get("requirename"), h.get("requireflags"),
+                h.get("requireversion"),
+            )
+            + "  </format>\n</package>"
+        )
+        dirnames = h.get("dirnames") or []
+        files = "".join(
+            f"\n  <file>{xml_escape(dirnames[d] + base)}</file>"
+            for base, d in zip(h.get("basenames") or [], h.get("dirindexes") or [])
+            if d < len(dirnames)
+        )
+        package_attrs = (
+            f'pkgid="{sha256}" name={xml_quoteattr(name)} arch={xml_quoteattr(arch)}'
+        )
+        return {
+            "primary": primary,
+            "filelists": f"<package {package_attrs}>\n  {version_xml}{files}\n</package>",
+            "other": f"<package {package_attrs}>\n  {version_xml}\n</package>",
+        }
+
+    def _write_apt(self, entries: dict) -> None:
+        stanzas = [entries[name]["stanza"] for name in sorted(entries)]
+        packages = ("\n\n".join(stanzas) + "\n").encode("utf-8") if stanzas else b""
+        packages_gz = gzip.compress(packages, mtime=0)
+        self._write("Packages", packages)
+        self._write("Packages.gz", packages_gz)
+
+        architectures = sorted(
+            {
+                line.split(":", 1)[1].strip()
+                for stanza in stanzas
+                for line in stanza.splitlines()
+                if line.startswith("Architecture:")
+            }
+        )
+        release = [
+            "Origin: chromium-gost-updater",
+            "Label: chromium-gost-updater",
+            f"Date: {formatdate(usegmt=True)}",
+            f"Architectures: {' '.join(architectures)}",
+        ]
+        for title, algorithm in (("MD5Sum", "md5"), ("SHA1", "sha1"), ("SHA256", "sha256")):
+            release.append(f"{title}:")
+            for name, data in (("Packages", packages), ("Packages.gz", packages_gz)):
+                digest = hashlib.new(algorithm, data).hexdigest()
+                release.append(f" {digest} {len(data)} {name}")
+        self._write("Release", ("\n".join(release) + "\n").encode("utf-8"))
+        log_debug(f"repo: apt index written, {len(stanzas)} package(s)")
+
+    def _write_yum(self, entries: dict) -> None:
+        names = sorted(entries)
+        documents = {
+            "primary": (
+                '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+                'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{count}">'
+            ),
+            "filelists": (
+                '<filelists xmlns="http://linux.duke.edu/metadata/filelists" '
+                'packages="{count}">'
+            ),
+            "other": (
+                '<otherdata xmlns="http://linux.duke.edu/metadata/other" '
+                'packages="{count}">'
+            ),
+        }
+        timestamp = int(time.time())
+        repomd = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+            'xmlns:rpm="http://linux.duke.edu/metadata/rpm">',
+            f"  <revision>{timestamp}</revision>",
+        ]
+        for kind, opening in documents.items():
+            closing = "</" + opening[1 : opening.index(" ")] + ">"
+            body = "\n".join(entries[name][kind] for name in names)
+            xml = (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                + opening.format(count=len(names))
+                + ("\n" + body if body else "")
+                + f"\n{closing}\n"
+            ).encode("utf-8")
+            compressed = gzip.compress(xml, mtime=0)
+            self._write(f"repodata/{kind}.xml.gz", compressed)
+            repomd += [
+                f'  <data type="{kind}">',
+                f'    <checksum type="sha256">{hashlib.sha256(compressed).hexdigest()}</checksum>',
+                f'    <open-checksum type="sha256">{hashlib.sha256(xml).hexdigest()}</open-checksum>',
+                f'    <location href="repodata/{kind}.xml.gz"/>',
+                f"    <timestamp>{timestamp}</timestamp>",
+                f"    <size>{len(compressed)}</size>",
+                f"    <open-size>{len(xml)}</open-size>",
+                "  </data>",
+            ]
+        repomd.append("</repomd>")
+        self._write("repodata/repomd.xml", ("\n".join(repomd) + "\n").encode("utf-8"))
+        log_debug(f"repo: yum index written, {len(names)} package(s)")
+
+
+# -------------------------
+# Локальный репозиторий apt/yum: конец
+# -------------------------
+
+
+def cleanup_old_package_files(keep_current: str | None = None) -> None:
+    """
+    Remove old package files (.deb or .rpm) from tmp_dir, optionally keeping the current one.
+    Также очищает старые файлы из кэш-директории (старше месяца).
+    """
+    # Очистка старых файлов из кэша (используется значение из конфига)
+    try:
+        DOWNLOADER.cleanup_old_cache_files()
+    except Exception as e:
+        log_debug(f"cleanup_old_package_files: failed to cleanup cache: {e}")
+
+    # Очистка старых файлов из tmp_dir (для обратной совместимости)
+    tmp_dir = CONFIG.tmp_dir()
+    if not tmp_dir.exists():
+        return
+    try:
+        old_packages = chain(
+            tmp_dir.glob("chromium-gost-*.deb"), tmp_dir.glob("chromium-gost-*.rpm")
+        )
+    except Exception:
+        return
+
+    current_file = str(Path(keep_current).resolve()) if keep_current else None
+    for pkg_file in old_packages:
+        if keep_current and str(pkg_file.resolve()) == current_file:
+            continue
+        try:
+            pkg_file.unlink()
+            log_debug(
+                f"cleanup_old_package_files: removed old file from tmp_dir: {pkg_file.name}"
+            )
+        except Exception:
+            pass
+
+
+def session_has_graphical_display() -> bool:
+    """Проверить, заданы ли переменные графической сессии DISPLAY или WAYLAND_DISPLAY."""
+    if IS_WINDOWS:
+        return True
+    display = os.environ.get("DISPLAY", "").strip()
+    wayland = os.environ.get("WAYLAND_DISPLAY", "").strip()
+    return bool(display) or bool(wayland)
+
+
+def _x11_display_socket_exists(display: str) -> bool:
+    try:
+        display_num = display.lstrip(":").split(".")[0]
+        socket = Path(f"/tmp/.X11-unix/X{display_num}")
+        return socket.exists()
+    except Exception:
+        return False
+
+
+def _x11_display_usable() -> bool:
+    display = os.environ.get("DISPLAY", "").strip()
+    if not display:
+        return False
+    for cmd in (["xset", "q"], ["xdpyinfo"]):
+        try:
+            result = subprocess.run(
+                cmd,
+                env=os.environ,
+                capture_output=True,
+                timeout=3,
+            )
+            if result.returncode == 0:
+                return True
+        except (FileNotFoundError, subprocess.TimeoutExpired, OSError):
+            continue
+    return _x11_display_socket_exists(display)
+
+
+def _wayland_display_usable() -> bool:
+    wayland = os.environ.get("WAYLAND_DISPLAY", "").strip()
+    if not wayland:
+        return False
+    runtime = os.environ.get("XDG_RUNTIME_DIR", "").strip()
+    if runtime:
+        return (Path(runtime) / wayland).exists()
+    return True
+
+
+def graphical_session_ready() -> bool:
+    """Проверить, что графическая сессия доступна (не только переменные окружения)."""
+    if IS_WINDOWS:
+        return True
+    if os.environ.get("WAYLAND_DISPLAY", "").strip():
+        return _wayland_display_usable()
+    if os.environ.get("DISPLAY", "").strip():
+        return _x11_display_usable()
+    return False
+
+
+def wait_for_graphical_session(
+    max_wait_sec: int = GRAPHICAL_SESSION_BOOT_WAIT_SEC,
+    poll_interval_sec: int = GRAPHICAL_SESSION_POLL_INTERVAL_SEC,
+) -> bool:
+    """Подождать появления графической сессии (например, после загрузки системы)."""
+    if graphical_session_ready():
+        return True
+    log_debug(
+        f"Graphical session not ready, waiting up to {max_wait_sec}s "
+        f"(poll every {poll_interval_sec}s)"
+    )
+    deadline = time.time() + max_wait_sec
+    while time.time() < deadline:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        time.sleep(min(poll_interval_sec, remaining))
+        if graphical_session_ready():
+            log_debug("Graphical session became ready")
+            return True
+    log_debug("Graphical session still not ready after wait")
+    return False
+
+
+def is_gui_running() -> bool:
+    """
+    Check if GUI instance is already running by checking lock file and process.
+    """
+    if not LOCK_FILE.exists():
+        return False
+
+    try:
+        # Check if process from lock file is still running
+        pid = int(LOCK_FILE.read_text().strip())
+        os.kill(pid, 0)  # Check if process exists (doesn't kill, just checks)
+        return True
+    except (OSError, ValueError):
+        # Process doesn't exist, remove stale lock file
+        try:
+            LOCK_FILE.unlink()
+        except Exception:
+            pass
+        return False
+
+
+def launch_gui_version(script_path: str | None = None) -> bool:
+    """
+    Launch GUI version of the script with proper DISPLAY/XAUTHORITY.
+    Tries multiple methods:
+    1. Check if GUI is already running (avoid duplicates)
+    2. systemd-run with environment from active session
+    3. Direct execution with environment variables
+    """
+    if script_path is None:
+        script_path = sys.argv[0]
+
+    # Check if GUI instance is already running
+    if is_gui_running():
+        return True
+
+    # Try to get DISPLAY/WAYLAND and XAUTHORITY from active user session
+    display = None
+    wayland_display = None
+    xauthority = None
+
+    # Method 1: Check environment of systemd user session
+    try:
+        result = subprocess.run(
+            ["systemctl", "--user", "show-environment"],
+            capture_output=True,
+            text=True,
+            timeout=2,
+        )
+        if result.returncode == 0:
+            for line in result.stdout.splitlines():
+                if line.startswith("DISPLAY="):
+                    display = line.split("=", 1)[1]
+                elif line.startswith("WAYLAND_DISPLAY="):
+                    wayland_display = line.split("=", 1)[1]
+                elif line.startswith("XAUTHORITY="):
+                    xauthority = line.split("=", 1)[1]
+    except Exception:
+        pass
+
+    # Method 2: Check common X11 locations
+    if not display:
+        try:
+            x11_dir = Path("/tmp/.X11-unix")
+            if x11_dir.exists():
+                sockets = list(x11_dir.glob("X*"))
+                if sockets:
+                    display = f":{sockets[0].name[1:]}"
+                    xauth_path = Path.home() / ".Xauthority"
+                    if xauth_path.exists():
+                        xauthority = str(xauth_path)
+        except Exception:
+            pass
+
+    # Method 3: Try systemd-run with user environment
+    if display or wayland_display:
+        try:
+            env_vars = {}
+            if display:
+                env_vars["DISPLAY"] = display
+            if wayland_display:
+                env_vars["WAYLAND_DISPLAY"] = wayland_display
+            if xauthority:
+                env_vars["XAUTHORITY"] = xauthority
+            if "DBUS_SESSION_BUS_ADDRESS" in os.environ:
+                env_vars["DBUS_SESSION_BUS_ADDRESS"] = os.environ[
+                    "DBUS_SESSION_BUS_ADDRESS"
+                ]
+
+            env_args = []
+            for k, v in env_vars.items():
+                env_args.extend([f"--setenv={k}={v}"])
+
+            cmd = (
+                ["systemd-run", "--user", "--collect", "--no-block"]
+                + env_args
+                + [script_path]
+            )
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            # Note: We can't reliably get PID from systemd-run, so skip lock file
+            return True
+        except Exception:
+            pass
+
+    # Fallback: Try direct execution with environment
+    try:
+        env = os.environ.copy()
+        if display:
             env["DISPLAY"] = display
         if wayland_display:
             env["WAYLAND_DISPLAY"] = wayland_display
         if xauthority:
             env["XAUTHORITY"] = xauthority
 
-        proc = subprocess.Popen(
-            [sys.executable, script_path],
-            env=env,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            start_new_session=True,
+        proc = subprocess.Popen(
+            [sys.executable, script_path],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        # Create lock file with PID
+        try:
+            LOCK_FILE.write_text(str(proc.pid))
+        except Exception:
+            pass
+        return True
+    except Exception:
+        pass
+
+    return False
+
+
+# -------------------------
+# Сдвиг проверок по хосту: начало
+# -------------------------
+
+_MACHINE_ID_PATHS = (Path("/etc/machine-id"), Path("/var/lib/dbus/machine-id"))
+
+
+def machine_id() -> str:
+    """Стабильный идентификатор машины: machine-id, MachineGuid или имя хоста."""
+    if IS_WINDOWS:
+        try:
+            import winreg
+
+            with winreg.OpenKey(
+                winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Cryptography"
+            ) as key:
+                value, _ = winreg.QueryValueEx(key, "MachineGuid")
+                if value:
+                    return str(value)
+        except OSError:
+            pass
+    else:
+        for path in _MACHINE_ID_PATHS:
+            try:
+                value = path.read_text(encoding="utf-8").strip()
+                if value:
+                    return value
+            except OSError:
+                continue
+    return socket.gethostname()
+
+
+def host_offset(spread: int, salt: str = "check", host_id: str | None = None) -> int:
+    """
+    Сдвиг хоста в секундах в диапазоне [0, spread): одинаковый от запуска к запуску,
+    но разный у разных машин, чтобы парк не обращался к серверу одновременно.
+    """
+    if spread <= 0:
+        return 0
+    host_id = machine_id() if host_id is None else host_id
+    digest = hashlib.sha256(f"{host_id}:{salt}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % spread
+
+
+def seconds_until_next_slot(now: float, interval: int, offset: int) -> float:
+    """
+    Сколько ждать до ближайшего момента t > now, для которого
+    (t - offset) кратно interval (слоты выровнены по часам, а не по загрузке).
+    """
+    if interval <= 0:
+        return 0.0
+    phase = (now - offset) % interval
+    wait = interval - phase
+    return wait if wait > 0 else float(interval)
+
+
+def next_check_delay(now: float | None = None) -> float:
+    """Пауза до следующей проверки в долгоживущем процессе с учётом [timing] spread."""
+    interval = CONFIG.timing_check_remote_interval()
+    spread = CONFIG.timing_spread()
+    if spread <= 0:
+        return float(interval)
+    now = time.time() if now is None else now
+    return seconds_until_next_slot(now, interval, host_offset(spread))
+
+
+def startup_check_delay(launch_source: str, thin_client: bool) -> float:
+    """
+    Сдвиг первой проверки при запуске по таймеру ([timing] spread), чтобы хосты,
+    загрузившиеся одновременно, не шли на сервер разом. Тонкому клиенту сдвиг
+    не нужен: на сервер ходит служба, а клиент только спрашивает её.
+    """
+    spread = CONFIG.timing_spread()
+    if thin_client or launch_source != "systemd-user-service" or spread <= 0:
+        return 0.0
+    return float(host_offset(spread))
+
+
+# -------------------------
+# Сдвиг проверок по хосту: конец
+# -------------------------
+
+
+# -------------------------
+# Наблюдение за файлами: начало
+# -------------------------
+
+# inotify(7)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_WATCH_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class FileWatcher:
+    """
+    Наблюдение за файлами в каталогах через inotify (ctypes, без сторонних
+    модулей). Каталог наблюдается целиком, а не файл: dpkg и rpm заменяют базу
+    переименованием. События, прошедшие фильтр match(имя), за
+    FS_WATCH_DEBOUNCE_SEC секунд тишины сводятся в один вызов
+    callback(set[метки]) из потока fs-watcher.
+    """
+
+    def __init__(self, callback, debounce: float = FS_WATCH_DEBOUNCE_SEC):
+        self.__callback = callback
+        self.__debounce = debounce
+        self.__watches: list[tuple[Path, str, object]] = []
+        self.__fd: int | None = None
+        self.__stop_pipe: tuple[int, int] | None = None
+        self.__thread: threading.Thread | None = None
+
+    @staticmethod
+    def _libc():
+        """libc с inotify или None (Windows, macOS)."""
+        if IS_WINDOWS:
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+        except OSError:
+            return None
+        if not hasattr(libc, "inotify_init1"):
+            return None
+        return libc
+
+    def watch(self, directory: Path, label: str, match=None) -> None:
+        """Сообщать label при изменении файлов directory, чьё имя принимает match."""
+        self.__watches.append((directory, label, match))
+
+    def start(self) -> bool:
+        """Запустить наблюдение; False, если inotify недоступен."""
+        libc = self._libc()
+        if libc is None:
+            log_debug("fs-watcher: inotify unavailable")
+            return False
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            error = os.strerror(ctypes.get_errno())
+            log_warn(f"fs-watcher: inotify_init1 failed: {error}")
+            return False
+        targets: dict[int, tuple[str, object]] = {}
+        for directory, label, match in self.__watches:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), _IN_WATCH_MASK)
+            if wd < 0:
+                log_debug(
+                    f"fs-watcher: cannot watch {directory}: "
+                    f"{os.strerror(ctypes.get_errno())}"
+                )
+                continue
+            targets[wd] = (label, match)
+            log_debug(f"fs-watcher: watching {directory} ({label})")
+        if not targets:
+            os.close(fd)
+            return False
+        self.__fd = fd
+        self.__stop_pipe = os.pipe()
+        self.__thread = threading.Thread(
+            target=self.__loop, args=(targets,), name="fs-watcher", daemon=True
+        )
+        self.__thread.start()
+        return True
+
+    def stop(self) -> None:
+        if self.__stop_pipe is not None:
+            os.write(self.__stop_pipe[1], b"x")
+
+    def __loop(self, targets: dict[int, tuple[str, object]]) -> None:
+        assert self.__fd is not None and self.__stop_pipe is not None
+        pending: set[str] = set()
+        deadline = 0.0
+        try:
+            while True:
+                timeout = max(0.0, deadline - time.monotonic()) if pending else None
+                readable, _, _ = select.select(
+                    [self.__fd, self.__stop_pipe[0]], [], [], timeout
+                )
+                if self.__stop_pipe[0] in readable:
+                    return
+                if self.__fd in readable:
+                    labels = self.__read_events(targets)
+                    if labels:
+                        pending |= labels
+                        deadline = time.monotonic() + self.__debounce
+                    continue
+                if pending and time.monotonic() >= deadline:
+                    changed, pending = pending, set()
+                    log_debug(f"fs-watcher: changed {sorted(changed)}")
+                    try:
+                        self.__callback(changed)
+                    except Exception as e:
+                        log_warn(f"fs-watcher: callback failed: {e}")
+        finally:
+            os.close(self.__fd)
+            for fd in self.__stop_pipe:
+                os.close(fd)
+
+    def __read_events(self, targets: dict[int, tuple[str, object]]) -> set[str]:
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        labels = set()
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, _mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0").decode(
+                "utf-8", "replace"
+            )
+            offset += length
+            target = targets.get(wd)
+            if target is None:
+                continue
+            label, match = target
+            if match is None or match(name):
+                labels.add(label)
+        return labels
+
+
+# -------------------------
+# Наблюдение за файлами: конец
+# -------------------------
+
+
+# -------------------------
+# Notifier: начало
+# -------------------------
+class Notifier:
+
+    def notify(self, message: str, timeout: int = 5000) -> None:
+        """
+        Send notification via DBus (notify-send) if available, else print.
+        In GUI mode, tray.showMessage should be used instead.
+        """
+        # Try DBus notification for headless mode
+        try:
+            # Use notify-send for DBus notifications (works without GUI)
+            subprocess.run(
+                ["notify-send", "-t", str(timeout), APPNAME, message],
+                check=False,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=2,
+            )
+        except Exception:
+            # Fallback to print if notify-send fails
+            print(f"[NOTIFY] {APPNAME}: {message}")
+
+
+NOTIFIER = Notifier()
+
+# -------------------------
+# Notifier: конец
+# -------------------------
+
+
+# -------------------------
+# Метрики Prometheus: начало
+# -------------------------
+
+
+def _prom_escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_line(name: str, value: float, labels: dict[str, str] | None = None) -> str:
+    label_text = ""
+    if labels:
+        label_text = (
+            "{"
+            + ",".join(
+                f'{key}="{_prom_escape_label(str(val))}"'
+                for key, val in sorted(labels.items())
+            )
+            + "}"
+        )
+    return f"{name}{label_text} {_prom_value(value)}"
+
+
+def _prom_value(value: float) -> str:
+    """
+    Значение без потери точности: целые (счётчики байт, метки времени) — как
+    есть, дробные — repr (кратчайшая запись, читающаяся обратно тем же числом).
+    """
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class MetricsExporter:
+    """
+    Экспорт метрик в файл .prom для textfile collector node_exporter.
+    Файл перезаписывается атомарно (временный файл + os.replace) после каждой проверки.
+    """
+
+    FILENAME = "chromium_gost_updater.prom"
+    PREFIX = "chromium_gost_updater"
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__last_check: dict | None = None
+
+    def record_check(self, versions: PackageVersions, duration: float) -> None:
+        """Запомнить результат и длительность проверки версий."""
+        with self.__lock:
+            self.__last_check = {
+                "timestamp": time.time(),
+                "duration": duration,
+                "local": versions.local() or "",
+                "remote": versions.remote() or "",
+                "update_pending": versions.differ(),
+            }
+
+    def __gauge(
+        self, lines: list[str], name: str, help_text: str, samples: list[tuple]
+    ) -> None:
+        """Добавить метрику типа gauge; samples — список пар (значение, метки)."""
+        full_name = f"{self.PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} gauge")
+        for value, labels in samples:
+            lines.append(_prom_line(full_name, value, labels))
+
+    def render(self) -> str:
+        """Сформировать содержимое .prom файла."""
+        lines: list[str] = []
+
+        def gauge(name: str, help_text: str, value: float, labels=None) -> None:
+            self.__gauge(lines, name, help_text, [(value, labels)])
+
+        with self.__lock:
+            check = dict(self.__last_check) if self.__last_check else None
+        if check:
+            gauge("last_check_timestamp_seconds", "Время последней проверки.", check["timestamp"])
+            gauge("last_check_duration_seconds", "Длительность проверки.", check["duration"])
+            gauge(
+                "version_info",
+                "Локальная и удалённая версии Chromium Gost.",
+                1,
+                {"local": check["local"], "remote": check["remote"]},
+            )
+            gauge("update_pending", "Доступно обновление.", int(check["update_pending"]))
+
+        stats = DOWNLOADER.last_download_stats
+        if stats:
+            gauge("download_bytes", "Размер последнего скачивания.", stats["bytes"])
+            gauge("download_duration_seconds", "Длительность скачивания.", stats["duration"])
+            gauge(
+                "download_throughput_bytes_per_second",
+                "Скорость последнего скачивания.",
+                stats["throughput"],
+            )
+
+        packages = DOWNLOADER._load_cache_manifest().get("packages", {})
+        if not isinstance(packages, dict):
+            packages = {}
+        entries = {v: info for v, info in packages.items() if isinstance(info, dict)}
+        failed_samples = []
+        cache_size = 0
+        for version, info in sorted(entries.items()):
+            try:
+                failed = int(info.get("failed_attempts", 0))
+                failed_samples.append((failed, {"version": str(version)}))
+            except (TypeError, ValueError):
+                pass
+            try:
+                cache_size += int(info.get("size", 0))
+            except (TypeError, ValueError):
+                pass
+        if failed_samples:
+            self.__gauge(
+                lines,
+                "failed_attempts",
+                "Неудачные попытки скачивания по версиям (cache.toml).",
+                failed_samples,
+            )
+        gauge("cache_size_bytes", "Суммарный размер артефактов в кэше.", cache_size)
+        gauge("cache_entries", "Количество записей в манифесте кэша.", len(entries))
+
+        validation = get_phase_timings().get("validate_artifact")
+        if validation:
+            gauge(
+                "validation_duration_seconds",
+                "Суммарное время проверки артефактов за запуск.",
+                validation["wall"],
+            )
+            gauge("validation_count", "Количество проверок артефактов.", validation["count"])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """Атомарно записать метрики, если задана директория textfile collector."""
+        target_dir = CONFIG.metrics_textfile_dir()
+        if target_dir is None:
+            return
+        try:
+            target_dir.mkdir(parents=True, exist_ok=True)
+            target = target_dir / self.FILENAME
+            # node_exporter читает только *.prom, поэтому временный файл он не увидит
+            tmp = target_dir / f".{self.FILENAME}.{os.getpid()}.tmp"
+            tmp.write_text(self.render(), encoding="utf-8")
+            os.replace(tmp, target)
+            log_debug(f"metrics: written to {target}")
+        except Exception as e:
+            log_warn(f"metrics: failed to write textfile: {e}")
+
+
+METRICS_EXPORTER = MetricsExporter()
+
+# -------------------------
+# Метрики Prometheus: конец
+# -------------------------
+
+
+# -------------------------
+# Раздача кэша в локальной сети: начало
+# -------------------------
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Разобрать заголовок Range (один диапазон) в пару (start, end) включительно.
+    None — заголовка нет или он не поддерживается, отдаём файл целиком;
+    ValueError — диапазон вне файла (ответ 416).
+    """
+    if not header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    start_text, end_text = match.groups()
+    if not start_text:
+        # bytes=-N: последние N байт
+        suffix = int(end_text)
+        if suffix == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - suffix), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def _version_key(version: str) -> tuple[int, ...]:
+    return tuple(int(part) if part.isdigit() else 0 for part in version.split("."))
+
+
+class CacheServer:
+    """
+    Режим --serve: раздаёт по HTTP артефакты из кэша (cache.toml, status=ok) по тем же
+    путям, что и основной сервер: /version, /linux/amd64/<file>, /windows/386/installer.
+    Машины в сети указывают его в [mirrors] urls. Клиенты обслуживаются в отдельных
+    потоках, файлы отдаются через socket.sendfile (os.sendfile без копирования
+    в user space), поддерживаются HEAD и Range. Рядом с каждым файлом доступен
+    <файл>.sha256 из манифеста: по нему клиенты сверяют файлы, скачанные у соседей.
+    """
+
+    INSTALLER_PATH = "/windows/386/installer"
+    LINUX_PREFIX = "/linux/amd64/"
+
+    def __init__(self, downloader: "Downloader", bind: str, port: int):
+        self.__downloader = downloader
+        self.__version: str | None = None
+        self.__lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((bind, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def version(self) -> str | None:
+        """
+        Версия для /version: последняя полученная с сервера и скачанная в кэш,
+        до первой проверки — новейшая из кэша.
+        """
+        with self.__lock:
+            if self.__version:
+                return self.__version
+        versions = set(self.__downloader.cached_artifacts())
+        versions.update(version for version, _ in self.__downloader.platform_artifacts())
+        return max(versions, key=_version_key) if versions else None
+
+    def refresh(self) -> None:
+        """Скачать в кэш актуальную версию с сервера и начать раздавать её."""
+        remote = self.__downloader.get_remote_version()
+        if not remote:
+            log_debug("serve: remote version unavailable, keeping current")
+            return
+        if self.__downloader.download_package(remote):
+            with self.__lock:
+                self.__version = remote
+            log_debug(f"serve: serving version {remote}")
+
+    def resolve(self, path: str) -> Path | None:
+        """Файл кэша для пути запроса или None."""
+        artifacts = self.__downloader.cached_artifacts()
+        platform_artifacts = self.__downloader.platform_artifacts()
+        if path == self.INSTALLER_PATH:
+            version = self.version()
+            installer = platform_artifacts.get((version, "exe")) or artifacts.get(version)
+            return installer if installer and installer.suffix == ".exe" else None
+        if path.startswith(self.LINUX_PREFIX):
+            name = path[len(self.LINUX_PREFIX) :]
+            for artifact in chain(artifacts.values(), platform_artifacts.values()):
+                if artifact.name == name:
+                    return artifact
+        return None
+
+    def sha256(self, path: str) -> str | None:
+        """SHA-256 из манифеста для файла, который раздаётся по пути path."""
+        artifact = self.resolve(path)
+        if artifact is None:
+            return None
+        for _, _, info in self.__downloader._verified_entries(
+            self.__downloader._load_cache_manifest()
+        ):
+            if info.get("file") == artifact.name and info.get("sha256"):
+                return str(info["sha256"])
+        return None
+
+    def _handler_class(self):
+        cache_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            server_version = "chromium-gost-updater"
+
+            def do_GET(self):
+                cache_server._handle(self, send_body=True)
+
+            def do_HEAD(self):
+                cache_server._handle(self, send_body=False)
+
+            def log_message(self, format, *args):
+                log_debug(f"serve: {self.address_string()} {format % args}")
+
+        return Handler
+
+    def _handle(self, request: BaseHTTPRequestHandler, send_body: bool) -> None:
+        path = urlparse(request.path).path
+        if path == "/version" or path.endswith(".sha256"):
+            if path == "/version":
+                text = self.version()
+            else:
+                digest = self.sha256(path[: -len(".sha256")])
+                text = digest and f"{digest}  {Path(path[: -len('.sha256')]).name}"
+            if not text:
+                request.send_error(404)
+                return
+            body = f"{text}\n".encode("utf-8")
+            request.send_response(200)
+            request.send_header("Content-Type", "text/plain; charset=utf-8")
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            if send_body:
+                request.wfile.write(body)
+            return
+
+        artifact = self.resolve(path)
+        if artifact is None:
+            request.send_error(404)
+            return
+        try:
+            f = artifact.open("rb")
+        except OSError:
+            request.send_error(404)
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            last_modified = request.date_time_string(stat.st_mtime)
+            range_header = request.headers.get("Range")
+            if_range = request.headers.get("If-Range")
+            if if_range is not None and if_range.strip() != last_modified:
+                # Файл изменился с прошлого запроса клиента: отдаём целиком
+                range_header = None
+            try:
+                byte_range = _parse_range(range_header, stat.st_size)
+            except ValueError:
+                request.send_response(416)
+                request.send_header("Content-Range", f"bytes */{stat.st_size}")
+                request.send_header("Content-Length", "0")
+                request.end_headers()
+                return
+            start, end = byte_range or (0, stat.st_size - 1)
+            length = end - start + 1
+            request.send_response(206 if byte_range else 200)
+            request.send_header("Content-Type", "application/octet-stream")
+            request.send_header("Content-Length", str(length))
+            request.send_header("Accept-Ranges", "bytes")
+            request.send_header("Last-Modified", last_modified)
+            if byte_range:
+                request.send_header(
+                    "Content-Range", f"bytes {start}-{end}/{stat.st_size}"
+                )
+            if path == self.INSTALLER_PATH:
+                request.send_header(
+                    "Content-Disposition", f'attachment; filename="{artifact.name}"'
+                )
+            request.end_headers()
+            if not send_body or length <= 0:
+                return
+            try:
+                request.connection.sendfile(f, start, length)
+            except (BrokenPipeError, ConnectionResetError) as e:
+                log_debug(f"serve: client closed connection for {artifact.name}: {e}")
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def serve_cache() -> int:
+    """
+    Режим --serve: раздавать кэш по HTTP и раз в check_remote_interval
+    докачивать в него новую версию.
+    """
+    server = CacheServer(DOWNLOADER, CONFIG.server_bind(), CONFIG.server_port())
+    host, port = server.address
+    log_debug(f"serve: listening on {host}:{port}")
+    print(f"Serving cache on http://{host}:{port}/", flush=True)
+    stop = threading.Event()
+
+    def refresh_loop() -> None:
+        while True:
+            try:
+                server.refresh()
+            except Exception as e:
+                log_warn(f"serve: refresh failed: {e}")
+            if stop.wait(CONFIG.timing_check_remote_interval()):
+                return
+
+    threading.Thread(target=refresh_loop, name="serve-refresh", daemon=True).start()
+    start_peer_sharing(server)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        DOWNLOADER.shutdown()
+        server.httpd.server_close()
+    return 0
+
+
+def start_peer_sharing(server: CacheServer | None = None) -> None:
+    """
+    При [p2p] enabled отвечать соседям на запросы who_has и раздавать им кэш
+    через CacheServer (свой на [p2p] http_port, если server не передан).
+    """
+    if not CONFIG.p2p_enabled():
+        return
+    try:
+        if server is None:
+            server = CacheServer(DOWNLOADER, CONFIG.server_bind(), CONFIG.p2p_http_port())
+            threading.Thread(
+                target=server.serve_forever, name="p2p-http", daemon=True
+            ).start()
+        DOWNLOADER.peers.start(server.address[1])
+    except OSError as e:
+        # Например, порт уже занят трэем другого пользователя этого хоста
+        log_warn(f"p2p: sharing disabled: {e}")
+
+
+def fetch_all_platforms() -> int:
+    """
+    Режим --fetch-all: скачать актуальную версию для всех платформ (deb, rpm, exe)
+    параллельно и вывести сводный отчёт. Код возврата 0, если скачаны все.
+    """
+    with timed_span("fetch_all"):
+        report = DOWNLOADER.fetch_all()
+    if not report:
+        print("Remote version unavailable.", flush=True)
+        return 1
+    for platform, result in report.items():
+        if result["status"] == "ok":
+            print(
+                f"{platform}: {result['file']} "
+                f"({_format_megabytes(result['size'])} MB, {result['source']}, "
+                f"{result['seconds']:.1f}s)",
+                flush=True,
+            )
+        else:
+            print(f"{platform}: FAILED", flush=True)
+    print(f"fetch-all: {json.dumps(report, ensure_ascii=False)}", flush=True)
+    return 0 if all(r["status"] == "ok" for r in report.values()) else 1
+
+
+# -------------------------
+# Раздача кэша в локальной сети: конец
+# -------------------------
+
+
+# -------------------------
+# Перенос кэша без сети: начало
+# -------------------------
+
+
+def _cli_option_value(option: str) -> str | None:
+    """Значение опции командной строки вида --option <значение>."""
+    try:
+        index = sys.argv.index(option)
+    except ValueError:
+        return None
+    return sys.argv[index + 1] if index + 1 < len(sys.argv) else None
+
+
+def export_cache_archive(target: str | None) -> int:
+    """
+    Режим --export <tar>: выгрузить дистрибутивы кэша с их записями манифеста
+    в архив для машин без доступа к серверу (--import).
+    """
+    if not target:
+        print("Usage: --export <archive.tar>", file=sys.stderr, flush=True)
+        return 2
+    try:
+        with timed_span("export"):
+            files = DOWNLOADER.export_cache(Path(target).expanduser())
+    except (OSError, tarfile.TarError) as e:
+        log_warn(f"export: failed: {e}")
+        return 1
+    for name in files:
+        print(name, flush=True)
+    print(f"export: {len(files)} files -> {target}", flush=True)
+    return 0 if files else 1
+
+
+def import_cache_archive(source: str | None) -> int:
+    """
+    Режим --import <каталог|tar>: принять дистрибутивы в кэш без сети.
+    Код возврата 0, если ни один файл не отвергнут.
+    """
+    if not source:
+        print("Usage: --import <dir|archive.tar>", file=sys.stderr, flush=True)
+        return 2
+    try:
+        with timed_span("import"):
+            report = DOWNLOADER.import_cache(Path(source).expanduser())
+    except (OSError, tarfile.TarError) as e:
+        log_warn(f"import: failed: {e}")
+        return 1
+    print(f"import: {json.dumps(report)}", flush=True)
+    return 0 if report["failed"] == 0 else 1
+
+
+# -------------------------
+# Перенос кэша без сети: конец
+# -------------------------
+
+
+# -------------------------
+# Системная служба: начало
+# -------------------------
+
+
+class HostDaemon:
+    """
+    Режим --daemon (системная служба): один раз на хост проверяет локальную
+    и удалённую версии, скачивает и проверяет дистрибутив в общий кэш и публикует
+    результат через unix-сокет ([daemon] socket). Трэи пользователей при работающей
+    службе становятся тонкими клиентами (DaemonClient): сами не ходят в сеть
+    и не опрашивают менеджер пакетов.
+
+    Протокол: клиент отправляет строку-команду (state или check) и получает одну
+    строку JSON с полями local, remote, package, status, progress, deferred
+    (причина, по которой политика отложила скачивание), checked_at.
+    Сокет открыт всем пользователям хоста, поэтому check от клиентов сводится
+    к одной проверке не чаще раза в [schedule] recheck_interval.
+    """
+
+    COMMANDS = ("state", "check")
+
+    def __init__(self, downloader: "Downloader", socket_path: Path):
+        self.__downloader = downloader
+        self.socket_path = socket_path
+        self.__lock = threading.Lock()
+        self.__check_lock = threading.Lock()
+        # monotonic-время окончания последней проверки
+        self.__checked: float | None = None
+        self.__state: dict = {"status": "starting"}
+        self.__download_thread: threading.Thread | None = None
+        self.__stop = threading.Event()
+        self.__server: socketserver.ThreadingUnixStreamServer | None = None
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return dict(self.__state)
+
+    def _update(self, **fields) -> None:
+        with self.__lock:
+            self.__state.update(fields)
+
+    def check(self) -> dict:
+        """Проверить версии; если нужна новая и её нет в кэше — начать скачивание."""
+        with self.__check_lock:
+            return self.__check()
+
+    def request_check(self) -> dict:
+        """
+        Проверка по запросу клиента: одновременные запросы ждут одну проверку,
+        а если последняя была меньше recheck_interval назад, сразу получают её итог.
+        """
+        with self.__check_lock:
+            if (
+                self.__checked is not None
+                and time.monotonic() - self.__checked
+                < CONFIG.schedule_recheck_interval()
+            ):
+                return self.snapshot()
+            return self.__check()
+
+    def __check(self) -> dict:
+        try:
+            return self.__check_versions()
+        finally:
+            self.__checked = time.monotonic()
+
+    def __check_versions(self) -> dict:
+        started = time.perf_counter()
+        with timed_span("package_manager_probe"):
+            local = PACKAGE_MANAGER.get_local_version()
+        remote = self.__downloader.get_remote_version()
+        versions = PackageVersions(local, remote)
+        METRICS_EXPORTER.record_check(versions, time.perf_counter() - started)
+        METRICS_EXPORTER.write()
+        if not versions.remote():
+            self._update(local=local, status="unavailable", checked_at=time.time())
+            return self.snapshot()
+
+        package = self.__downloader.get_valid_cached_package(versions.remote())
+        if not versions.differ():
+            status = "up_to_date"
+        else:
+            status = "ready" if package else "pending"
+        self._update(
+            local=local,
+            remote=versions.remote(),
+            package=str(package) if package else None,
+            status=status,
+            checked_at=time.time(),
         )
-        # Create lock file with PID
+        log_debug(f"daemon: check done, {self.snapshot()}")
+        if status == "pending":
+            self._start_download(versions.remote())
+        return self.snapshot()
+
+    def _start_download(self, version: str) -> None:
+        with self.__lock:
+            if self.__download_thread and self.__download_thread.is_alive():
+                self.__state["status"] = "downloading"
+                return
+            self.__state.update(status="downloading", progress=None)
+            thread = threading.Thread(
+                target=self._download,
+                args=(version,),
+                name="daemon-download",
+                daemon=True,
+            )
+            self.__download_thread = thread
+        thread.start()
+
+    def _download(self, version: str) -> None:
+        def on_progress(progress: DownloadProgress) -> None:
+            self._update(progress=progress.as_dict())
+
+        def on_defer(reason: str | None) -> None:
+            self._update(deferred=reason)
+
+        package = None
         try:
-            LOCK_FILE.write_text(str(proc.pid))
-        except Exception:
-            pass
-        return True
+            package = self.__downloader.download_package_when_allowed(
+                version, progress_callback=on_progress, on_defer=on_defer
+            )
+        except Exception as e:
+            log_warn(f"daemon: download of {version} failed: {e}")
+        METRICS_EXPORTER.write()
+        with self.__lock:
+            if self.__state.get("remote") == version:
+                self.__state.update(
+                    package=str(package) if package else None,
+                    status="ready" if package else "error",
+                    progress=None,
+                    deferred=None,
+                )
+
+    def join_download(self, timeout: float | None = None) -> None:
+        """Дождаться окончания текущего скачивания."""
+        thread = self.__download_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def handle_command(self, command: str) -> dict:
+        if command == "check":
+            return self.request_check()
+        if command == "state":
+            return self.snapshot()
+        return {"error": f"unknown command {command!r}"}
+
+    def _handler_class(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            timeout = DAEMON_REQUEST_TIMEOUT_SEC
+
+            def handle(self):
+                command = self.rfile.readline(64).decode("utf-8", "replace").strip()
+                reply = daemon.handle_command(command or "state")
+                self.wfile.write(json.dumps(reply, ensure_ascii=False).encode("utf-8"))
+                self.wfile.write(b"\n")
+
+        return Handler
+
+    def start(self) -> None:
+        """Открыть сокет и начать отвечать клиентам."""
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self.socket_path.unlink(missing_ok=True)
+        self.__server = socketserver.ThreadingUnixStreamServer(
+            str(self.socket_path), self._handler_class()
+        )
+        self.__server.daemon_threads = True
+        # Читать состояние и просить проверку могут все пользователи хоста
+        os.chmod(self.socket_path, 0o666)
+        threading.Thread(
+            target=self.__server.serve_forever, name="daemon-socket", daemon=True
+        ).start()
+        log_debug(f"daemon: listening on {self.socket_path}")
+
+    def run(self) -> None:
+        """Плановые проверки до остановки."""
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                log_warn(f"daemon: check failed: {e}")
+            delay = next_check_delay()
+            log_debug(f"daemon: next check in {delay:.0f}s")
+            if self.__stop.wait(delay):
+                return
+
+    def stop(self) -> None:
+        self.__stop.set()
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+
+class DaemonClient:
+    """Тонкий клиент системной службы: запрашивает состояние через unix-сокет."""
+
+    def __init__(self, socket_path: Path):
+        self.socket_path = socket_path
+
+    @classmethod
+    def connect(cls) -> "DaemonClient | None":
+        """Клиент, если служба запущена и отвечает, иначе None."""
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        socket_path = CONFIG.daemon_socket()
+        if not socket_path.exists():
+            return None
+        client = cls(socket_path)
+        return client if client.request("state") is not None else None
+
+    def request(self, command: str = "state") -> dict | None:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(DAEMON_REQUEST_TIMEOUT_SEC)
+                sock.connect(str(self.socket_path))
+                sock.sendall(f"{command}\n".encode("utf-8"))
+                data = b""
+                while chunk := sock.recv(65536):
+                    data += chunk
+            reply = json.loads(data.decode("utf-8"))
+        except (OSError, ValueError) as e:
+            log_debug(f"daemon client: {command} failed: {e}")
+            return None
+        return reply if isinstance(reply, dict) else None
+
+
+def run_host_daemon() -> int:
+    """Режим --daemon: кэш в [paths] shared_cache_dir или SYSTEM_CACHE_DIR."""
+    if not hasattr(socket, "AF_UNIX"):
+        log_warn("daemon: unix sockets are not available on this platform")
+        return 1
+    downloader = SHARED_CACHE or SharedCache(SYSTEM_CACHE_DIR)
+    daemon = HostDaemon(downloader, CONFIG.daemon_socket())
+    daemon.start()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        downloader.shutdown()
+        daemon.stop()
+    return 0
+
+
+# -------------------------
+# Системная служба: конец
+# -------------------------
+
+
+# -------------------------
+# Сетевой ввод-вывод в главном цикле GUI: начало
+# -------------------------
+
+
+def _qt_enum(owner, scope: str, name: str):
+    """Значение перечисления Qt: в PySide6 — owner.Scope.Name, в PyQt5 — owner.Name."""
+    scoped = getattr(owner, scope, None)
+    value = getattr(scoped, name, None) if scoped is not None else None
+    return value if value is not None else getattr(owner, name, None)
+
+
+def _unlink_quietly(path: Path) -> None:
+    try:
+        path.unlink()
     except Exception:
         pass
 
-    return False
 
+class NativeIo:
+    """
+    Таймеры и HTTP GET средствами главного цикла GUI ([gui] native_io):
+    обратные вызовы выполняются в том же цикле. post() возвращает в цикл
+    результат шагов, выполненных в пуле задач.
+    """
+
+    def call_later(self, seconds: float, callback) -> None:
+        """Вызвать callback() через seconds секунд."""
+        raise NotImplementedError
+
+    def post(self, callback) -> None:
+        """Вызвать callback() в главном цикле; можно из любого потока."""
+        raise NotImplementedError
+
+    def http_get(self, url: str, headers: dict[str, str], on_chunk, on_done):
+        """
+        Начать GET и вернуть описатель для abort(), pause() и resume().
+        on_chunk(data, response) — по мере прихода тела успешного ответа
+        (response.status, response.headers); исключение из on_chunk прерывает
+        запрос и передаётся в on_done(error). on_done(None) — тело прочитано
+        целиком; ответ >= 400 — HTTPError, отмена — DownloadCancelledError.
+        """
+        raise NotImplementedError
+
+    def pause(self, handle) -> None:
+        """Не передавать тело в on_chunk до resume(): сервер упрётся в окно TCP."""
+        raise NotImplementedError
+
+    def resume(self, handle) -> None:
+        """Продолжить чтение после pause()."""
+        raise NotImplementedError
+
+    def abort(self, handle) -> None:
+        """Прервать запрос; on_done получит DownloadCancelledError."""
+        raise NotImplementedError
+
+
+class _NativeResponse:
+    """Статус и заголовки ответа NativeIo, как у AsyncHttpResponse."""
+
+    def __init__(self, status: int, headers: Message):
+        self.status = status
+        self.headers = headers
+
+
+class QtNativeIo(NativeIo):
+    """NativeIo на QNetworkAccessManager и QTimer (PySide6/PyQt5)."""
+
+    def __init__(self, qtcore, qtnetwork, signal):
+        self.__qtcore = qtcore
+        self.__qtnetwork = qtnetwork
+        self.__manager = qtnetwork.QNetworkAccessManager()
+        # Ответы держим до finished, иначе их соберёт сборщик мусора
+        self.__replies: dict = {}
+
+        class Poster(qtcore.QObject):
+            """Сигнал из любого потока доставляется в главный цикл очередью."""
+
+            posted = signal(object)
+
+        self.__poster = Poster()
+        self.__poster.posted.connect(lambda callback: callback())
+
+    def call_later(self, seconds: float, callback) -> None:
+        self.__qtcore.QTimer.singleShot(max(0, int(seconds * 1000)), callback)
+
+    def post(self, callback) -> None:
+        self.__poster.posted.emit(callback)
+
+    def http_get(self, url: str, headers: dict[str, str], on_chunk, on_done):
+        QNetworkRequest = self.__qtnetwork.QNetworkRequest
+        request = QNetworkRequest(self.__qtcore.QUrl(url))
+        for name, value in headers.items():
+            request.setRawHeader(name.encode("latin-1"), value.encode("latin-1"))
+        follow = _qt_enum(QNetworkRequest, "Attribute", "FollowRedirectsAttribute")
+        if follow is not None:
+            request.setAttribute(follow, True)
+        reply = self.__manager.get(request)
+        # Буфер ограничен: пока чтение на паузе, Qt не забирает данные из сокета
+        reply.setReadBufferSize(DOWNLOAD_CHUNK_SIZE * 4)
+        state: dict = {"response": None, "error": None, "paused": False}
+
+        def ready_read() -> None:
+            if state["paused"] or state["error"] is not None:
+                return
+            if self.__status(reply) >= 400:
+                # Тело ошибки не нужно, но буфер должен освобождаться
+                reply.readAll()
+                return
+            data = reply.readAll().data()
+            if not data:
+                return
+            if state["response"] is None:
+                state["response"] = _NativeResponse(
+                    self.__status(reply), self.__headers(reply)
+                )
+            try:
+                on_chunk(data, state["response"])
+            except Exception as e:
+                state["error"] = e
+                reply.abort()
+
+        def finished() -> None:
+            if reply not in self.__replies:
+                return
+            if state["paused"] and state["error"] is None and not self.__failed(reply):
+                # Тело дочитается и запрос завершится в resume()
+                return
+            ready_read()
+            del self.__replies[reply]
+            error = state["error"] or self.__reply_error(url, reply)
+            reply.deleteLater()
+            on_done(error)
+
+        def drain() -> None:
+            ready_read()
+            if reply.isFinished():
+                finished()
+
+        state["drain"] = drain
+        self.__replies[reply] = state
+        reply.readyRead.connect(ready_read)
+        reply.finished.connect(finished)
+        return reply
+
+    def pause(self, handle) -> None:
+        state = self.__replies.get(handle)
+        if state is not None:
+            state["paused"] = True
+
+    def resume(self, handle) -> None:
+        state = self.__replies.get(handle)
+        if state is None or not state["paused"]:
+            return
+        state["paused"] = False
+        # Данные уже в буфере: readyRead для них не повторится
+        self.call_later(0, state["drain"])
+
+    def abort(self, handle) -> None:
+        if handle in self.__replies:
+            handle.abort()
+
+    def __status(self, reply) -> int:
+        attribute = _qt_enum(
+            self.__qtnetwork.QNetworkRequest, "Attribute", "HttpStatusCodeAttribute"
+        )
+        status = reply.attribute(attribute)
+        return int(status) if status is not None else 0
+
+    def __failed(self, reply) -> bool:
+        QNetworkReply = self.__qtnetwork.QNetworkReply
+        return reply.error() != _qt_enum(QNetworkReply, "NetworkError", "NoError")
+
+    @staticmethod
+    def __headers(reply) -> Message:
+        headers = Message()
+        for name, value in reply.rawHeaderPairs():
+            headers[name.data().decode("latin-1")] = value.data().decode("latin-1")
+        return headers
+
+    def __reply_error(self, url: str, reply) -> Exception | None:
+        status = self.__status(reply)
+        if status >= 400:
+            return HTTPError(url, status, f"HTTP {status}", self.__headers(reply), None)
+        QNetworkReply = self.__qtnetwork.QNetworkReply
+        code = reply.error()
+        if code == _qt_enum(QNetworkReply, "NetworkError", "NoError"):
+            return None
+        if code == _qt_enum(QNetworkReply, "NetworkError", "OperationCanceledError"):
+            return DownloadCancelledError("request aborted")
+        return ConnectionError(reply.errorString())
+
+
+class _NativeRequest:
+    """Запрос NativeUpdateFlow: описатель, сторожевой таймер простоя, пауза, итог."""
+
+    def __init__(self, timeout: float):
+        self.handle = None
+        self.done = False
+        self.paused = False
+        self.timed_out = False
+        self.timeout = timeout
+        self.started = self.activity = time.monotonic()
+        # Время до первой порции тела (NETWORK_STATS.record_rtt)
+        self.rtt: float | None = None
+
+
+class NativeUpdateFlow:
+    """
+    Проверка версии и скачивание дистрибутива на обратных вызовах NativeIo.
+    В главном цикле GUI идёт только передача по HTTP (сторожевой таймер, лимит
+    скорости). Всё, что касается диска, — шаги в пуле задач submit(key, fn) ->
+    Future: предохранители и статистика сети (state.json), оценки зеркал, .part
+    (_PartialDownload: докачка, резерв места, запись порций), кэш, проверка
+    дистрибутива, SHA-256, манифест и пробы политики. Результат шага
+    возвращается в главный цикл через NativeIo.post.
+    Общий кэш и p2p не поддерживаются: при них UpdaterApp выбирает потоки.
+    Публичные методы можно вызывать из любого потока.
+    """
+
+    def __init__(self, native_io: NativeIo, downloader: Downloader, submit):
+        self.native_io = native_io
+        self.downloader = downloader
+        self.__submit = submit
+        self.__requests: set[_NativeRequest] = set()
+        self.__retry_token = 0
+        self.__pending_retry = None
+        self.__cancelled = False
+
+    def cancel(self) -> None:
+        """Прервать запросы и отложенные повторы (выход из приложения)."""
+        self.__cancelled = True
+        self.__retry_token += 1
+        self.__pending_retry = None
+        self.__abort_requests()
+
+    def __abort_requests(self) -> None:
+        for request in list(self.__requests):
+            if request.handle is not None:
+                self.native_io.abort(request.handle)
+
+    def wake(self) -> None:
+        """Не ждать паузу между попытками, повторить скачивание сразу."""
+        self.native_io.post(self.__wake)
+
+    def __wake(self) -> None:
+        retry = self.__pending_retry
+        if retry is None:
+            return
+        log_debug("native: retry wait interrupted, retrying now")
+        self.__pending_retry = None
+        self.__retry_token += 1
+        retry()
+
+    def __schedule_retry(self, delay: float, retry) -> None:
+        self.__retry_token += 1
+        token = self.__retry_token
+
+        def fire() -> None:
+            if token == self.__retry_token and not self.__cancelled:
+                self.__pending_retry = None
+                retry()
+
+        self.__pending_retry = retry
+        self.native_io.call_later(delay, fire)
+
+    def __offload(self, key: str, fn, on_result) -> None:
+        """
+        fn() в пуле задач, on_result(результат) — в главном цикле; если fn
+        упала, результат None (ошибку записывает в лог TaskRunner).
+        """
+
+        def done(future: Future) -> None:
+            if future.cancelled() or self.__cancelled:
+                return
+            result = future.result() if future.exception() is None else None
+            self.native_io.post(lambda: on_result(result))
+
+        self.__submit(key, fn).add_done_callback(done)
+
+    def __request(self, url: str, headers: dict[str, str], on_chunk, on_done) -> None:
+        """
+        GET через предохранитель хоста. Пока нет ответа, ждём connect-таймаут,
+        дальше между порциями данных — read-таймаут (TimeoutError).
+        on_chunk может вернуть hold(resume): чтение встаёт на паузу (лимит
+        скорости, отставшая запись .part), пока hold не вызовет resume().
+        Предохранитель и статистика сети (state.json) — в пуле задач.
+        """
+        breaker = self.downloader.circuit_breaker(url)
+
+        def prepare():
+            try:
+                breaker.check()
+            except CircuitOpenError as e:
+                return e
+            return NETWORK_STATS.connect_timeout(), NETWORK_STATS.read_timeout()
+
+        def prepared(result) -> None:
+            if isinstance(result, CircuitOpenError):
+                on_done(result)
+            elif result is None:
+                on_done(RuntimeError(f"request to {url} not started"))
+            elif not self.__cancelled:
+                self.__start_request(url, headers, breaker, *result, on_chunk, on_done)
+
+        self.__offload(f"native-request {url}", prepare, prepared)
+
+    def __start_request(
+        self,
+        url: str,
+        headers: dict[str, str],
+        breaker: CircuitBreaker,
+        connect_timeout: float,
+        read_timeout: float,
+        on_chunk,
+        on_done,
+    ) -> None:
+        request = _NativeRequest(connect_timeout)
+
+        def resume() -> None:
+            if request.done or not request.paused:
+                return
+            request.paused = False
+            request.activity = time.monotonic()
+            self.native_io.resume(request.handle)
+
+        def chunk(data: bytes, response) -> None:
+            request.activity = time.monotonic()
+            if request.rtt is None:
+                request.rtt = request.activity - request.started
+            request.timeout = read_timeout
+            hold = on_chunk(data, response)
+            if hold is not None:
+                request.paused = True
+                self.native_io.pause(request.handle)
+                hold(resume)
+
+        def done(error: Exception | None) -> None:
+            if request.done:
+                return
+            request.done = True
+            self.__requests.discard(request)
+            if request.timed_out:
+                error = TimeoutError(f"no data for {request.timeout:.0f}s")
+
+            def record() -> None:
+                if request.rtt is not None:
+                    NETWORK_STATS.record_rtt(request.rtt)
+                if error is not None and _is_server_failure(error):
+                    breaker.record_failure()
+                elif not isinstance(error, DownloadCancelledError):
+                    breaker.record_success()
+
+            self.__offload(f"native-breaker {url}", record, lambda _: on_done(error))
+
+        def watchdog() -> None:
+            if request.done:
+                return
+            idle = time.monotonic() - request.activity
+            if request.paused or idle < request.timeout:
+                # Пауза — наша, а не сервера: простой не считаем
+                self.native_io.call_later(max(request.timeout - idle, 1.0), watchdog)
+                return
+            request.timed_out = True
+            self.native_io.abort(request.handle)
+
+        self.__requests.add(request)
+        handle = self.native_io.http_get(
+            url, {**Downloader.HEADERS, **headers}, chunk, done
+        )
+        if not request.done:
+            request.handle = handle
+            self.native_io.call_later(request.timeout, watchdog)
+
+    def __read_version(self, base_url: str, on_done) -> None:
+        body: list[bytes] = []
+
+        def on_chunk(data: bytes, response) -> None:
+            body.append(data)
+
+        def done(error: Exception | None) -> None:
+            if isinstance(error, CircuitOpenError):
+                log_debug(f"get_remote_version: {base_url} skipped, {error}")
+            elif isinstance(error, DownloadCancelledError):
+                pass
+            elif error is not None:
+                log_debug(f"get_remote_version: {base_url} failed: {error}")
+                self.__offload(
+                    f"native-mirror-failure {base_url}",
+                    lambda: self.downloader.mirrors.record_failure(base_url),
+                    lambda _: on_done(None),
+                )
+                return
+            else:
+                on_done(b"".join(body).decode("utf-8").strip())
+                return
+            on_done(None)
+
+        self.__request(f"{base_url}/version", {}, on_chunk, done)
+
+    def fetch_remote_version(self, on_done) -> None:
+        """Узнать версию на сервере; on_done(version | None) в главном цикле."""
+        self.native_io.post(lambda: self.__fetch_remote_version(on_done))
+
+    def __fetch_remote_version(self, on_done) -> None:
+        # Оценки зеркал — из state.json: порядок обхода готовится в пуле задач
+        self.__offload(
+            "native-mirrors",
+            lambda: self.downloader.mirrors.ranked(probe=False),
+            lambda base_urls: self.__try_versions(base_urls or [], on_done),
+        )
+
+    def __try_versions(self, base_urls: list[str], on_done) -> None:
+        downloader = self.downloader
+        primary = downloader.mirrors.primary()
+
+        def try_mirror(index: int) -> None:
+            if index == len(base_urls):
+                on_done(None)
+                return
+            base_url = base_urls[index]
+
+            def got(version: str | None) -> None:
+                if version is None:
+                    try_mirror(index + 1)
+                elif base_url == primary:
+                    on_done(version)
+                else:
+                    self.__read_version(
+                        primary,
+                        lambda primary_version: on_done(
+                            downloader._reconcile_versions(
+                                base_url, version, primary_version
+                            )
+                        ),
+                    )
+
+            self.__read_version(base_url, got)
+
+        try_mirror(0)
+
+    def __fetch_file(self, url: str, dest: Path, progress_callback, on_done) -> None:
+        """
+        Скачать url в .part рядом с dest (с докачкой); on_done(path | None, error).
+        В кэш файл кладёт вызывающий (_commit_partial) после проверки.
+        """
+
+        def opened(transfer: _PartialDownload | None) -> None:
+            if transfer is None:
+                on_done(None, None)
+            else:
+                self.__receive(url, transfer, on_done)
+
+        # stat и валидатор прежнего .part — в пуле задач
+        self.__offload(
+            "native-transfer",
+            lambda: _PartialDownload(dest, progress_callback),
+            opened,
+        )
+
+    def __receive(self, url: str, transfer: _PartialDownload, on_done) -> None:
+        """
+        Тело ответа в transfer. Главный цикл только копит порции; открывает .part,
+        пишет их по порядку и сбрасывает из page cache шаг "native-write" в пуле
+        задач. Пока он отстаёт на NATIVE_WRITE_BACKLOG_BYTES, чтение стоит.
+        """
+        bucket = self.downloader._transfer_bucket()
+        state: dict = {
+            "html": False,
+            "error": None,
+            "response": None,
+            "queue": [],
+            # Принято из сети, но ещё не записано
+            "backlog": 0,
+            "writing": False,
+            "resume": None,
+            "finish": None,
+        }
+
+        def write(chunks: list[bytes]) -> Exception | None:
+            try:
+                if transfer.monitor is None and not transfer.open(
+                    state["response"], chunks[0]
+                ):
+                    state["html"] = True
+                    return ValueError("HTML instead of package")
+                for chunk in chunks:
+                    if transfer.write(chunk):
+                        transfer.drop_page_cache()
+            except Exception as e:
+                # Зависание (StallDetector) или ошибка диска прерывает запрос
+                return e
+            return None
+
+        def start_writing() -> None:
+            chunks, state["queue"] = state["queue"], []
+            state["writing"] = True
+            size = sum(len(chunk) for chunk in chunks)
+
+            def written(error: Exception | None) -> None:
+                state["writing"] = False
+                state["backlog"] -= size
+                state["error"] = state["error"] or error
+                if state["queue"] and state["error"] is None:
+                    start_writing()
+                if state["resume"] is not None and (
+                    state["error"] is not None
+                    or state["backlog"] < NATIVE_WRITE_BACKLOG_BYTES
+                ):
+                    # Следующая порция поднимет ошибку записи и прервёт запрос
+                    resume, state["resume"] = state["resume"], None
+                    resume()
+                if not state["writing"] and state["finish"] is not None:
+                    state["finish"]()
+
+            self.__offload("native-write", lambda: write(chunks), written)
+
+        def on_chunk(data: bytes, response):
+            if state["error"] is not None:
+                raise state["error"]
+            state["response"] = state["response"] or response
+            state["queue"].append(data)
+            state["backlog"] += len(data)
+            if not state["writing"]:
+                start_writing()
+            behind = state["backlog"] >= NATIVE_WRITE_BACKLOG_BYTES
+            delay = bucket.take(len(data))
+            if not behind and delay <= 0:
+                return None
+
+            def wait_tokens(delay: float, resume) -> None:
+                if delay <= 0:
+                    resume()
+                    return
+                # Короткими паузами, чтобы новая скорость из set_rate подхватывалась
+                self.native_io.call_later(
+                    min(delay, TOKEN_BUCKET_MAX_SLEEP_SEC),
+                    lambda: wait_tokens(bucket.take(len(data)), resume),
+                )
+
+            def hold(resume) -> None:
+                if behind:
+                    # Запись отстала: читаем дальше, когда она догонит
+                    state["resume"] = lambda: wait_tokens(delay, resume)
+                else:
+                    wait_tokens(delay, resume)
+
+            return hold
+
+        def complete() -> Path | None:
+            transfer.drop_page_cache()
+            path = transfer.finish()
+            stats = transfer.stats
+            self.downloader.last_download_stats = stats
+            NETWORK_STATS.record_throughput(stats["bytes"], stats["duration"])
+            return path
+
+        def done(error: Exception | None) -> None:
+            if state["writing"]:
+                # Запрос завершился раньше записи: закроем файл после неё
+                state["finish"] = lambda: done(error)
+                return
+            state["finish"] = None
+            self.downloader._release_bucket(bucket)
+            error = error or state["error"]
+            if error is not None or state["html"] or transfer.monitor is None:
+                # Принятое остаётся в .part для докачки
+                self.__offload(
+                    "native-transfer",
+                    transfer.close,
+                    lambda _: on_done(None, None if state["html"] else error),
+                )
+                return
+            self.__offload(
+                "native-transfer", complete, lambda path: on_done(path, None)
+            )
+
+        self.__request(url, transfer.request_headers(), on_chunk, done)
+
+    def __prepare_download(self, version: str, ext: str, force: bool):
+        """
+        Шаг в пуле задач: готовый файл из кэша (Path), None — скачивать нельзя
+        (исчерпан лимит попыток), иначе (dest, зеркала, прежние неудачи).
+        """
+        downloader = self.downloader
+        cached_file = downloader._check_cache(version, ext)
+        if cached_file:
+            log_debug(f"cache: using cached file for version {version}")
+            return cached_file
+        max_attempts = downloader.get_retries_count()
+        prior_failures = downloader.get_failed_attempts(version)
+        if not force and prior_failures >= max_attempts:
+            log_debug(
+                f"cache: download skipped for {version}, "
+                f"failed_attempts={prior_failures} >= {max_attempts}"
+            )
+            return None
+        if force:
+            downloader._reset_failed_attempts(version)
+            prior_failures = 0
+        filename = downloader._get_download_target(version, ext)[1]
+        dest = downloader._get_cache_dir() / filename
+        return dest, downloader._download_base_urls(probe=False), prior_failures
+
+    def download(
+        self,
+        version: str,
+        on_done,
+        progress_callback=None,
+        force: bool = False,
+        cancel: CancelToken | None = None,
+    ) -> None:
+        """
+        Скачать дистрибутив version в кэш; on_done(path | None) в главном цикле.
+        Паузы между попытками — таймером цикла; wake() повторяет сразу.
+        cancel прерывает текущий запрос и паузу; принятое остаётся в .part
+        (status=partial) и докачивается следующей попыткой.
+        """
+        self.native_io.post(
+            lambda: self.__download(version, on_done, progress_callback, force, cancel)
+        )
+
+    def __download(self, version, on_done, progress_callback, force, cancel) -> None:
+        if cancel is not None:
+
+            def abort() -> None:
+                # Токен отменяют из любого потока: запросы прерываются в цикле
+                self.native_io.post(self.__abort_requests)
+                self.wake()
+
+            stop = cancel.on_cancel(abort)
+            reply = on_done
+
+            def on_done(path: Path | None) -> None:
+                stop()
+                reply(path)
+
+        def cancelled() -> bool:
+            return self.__cancelled or (cancel is not None and cancel.is_set())
+
+        downloader = self.downloader
+        ext = PACKAGE_MANAGER.get_extension()
+
+        def prepared(plan) -> None:
+            if plan is None or isinstance(plan, Path):
+                on_done(plan)
+                return
+            dest, base_urls, attempt = plan
+            self.__download_attempts(
+                version,
+                ext,
+                dest,
+                base_urls,
+                attempt,
+                progress_callback,
+                cancelled,
+                on_done,
+            )
+
+        self.__offload(
+            "native-download",
+            lambda: self.__prepare_download(version, ext, force),
+            prepared,
+        )
+
+    def __download_attempts(
+        self,
+        version: str,
+        ext: str,
+        dest: Path,
+        base_urls: list[str],
+        attempt: int,
+        progress_callback,
+        cancelled,
+        on_done,
+    ) -> None:
+        downloader = self.downloader
+        max_attempts = downloader.get_retries_count()
+        scheduler = RetryScheduler(
+            DOWNLOAD_RETRY_BASE_DELAY_SEC, CONFIG.download_retry_max_delay()
+        )
+        log_debug(f"cache: downloading {version} from {base_urls} (native)")
+
+        def start_attempt() -> None:
+            nonlocal attempt
+            attempt += 1
+            try_mirror(0, None, 0)
+
+        def try_mirror(index: int, retry_after, circuit_open: int) -> None:
+            if cancelled():
+                on_done(None)
+                return
+            if index == len(base_urls):
+                finish_attempt(None, retry_after, circuit_open)
+                return
+            base_url = base_urls[index]
+            url = downloader._get_download_target(version, ext, base_url)[0]
+
+            def fetched(path: Path | None, error: Exception | None) -> None:
+                if isinstance(error, CircuitOpenError):
+                    log_debug(f"cache: {base_url} skipped, {error}")
+                    try_mirror(index + 1, retry_after, circuit_open + 1)
+                elif isinstance(error, DownloadCancelledError):
+                    log_debug(f"cache: download of {version} cancelled")
+                    self.__offload(
+                        "native-partial",
+                        lambda: downloader._register_partial(version, dest),
+                        lambda _: on_done(None),
+                    )
+                elif error is not None:
+                    log_debug(
+                        f"cache: download attempt {attempt}/{max_attempts} "
+                        f"from {base_url} failed: {error}"
+                    )
+                    next_mirror(
+                        index + 1,
+                        _retry_after_seconds(error) or retry_after,
+                        circuit_open,
+                    )
+                elif path is not None:
+                    finish_attempt(path, retry_after, circuit_open, base_url)
+                else:
+                    log_debug(
+                        f"cache: download attempt {attempt}/{max_attempts} "
+                        f"from {base_url} returned no file for {version}"
+                    )
+                    next_mirror(index + 1, retry_after, circuit_open)
+
+            def next_mirror(index: int, retry_after, circuit_open: int) -> None:
+                # Оценка зеркала — в state.json: запись в пуле задач
+                self.__offload(
+                    f"native-mirror-failure {base_url}",
+                    lambda: downloader.mirrors.record_failure(base_url),
+                    lambda _: try_mirror(index, retry_after, circuit_open),
+                )
+
+            self.__fetch_file(url, dest, progress_callback, fetched)
+
+        def finish_attempt(
+            path: Path | None, retry_after, circuit_open: int, base_url=None
+        ) -> None:
+            if circuit_open == len(base_urls):
+                log_debug(f"cache: download skipped for {version}, all circuits open")
+                on_done(None)
+                return
 
-# -------------------------
-# Notifier: начало
-# -------------------------
-class Notifier:
+            def accepted(result: Path | None) -> None:
+                nonlocal base_urls
+                if result is not None:
+                    on_done(result)
+                    return
+                if base_url:
+                    # Файл не прошёл проверку: следующая попытка — сначала с других
+                    base_urls = [url for url in base_urls if url != base_url]
+                    base_urls.append(base_url)
+                if attempt < max_attempts and not cancelled():
+                    delay_sec = scheduler.next_delay(attempt, retry_after)
+                    log_debug(
+                        f"cache: waiting {delay_sec:.1f}s before next download "
+                        f"attempt (Retry-After: {retry_after})"
+                    )
+                    self.__schedule_retry(delay_sec, start_attempt)
+                else:
+                    on_done(None)
+
+            # Проверка, fsync, SHA-256 и запись манифеста — в пуле задач
+            self.__offload(
+                "native-finish",
+                lambda: downloader._accept_download(
+                    version, ext, dest, path, attempt, base_url
+                ),
+                accepted,
+            )
 
-    def notify(self, message: str, timeout: int = 5000) -> None:
+        start_attempt()
+
+    def download_when_allowed(
+        self,
+        version: str,
+        on_done,
+        progress_callback=None,
+        cancel: CancelToken | None = None,
+        on_defer=None,
+    ) -> None:
         """
-        Send notification via DBus (notify-send) if available, else print.
-        In GUI mode, tray.showMessage should be used instead.
+        download по правилам DOWNLOAD_POLICY, как
+        Downloader.download_package_when_allowed: пробы — в пуле задач, ожидание
+        и перепроверка раз в recheck_interval — таймером цикла. slow ограничивает
+        скорость, defer во время скачивания прерывает его до снятия запрета.
+        on_defer(причина) — скачивание отложено, on_defer(None) — началось.
         """
-        # Try DBus notification for headless mode
-        try:
-            # Use notify-send for DBus notifications (works without GUI)
-            subprocess.run(
-                ["notify-send", "-t", str(timeout), APPNAME, message],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                timeout=2,
-            )
-        except Exception:
-            # Fallback to print if notify-send fails
-            print(f"[NOTIFY] {APPNAME}: {message}")
+        token = CancelToken(cancel)
+        state: dict = {"finished": False, "active": False, "deferred": False}
+        recheck = CONFIG.schedule_recheck_interval()
 
+        def finish(path: Path | None) -> None:
+            if state["finished"]:
+                return
+            state["finished"] = True
+            stop()
+            token.close()
+            on_done(path)
+
+        def cancelled() -> bool:
+            return self.__cancelled or token.is_set()
+
+        # Отмена во время ожидания не ждёт следующей перепроверки
+        stop = token.on_cancel(
+            lambda: self.native_io.post(lambda: state["active"] or finish(None))
+        )
+
+        def check() -> None:
+            if cancelled():
+                finish(None)
+                return
+            self.__offload("native-policy", DOWNLOAD_POLICY.decide, decided)
+
+        def decided(decision: PolicyDecision | None) -> None:
+            if state["finished"] or cancelled():
+                finish(None)
+                return
+            decision = decision or PolicyDecision()
+            if decision.action == PolicyDecision.DEFER:
+                log_debug(f"policy: download deferred ({decision.reason()})")
+                if on_defer is not None:
+                    on_defer(decision.reason())
+                self.native_io.call_later(recheck, check)
+                return
+            if on_defer is not None:
+                on_defer(None)
+            self.downloader.set_rate_limit(decision.rate)
+            attempt = CancelToken(token)
+            state.update(active=True, deferred=False)
+
+            def watch() -> None:
+                if state["active"]:
+                    self.__offload("native-policy", DOWNLOAD_POLICY.decide, rechecked)
+
+            def rechecked(current: PolicyDecision | None) -> None:
+                if not state["active"]:
+                    return
+                if current is not None and current.action == PolicyDecision.DEFER:
+                    log_debug(f"policy: pausing download ({current.reason()})")
+                    state["deferred"] = True
+                    attempt.cancel()
+                    return
+                if current is not None:
+                    self.downloader.set_rate_limit(current.rate)
+                self.native_io.call_later(recheck, watch)
+
+            def done(path: Path | None) -> None:
+                state["active"] = False
+                attempt.close()
+                self.downloader.set_rate_limit(None)
+                if path is None and state["deferred"] and not cancelled():
+                    check()
+                    return
+                finish(path)
+
+            self.native_io.call_later(recheck, watch)
+            self.__download(version, done, progress_callback, False, attempt)
+
+        self.native_io.post(check)
 
-NOTIFIER = Notifier()
 
 # -------------------------
-# Notifier: конец
+# Сетевой ввод-вывод в главном цикле GUI: конец
 # -------------------------
 
 
@@ -1590,6 +7670,22 @@ class UpdaterApp:
         """Установить напоминание позже для версии."""
         pass
 
+    def quit(self) -> None:
+        """Выйти из приложения."""
+        pass
+
+    def cancel_download(self) -> None:
+        """Отменить идущее скачивание; принятая часть сохраняется для докачки."""
+        pass
+
+    def wants_native_io(self) -> bool:
+        """Выполнять сеть в главном цикле GUI (NativeIo) вместо отдельных потоков."""
+        return False
+
+    def submit_task(self, key: str, fn) -> None:
+        """Выполнить действие меню в фоне; key — для схлопывания одинаковых."""
+        threading.Thread(target=fn, daemon=True).start()
+
 # -------------------------
 # API UpdaterApp: конец
 # -------------------------
@@ -1612,6 +7708,8 @@ class GuiBackend:
     def __init__(self):
         self.app = None
         self.tray = None
+        # Таймеры и HTTP в главном цикле GUI ([gui] native_io), None — потоки
+        self.native_io: NativeIo | None = None
 
     def _find_icon_path(self) -> Path | None:
         """
@@ -1684,6 +7782,34 @@ class GuiBackend:
         """Создать tray иконку."""
         raise NotImplementedError
 
+    def _create_native_io(self) -> NativeIo | None:
+        """NativeIo главного цикла бэкенда; None, если бэкенд его не умеет."""
+        return None
+
+    def _setup_native_io(self, updater_app: UpdaterApp) -> None:
+        """Подключить NativeIo после создания главного цикла, если его просят."""
+        if not updater_app.wants_native_io():
+            return
+        try:
+            self.native_io = self._create_native_io()
+        except Exception as e:
+            log_warn(f"native io: unavailable, using threads: {e}")
+            self.native_io = None
+        if self.native_io is not None:
+            log_debug(f"native io: using {type(self.native_io).__name__}")
+        else:
+            log_debug(f"native io: {type(self).__name__} has none, using threads")
+
+    def _dispatch(self, updater_app: UpdaterApp, key: str, fn) -> None:
+        """
+        Выполнить действие меню: проверку при NativeIo — в главном цикле,
+        остальное — в общем пуле UpdaterApp.submit_task.
+        """
+        if key == "check" and self.native_io is not None:
+            fn()
+            return
+        updater_app.submit_task(key, fn)
+
     def show_update_dialog(self, updater_app: UpdaterApp) -> None:
         """Показать диалог обновления."""
         raise NotImplementedError
@@ -1708,6 +7834,10 @@ class GuiBackend:
         """Показать иконку ошибки в трее или восстановить обычную."""
         pass
 
+    def update_download_progress(self, text: str | None) -> None:
+        """Показать ход скачивания в подсказке и меню трея; None — убрать."""
+        pass
+
     def quit(self) -> None:
         """Выход из приложения."""
         raise NotImplementedError
@@ -1717,6 +7847,7 @@ class GuiBackend:
         raise NotImplementedError
 
     @classmethod
+    @timed_span("gui_backend_detect")
     def create(cls) -> "GuiBackend":
         """Создать подходящий GUI бэкенд на основе доступных библиотек."""
         if IS_WINDOWS:
@@ -1838,6 +7969,14 @@ class QtBackend(GuiBackend):
         """Получить класс Signal (или pyqtSignal). Должен быть переопределен в дочерних классах."""
         raise NotImplementedError
 
+    def _get_qtcore(self):
+        """Получить модуль QtCore. Должен быть переопределен в дочерних классах."""
+        raise NotImplementedError
+
+    def _get_qtnetwork(self):
+        """Получить модуль QtNetwork. Должен быть переопределен в дочерних классах."""
+        raise NotImplementedError
+
     def __init__(self):
         """Инициализация Qt бэкенда (создание DialogSignaler)."""
         super().__init__()
@@ -1851,6 +7990,7 @@ class QtBackend(GuiBackend):
             show_dialog_signal = Signal()
             show_install_dialog_signal = Signal()
             refresh_install_menu_signal = Signal()
+            download_progress_signal = Signal(str)
 
         self.__dialog_signaler_class = DialogSignaler
 
@@ -1885,6 +8025,15 @@ class QtBackend(GuiBackend):
         tray.setIcon(icon)
         tray.setToolTip(APPNAME)
         menu = QMenu()
+        progress_action = QAction("", menu)
+        progress_action.setEnabled(False)
+        progress_action.setVisible(False)
+        self._progress_menu_action = progress_action
+        menu.addAction(progress_action)
+        cancel_action = QAction("Отменить скачивание", menu)
+        cancel_action.setVisible(False)
+        self._cancel_menu_action = cancel_action
+        menu.addAction(cancel_action)
         check_action = QAction("Проверить сейчас", menu)
         forum_action = QAction("Чё там на форуме?", menu)
         install_action = QAction("Установить", menu)
@@ -1896,21 +8045,24 @@ class QtBackend(GuiBackend):
         menu.addAction(quit_action)
         tray.setContextMenu(menu)
         check_action.triggered.connect(
-            lambda checked=False: threading.Thread(
-                target=updater_app.manual_check_and_notify, daemon=True
-            ).start()
+            lambda checked=False: self._dispatch(
+                updater_app, "check", updater_app.manual_check_and_notify
+            )
         )
         forum_action.triggered.connect(
-            lambda checked=False: threading.Thread(
-                target=updater_app.show_forum, daemon=True
-            ).start()
+            lambda checked=False: self._dispatch(
+                updater_app, "forum", updater_app.show_forum
+            )
         )
         install_action.triggered.connect(
-            lambda checked=False: threading.Thread(
-                target=updater_app.show_install, daemon=True
-            ).start()
+            lambda checked=False: self._dispatch(
+                updater_app, "install", updater_app.show_install
+            )
         )
-        quit_action.triggered.connect(lambda checked=False: self.quit())
+        cancel_action.triggered.connect(
+            lambda checked=False: updater_app.cancel_download()
+        )
+        quit_action.triggered.connect(lambda checked=False: updater_app.quit())
         tray.activated.connect(
             lambda reason: self.__consider_on_tray_activated(updater_app, reason)
         )
@@ -1929,7 +8081,14 @@ class QtBackend(GuiBackend):
         self.__dialog_signaler.refresh_install_menu_signal.connect(
             lambda: self.__update_install_menu_visibility_impl(updater_app)
         )
+        self.__dialog_signaler.download_progress_signal.connect(
+            lambda text: self.__update_download_progress_impl(text or None)
+        )
         log_debug("create_tray: created dialog signaler in main thread")
+        self._setup_native_io(updater_app)
+
+    def _create_native_io(self) -> NativeIo | None:
+        return QtNativeIo(self._get_qtcore(), self._get_qtnetwork(), self._get_signal())
 
     def update_install_menu_visibility(self, updater_app: UpdaterApp) -> None:
         """Показать пункт «Установить», только если в кэше есть валидный дистрибутив."""
@@ -1940,6 +8099,26 @@ class QtBackend(GuiBackend):
         else:
             self.__dialog_signaler.refresh_install_menu_signal.emit()
 
+    def update_download_progress(self, text: str | None) -> None:
+        """Показать ход скачивания в подсказке и меню трея Qt."""
+        if not self.tray:
+            return
+        QThread = self._get_qthread()
+        if QThread.currentThread() == self.app.thread():
+            self.__update_download_progress_impl(text)
+        else:
+            self.__dialog_signaler.download_progress_signal.emit(text or "")
+
+    def __update_download_progress_impl(self, text: str | None) -> None:
+        self.tray.setToolTip(f"{APPNAME}\n{text}" if text else APPNAME)
+        action = getattr(self, "_progress_menu_action", None)
+        if action is not None:
+            action.setText(text or "")
+            action.setVisible(bool(text))
+        cancel_action = getattr(self, "_cancel_menu_action", None)
+        if cancel_action is not None:
+            cancel_action.setVisible(bool(text))
+
     def __update_install_menu_visibility_impl(self, updater_app: UpdaterApp) -> None:
         if not self._install_menu_action:
             return
@@ -2097,6 +8276,20 @@ class Pyside6GuiBackend(QtBackend):
 
         return Signal
 
+    @cached_getter("_qtcore")
+    def _get_qtcore(self):
+        """Получить модуль QtCore из PySide6."""
+        from PySide6 import QtCore  # type: ignore[import]
+
+        return QtCore
+
+    @cached_getter("_qtnetwork")
+    def _get_qtnetwork(self):
+        """Получить модуль QtNetwork из PySide6."""
+        from PySide6 import QtNetwork  # type: ignore[import]
+
+        return QtNetwork
+
     @cached_getter("_qapplication")
     def _get_qapplication(self):
         """Получить класс QApplication из PySide6."""
@@ -2171,6 +8364,20 @@ class Pyqt5GuiBackend(QtBackend):
 
         return Signal
 
+    @cached_getter("_qtcore")
+    def _get_qtcore(self):
+        """Получить модуль QtCore из PyQt5."""
+        from PyQt5 import QtCore
+
+        return QtCore
+
+    @cached_getter("_qtnetwork")
+    def _get_qtnetwork(self):
+        """Получить модуль QtNetwork из PyQt5."""
+        from PyQt5 import QtNetwork
+
+        return QtNetwork
+
     @cached_getter("_qapplication")
     def _get_qapplication(self):
         """Получить класс QApplication из PyQt5."""
@@ -2235,6 +8442,8 @@ class AppIndicatorGuiBackend(GuiBackend):
         super().__init__()
         self._normal_tray_icon_name = "applications-internet"
         self._install_menu_item = None
+        self._progress_menu_item = None
+        self._cancel_menu_item = None
         self._install_menu_visible: bool | None = None
         self._tray_error_state: bool | None = None
         self._gtk_main_thread_id: int | None = None
@@ -2344,21 +8553,33 @@ class AppIndicatorGuiBackend(GuiBackend):
         # Create menu
         menu = Gtk.Menu()
 
+        progress_item = Gtk.MenuItem(label="")
+        progress_item.set_sensitive(False)
+        self._progress_menu_item = progress_item
+        menu.append(progress_item)
+
+        cancel_item = Gtk.MenuItem(label="Отменить скачивание")
+        cancel_item.connect(
+            "activate", lambda ignored_widget: updater_app.cancel_download()
+        )
+        self._cancel_menu_item = cancel_item
+        menu.append(cancel_item)
+
         check_item = Gtk.MenuItem(label="Проверить сейчас")
         check_item.connect(
             "activate",
-            lambda ignored_widget: threading.Thread(
-                target=updater_app.manual_check_and_notify, daemon=True
-            ).start(),
+            lambda ignored_widget: self._dispatch(
+                updater_app, "check", updater_app.manual_check_and_notify
+            ),
         )
         menu.append(check_item)
 
         forum_item = Gtk.MenuItem(label="Чё там на форуме?")
         forum_item.connect(
             "activate",
-            lambda ignored_widget: threading.Thread(
-                target=updater_app.show_forum, daemon=True
-            ).start(),
+            lambda ignored_widget: self._dispatch(
+                updater_app, "forum", updater_app.show_forum
+            ),
         )
         menu.append(forum_item)
 
@@ -2366,20 +8587,25 @@ class AppIndicatorGuiBackend(GuiBackend):
         self._install_menu_item = install_item
         install_item.connect(
             "activate",
-            lambda ignored_widget: threading.Thread(
-                target=updater_app.show_install, daemon=True
-            ).start(),
+            lambda ignored_widget: self._dispatch(
+                updater_app, "install", updater_app.show_install
+            ),
         )
         menu.append(install_item)
 
         menu.append(Gtk.SeparatorMenuItem())
 
         quit_item = Gtk.MenuItem(label="Выйти")
-        quit_item.connect("activate", lambda ignored_widget: self.quit())
+        quit_item.connect("activate", lambda ignored_widget: updater_app.quit())
         menu.append(quit_item)
 
         menu.show_all()
+        progress_item.hide()
+        cancel_item.hide()
         self.tray.set_menu(menu)
+        # NativeIo здесь нет: gvfs не передаёт заголовки запроса (Range, If-Range)
+        # и скрывает статус ответа (429/503, Retry-After), сеть остаётся на потоках
+        self._setup_native_io(updater_app)
 
     def __update_install_menu_visibility_impl(self, visible: bool) -> None:
         if not self._install_menu_item:
@@ -2390,6 +8616,21 @@ class AppIndicatorGuiBackend(GuiBackend):
         self._install_menu_visible = visible
         log_debug(f"update_install_menu_visibility: visible={visible}")
 
+    def __update_download_progress_impl(self, text: str | None) -> None:
+        if self._progress_menu_item is not None:
+            self._progress_menu_item.set_label(text or "")
+            self._progress_menu_item.set_visible(bool(text))
+        if self._cancel_menu_item is not None:
+            self._cancel_menu_item.set_visible(bool(text))
+        if self.tray:
+            # Заголовок индикатора часть оболочек показывает как подсказку
+            self.tray.set_title(f"{APPNAME}: {text}" if text else APPNAME)
+
+    def update_download_progress(self, text: str | None) -> None:
+        if not self.tray:
+            return
+        self._run_on_gtk_main_async(self.__update_download_progress_impl, text)
+
     def update_install_menu_visibility(self, updater_app: UpdaterApp) -> None:
         if not self._install_menu_item:
             return
@@ -2611,20 +8852,151 @@ GUI_BACKEND: GuiBackend = GuiBackend.create()
 # -------------------------
 
 
+class TaskRunner:
+    """
+    Общий пул для действий трея: не больше max_workers задач одновременно,
+    повторная задача с тем же ключом, пока прежняя ждёт или выполняется,
+    не запускается, а присоединяется к ней (single-flight). Пять нажатий
+    «Проверить сейчас» подряд дают одну проверку.
+    """
+
+    def __init__(self, max_workers: int = TRAY_TASK_WORKERS):
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tray-task"
+        )
+        self.__lock = threading.Lock()
+        self.__inflight: dict[str, Future] = {}
+
+    def submit(self, key: str, fn) -> Future:
+        with self.__lock:
+            future = self.__inflight.get(key)
+            if future is not None:
+                log_debug(f"tasks: {key} coalesced, depth={len(self.__inflight)}")
+                return future
+            future = self.__executor.submit(self.__run, key, fn, time.monotonic())
+            self.__inflight[key] = future
+            depth = len(self.__inflight)
+        log_debug(f"tasks: {key} queued, depth={depth}")
+        return future
+
+    def __run(self, key: str, fn, queued_at: float):
+        started = time.monotonic()
+        log_debug(f"tasks: {key} started after {started - queued_at:.3f}s in queue")
+        try:
+            return fn()
+        except Exception as e:
+            log_warn(f"tasks: {key} failed: {e}")
+        finally:
+            with self.__lock:
+                self.__inflight.pop(key, None)
+                depth = len(self.__inflight)
+            log_debug(
+                f"tasks: {key} done in {time.monotonic() - started:.3f}s, depth={depth}"
+            )
+
+    def shutdown(self) -> None:
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+
+class UpdateState:
+    """
+    Состояние обновления в памяти: версии, готовый дистрибутив и ход скачивания.
+    Меняют его фоновые проверки и скачивание, GUI только читает: обработчики
+    кликов не валидируют дистрибутив и не разбирают манифест кэша.
+    """
+
+    IDLE = "idle"
+    DOWNLOADING = "downloading"
+
+    def __init__(self):
+        self.versions = PackageVersions()
+        self.status = self.IDLE
+        self.progress: DownloadProgress | None = None
+        # (версия, путь) одним присваиванием: читатель не увидит половину пары
+        self.__ready: tuple[str | None, Path | None] = (None, None)
+
+    @property
+    def downloading(self) -> bool:
+        return self.status == self.DOWNLOADING
+
+    def set_ready_package(self, version: str | None, package: Path | None) -> None:
+        self.__ready = (version, package)
+
+    def ready_package(self, version: str | None = None) -> Path | None:
+        """Проверенный дистрибутив версии version (по умолчанию — удалённой)."""
+        version = version or self.versions.remote()
+        ready_version, package = self.__ready
+        if not version or ready_version != version:
+            return None
+        return package
+
+
 class UpdaterAppImpl(UpdaterApp):
     def __init__(self):
         self.state = load_state()
         self.state.setdefault("ignored_versions", [])
         self.state.setdefault("remind_at", {})
-        self.current_package_versions = PackageVersions()
+        self.update_state = UpdateState()
+        self._tasks = TaskRunner()
+        self._watcher: FileWatcher | None = None
         self._download_lock = threading.Lock()
-        self._download_in_progress = False
+        self._download_cancel: CancelToken | None = None
+        self._download_thread: threading.Thread | None = None
+        self._last_progress_log = 0.0
+        self._stop_event = threading.Event()
+        # Системная служба (--daemon) проверяет и скачивает за нас, трэй только
+        # показывает её состояние
+        self._daemon = DaemonClient.connect()
+        self._daemon_state: dict = {}
+        if self._daemon is not None:
+            log_debug(f"updater: thin client of {self._daemon.socket_path}")
+        # Проверки и скачивание в главном цикле GUI ([gui] native_io)
+        self._native: NativeUpdateFlow | None = None
+
+    @property
+    def thin_client(self) -> bool:
+        return self._daemon is not None
+
+    @property
+    def current_package_versions(self) -> PackageVersions:
+        return self.update_state.versions
+
+    @property
+    def download_progress(self) -> DownloadProgress | None:
+        return self.update_state.progress
+
+    # Разделы state.json, которыми владеет UpdaterAppImpl
+    _OWN_STATE_KEYS = ("ignored_versions", "remind_at")
+
+    def _save_state(self) -> None:
+        """Сохранить свои разделы состояния, не затирая остальные (например, network)."""
+
+        def merge(state: dict) -> None:
+            for key in self._OWN_STATE_KEYS:
+                if key in self.state:
+                    state[key] = self.state[key]
+
+        update_state(merge)
 
     def get_ready_package(self, version: str | None = None) -> Path | None:
+        """Готовый дистрибутив из UpdateState; не блокирует, можно звать из GUI."""
+        return self.update_state.ready_package(version)
+
+    def _refresh_ready_package(self, version: str | None = None) -> Path | None:
+        """
+        Найти и проверить готовый дистрибутив (валидация, манифест кэша) и
+        записать результат в UpdateState. Только из фоновых проверок.
+        """
         version = version or self.current_package_versions.remote()
-        if not version:
-            return None
-        return DOWNLOADER.get_valid_cached_package(version)
+        package = None
+        if version and self._daemon is not None:
+            path = self._daemon_state.get("package")
+            if self._daemon_state.get("remote") == version and path:
+                package = Path(path) if Path(path).exists() else None
+        elif version:
+            package = DOWNLOADER.get_valid_cached_package(version)
+        self.update_state.set_ready_package(version, package)
+        return package
 
     def has_ready_package(self, version: str | None = None) -> bool:
         return self.get_ready_package(version) is not None
@@ -2643,6 +9015,9 @@ class UpdaterAppImpl(UpdaterApp):
             package_path = self.get_ready_package(remote_version)
         if not package_path:
             return
+        self.update_state.set_ready_package(
+            remote_version or self.current_package_versions.remote(), package_path
+        )
         self._set_tray_error(False)
         self.refresh_install_menu_visibility()
         remote = remote_version or self.current_package_versions.remote() or "?"
@@ -2657,62 +9032,262 @@ class UpdaterAppImpl(UpdaterApp):
             f"Скачан {artifact} Chromium Gost {remote}", 5000
         )
 
+    def _on_download_progress(self, progress: DownloadProgress) -> None:
+        """Принять ход скачивания от Downloader: запомнить, залогировать, показать в трее."""
+        self.update_state.progress = progress
+        now = time.monotonic()
+        if progress.done or now - self._last_progress_log >= PROGRESS_LOG_INTERVAL_SEC:
+            self._last_progress_log = now
+            log_debug(f"download progress: {progress.format()}")
+        GUI_BACKEND.update_download_progress(f"Скачивается: {progress.format()}")
+
+    def _server_unavailable_message(self) -> str | None:
+        """Сообщение для трея, если сервер обновлений признан недоступным."""
+        retry_at = DOWNLOADER.circuit_retry_at()
+        if retry_at is None:
+            return None
+        when = datetime.fromtimestamp(retry_at).strftime("%H:%M")
+        return f"Сервер обновлений недоступен. Следующая попытка после {when}"
+
     def download_update_async(self, force: bool = False) -> None:
         remote = self.current_package_versions.remote()
         if not remote:
             return
 
+        if self._daemon is not None:
+            # Скачивает системная служба; просим её проверить ещё раз
+            if self.has_ready_package(remote):
+                self.notify_update_ready(remote_version=remote)
+                return
+            self.submit_task(
+                "daemon-check", lambda: self._refresh_from_daemon("check")
+            )
+            if force:
+                GUI_BACKEND.show_tray_message(
+                    "Дистрибутив скачивает системная служба", 3000
+                )
+            return
+
         with self._download_lock:
-            if self._download_in_progress:
+            if self.update_state.downloading:
+                if force:
+                    # Ручная проверка: не ждём паузу между попытками
+                    if self._native is not None:
+                        self._native.wake()
+                    else:
+                        DOWNLOADER.wake_retry()
                 GUI_BACKEND.show_tray_message("Скачивание уже выполняется...", 3000)
                 return
             if not force and self.has_ready_package(remote):
                 self.notify_update_ready(remote_version=remote)
                 return
-            self._download_in_progress = True
+            self.update_state.status = UpdateState.DOWNLOADING
+            cancel = self._download_cancel = CancelToken()
+
+        filename = DOWNLOADER.get_package_filename(remote)
+
+        def on_defer(reason: str | None) -> None:
+            if reason:
+                GUI_BACKEND.update_download_progress(f"Скачивание отложено: {reason}")
+            else:
+                GUI_BACKEND.update_download_progress(f"Скачивается {filename}")
+
+        if self._native is not None:
+            GUI_BACKEND.show_tray_message(f"Скачивается {filename}", 3000)
+            GUI_BACKEND.update_download_progress(f"Скачивается {filename}")
+
+            def done(package_path: Path | None) -> None:
+                if self._stop_event.is_set():
+                    self._reset_download_state()
+                    return
+
+                # Итог (метрики, уведомление) — в пуле задач, не в главном цикле
+                def complete() -> None:
+                    try:
+                        self._complete_download(remote, package_path, cancel.is_set())
+                    finally:
+                        self._reset_download_state()
+
+                self.submit_task("download-complete", complete)
+
+            if force:
+                # Пользователь попросил сам: политика не откладывает
+                self._native.download(
+                    remote, done, self._on_download_progress, force=True, cancel=cancel
+                )
+            else:
+                self._native.download_when_allowed(
+                    remote,
+                    done,
+                    self._on_download_progress,
+                    cancel=cancel,
+                    on_defer=on_defer,
+                )
+            return
 
         def worker() -> None:
             try:
-                filename = DOWNLOADER.get_package_filename(remote)
                 GUI_BACKEND.show_tray_message(f"Скачивается {filename}", 3000)
-                package_path = DOWNLOADER.download_package(remote, force=force)
-                if package_path:
-                    self.notify_update_ready(
-                        package_path=package_path,
-                        remote_version=remote,
+                GUI_BACKEND.update_download_progress(f"Скачивается {filename}")
+                if force:
+                    # Пользователь попросил сам: политика не откладывает
+                    package_path = DOWNLOADER.download_package(
+                        remote,
+                        force=True,
+                        progress_callback=self._on_download_progress,
+                        cancel=cancel,
                     )
                 else:
-                    self._set_tray_error(True)
-                    self.refresh_install_menu_visibility()
-                    retries = DOWNLOADER.get_retries_count()
-                    if DOWNLOADER.has_exhausted_download_attempts(remote):
-                        GUI_BACKEND.show_tray_message(
-                            f"Дистрибутив {remote} не прошёл проверку после "
-                            f"{retries} попыток. Повторная загрузка отложена.",
-                            8000,
-                        )
-                    else:
-                        GUI_BACKEND.show_tray_message(
-                            f"Не удалось скачать {remote}",
-                            5000,
-                        )
+                    package_path = DOWNLOADER.download_package_when_allowed(
+                        remote,
+                        progress_callback=self._on_download_progress,
+                        cancel=cancel,
+                        on_defer=on_defer,
+                    )
+                if not self._stop_event.is_set():
+                    self._complete_download(remote, package_path, cancel.is_set())
             finally:
-                with self._download_lock:
-                    self._download_in_progress = False
+                self._reset_download_state()
+
+        thread = threading.Thread(target=worker, name="download", daemon=True)
+        self._download_thread = thread
+        thread.start()
+
+    def cancel_download(self) -> None:
+        """
+        Отменить скачивание из меню трея. Передача останавливается в пределах
+        одной порции данных; принятое остаётся в .part и докачивается потом.
+        """
+        if self._daemon is not None:
+            GUI_BACKEND.show_tray_message(
+                "Дистрибутив скачивает системная служба", 3000
+            )
+            return
+        with self._download_lock:
+            cancel = self._download_cancel
+        if cancel is None:
+            return
+        log_debug("cancel_download: requested by user")
+        cancel.cancel()
+
+    def _complete_download(
+        self, remote: str, package_path: Path | None, cancelled: bool = False
+    ) -> None:
+        """Сообщить итог скачивания: готовый дистрибутив или причину неудачи."""
+        METRICS_EXPORTER.write()
+        if cancelled and not package_path:
+            self.refresh_install_menu_visibility()
+            GUI_BACKEND.show_tray_message("Скачивание отменено", 3000)
+            return
+        if package_path:
+            self.notify_update_ready(
+                package_path=package_path,
+                remote_version=remote,
+            )
+            return
+        self._set_tray_error(True)
+        self.refresh_install_menu_visibility()
+        retries = DOWNLOADER.get_retries_count()
+        if DOWNLOADER.has_exhausted_download_attempts(remote):
+            GUI_BACKEND.show_tray_message(
+                f"Дистрибутив {remote} не прошёл проверку после "
+                f"{retries} попыток. Повторная загрузка отложена.",
+                8000,
+            )
+        else:
+            GUI_BACKEND.show_tray_message(
+                self._server_unavailable_message() or f"Не удалось скачать {remote}",
+                5000,
+            )
 
-        threading.Thread(target=worker, daemon=True).start()
+    def _reset_download_state(self) -> None:
+        self.update_state.progress = None
+        GUI_BACKEND.update_download_progress(None)
+        with self._download_lock:
+            self.update_state.status = UpdateState.IDLE
+            self._download_cancel = None
+
+    def _refresh_from_daemon(self, command: str = "state") -> PackageVersions:
+        """Взять версии, готовый дистрибутив и ход скачивания у системной службы."""
+        assert self._daemon is not None
+        state = self._daemon.request(command)
+        if state is None:
+            log_debug("check_package_versions: daemon unavailable, keeping last state")
+            return self.current_package_versions
+        self._daemon_state = state
+        self.current_package_versions.set_local(state.get("local"))
+        self.current_package_versions.set_remote(state.get("remote"))
+        self._refresh_ready_package()
+        self.update_state.status = (
+            UpdateState.DOWNLOADING
+            if state.get("status") == "downloading"
+            else UpdateState.IDLE
+        )
+        progress = state.get("progress")
+        self.update_state.progress = DownloadProgress(**progress) if progress else None
+        if state.get("deferred"):
+            text = f"Скачивание отложено: {state['deferred']}"
+        elif self.download_progress:
+            text = f"Скачивается: {self.download_progress.format()}"
+        else:
+            text = None
+        GUI_BACKEND.update_download_progress(text)
+        log_debug(f"check_package_versions: from daemon {state}")
+        return self.current_package_versions
 
     def check_package_versions(self) -> PackageVersions:
-        local = PACKAGE_MANAGER.get_local_version()
+        if self._daemon is not None:
+            return self._refresh_from_daemon()
+        started = time.perf_counter()
+        with timed_span("package_manager_probe"):
+            local = PACKAGE_MANAGER.get_local_version()
         self.current_package_versions.set_local(local)
         log_debug(f"check_package_versions: local={local}")
 
         remote = DOWNLOADER.get_remote_version()
         self.current_package_versions.set_remote(remote)
         log_debug(f"check_package_versions: remote={remote}")
+        self._refresh_ready_package()
 
+        METRICS_EXPORTER.record_check(
+            self.current_package_versions, time.perf_counter() - started
+        )
+        METRICS_EXPORTER.write()
         return self.current_package_versions
 
+    def _check_versions_native(self, on_done) -> None:
+        """
+        Как check_package_versions, но удалённая версия запрашивается через
+        NativeUpdateFlow в главном цикле GUI. Опрос пакетного менеджера, проверка
+        готового дистрибутива и on_done(PackageVersions) — в пуле задач.
+        """
+        assert self._native is not None
+        native = self._native
+        started = time.perf_counter()
+
+        def probe_local() -> None:
+            with timed_span("package_manager_probe"):
+                local = PACKAGE_MANAGER.get_local_version()
+            self.current_package_versions.set_local(local)
+            log_debug(f"check_package_versions: local={local}")
+            native.fetch_remote_version(remote_done)
+
+        def remote_done(remote: str | None) -> None:
+            if not self._stop_event.is_set():
+                self.submit_task("check-finish", lambda: finish(remote))
+
+        def finish(remote: str | None) -> None:
+            self.current_package_versions.set_remote(remote)
+            log_debug(f"check_package_versions: remote={remote}")
+            self._refresh_ready_package()
+            METRICS_EXPORTER.record_check(
+                self.current_package_versions, time.perf_counter() - started
+            )
+            METRICS_EXPORTER.write()
+            on_done(self.current_package_versions)
+
+        self.submit_task("check-local", probe_local)
+
     def has_updates(self) -> bool:
         """
         Проверяем, есть ли обновления.
@@ -2744,7 +9319,7 @@ class UpdaterAppImpl(UpdaterApp):
             return
         if version not in lst:
             lst.append(version)
-        save_state(self.state)
+        self._save_state()
 
     def set_remind_later(self) -> None:
         version = self.current_package_versions.remote()
@@ -2753,7 +9328,7 @@ class UpdaterAppImpl(UpdaterApp):
 
         after_seconds = CONFIG.timing_check_remote_interval()
         self.state.setdefault("remind_at", {})[version] = time.time() + after_seconds
-        save_state(self.state)
+        self._save_state()
 
     def cleanup_installed_version(self) -> None:
         """
@@ -2794,7 +9369,7 @@ class UpdaterAppImpl(UpdaterApp):
         if removed_from_ignored or removed_from_remind:
             self.state["ignored_versions"] = ignored_versions
             self.state["remind_at"] = remind_at
-            save_state(self.state)
+            self._save_state()
             log_debug("cleanup_installed_version: state saved after cleanup")
 
     def cleanup_stale_state_versions(self) -> None:
@@ -2822,12 +9397,33 @@ class UpdaterAppImpl(UpdaterApp):
             )
 
         self.state["remind_at"] = remind_at
-        save_state(self.state)
+        self._save_state()
         log_debug("cleanup_stale_state_versions: state saved after cleanup")
 
+    def submit_task(self, key: str, fn) -> None:
+        self._tasks.submit(key, fn)
+
+    def wants_native_io(self) -> bool:
+        """
+        Сеть в главном цикле GUI, если включено [gui] native_io. Тонкому клиенту
+        сеть не нужна; общий кэш и p2p остаются на потоках: там блокировки
+        между процессами и обмен с соседями.
+        """
+        return (
+            CONFIG.gui_native_io()
+            and self._daemon is None
+            and SHARED_CACHE is None
+            and not CONFIG.p2p_enabled()
+        )
+
     def create_tray(self) -> None:
         """Создать tray иконку через GUI бэкенд."""
-        GUI_BACKEND.create_tray(self)
+        with timed_span("gui_create_tray"):
+            GUI_BACKEND.create_tray(self)
+        if GUI_BACKEND.native_io is not None:
+            self._native = NativeUpdateFlow(
+                GUI_BACKEND.native_io, DOWNLOADER, self._tasks.submit
+            )
         self.refresh_install_menu_visibility()
 
     def refresh_install_menu_visibility(self) -> None:
@@ -2842,7 +9438,14 @@ class UpdaterAppImpl(UpdaterApp):
 
     def _show_downloading_status_message(self, version: str | None = None) -> None:
         filename = self._get_download_filename(version)
-        if filename:
+        if not filename:
+            return
+        progress = self.download_progress
+        if progress:
+            GUI_BACKEND.show_tray_message(
+                f"Скачивается {filename}: {progress.format()}", 3000
+            )
+        else:
             GUI_BACKEND.show_tray_message(f"Скачивается {filename}", 3000)
 
     def handle_left_or_double_click(self) -> None:
@@ -2851,7 +9454,7 @@ class UpdaterAppImpl(UpdaterApp):
         if self.has_ready_package():
             self.show_install()
             return
-        if self._download_in_progress:
+        if self.update_state.downloading:
             self._show_downloading_status_message()
             return
         if self.has_updates():
@@ -2868,7 +9471,27 @@ class UpdaterAppImpl(UpdaterApp):
         if IS_WINDOWS:
             open_installer_folder(package_path)
             return
-        GUI_BACKEND.show_install_dialog(self)
+        # Хэш 100 МБ считаем в фоне; диалог бэкенд покажет в своём главном цикле
+        self.submit_task("install", lambda: self._verify_and_show_install(package_path))
+
+    def _verify_and_show_install(self, package_path: Path) -> None:
+        """
+        Сверить SHA-256 дистрибутива с манифестом и показать команду установки.
+        Файл, изменённый после проверки (в том числе в общем кэше), не предлагается;
+        свой такой файл удаляется, чтобы следующая проверка скачала его заново.
+        """
+        if DOWNLOADER.verify_package_digest(package_path):
+            GUI_BACKEND.show_install_dialog(self)
+            return
+        if package_path.parent == DOWNLOADER._get_cache_dir():
+            _unlink_quietly(package_path)
+        remote = self.current_package_versions.remote()
+        self.update_state.set_ready_package(remote, None)
+        self.refresh_install_menu_visibility()
+        GUI_BACKEND.show_tray_message(
+            f"Дистрибутив {package_path.name} изменён после скачивания "
+            "и не будет установлен"
+        )
 
     def show_update_dialog(self) -> None:
         """Показать диалог обновления через GUI бэкенд."""
@@ -2877,10 +9500,148 @@ class UpdaterAppImpl(UpdaterApp):
         log_debug("show_update_dialog: called")
         GUI_BACKEND.show_update_dialog(self)
 
+    def quit(self) -> None:
+        """Остановить повторы скачивания и периодические проверки, выйти из GUI."""
+        log_debug("quit: requested by user")
+        self._stop_event.set()
+        if self._native is not None:
+            self._native.cancel()
+        DOWNLOADER.shutdown()
+        thread = self._download_thread
+        if thread is not None:
+            # Отмена доходит до потока за одну порцию данных или тик таймаута
+            thread.join(QUIT_JOIN_TIMEOUT_SEC)
+            if thread.is_alive():
+                log_warn("quit: download thread did not stop in time")
+        self._tasks.shutdown()
+        if self._watcher is not None:
+            self._watcher.stop()
+        GUI_BACKEND.quit()
+
+    def background_check(self) -> None:
+        """Плановая проверка без участия пользователя: при обновлении — скачать."""
+        log_debug("background_check: starting scheduled check")
+        was_ready = self.has_ready_package()
+        if self._native is not None:
+            self._check_versions_native(
+                lambda versions: self._finish_background_check(was_ready)
+            )
+            return
+        self.check_package_versions()
+        self._finish_background_check(was_ready)
+
+    def _finish_background_check(self, was_ready: bool) -> None:
+        self.cleanup_installed_version()
+        self.cleanup_stale_state_versions()
+        self.refresh_install_menu_visibility()
+        if self._daemon is not None:
+            # Служба опрашивается часто: сообщаем только о появлении дистрибутива
+            if self.has_updates() and not was_ready and self.has_ready_package():
+                self.notify_update_ready()
+            return
+        if self.has_updates():
+            self.download_update_async()
+
+    def start_watching(self) -> None:
+        """
+        Следить за базой пакетов (установка через apt/dnf) и каталогом кэша
+        (дистрибутив появился или удалён) и сразу обновлять трэй, не дожидаясь
+        клика или плановой проверки. Тонкому клиенту состояние даёт служба.
+        """
+        if self._daemon is not None:
+            return
+        watcher = FileWatcher(self._on_files_changed)
+        for path in PACKAGE_MANAGER.database_paths():
+            watcher.watch(
+                path.parent, "packages", lambda name, db=path.name: name.startswith(db)
+            )
+        cache_dir = DOWNLOADER._get_cache_dir()
+        watcher.watch(
+            cache_dir,
+            "cache",
+            lambda name: name == CACHE_MANIFEST_FILE.name
+            or DOWNLOADER._version_from_cached_filename(name) is not None,
+        )
+        if watcher.start():
+            self._watcher = watcher
+
+    def _on_files_changed(self, labels: set[str]) -> None:
+        """Изменились база пакетов и/или кэш: обновить UpdateState и трэй."""
+        if "packages" in labels:
+            with timed_span("package_manager_probe"):
+                local = PACKAGE_MANAGER.get_local_version()
+            self.current_package_versions.set_local(local)
+            log_debug(f"files changed: local={local}")
+            self.cleanup_installed_version()
+        self._refresh_ready_package()
+        if self.current_package_versions.remote() and (
+            not self.current_package_versions.differ() or self.has_ready_package()
+        ):
+            # Обновление установлено или дистрибутив на месте: ошибка неактуальна
+            self._set_tray_error(False)
+        self.refresh_install_menu_visibility()
+
+    def start_periodic_checks(self, first_delay: float | None = None) -> None:
+        """
+        Запустить плановые проверки в долгоживущем процессе (tray).
+        При заданном [timing] spread слоты проверок сдвинуты на стабильный для хоста offset.
+        Тонкий клиент вместо этого раз в DAEMON_POLL_INTERVAL_SEC опрашивает службу.
+        С NativeIo проверки планируются таймером главного цикла GUI.
+        first_delay — пауза перед первой проверкой (отложенная проверка при запуске).
+        """
+        if self._native is not None:
+            native_io = self._native.native_io
+
+            def scheduled() -> None:
+                if self._stop_event.is_set():
+                    return
+                try:
+                    self.background_check()
+                except Exception as e:
+                    log_warn(f"periodic_checks: check failed: {e}")
+                schedule()
+
+            def schedule(delay: float | None = None) -> None:
+                if delay is None:
+                    delay = next_check_delay()
+                log_debug(f"periodic_checks: next check in {delay:.0f}s")
+                native_io.call_later(delay, scheduled)
+
+            schedule(first_delay)
+            return
+
+        def loop() -> None:
+            delay = first_delay
+            while True:
+                if delay is None:
+                    if self._daemon is not None:
+                        delay = DAEMON_POLL_INTERVAL_SEC
+                    else:
+                        delay = next_check_delay()
+                log_debug(f"periodic_checks: next check in {delay:.0f}s")
+                if self._stop_event.wait(delay):
+                    return
+                delay = None
+                try:
+                    self.background_check()
+                except Exception as e:
+                    log_warn(f"periodic_checks: check failed: {e}")
+
+        threading.Thread(target=loop, name="periodic-checks", daemon=True).start()
+
     def manual_check_and_notify(self) -> None:
         log_debug("manual_check_and_notify: starting manual check")
         GUI_BACKEND.show_tray_if_hidden()
-        package_versions = self.check_package_versions()
+        if self._native is not None:
+            self._check_versions_native(self._finish_manual_check)
+            return
+        if self._daemon is not None:
+            package_versions = self._refresh_from_daemon("check")
+        else:
+            package_versions = self.check_package_versions()
+        self._finish_manual_check(package_versions)
+
+    def _finish_manual_check(self, package_versions: PackageVersions) -> None:
         log_debug(f"manual_check_and_notify: package_versions={package_versions}")
         log_debug(
             f"manual_check_and_notify: state={json.dumps(self.state, ensure_ascii=False)}"
@@ -2888,7 +9649,10 @@ class UpdaterAppImpl(UpdaterApp):
         remote = package_versions.remote()
         if not remote:
             log_debug("manual_check_and_notify: remote check failed")
-            GUI_BACKEND.show_tray_message("Не удалось получить удалённую версию")
+            GUI_BACKEND.show_tray_message(
+                self._server_unavailable_message()
+                or "Не удалось получить удалённую версию"
+            )
             return
 
         differ = self.current_package_versions.differ()
@@ -2906,9 +9670,24 @@ class UpdaterAppImpl(UpdaterApp):
         self.download_update_async(force=True)
 
 
+_last_printed_progress = 0.0
+
+
+def print_download_progress(progress: DownloadProgress) -> None:
+    """Вывести ход скачивания в stdout (поле progress) и в лог для режима --check-only."""
+    global _last_printed_progress
+    now = time.monotonic()
+    if not progress.done and now - _last_printed_progress < PROGRESS_LOG_INTERVAL_SEC:
+        return
+    _last_printed_progress = now
+    print(f"progress: {json.dumps(progress.as_dict())}", flush=True)
+    log_debug(f"main: download progress: {progress.format()}")
+
+
 def main() -> None:
     log_debug(f"=== Starting {APPNAME} ===")
     log_debug(f"Session ID: {SESSION_ID}, PID: {os.getpid()}, Args: {sys.argv}")
+    atexit.register(log_timing_summary)
     launch_source = detect_launch_source()
     log_debug(
         f"Launch marker: pid={os.getpid()}, ppid={os.getppid()}, source={launch_source}"
@@ -2922,15 +9701,22 @@ def main() -> None:
     # Очистка старых файлов из кэша при периодических запусках
     try:
         DOWNLOADER.cleanup_old_cache_files()
+        if SHARED_CACHE is not None:
+            SHARED_CACHE.cleanup_old_cache_files()
         log_debug("main: cache cleanup completed")
     except Exception as e:
         log_debug(f"main: cache cleanup failed: {e}")
+    if "--fetch-all" in sys.argv:
+        sys.exit(fetch_all_platforms())
+    if "--export" in sys.argv:
+        sys.exit(export_cache_archive(_cli_option_value("--export")))
+    if "--import" in sys.argv:
+        sys.exit(import_cache_archive(_cli_option_value("--import")))
+    if "--serve" in sys.argv:
+        sys.exit(serve_cache())
+    if "--daemon" in sys.argv:
+        sys.exit(run_host_daemon())
     updater = UpdaterAppImpl()
-    updater.check_package_versions()
-    # Очищаем уже установленную версию из ignored_versions и remind_at
-    updater.cleanup_installed_version()
-    # Очищаем устаревшие remind_at для старых remote-версий
-    updater.cleanup_stale_state_versions()
 
     # Headless без GUI-сессии; при старте без DISPLAY/WAYLAND ждём появления сессии
     check_only_requested = "--check-only" in sys.argv
@@ -2941,6 +9727,31 @@ def main() -> None:
             "main: Qt session restore detected (-session), forcing lazy tray mode"
         )
 
+    # Запуск по таймеру: сдвигаем проверку (и следующее за ней скачивание),
+    # чтобы хосты, загрузившиеся одновременно, не шли на сервер разом
+    check_delay = startup_check_delay(launch_source, updater.thin_client)
+    # Трэй, который показывается всегда, не ждёт проверки: она пойдёт таймером.
+    # Ленивому трэю и headless нужен её результат, им остаётся только подождать
+    defer_check = (
+        check_delay > 0
+        and not check_only_requested
+        and not show_tray_lazily
+        and not isinstance(GUI_BACKEND, NoneGuiBackend)
+    )
+
+    def initial_check() -> None:
+        if check_delay > 0:
+            log_debug(f"main: per-host jitter, delaying check by {check_delay:.0f}s")
+            time.sleep(check_delay)
+        updater.check_package_versions()
+        # Очищаем уже установленную версию из ignored_versions и remind_at
+        updater.cleanup_installed_version()
+        # Очищаем устаревшие remind_at для старых remote-версий
+        updater.cleanup_stale_state_versions()
+
+    if not defer_check:
+        initial_check()
+
     if not IS_WINDOWS and not check_only_requested and not graphical_session_ready():
         log_debug(
             "main: no usable graphical session (DISPLAY/WAYLAND_DISPLAY), "
@@ -2952,13 +9763,17 @@ def main() -> None:
     check_only = check_only_requested or not has_display
     if check_only and not check_only_requested:
         log_debug("main: running in headless mode (graphical session unavailable)")
+        if defer_check:
+            # Сессия так и не появилась: отложенную до трэя проверку делаем сейчас
+            defer_check = False
+            initial_check()
 
     # Проверяем, доступен ли GUI бэкенд (не NoneGuiBackend)
     gui_available = not isinstance(GUI_BACKEND, NoneGuiBackend)
 
     if gui_available and not check_only:
-        # Проверяем, есть ли обновления
-        has_updates = updater.has_updates()
+        # Проверяем, есть ли обновления (отложенная проверка ещё не выполнялась)
+        has_updates = not defer_check and updater.has_updates()
         log_debug(
             f"main: has_updates={has_updates}, show_tray_lazily={show_tray_lazily}"
         )
@@ -2992,6 +9807,11 @@ def main() -> None:
 
         if has_updates:
             updater.download_update_async()
+        if defer_check:
+            log_debug(f"main: per-host jitter, first check in {check_delay:.0f}s")
+        updater.start_periodic_checks(check_delay if defer_check else None)
+        updater.start_watching()
+        start_peer_sharing()
 
         # Run appropriate main loop
         sys.exit(GUI_BACKEND.run_main_loop())
@@ -3005,7 +9825,22 @@ def main() -> None:
             if gui_launched:
                 msg = f"Доступно обновление {remote}\nGUI запущен в системном трее."
             else:
-                package_path = DOWNLOADER.download_package(remote) if remote else None
+                if updater.thin_client:
+                    package_path = updater.get_ready_package(remote)
+                elif remote:
+                    # Разовый запуск не ждёт: отложенное скачает следующий запуск
+                    decision = DOWNLOAD_POLICY.decide()
+                    if decision.action == PolicyDecision.DEFER:
+                        print("Download deferred:", decision.reason())
+                        package_path = None
+                    else:
+                        DOWNLOADER.set_rate_limit(decision.rate)
+                        package_path = DOWNLOADER.download_package(
+                            remote, progress_callback=print_download_progress
+                        )
+                else:
+                    package_path = None
+                METRICS_EXPORTER.write()
                 if package_path:
                     install_hint = PACKAGE_MANAGER.format_user_install_command(
                         package_path
@@ -3026,5 +9861,28 @@ def main() -> None:
             print("No update available.")
 
 
+def run_main() -> None:
+    """
+    Запустить main(); при заданной переменной CHROMIUM_GOST_UPDATER_PROFILE
+    выполнить его под cProfile и сохранить статистику рядом с LOG_FILE.
+    """
+    if os.environ.get(PROFILE_ENV_VAR, "").strip() in ("", "0"):
+        main()
+        return
+
+    import cProfile
+
+    stats_path = LOG_FILE.with_name(f"chromium-gost-updater-{SESSION_ID}.prof")
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(main)
+    finally:
+        try:
+            profiler.dump_stats(str(stats_path))
+            log_debug(f"run_main: profile stats saved to {stats_path}")
+        except Exception as e:
+            log_warn(f"run_main: failed to save profile stats: {e}")
+
+
 if __name__ == "__main__":
-    main()
+    run_main()
@@ -9,6 +9,8 @@ Release: %{release}%{?dist}
 License: Apache-2.0
 Group: Applications/System
 Source0: %{name}-%{version}.tar.gz
+# Пользователь службы: нужен до распаковки файлов пакета (скриптлет pre)
+Source1: %{name}.sysusers
 URL: https://github.com/alexvas/chromium-gost-updater
 BuildArch: noarch
 
@@ -35,6 +37,8 @@ Requires: systemd
 %install
 mkdir -p %{buildroot}/usr/bin
 mkdir -p %{buildroot}/usr/lib/systemd/user
+mkdir -p %{buildroot}/usr/lib/systemd/system
+mkdir -p %{buildroot}/usr/lib/sysusers.d
 mkdir -p %{buildroot}/usr/share/chromium-gost-updater
 mkdir -p %{buildroot}/usr/share/doc/%{name}
 
@@ -50,6 +54,8 @@ else
     chmod 644 %{buildroot}/usr/lib/systemd/user/chromium-gost-updater.service
 fi
 install -m 644 chromium-gost-remote.timer %{buildroot}/usr/lib/systemd/user/
+install -m 644 chromium-gost-updater-daemon.service %{buildroot}/usr/lib/systemd/system/
+install -m 644 chromium-gost-updater.sysusers %{buildroot}/usr/lib/sysusers.d/chromium-gost-updater.conf
 
 install -m 644 chromium-gost-logo.png %{buildroot}/usr/share/chromium-gost-updater/
 install -m 644 chromium-gost-updater.toml %{buildroot}/usr/share/chromium-gost-updater/
@@ -57,7 +63,24 @@ install -m 644 chromium-gost-updater.toml %{buildroot}/usr/share/chromium-gost-u
 install -m 644 README.md %{buildroot}/usr/share/doc/%{name}/
 install -m 644 NOTICE.txt %{buildroot}/usr/share/doc/%{name}/
 
+%pre
+# Пользователь системной службы (sysusers.d/chromium-gost-updater.conf).
+# До установки файлов пакета его ещё нет: строки подставляются при сборке
+# из Source1, как это делает макрос sysusers_create_compat
+if command -v systemd-sysusers >/dev/null 2>&1; then
+    systemd-sysusers - 2>/dev/null <<'EOF' || true
+%(cat %{SOURCE1})
+EOF
+fi
+
 %post
+# Системная служба (--daemon) по умолчанию выключена: её включает администратор
+# (README, «Системная служба»); уже включённую перезапускаем с новой версией
+if command -v systemctl >/dev/null 2>&1; then
+    systemctl daemon-reload 2>/dev/null || true
+    systemctl try-restart chromium-gost-updater-daemon.service 2>/dev/null || true
+fi
+
 # Выполняем команды systemctl для всех активных пользователей
 if command -v systemctl >/dev/null 2>&1 && command -v su >/dev/null 2>&1; then
     # Метод 1: Если установка через sudo, используем SUDO_USER (самый надёжный)
@@ -93,6 +116,11 @@ if command -v systemctl >/dev/null 2>&1 && command -v su >/dev/null 2>&1; then
     fi
 fi
 
+%preun
+if [ "$1" -eq 0 ] && command -v systemctl >/dev/null 2>&1; then
+    systemctl disable --now chromium-gost-updater-daemon.service 2>/dev/null || true
+fi
+
 %postun
 # Выполняем daemon-reload для всех активных пользователей
 if command -v systemctl >/dev/null 2>&1 && command -v su >/dev/null 2>&1; then
@@ -129,6 +157,8 @@ fi
 /usr/bin/chromium-gost-updater-wrapper.sh
 /usr/lib/systemd/user/chromium-gost-updater.service
 /usr/lib/systemd/user/chromium-gost-remote.timer
+/usr/lib/systemd/system/chromium-gost-updater-daemon.service
+/usr/lib/sysusers.d/chromium-gost-updater.conf
 /usr/share/chromium-gost-updater/chromium-gost-logo.png
 /usr/share/chromium-gost-updater/chromium-gost-updater.toml
 /usr/share/doc/%{name}/README.md
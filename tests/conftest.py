@@ -8,13 +8,122 @@ ROOT_DIR = Path(__file__).resolve().parents[1]
 SCRIPT_PATH = ROOT_DIR / "chromium-gost-updater.py"
 
 
-@pytest.fixture
-def updater():
-    """Load script module from file path (hyphenated filename)."""
-    spec = importlib.util.spec_from_file_location(
-        "chromium_gost_updater_under_test", SCRIPT_PATH
-    )
+def _load_script(module_name):
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPT_PATH)
     assert spec is not None and spec.loader is not None
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
     return module
+
+
+@pytest.fixture
+def updater():
+    """Load script module from file path (hyphenated filename)."""
+    return _load_script("chromium_gost_updater_under_test")
+
+
+@pytest.fixture
+def peer_updater():
+    """Independent second copy of the script module (another workstation)."""
+    return _load_script("chromium_gost_updater_peer_under_test")
+
+
+@pytest.fixture
+def point_cache(monkeypatch):
+    """
+    point_cache(module, cache_dir, state_file=None): перенаправить кэш пакетов
+    (и state.json, если задан) копии модуля во временный каталог.
+    """
+
+    def point(module, cache_dir, state_file=None):
+        monkeypatch.setattr(module, "CACHE_PACKAGES_DIR", cache_dir)
+        monkeypatch.setattr(module, "CACHE_MANIFEST_FILE", cache_dir / "cache.toml")
+        if state_file is not None:
+            monkeypatch.setattr(module, "STATE_FILE", state_file)
+        return cache_dir
+
+    return point
+
+
+@pytest.fixture
+def cache_dir(point_cache, updater, tmp_path):
+    """Кэш пакетов и state.json тестируемого модуля во временном каталоге."""
+    return point_cache(
+        updater, tmp_path / "cache" / "packages", tmp_path / "state.json"
+    )
+
+
+@pytest.fixture
+def http_server():
+    """Loopback HTTP server: routes maps path -> (status, headers, body)."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    routes: dict[str, tuple[int, dict[str, str], bytes]] = {}
+    requests: list[str] = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._respond(send_body=True)
+
+        def do_HEAD(self):
+            self._respond(send_body=False)
+
+        def _respond(self, send_body):
+            requests.append(self.path if send_body else f"HEAD {self.path}")
+            status, headers, body = routes.get(self.path, (404, {}, b""))
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.routes = routes
+    server.requests = requests
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def raw_server():
+    """TCP-сервер, отвечающий на каждое соединение функцией handler(conn, request)."""
+    import socket
+    import threading
+
+    listener = socket.create_server(("127.0.0.1", 0))
+    state = {"handler": None}
+
+    def loop():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            request = b""
+            while b"\r\n\r\n" not in request:
+                data = conn.recv(4096)
+                if not data:
+                    break
+                request += data
+            threading.Thread(
+                target=state["handler"], args=(conn, request), daemon=True
+            ).start()
+
+    threading.Thread(target=loop, daemon=True).start()
+    state["base_url"] = "http://127.0.0.1:%d" % listener.getsockname()[1]
+    try:
+        yield state
+    finally:
+        listener.close()
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+
+
+def _setup(monkeypatch, updater, cache_dir, raw_server, body, release):
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    monkeypatch.setattr(updater.CONFIG, "download_retries", lambda: 1)
+    half = len(body) // 2
+    sent = threading.Event()
+
+    def handler(conn, request):
+        with conn:
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body))
+            conn.sendall(body[:half])
+            sent.set()
+            release.wait(5)
+            conn.sendall(body[half:])
+
+    raw_server["handler"] = handler
+    monkeypatch.setattr(
+        updater.Downloader,
+        "_get_download_target",
+        lambda self, version, ext, base_url=None: (
+            f"{raw_server['base_url']}/pkg",
+            "chromium-gost-1.0-linux-amd64.deb",
+        ),
+    )
+    return cache_dir / "chromium-gost-1.0-linux-amd64.deb", sent
+
+
+def test_artifact_appears_only_after_validation(
+    monkeypatch, updater, cache_dir, raw_server
+):
+    body = bytes(range(256)) * (updater.MIN_ARTIFACT_SIZE // 64)
+    release = threading.Event()
+    dest, sent = _setup(monkeypatch, updater, cache_dir, raw_server, body, release)
+    part = dest.with_name(dest.name + ".part")
+    monkeypatch.setattr(updater.CONFIG, "download_durability", lambda: "full")
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(
+        updater.os, "fsync", lambda fd: synced.append(fd) or real_fsync(fd)
+    )
+    validated = []
+
+    def validate(path, ext):
+        validated.append((path, dest.exists(), path.read_bytes() == body))
+        return True
+
+    monkeypatch.setattr(updater, "validate_linux_package_file", validate)
+    result = []
+    worker = threading.Thread(
+        target=lambda: result.append(updater.Downloader().download_package("1.0"))
+    )
+    worker.start()
+    assert sent.wait(5)
+    try:
+        # Половина принята: место зарезервировано целиком, в кэше файла ещё нет
+        for _ in range(50):
+            if part.exists() and part.stat().st_size == len(body):
+                break
+            time.sleep(0.05)
+        assert part.stat().st_size == len(body)
+        assert not dest.exists()
+    finally:
+        release.set()
+        worker.join(10)
+
+    assert result == [dest]
+    assert validated == [(part, False, True)]
+    assert dest.read_bytes() == body and not part.exists()
+    # full: файл и каталог
+    assert len(synced) == 2
+
+
+def test_invalid_artifact_never_reaches_cache(
+    monkeypatch, updater, cache_dir, raw_server
+):
+    body = b"\x00" * (updater.MIN_ARTIFACT_SIZE * 2)
+    release = threading.Event()
+    release.set()
+    dest, _ = _setup(monkeypatch, updater, cache_dir, raw_server, body, release)
+    monkeypatch.setattr(updater, "validate_linux_package_file", lambda path, ext: False)
+
+    downloader = updater.Downloader()
+    assert downloader.download_package("1.0") is None
+
+    assert list(dest.parent.glob("chromium-gost-*")) == []
+    assert downloader._get_manifest_entry("1.0")["status"] == "error"
@@ -1,14 +1,6 @@
 from datetime import datetime, timedelta
 
 
-def _setup_cache_paths(monkeypatch, updater, tmp_path):
-    cache_dir = tmp_path / "cache" / "packages"
-    manifest_path = cache_dir / "cache.toml"
-    monkeypatch.setattr(updater, "CACHE_PACKAGES_DIR", cache_dir)
-    monkeypatch.setattr(updater, "CACHE_MANIFEST_FILE", manifest_path)
-    return cache_dir, manifest_path
-
-
 def _pkg_ext(updater):
     return updater.PACKAGE_MANAGER.get_extension()
 
@@ -17,8 +9,9 @@ def _pkg_filename(version, ext):
     return f"chromium-gost-{version}-linux-amd64.{ext}"
 
 
-def test_register_in_cache_writes_manifest_entry(monkeypatch, updater, tmp_path):
-    _setup_cache_paths(monkeypatch, updater, tmp_path)
+def test_register_in_cache_writes_manifest_entry(
+    monkeypatch, updater, tmp_path, cache_dir
+):
     downloader = updater.Downloader()
     ext = _pkg_ext(updater)
 
@@ -44,9 +37,8 @@ def test_register_in_cache_writes_manifest_entry(monkeypatch, updater, tmp_path)
 
 
 def test_get_valid_cached_package_marks_error_when_invalid(
-    monkeypatch, updater, tmp_path
+    monkeypatch, updater, cache_dir
 ):
-    cache_dir, _ = _setup_cache_paths(monkeypatch, updater, tmp_path)
     downloader = updater.Downloader()
     ext = _pkg_ext(updater)
 
@@ -77,9 +69,8 @@ def test_get_valid_cached_package_marks_error_when_invalid(
 
 
 def test_get_valid_cached_package_recovers_non_ok_status_when_valid(
-    monkeypatch, updater, tmp_path
+    monkeypatch, updater, cache_dir
 ):
-    cache_dir, _ = _setup_cache_paths(monkeypatch, updater, tmp_path)
     downloader = updater.Downloader()
     ext = _pkg_ext(updater)
 
@@ -108,8 +99,7 @@ def test_get_valid_cached_package_recovers_non_ok_status_when_valid(
     assert entry["failed_attempts"] == 0
 
 
-def test_cleanup_old_cache_files_removes_stale_entries(monkeypatch, updater, tmp_path):
-    cache_dir, _ = _setup_cache_paths(monkeypatch, updater, tmp_path)
+def test_cleanup_old_cache_files_removes_stale_entries(monkeypatch, updater, cache_dir):
     downloader = updater.Downloader()
     ext = _pkg_ext(updater)
 
@@ -154,9 +144,9 @@ def test_cleanup_old_cache_files_removes_stale_entries(monkeypatch, updater, tmp
 
 
 def test_rebuild_cache_manifest_if_missing_restores_from_files(
-    monkeypatch, updater, tmp_path
+    monkeypatch, updater, cache_dir
 ):
-    cache_dir, manifest_path = _setup_cache_paths(monkeypatch, updater, tmp_path)
+    manifest_path = cache_dir / "cache.toml"
     downloader = updater.Downloader()
     ext = _pkg_ext(updater)
 
@@ -191,9 +181,8 @@ def test_rebuild_cache_manifest_if_missing_restores_from_files(
 
 
 def test_rebuild_cache_manifest_if_missing_keeps_existing_packages(
-    monkeypatch, updater, tmp_path
+    monkeypatch, updater, cache_dir
 ):
-    cache_dir, _ = _setup_cache_paths(monkeypatch, updater, tmp_path)
     downloader = updater.Downloader()
     ext = _pkg_ext(updater)
 
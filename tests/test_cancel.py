@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+
+
+def test_cancel_keeps_partial_and_next_download_resumes(
+    monkeypatch, updater, cache_dir, raw_server
+):
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    monkeypatch.setattr(updater, "validate_linux_package_file", lambda path, ext: True)
+    body = bytes(range(256)) * (updater.MIN_ARTIFACT_SIZE // 64)
+    half = len(body) // 2
+    sent = threading.Event()
+    ranges = []
+    etag = [b'"v1"']
+
+    def handler(conn, request):
+        with conn:
+            match = re.search(rb"Range: bytes=(\d+)-", request)
+            if_range = re.search(rb"If-Range: (.+)\r\n", request)
+            if match and if_range and if_range.group(1) == etag[0]:
+                offset = int(match.group(1))
+                ranges.append(offset)
+                conn.sendall(
+                    b"HTTP/1.1 206 Partial Content\r\n"
+                    b"Content-Range: bytes %d-%d/%d\r\n"
+                    b"Content-Length: %d\r\n\r\n"
+                    % (offset, len(body) - 1, len(body), len(body) - offset)
+                    + body[offset:]
+                )
+                return
+            conn.sendall(
+                b"HTTP/1.1 200 OK\r\nETag: %s\r\nContent-Length: %d\r\n\r\n"
+                % (etag[0], len(body))
+            )
+            if match:
+                # If-Range не совпал: файл на сервере уже другой
+                ranges.append(None)
+                conn.sendall(body)
+                return
+            conn.sendall(body[:half])
+            sent.set()
+            time.sleep(10)
+
+    raw_server["handler"] = handler
+    monkeypatch.setattr(
+        updater.Downloader,
+        "_get_download_target",
+        lambda self, version, ext, base_url=None: (
+            f"{raw_server['base_url']}/pkg",
+            "chromium-gost-1.0-linux-amd64.deb",
+        ),
+    )
+    downloader = updater.Downloader()
+    cancel = updater.CancelToken()
+    cancelled_at = []
+
+    def press_cancel():
+        sent.wait(5)
+        time.sleep(0.2)
+        cancelled_at.append(time.monotonic())
+        cancel.cancel()
+
+    threading.Thread(target=press_cancel).start()
+    assert downloader.download_package("1.0", cancel=cancel) is None
+    assert time.monotonic() - cancelled_at[0] < 1
+
+    dest = cache_dir / "chromium-gost-1.0-linux-amd64.deb"
+    part = cache_dir / "chromium-gost-1.0-linux-amd64.deb.part"
+    assert not dest.exists()
+    assert part.read_bytes() == body[:half]
+    assert (cache_dir / (part.name + ".validator")).read_text() == '"v1"\n'
+    assert downloader._get_manifest_entry("1.0")["status"] == "partial"
+    assert downloader.get_failed_attempts("1.0") == 0
+
+    # Докачка: запрашивается только остаток
+    assert downloader.download_package("1.0") == dest
+    assert ranges == [half]
+    assert dest.read_bytes() == body
+    assert not part.exists()
+    assert not (cache_dir / (part.name + ".validator")).exists()
+    assert downloader._get_manifest_entry("1.0")["status"] == "ok"
+
+    # Файл на сервере сменился после обрыва: If-Range не совпал, скачивается заново
+    part.write_bytes(b"\xff" * half)
+    (cache_dir / (part.name + ".validator")).write_text('"v0"\n')
+    dest.unlink()
+    assert downloader.download_package("1.0", force=True) == dest
+    assert ranges == [half, None]
+    assert dest.read_bytes() == body
+
+
+def test_cancel_token_follows_parents_until_closed(updater):
+    shutdown, menu = updater.CancelToken(), updater.CancelToken()
+    token = updater.CancelToken(shutdown, menu, None)
+    calls = []
+    remove = token.on_cancel(lambda: calls.append("removed"))
+    token.on_cancel(lambda: calls.append("abort"))
+    remove()
+
+    menu.cancel()
+    assert token.is_set() and token.wait(0)
+    assert not shutdown.is_set()
+    assert calls == ["abort"]
+    # Обработчик, добавленный после отмены, вызывается сразу
+    token.on_cancel(lambda: calls.append("late"))
+    assert calls == ["abort", "late"]
+
+    # Завершённая операция отвязывается от родителей
+    finished = updater.CancelToken(shutdown)
+    finished.close()
+    shutdown.cancel()
+    assert not finished.is_set()
@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+def _setup(monkeypatch, updater, tmp_path):
+    monkeypatch.setattr(updater, "STATE_FILE", tmp_path / "state.json")
+    monkeypatch.setattr(updater.CONFIG, "circuit_breaker_failure_threshold", lambda: 2)
+    monkeypatch.setattr(updater.CONFIG, "circuit_breaker_open_seconds", lambda: 100)
+    monkeypatch.setattr(updater.CONFIG, "circuit_breaker_max_open_seconds", lambda: 300)
+
+
+def test_circuit_opens_after_threshold_and_probes_once(monkeypatch, updater, tmp_path):
+    _setup(monkeypatch, updater, tmp_path)
+    now = {"value": 1000.0}
+    breaker = updater.CircuitBreaker("example.org", clock=lambda: now["value"])
+
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state() == "open"
+    assert breaker.retry_at() == 1100.0
+    assert not breaker.allow_request()
+
+    now["value"] = 1101.0
+    assert breaker.allow_request()
+    assert breaker.state() == "half_open"
+    # Пока проба выполняется, остальные запросы отклоняются
+    assert not breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state() == "open"
+    assert breaker.retry_at() == 1101.0 + 200
+
+    now["value"] = 1400.0
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state() == "closed"
+    assert breaker.allow_request()
+
+
+def test_circuit_state_persists_in_state_file(monkeypatch, updater, tmp_path):
+    _setup(monkeypatch, updater, tmp_path)
+    for _ in range(2):
+        updater.CircuitBreaker("example.org").record_failure()
+
+    state = updater.load_state()
+    assert state["circuit_breakers"]["example.org"]["state"] == "open"
+    assert not updater.CircuitBreaker("example.org").allow_request()
+
+
+def test_get_remote_version_fails_fast_when_open(
+    monkeypatch, updater, tmp_path, http_server
+):
+    _setup(monkeypatch, updater, tmp_path)
+    url = f"{http_server.base_url}/version"
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", http_server.base_url)
+    http_server.routes["/version"] = (503, {}, b"")
+    downloader = updater.Downloader()
+
+    assert downloader.get_remote_version() is None
+    assert downloader.get_remote_version() is None
+    assert downloader.get_remote_version() is None
+
+    assert http_server.requests == ["/version", "/version"]
+    assert downloader.circuit_retry_at(url) is not None
+
+
+def test_only_one_process_gets_the_probe(monkeypatch, updater, peer_updater, tmp_path):
+    # Две копии модуля — трэй и демон: общий у них только state.json
+    for module in (updater, peer_updater):
+        _setup(monkeypatch, module, tmp_path)
+    breaker = updater.CircuitBreaker("example.org", clock=lambda: 1000.0)
+    breaker.record_failure()
+    breaker.record_failure()
+
+    for module in (updater, peer_updater):
+        # Медленное чтение расширяет окно гонки между чтением и записью
+        real_load_state = module.load_state
+        monkeypatch.setattr(
+            module,
+            "load_state",
+            lambda real=real_load_state: (real(), time.sleep(0.02))[0],
+        )
+    barrier = threading.Barrier(8)
+    granted = []
+
+    def probe(module):
+        peer = module.CircuitBreaker("example.org", clock=lambda: 1200.0)
+        barrier.wait(5)
+        granted.append(peer.allow_request())
+
+    workers = [
+        threading.Thread(target=probe, args=(module,))
+        for module in (updater, peer_updater) * 4
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+
+    assert sorted(granted) == [False] * 7 + [True]
+    assert breaker.state() == "half_open"
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def host_daemon(monkeypatch, updater, tmp_path, cache_dir):
+    monkeypatch.setattr(updater, "METRICS_EXPORTER", updater.MetricsExporter())
+    socket_path = tmp_path / "daemon.sock"
+    monkeypatch.setattr(updater.CONFIG, "daemon_socket", lambda: socket_path)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_local_version", lambda: "1.0")
+
+    shared = updater.SharedCache(tmp_path / "shared")
+    package = tmp_path / "shared" / "chromium-gost-2.0-linux-amd64.deb"
+    monkeypatch.setattr(shared, "get_remote_version", lambda: "2.0")
+    monkeypatch.setattr(shared, "get_valid_cached_package", lambda version: None)
+
+    def download_package(version, progress_callback=None, cancel=None):
+        package.parent.mkdir(parents=True, exist_ok=True)
+        package.write_bytes(b"deb")
+        return package
+
+    monkeypatch.setattr(shared, "download_package", download_package)
+    idle = dict.fromkeys(("metered", "on_battery", "load", "pressure"), lambda: None)
+    monkeypatch.setattr(updater, "DOWNLOAD_POLICY", updater.DownloadPolicy(idle))
+    daemon = updater.HostDaemon(shared, socket_path)
+    daemon.start()
+    try:
+        yield daemon, package
+    finally:
+        daemon.stop()
+
+
+def test_daemon_publishes_check_result(updater, host_daemon):
+    daemon, package = host_daemon
+    daemon.check()
+    daemon.join_download(5)
+
+    state = updater.DaemonClient(daemon.socket_path).request("state")
+
+    assert state["local"] == "1.0" and state["remote"] == "2.0"
+    assert state["status"] == "ready"
+    assert state["package"] == str(package)
+
+
+def test_tray_is_thin_client_of_daemon(monkeypatch, updater, host_daemon):
+    daemon, package = host_daemon
+    daemon.check()
+    daemon.join_download(5)
+
+    def no_probe():
+        raise AssertionError("thin client must not query the package manager")
+
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_local_version", no_probe)
+    monkeypatch.setattr(updater.DOWNLOADER, "get_remote_version", no_probe)
+    app = updater.UpdaterAppImpl()
+    versions = app.check_package_versions()
+
+    assert app.thin_client
+    assert (versions.local(), versions.remote()) == ("1.0", "2.0")
+    assert app.get_ready_package() == package
+
+
+def test_client_checks_are_coalesced_and_rate_limited(
+    monkeypatch, updater, host_daemon
+):
+    daemon, _ = host_daemon
+    shared = daemon._HostDaemon__downloader
+    calls = []
+    release = threading.Event()
+
+    def get_remote_version():
+        calls.append(1)
+        release.wait(5)
+        return "2.0"
+
+    monkeypatch.setattr(shared, "get_remote_version", get_remote_version)
+    client = updater.DaemonClient(daemon.socket_path)
+    replies = []
+    clients = [
+        threading.Thread(target=lambda: replies.append(client.request("check")))
+        for _ in range(10)
+    ]
+    for thread in clients:
+        thread.start()
+    time.sleep(0.3)
+    release.set()
+    for thread in clients:
+        thread.join(5)
+
+    # Десять клиентов разом — одна проверка; повторный запрос берёт её итог
+    assert len(calls) == 1
+    assert len(replies) == 10 and all(r["remote"] == "2.0" for r in replies)
+    assert client.request("check")["remote"] == "2.0"
+    assert len(calls) == 1
+
+    monkeypatch.setattr(updater.CONFIG, "schedule_recheck_interval", lambda: 0)
+    client.request("check")
+    assert len(calls) == 2
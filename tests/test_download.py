@@ -0,0 +1,100 @@
+def _serve_artifact(monkeypatch, updater, http_server, body):
+    http_server.routes["/pkg"] = (
+        200,
+        {"Content-Type": "application/octet-stream"},
+        body,
+    )
+    monkeypatch.setattr(
+        updater.Downloader,
+        "_get_download_target",
+        lambda self, version, ext, base_url=None: (
+            f"{http_server.base_url}/pkg",
+            f"chromium-gost-{version}-linux-amd64.{ext}",
+        ),
+    )
+
+
+def test_download_package_streams_and_reports_progress(
+    monkeypatch, updater, cache_dir, http_server
+):
+    body = b"\x00" * (updater.MIN_ARTIFACT_SIZE * 3)
+    _serve_artifact(monkeypatch, updater, http_server, body)
+    monkeypatch.setattr(updater, "validate_artifact", lambda *args: True)
+
+    reports = []
+    downloader = updater.Downloader()
+    path = downloader.download_package("1.0", progress_callback=reports.append)
+
+    assert path is not None and path.parent == cache_dir
+    assert path.read_bytes() == body
+    assert reports and reports[-1].done
+    assert reports[-1].received == len(body)
+    assert reports[-1].total == len(body)
+    assert downloader.last_download_stats["bytes"] == len(body)
+    assert len(updater.NETWORK_STATS.throughput_history()) == 1
+
+
+def test_transfer_monitor_throttles_callbacks(updater):
+    reports = []
+    monitor = updater.TransferMonitor(1000, reports.append)
+    for _ in range(100):
+        monitor.on_chunk(10)
+    monitor.finish()
+
+    assert len(reports) <= 3
+    assert reports[-1].done and reports[-1].received == 1000
+
+
+def test_download_progress_format(updater):
+    progress = updater.DownloadProgress(
+        received=5 * 1024 * 1024, total=10 * 1024 * 1024, rate=1024 * 1024, eta=65
+    )
+    assert progress.format() == "5.0 из 10.0 МБ, 1.0 МБ/с, осталось ~1:05"
+
+
+def test_app_state_save_keeps_network_section(monkeypatch, updater, cache_dir):
+    app = updater.UpdaterAppImpl()
+    updater.NETWORK_STATS.record_throughput(1000, 1.0)
+
+    app.current_package_versions.set_remote("2.0")
+    app.mark_ignored()
+
+    state = updater.load_state()
+    assert state["ignored_versions"] == ["2.0"]
+    assert len(state["network"]["throughput_history"]) == 1
+
+
+def test_stall_detector_tolerates_slow_but_progressing_transfer(updater):
+    detector = updater.StallDetector(min_rate=100, window=10, now=0.0)
+    received = 0
+    for second in range(1, 60):
+        received += 150
+        detector.check(received, now=float(second))
+
+
+def test_stall_detector_raises_when_window_rate_too_low(updater):
+    import pytest
+
+    detector = updater.StallDetector(min_rate=100, window=10, now=0.0)
+    detector.check(5000, now=1.0)
+    with pytest.raises(updater.DownloadStalledError):
+        for second in range(2, 30):
+            detector.check(5000 + second, now=float(second))
+
+
+def test_timeouts_derive_from_network_history(monkeypatch, updater, cache_dir):
+    stats = updater.NetworkStats()
+    assert stats.connect_timeout() == updater.DEFAULT_CONNECT_TIMEOUT_SEC
+    assert stats.read_timeout() == updater.DEFAULT_READ_TIMEOUT_SEC
+
+    for _ in range(5):
+        stats.record_rtt(0.05)
+        stats.record_throughput(10 * 1024 * 1024, 1.0)
+    assert stats.connect_timeout() == updater.CONNECT_TIMEOUT_BOUNDS_SEC[0]
+    assert stats.read_timeout() == updater.READ_TIMEOUT_BOUNDS_SEC[0]
+
+    for _ in range(20):
+        stats.record_rtt(2.0)
+        stats.record_throughput(2048, 1.0)
+    assert stats.connect_timeout() == 10.0
+    assert stats.read_timeout() == updater.READ_TIMEOUT_BOUNDS_SEC[1]
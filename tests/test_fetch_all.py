@@ -0,0 +1,145 @@
+import hashlib
+import time
+
+
+def _pe_body(updater):
+    body = bytearray(updater.MIN_ARTIFACT_SIZE * 2)
+    body[:2] = b"MZ"
+    body[0x3C:0x40] = (0x80).to_bytes(4, "little")
+    body[0x80:0x84] = b"PE\x00\x00"
+    return bytes(body)
+
+
+def _setup(monkeypatch, updater, cache_dir, http_server):
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", http_server.base_url)
+    monkeypatch.setattr(updater.CONFIG, "mirror_urls", lambda: [])
+    monkeypatch.setattr(updater.CONFIG, "download_retries", lambda: 1)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    monkeypatch.setattr(
+        updater,
+        "validate_linux_package_file",
+        lambda path, ext: path.read_bytes()[:4] == ext.encode().ljust(4, b"\0"),
+    )
+    http_server.routes["/version"] = (200, {}, b"1.0")
+    linux = "/linux/amd64/chromium-gost-1.0-linux-amd64"
+    http_server.routes[f"{linux}.deb"] = (200, {}, b"deb\0" * updater.MIN_ARTIFACT_SIZE)
+    http_server.routes[f"{linux}.rpm"] = (200, {}, b"rpm\0" * updater.MIN_ARTIFACT_SIZE)
+    http_server.routes["/windows/386/installer"] = (200, {}, _pe_body(updater))
+
+
+def test_fetch_all_downloads_every_platform(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    downloader = updater.Downloader()
+
+    report = downloader.fetch_all()
+
+    assert {p: r["status"] for p, r in report.items()} == {
+        "deb": "ok",
+        "rpm": "ok",
+        "exe": "ok",
+    }
+    assert report["exe"]["file"] == "chromium-gost-1.0-installer.exe"
+    platforms = downloader._load_cache_manifest()["platforms"]["1.0"]
+    assert set(platforms) == {"deb", "rpm", "exe"}
+    assert all(entry["status"] == "ok" and entry["sha256"] for entry in platforms.values())
+    # Своя платформа записана и в packages: её видят трэй и --serve
+    assert downloader.get_valid_cached_package("1.0") == cache_dir / report["deb"]["file"]
+    assert set(downloader.platform_artifacts()) == {
+        ("1.0", "deb"),
+        ("1.0", "rpm"),
+        ("1.0", "exe"),
+    }
+
+    # Повторный запуск берёт всё из кэша
+    http_server.requests.clear()
+    report = downloader.fetch_all("1.0")
+    assert {r["source"] for r in report.values()} == {"cache"}
+    assert http_server.requests == []
+
+
+def test_fetch_all_reports_invalid_artifact(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    http_server.routes["/windows/386/installer"] = (200, {}, b"\0" * 300000)
+
+    downloader = updater.Downloader()
+    report = downloader.fetch_all("1.0")
+
+    assert report["exe"]["status"] == "error"
+    assert report["rpm"]["status"] == "ok"
+    entry = downloader._load_cache_manifest()["platforms"]["1.0"]["exe"]
+    assert entry["status"] == "error"
+    assert "sha256" not in entry
+
+
+def test_fetch_platform_does_not_wait_when_all_circuits_open(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    monkeypatch.setattr(updater.CONFIG, "download_retries", lambda: 3)
+
+    async def circuit_open(self, url, timeout, method=None, headers=None):
+        raise updater.CircuitOpenError("example.org", time.time() + 60)
+
+    monkeypatch.setattr(updater.Downloader, "_open_url", circuit_open)
+    waits = []
+    monkeypatch.setattr(
+        updater.RetryScheduler, "wait", lambda self, delay: waits.append(delay)
+    )
+
+    downloader = updater.Downloader()
+    assert downloader.fetch_platform("1.0", "rpm") == (None, "error")
+
+    # Попытка не засчитана, паузы между попытками не было
+    assert waits == []
+    assert "platforms" not in downloader._load_cache_manifest()
+
+
+def test_fetch_platform_counts_failed_attempts(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    monkeypatch.setattr(updater.CONFIG, "download_retries", lambda: 2)
+    monkeypatch.setattr(updater, "DOWNLOAD_RETRY_BASE_DELAY_SEC", 0)
+    rpm = "/linux/amd64/chromium-gost-1.0-linux-amd64.rpm"
+    http_server.routes[rpm] = (500, {}, b"")
+
+    downloader = updater.Downloader()
+    assert downloader.fetch_platform("1.0", "rpm") == (None, "error")
+    entry = downloader._load_cache_manifest()["platforms"]["1.0"]["rpm"]
+    assert entry["status"] == "error" and entry["failed_attempts"] == 2
+    assert entry["file"] == "chromium-gost-1.0-linux-amd64.rpm"
+    assert http_server.requests.count(rpm) == 2
+
+    # Попытки исчерпаны: сервер больше не запрашивается
+    http_server.requests.clear()
+    assert downloader.fetch_platform("1.0", "rpm") == (None, "error")
+    assert http_server.requests == []
+
+
+def test_cancelled_fetch_platform_is_not_recorded_as_error(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    downloader = updater.Downloader()
+    downloader.shutdown()
+
+    assert downloader.fetch_platform("1.0", "rpm") == (None, "error")
+    assert "platforms" not in downloader._load_cache_manifest()
+
+
+def test_redownloaded_artifact_of_same_size_is_rehashed(updater, cache_dir):
+    cache_dir.mkdir(parents=True)
+    path = cache_dir / "chromium-gost-1.0-linux-amd64.rpm"
+    downloader = updater.Downloader()
+
+    path.write_bytes(b"\x01" * 1024)
+    first = downloader._register_platform("1.0", "rpm", path, "ok")
+    path.write_bytes(b"\x02" * 1024)
+    second = downloader._register_platform("1.0", "rpm", path, "ok")
+
+    assert first["size"] == second["size"]
+    assert second["sha256"] == hashlib.sha256(b"\x02" * 1024).hexdigest()
@@ -0,0 +1,184 @@
+import tarfile
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def use_cache(point_cache, updater, tmp_path):
+    """use_cache(name): Downloader с кэшем в tmp_path / name (источник или цель)."""
+
+    def use(name):
+        point_cache(updater, tmp_path / name, tmp_path / "state.json")
+        return updater.Downloader()
+
+    return use
+
+
+def _setup(monkeypatch, updater, use_cache):
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    validated = []
+
+    def validate(path, ext):
+        validated.append(path.name)
+        return path.read_bytes()[:1] != b"!"
+
+    monkeypatch.setattr(updater, "validate_artifact", validate)
+    source = use_cache("source")
+    deb = source._get_cache_dir() / "chromium-gost-2.0-linux-amd64.deb"
+    rpm = source._get_cache_dir() / "chromium-gost-2.0-linux-amd64.rpm"
+    deb.parent.mkdir(parents=True, exist_ok=True)
+    deb.write_bytes(b"\x01" * updater.MIN_ARTIFACT_SIZE)
+    rpm.write_bytes(b"\x02" * updater.MIN_ARTIFACT_SIZE)
+    source._register_in_cache("2.0", deb.name, deb, "ok", failed_attempts=0)
+    source._register_platform("2.0", "rpm", rpm, "ok")
+    return source, validated
+
+
+def test_export_then_import_restores_cache_and_skips_known(
+    monkeypatch, updater, tmp_path, use_cache
+):
+    source, validated = _setup(monkeypatch, updater, use_cache)
+    archive = tmp_path / "usb" / "cache.tar"
+    archive.parent.mkdir()
+    assert source.export_cache(archive) == [
+        "chromium-gost-2.0-linux-amd64.deb",
+        "chromium-gost-2.0-linux-amd64.rpm",
+    ]
+    with tarfile.open(archive) as tar:
+        assert tar.getnames()[0] == "cache.toml"
+    expected = source._load_cache_manifest()
+
+    target = use_cache("target")
+    assert target.import_cache(archive) == {"imported": 2, "skipped": 0, "failed": 0}
+    # Проверяется .part: под своим именем файл появляется только после проверки
+    assert sorted(validated) == [
+        "chromium-gost-2.0-linux-amd64.deb.part",
+        "chromium-gost-2.0-linux-amd64.rpm.part",
+    ]
+    manifest = target._load_cache_manifest()
+    for section in ("packages", "platforms"):
+        assert {
+            version: {k: v for k, v in info.items() if k != "downloaded_at"}
+            for version, info in manifest[section].items()
+        } == {
+            version: {k: v for k, v in info.items() if k != "downloaded_at"}
+            for version, info in expected[section].items()
+        }
+    assert target.cached_artifacts() == {
+        "2.0": target._get_cache_dir() / "chromium-gost-2.0-linux-amd64.deb"
+    }
+
+    # Повторный импорт: всё уже в кэше, файлы даже не проверяются
+    validated.clear()
+    assert target.import_cache(archive) == {"imported": 0, "skipped": 2, "failed": 0}
+    assert validated == []
+
+
+def test_import_from_directory_rejects_invalid_files(
+    monkeypatch, updater, tmp_path, use_cache
+):
+    _setup(monkeypatch, updater, use_cache)
+    usb = tmp_path / "usb"
+    usb.mkdir()
+    (usb / "chromium-gost-3.0-linux-amd64.deb").write_bytes(
+        b"\x03" * updater.MIN_ARTIFACT_SIZE
+    )
+    (usb / "chromium-gost-3.1-linux-amd64.deb").write_bytes(
+        b"!" * updater.MIN_ARTIFACT_SIZE
+    )
+    (usb / "notes.txt").write_text("readme")
+
+    target = use_cache("target")
+    assert target.import_cache(usb) == {"imported": 1, "skipped": 0, "failed": 1}
+    cache_dir = target._get_cache_dir()
+    assert sorted(p.name for p in cache_dir.iterdir() if p.suffix != ".lock") == [
+        "cache.toml",
+        "chromium-gost-3.0-linux-amd64.deb",
+    ]
+    entry = target._get_manifest_entry("3.0")
+    assert entry["status"] == "ok" and entry["size"] == updater.MIN_ARTIFACT_SIZE
+    assert target._get_manifest_entry("3.1") is None
+
+
+def test_truncated_archive_keeps_validated_files(
+    monkeypatch, updater, tmp_path, use_cache
+):
+    source, _ = _setup(monkeypatch, updater, use_cache)
+    archive = tmp_path / "cache.tar"
+    source.export_cache(archive)
+    # Обрываем архив посреди второго файла (rpm)
+    data = archive.read_bytes()
+    archive.write_bytes(data[: len(data) - updater.MIN_ARTIFACT_SIZE // 2 - 10240])
+
+    target = use_cache("target")
+    with pytest.raises((OSError, tarfile.TarError)):
+        target.import_cache(archive)
+
+    cache_dir = target._get_cache_dir()
+    assert sorted(p.name for p in cache_dir.iterdir() if p.suffix != ".lock") == [
+        "cache.toml",
+        "chromium-gost-2.0-linux-amd64.deb",
+    ]
+    assert target._get_manifest_entry("2.0")["status"] == "ok"
+
+
+def test_preallocation_capped_at_member_size(
+    monkeypatch, updater, tmp_path, use_cache
+):
+    _setup(monkeypatch, updater, use_cache)
+    usb = tmp_path / "usb"
+    usb.mkdir()
+    name = "chromium-gost-3.0-linux-amd64.deb"
+    (usb / name).write_bytes(b"\x03" * updater.MIN_ARTIFACT_SIZE)
+    # Манифест источника не доверенный: заявленный размер не резервируется
+    manifest = {"packages": {"3.0": {"file": name, "status": "ok", "size": 10**12}}}
+    (usb / "cache.toml").write_text(updater._serialize_cache_manifest(manifest))
+    reserved = []
+    monkeypatch.setattr(
+        updater, "_preallocate", lambda f, offset, size: reserved.append(size)
+    )
+
+    target = use_cache("target")
+    assert target.import_cache(usb)["imported"] == 1
+
+    assert reserved == [updater.MIN_ARTIFACT_SIZE]
+
+
+def test_registrations_from_two_processes_are_not_lost(
+    monkeypatch, updater, peer_updater, point_cache, tmp_path
+):
+    # Две копии модуля — как --import и трэй в разных процессах: общий только
+    # flock на .cache.toml.lock
+    cache = tmp_path / "cache"
+    downloaders = []
+    for module, prefix in ((updater, "1"), (peer_updater, "2")):
+        point_cache(module, cache, tmp_path / f"state-{prefix}.json")
+        real_load = module.Downloader._load_cache_manifest
+
+        def slow_load(self, real_load=real_load):
+            manifest = real_load(self)
+            time.sleep(0.005)
+            return manifest
+
+        monkeypatch.setattr(module.Downloader, "_load_cache_manifest", slow_load)
+        downloaders.append((module.Downloader(), prefix))
+    cache.mkdir(parents=True)
+
+    def register(downloader, prefix):
+        for minor in range(10):
+            version = f"{prefix}.{minor}"
+            path = cache / f"chromium-gost-{version}-linux-amd64.deb"
+            path.write_bytes(b"\x01")
+            downloader._register_in_cache(version, path.name, path, "ok")
+
+    workers = [threading.Thread(target=register, args=item) for item in downloaders]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+
+    packages = updater.Downloader()._load_cache_manifest()["packages"]
+    assert len(packages) == 20
+    assert not list(cache.glob(".cache.toml.*.tmp"))
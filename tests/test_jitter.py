@@ -0,0 +1,64 @@
+import threading
+import uuid
+from collections import Counter
+
+
+def test_host_offset_is_stable_and_within_spread(updater):
+    offsets = {updater.host_offset(3600, host_id="abc") for _ in range(5)}
+    assert len(offsets) == 1
+    assert 0 <= offsets.pop() < 3600
+    assert updater.host_offset(0, host_id="abc") == 0
+    assert updater.host_offset(3600, "check", "abc") != updater.host_offset(
+        3600, "check", "abd"
+    )
+
+
+def test_seconds_until_next_slot_aligns_to_offset(updater):
+    assert updater.seconds_until_next_slot(1000.0, 3600, 100) == 2700.0
+    assert updater.seconds_until_next_slot(3700.0, 3600, 100) == 3600.0
+    assert updater.seconds_until_next_slot(3699.0, 3600, 100) == 1.0
+
+
+def test_fleet_load_is_flattened_by_spread(updater):
+    """Парк из 5000 хостов, загрузившихся в 9:00: запросы по минутам."""
+    hosts = [uuid.uuid4().hex for _ in range(5000)]
+    boot = 9 * 3600
+    timer_delay = 5 * 60
+
+    def max_per_minute(spread):
+        starts = Counter(
+            int((boot + timer_delay + updater.host_offset(spread, host_id=h)) // 60)
+            for h in hosts
+        )
+        return max(starts.values())
+
+    assert max_per_minute(0) == len(hosts)
+    flattened = max_per_minute(3600)
+    average = len(hosts) / 60
+    assert flattened < 2 * average
+
+
+def test_startup_delay_only_for_timer_launch_without_daemon(monkeypatch, updater):
+    monkeypatch.setattr(updater.CONFIG, "timing_spread", lambda: 3600)
+    delay = updater.startup_check_delay("systemd-user-service", thin_client=False)
+    assert 0 <= delay < 3600
+    assert delay == updater.host_offset(3600)
+    # Тонкий клиент на сервер не ходит: ждать ему незачем
+    assert updater.startup_check_delay("systemd-user-service", thin_client=True) == 0
+    assert updater.startup_check_delay("terminal", thin_client=False) == 0
+    monkeypatch.setattr(updater.CONFIG, "timing_spread", lambda: 0)
+    assert updater.startup_check_delay("systemd-user-service", thin_client=False) == 0
+
+
+def test_first_periodic_check_runs_after_startup_delay(monkeypatch, updater, cache_dir):
+    monkeypatch.setattr(updater, "next_check_delay", lambda: 3600.0)
+    app = updater.UpdaterAppImpl()
+    checked = threading.Event()
+    monkeypatch.setattr(app, "background_check", checked.set)
+
+    app.start_periodic_checks(first_delay=0.05)
+    try:
+        # Первая проверка — через first_delay, а не через обычный интервал
+        assert checked.wait(5)
+    finally:
+        app._stop_event.set()
@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+
+
+def test_low_impact_thread_gets_idle_io_class_and_nice(monkeypatch, updater):
+    if updater._ioprio_call(1) is None:
+        pytest.skip("ioprio_get unavailable")
+    monkeypatch.setattr(updater.CONFIG, "io_low_impact", lambda: True)
+    seen = {}
+
+    def worker():
+        previous, nice = updater._ioprio_call(1), os.nice(0)
+        with updater.low_impact_io("test"):
+            seen["inside"] = updater._ioprio_call(1)
+            seen["nice"] = os.nice(0) - nice
+        seen["restored"] = updater._ioprio_call(1) == previous
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join(5)
+
+    assert seen["inside"] == updater.IOPRIO_IDLE
+    assert seen["restored"]
+    assert seen["nice"] == min(updater.LOW_IMPACT_NICE, 19 - (os.nice(0)))
+
+
+def test_download_leaves_no_pages_behind_and_reports_io(
+    monkeypatch, updater, cache_dir, http_server
+):
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", f"{http_server.base_url}/primary")
+    monkeypatch.setattr(updater.CONFIG, "mirror_urls", lambda: [])
+    monkeypatch.setattr(updater.CONFIG, "io_low_impact", lambda: True)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    monkeypatch.setattr(updater, "validate_linux_package_file", lambda path, ext: True)
+    monkeypatch.setattr(updater, "PAGE_CACHE_DROP_BYTES", 256 * 1024)
+    body = b"\x01" * (1024 * 1024 + 100)
+    http_server.routes["/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"] = (
+        200,
+        {},
+        body,
+    )
+    dropped, messages = [], []
+    real_fadvise = os.posix_fadvise
+
+    threads = set()
+
+    def fadvise(fd, offset, length, advice):
+        if advice == os.POSIX_FADV_DONTNEED:
+            dropped.append((offset, length))
+            threads.add(threading.current_thread().name)
+        real_fadvise(fd, offset, length, advice)
+
+    monkeypatch.setattr(os, "posix_fadvise", fadvise)
+    monkeypatch.setattr(updater, "log_debug", messages.append)
+
+    path = updater.Downloader().download_package("1.0")
+
+    assert path is not None and path.read_bytes() == body
+    # Записанное уходит из page cache кусками подряд, от начала до конца файла
+    download_ranges = dropped[: len(dropped) - 1]
+    assert len(download_ranges) >= 4
+    position = 0
+    for offset, length in download_ranges:
+        assert offset == position
+        position += length
+    assert position == len(body)
+    # fdatasync не останавливает цикл событий, где идут все передачи
+    assert "network-loop" not in threads
+    # После подсчёта SHA-256 файл целиком убран из page cache
+    assert dropped[-1] == (0, len(body))
+    assert any(m.startswith("io download chromium-gost-1.0") for m in messages)
@@ -0,0 +1,58 @@
+def _setup(monkeypatch, updater, tmp_path):
+    textfile_dir = tmp_path / "textfile"
+    monkeypatch.setattr(updater.CONFIG, "metrics_textfile_dir", lambda: textfile_dir)
+    return textfile_dir
+
+
+def test_metrics_exporter_writes_prom_file(monkeypatch, updater, tmp_path, cache_dir):
+    textfile_dir = _setup(monkeypatch, updater, tmp_path)
+    cache_dir.mkdir(parents=True)
+    artifact = cache_dir / "chromium-gost-1.0-linux-amd64.deb"
+    artifact.write_bytes(b"x" * 32)
+    updater.DOWNLOADER._register_in_cache(
+        "1.0", artifact.name, artifact, "error", failed_attempts=2
+    )
+    updater.DOWNLOADER.last_download_stats = {
+        "bytes": 32,
+        "duration": 0.5,
+        "throughput": 64.0,
+    }
+
+    exporter = updater.MetricsExporter()
+    exporter.record_check(updater.PackageVersions("0.9", "1.0"), 0.25)
+    exporter.write()
+
+    text = (textfile_dir / exporter.FILENAME).read_text(encoding="utf-8")
+    assert 'chromium_gost_updater_version_info{local="0.9",remote="1.0"} 1' in text
+    assert "chromium_gost_updater_update_pending 1" in text
+    assert "chromium_gost_updater_last_check_duration_seconds 0.25" in text
+    assert 'chromium_gost_updater_failed_attempts{version="1.0"} 2' in text
+    assert "chromium_gost_updater_cache_size_bytes 32" in text
+    assert "chromium_gost_updater_cache_entries 1" in text
+    assert "chromium_gost_updater_download_throughput_bytes_per_second 64" in text
+    assert [p.name for p in textfile_dir.iterdir()] == [exporter.FILENAME]
+
+
+def test_metrics_exporter_disabled_without_textfile_dir(
+    monkeypatch, updater, tmp_path, cache_dir
+):
+    _setup(monkeypatch, updater, tmp_path)
+    monkeypatch.setattr(updater.CONFIG, "metrics_textfile_dir", lambda: None)
+
+    updater.MetricsExporter().write()
+
+    assert not (tmp_path / "textfile").exists()
+
+
+def test_prom_label_values_are_escaped(updater):
+    line = updater._prom_line("m", 1, {"version": 'a"b\\c\nd'})
+    assert line == 'm{version="a\\"b\\\\c\\nd"} 1'
+
+
+def test_prom_values_keep_full_precision(updater):
+    assert updater._prom_line("t", 1760000000) == "t 1760000000"
+    assert updater._prom_line("b", 123456789012) == "b 123456789012"
+    assert updater._prom_line("ts", 1760000000.123456) == "ts 1760000000.123456"
+    assert updater._prom_line("r", 0.1) == "r 0.1"
+    assert updater._prom_line("up", True) == "up 1"
+    assert updater._prom_line("x", float("inf")) == "x +Inf"
@@ -0,0 +1,189 @@
+import threading
+import time
+
+
+def _setup(monkeypatch, updater, cache_dir, http_server, mirrors):
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", f"{http_server.base_url}/primary")
+    monkeypatch.setattr(
+        updater.CONFIG,
+        "mirror_urls",
+        lambda: [f"{http_server.base_url}/{name}" for name in mirrors],
+    )
+
+
+def test_ranked_probes_and_persists_scores(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server, ["near", "down"])
+    http_server.routes["/near/version"] = (200, {}, b"1.0")
+    http_server.routes["/primary/version"] = (200, {}, b"1.0")
+
+    selector = updater.Downloader().mirrors
+    ranked = selector.ranked()
+
+    base = http_server.base_url
+    assert ranked[-1] == f"{base}/down"
+    assert "HEAD /near/version" in http_server.requests
+    scores = updater.load_state()["mirrors"]
+    assert scores[f"{base}/near"]["rtt"] > 0
+    assert scores[f"{base}/down"]["failures"] == 1
+
+    # Свежие оценки берутся из state.json без повторных проб
+    http_server.requests.clear()
+    assert selector.ranked() == ranked
+    assert http_server.requests == []
+
+
+def test_ranked_prefers_faster_persisted_mirror(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server, ["slow", "fast"])
+    base = http_server.base_url
+    now = time.time()
+    updater.save_state(
+        {
+            "mirrors": {
+                f"{base}/slow": {"probed_at": now, "rtt": 0.01, "throughput": 1e6},
+                f"{base}/fast": {"probed_at": now, "rtt": 0.05, "throughput": 5e7},
+                f"{base}/primary": {"probed_at": now, "rtt": 0.2},
+            }
+        }
+    )
+
+    ranked = updater.Downloader().mirrors.ranked()
+
+    # Для основного сервера скорость неизвестна: берётся медиана по зеркалам
+    assert ranked == [f"{base}/fast", f"{base}/primary", f"{base}/slow"]
+
+
+def test_download_falls_back_to_next_mirror(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server, ["broken"])
+    monkeypatch.setattr(updater, "validate_artifact", lambda *args: True)
+    monkeypatch.setattr(updater, "IS_WINDOWS", False)
+    body = b"\x00" * (updater.MIN_ARTIFACT_SIZE * 2)
+    name = "chromium-gost-1.0-linux-amd64.deb"
+    now = time.time()
+    base = http_server.base_url
+    updater.save_state(
+        {
+            "mirrors": {
+                f"{base}/broken": {"probed_at": now, "rtt": 0.01},
+                f"{base}/primary": {"probed_at": now, "rtt": 0.1},
+            }
+        }
+    )
+    http_server.routes[f"/broken/linux/amd64/{name}"] = (500, {}, b"")
+    http_server.routes[f"/primary/linux/amd64/{name}"] = (200, {}, body)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+
+    downloader = updater.Downloader()
+    path = downloader.download_package("1.0")
+
+    assert path is not None and path.read_bytes() == body
+    assert downloader.get_failed_attempts("1.0") == 0
+    scores = updater.load_state()["mirrors"]
+    assert scores[f"{base}/broken"]["failures"] == 1
+    assert scores[f"{base}/primary"]["throughput"] > 0
+
+
+def test_mirror_version_is_cross_checked_with_primary(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server, ["lagging"])
+    base = http_server.base_url
+    now = time.time()
+    updater.save_state(
+        {
+            "mirrors": {
+                f"{base}/lagging": {"probed_at": now, "rtt": 0.01},
+                f"{base}/primary": {"probed_at": now, "rtt": 0.1},
+            }
+        }
+    )
+    http_server.routes["/lagging/version"] = (200, {}, b"1.0")
+    http_server.routes["/primary/version"] = (200, {}, b"2.0")
+
+    downloader = updater.Downloader()
+
+    assert downloader.get_remote_version() == "2.0"
+    assert downloader._download_base_urls() == [f"{base}/primary"]
+
+
+def test_remote_version_does_not_wait_for_probes(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server, ["near"])
+    base = http_server.base_url
+    updater.save_state(
+        {
+            "mirrors": {
+                f"{base}/near": {"probed_at": 0, "rtt": 0.01},
+                f"{base}/primary": {"probed_at": 0, "rtt": 0.1},
+            }
+        }
+    )
+    http_server.routes["/near/version"] = (200, {}, b"1.0")
+    http_server.routes["/primary/version"] = (200, {}, b"1.0")
+    release = threading.Event()
+    probed = []
+
+    async def probe(self, base_url):
+        await updater.NETWORK_ENGINE.run_blocking(lambda: release.wait(5))
+        probed.append(base_url)
+        return 0.02
+
+    monkeypatch.setattr(updater.MirrorSelector, "probe", probe)
+    downloader = updater.Downloader()
+
+    # Оценки устарели, но версия берётся сразу по сохранённому порядку
+    assert downloader.get_remote_version() == "1.0"
+    assert probed == []
+    assert http_server.requests[0] == "/near/version"
+
+    release.set()
+    for _ in range(100):
+        scores = updater.load_state()["mirrors"]
+        if scores[f"{base}/primary"]["probed_at"] > 0:
+            break
+        time.sleep(0.05)
+    assert sorted(probed) == [f"{base}/near", f"{base}/primary"]
+    assert scores[f"{base}/near"]["probed_at"] > 0
+
+
+def test_invalid_artifact_counts_against_mirror(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server, ["corrupt"])
+    monkeypatch.setattr(updater, "IS_WINDOWS", False)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    monkeypatch.setattr(updater.CONFIG, "download_retries", lambda: 2)
+    monkeypatch.setattr(updater, "DOWNLOAD_RETRY_BASE_DELAY_SEC", 0)
+    monkeypatch.setattr(
+        updater, "validate_artifact", lambda path, ext: path.read_bytes()[:1] != b"!"
+    )
+    name = "chromium-gost-1.0-linux-amd64.deb"
+    now = time.time()
+    base = http_server.base_url
+    updater.save_state(
+        {
+            "mirrors": {
+                f"{base}/corrupt": {"probed_at": now, "rtt": 0.01},
+                f"{base}/primary": {"probed_at": now, "rtt": 0.1},
+            }
+        }
+    )
+    size = updater.MIN_ARTIFACT_SIZE * 2
+    http_server.routes[f"/corrupt/linux/amd64/{name}"] = (200, {}, b"!" * size)
+    http_server.routes[f"/primary/linux/amd64/{name}"] = (200, {}, b"\x00" * size)
+
+    downloader = updater.Downloader()
+    path = downloader.download_package("1.0")
+
+    assert path is not None and path.read_bytes() == b"\x00" * size
+    scores = updater.load_state()["mirrors"]
+    # Испорченный файл — ошибка зеркала: скорость не учтена, вперёд идёт primary
+    assert scores[f"{base}/corrupt"]["failures"] == 1
+    assert "throughput" not in scores[f"{base}/corrupt"]
+    assert downloader.mirrors.ranked()[0] == f"{base}/primary"
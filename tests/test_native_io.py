@@ -0,0 +1,416 @@
+import re
+from concurrent.futures import Future
+from email.message import Message
+from types import SimpleNamespace
+from urllib.request import Request, urlopen
+
+
+class FakeNativeIo:
+    """
+    NativeIo без главного цикла: post и запросы копятся в очереди до run(),
+    таймеры — в timers.
+    """
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.queue = []
+        self.timers = []
+
+    def run(self):
+        while self.queue:
+            self.queue.pop(0)()
+
+    def call_later(self, seconds, callback):
+        self.timers.append((seconds, callback))
+
+    def post(self, callback):
+        self.queue.append(callback)
+
+    def http_get(self, url, headers, on_chunk, on_done):
+        handle = {"paused": False, "aborted": False, "pump": None}
+
+        def start():
+            try:
+                response = urlopen(Request(url, headers=headers), timeout=5)
+            except Exception as e:
+                on_done(e)
+                return
+            response_headers = Message()
+            for name, value in response.headers.items():
+                response_headers[name] = value
+            native_response = SimpleNamespace(
+                status=response.status, headers=response_headers
+            )
+
+            def pump():
+                try:
+                    while not handle["paused"]:
+                        if handle["aborted"]:
+                            raise self.updater.DownloadCancelledError("aborted")
+                        data = response.read(self.updater.DOWNLOAD_CHUNK_SIZE)
+                        if not data:
+                            break
+                        on_chunk(data, native_response)
+                    else:
+                        return
+                except Exception as e:
+                    response.close()
+                    on_done(e)
+                    return
+                response.close()
+                on_done(None)
+
+            handle["pump"] = pump
+            pump()
+
+        self.queue.append(start)
+        return handle
+
+    def pause(self, handle):
+        handle["paused"] = True
+
+    def resume(self, handle):
+        if handle["paused"]:
+            handle["paused"] = False
+            self.queue.append(handle["pump"])
+
+    def abort(self, handle):
+        handle["aborted"] = True
+
+
+class InlineTasks:
+    """Пул задач без потоков: задача выполняется сразу, ключи запоминаются."""
+
+    def __init__(self):
+        self.keys = []
+        self.running = None
+
+    def submit(self, key, fn):
+        self.keys.append(key)
+        future = Future()
+        self.running = key
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self.running = None
+        return future
+
+
+def _setup(monkeypatch, updater, cache_dir, http_server):
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", f"{http_server.base_url}/primary")
+    monkeypatch.setattr(updater.CONFIG, "mirror_urls", lambda: [])
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    monkeypatch.setattr(updater, "validate_linux_package_file", lambda path, ext: True)
+    # Сторожевые таймеры запросов короче пауз между попытками
+    monkeypatch.setattr(updater.NETWORK_STATS, "connect_timeout", lambda: 1.0)
+
+    def no_engine(self, coro):
+        coro.close()
+        raise AssertionError("NETWORK_ENGINE used in native mode")
+
+    monkeypatch.setattr(updater.NetworkEngine, "submit", no_engine)
+
+
+def _flow(updater, downloader=None):
+    native_io, tasks = FakeNativeIo(updater), InlineTasks()
+    flow = updater.NativeUpdateFlow(
+        native_io, downloader or updater.Downloader(), tasks.submit
+    )
+    return flow, native_io, tasks
+
+
+def test_version_cross_checked_against_primary(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    mirror = f"{http_server.base_url}/mirror"
+    monkeypatch.setattr(updater.CONFIG, "mirror_urls", lambda: [mirror])
+    http_server.routes["/mirror/version"] = (200, {}, b"1.0\n")
+    http_server.routes["/primary/version"] = (200, {}, b"2.0\n")
+    downloader = updater.Downloader()
+    flow, native_io, _ = _flow(updater, downloader)
+
+    versions = []
+    flow.fetch_remote_version(versions.append)
+    native_io.run()
+
+    assert versions == ["2.0"]
+    assert mirror in downloader._lagging_mirrors
+    assert downloader._download_base_urls(probe=False) == [
+        f"{http_server.base_url}/primary"
+    ]
+
+
+def test_download_validates_and_registers_in_task_pool(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    body = b"\x01" * (updater.MIN_ARTIFACT_SIZE * 3)
+    http_server.routes["/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"] = (
+        200,
+        {},
+        body,
+    )
+    downloader = updater.Downloader()
+    flow, native_io, tasks = _flow(updater, downloader)
+    validated_in = []
+    monkeypatch.setattr(
+        updater,
+        "validate_linux_package_file",
+        lambda path, ext: validated_in.append(tasks.running) or True,
+    )
+
+    results, progress = [], []
+    flow.download("1.0", results.append, progress.append)
+    native_io.run()
+
+    path = cache_dir / "chromium-gost-1.0-linux-amd64.deb"
+    assert results == [path]
+    assert path.read_bytes() == body
+    assert progress[-1].done and progress[-1].received == len(body)
+    assert downloader._get_manifest_entry("1.0")["status"] == "ok"
+    # В главном цикле только HTTP: кэш, проверка и манифест — в пуле задач
+    assert validated_in == ["native-finish"]
+    assert tasks.keys[0] == "native-download"
+
+
+def test_failed_download_retries_on_loop_timer(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    monkeypatch.setattr(updater.CONFIG, "download_retries", lambda: 2)
+    target = "/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"
+    http_server.routes[target] = (503, {"Retry-After": "7"}, b"")
+    downloader = updater.Downloader()
+    flow, native_io, _ = _flow(updater, downloader)
+
+    results = []
+    flow.download("1.0", results.append)
+    native_io.run()
+
+    # Первая попытка не удалась: повтор запланирован таймером, а не сном в потоке
+    assert results == []
+    assert downloader.get_failed_attempts("1.0") == 1
+    retry_delays = [delay for delay, _ in native_io.timers if delay >= 7]
+    assert len(retry_delays) == 1
+
+    http_server.routes[target] = (200, {}, b"\x01" * updater.MIN_ARTIFACT_SIZE)
+    flow.wake()
+    native_io.run()
+    assert results and results[0].name == "chromium-gost-1.0-linux-amd64.deb"
+    assert downloader.get_failed_attempts("1.0") == 0
+    assert http_server.requests.count(target) == 2
+
+
+def test_native_download_resumes_partial_with_if_range(
+    monkeypatch, updater, cache_dir, http_server, raw_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", raw_server["base_url"])
+    body = bytes(range(256)) * (updater.MIN_ARTIFACT_SIZE // 64)
+    half = len(body) // 2
+    part = cache_dir / "chromium-gost-1.0-linux-amd64.deb.part"
+    cache_dir.mkdir(parents=True)
+    part.write_bytes(body[:half])
+    (cache_dir / (part.name + ".validator")).write_text('"v1"\n')
+    requests = []
+
+    def handler(conn, request):
+        with conn:
+            requests.append(request)
+            offset = int(re.search(rb"Range: bytes=(\d+)-", request).group(1))
+            conn.sendall(
+                b"HTTP/1.1 206 Partial Content\r\n"
+                b"Content-Range: bytes %d-%d/%d\r\n"
+                b"Content-Length: %d\r\n\r\n"
+                % (offset, len(body) - 1, len(body), len(body) - offset)
+                + body[offset:]
+            )
+
+    raw_server["handler"] = handler
+    flow, native_io, _ = _flow(updater)
+
+    results = []
+    flow.download("1.0", results.append)
+    native_io.run()
+
+    assert results == [cache_dir / "chromium-gost-1.0-linux-amd64.deb"]
+    assert results[0].read_bytes() == body
+    assert b'If-Range: "v1"' in requests[0]
+    assert not part.exists()
+
+
+def test_policy_defers_and_slows_native_download(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    http_server.routes["/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"] = (
+        200,
+        {},
+        b"\x01" * updater.MIN_ARTIFACT_SIZE,
+    )
+    monkeypatch.setattr(updater.CONFIG, "schedule_recheck_interval", lambda: 60)
+    monkeypatch.setattr(updater.CONFIG, "schedule_slow_rate", lambda: 10**9)
+    decisions = [
+        updater.PolicyDecision(updater.PolicyDecision.DEFER, ["батарея"]),
+        updater.PolicyDecision(updater.PolicyDecision.SLOW, ["лимит"]),
+    ]
+    monkeypatch.setattr(updater.DOWNLOAD_POLICY, "decide", lambda: decisions.pop(0))
+    downloader = updater.Downloader()
+    rates = []
+    real_set_rate_limit = downloader.set_rate_limit
+    monkeypatch.setattr(
+        downloader,
+        "set_rate_limit",
+        lambda rate: rates.append(rate) or real_set_rate_limit(rate),
+    )
+    flow, native_io, _ = _flow(updater, downloader)
+
+    results, deferred = [], []
+    flow.download_when_allowed("1.0", results.append, on_defer=deferred.append)
+    native_io.run()
+
+    # Отложено: перепроверка таймером цикла, без запросов к серверу
+    assert results == [] and deferred == ["батарея"]
+    assert http_server.requests == []
+    delay, recheck = native_io.timers.pop()
+    assert delay == 60
+
+    recheck()
+    native_io.run()
+    assert deferred == ["батарея", None]
+    assert results and results[0].name == "chromium-gost-1.0-linux-amd64.deb"
+    assert rates == [10**9, None]
+
+
+def test_rate_limit_pauses_reading_until_tokens_arrive(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    body = b"\x01" * updater.MIN_ARTIFACT_SIZE
+    http_server.routes["/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"] = (
+        200,
+        {},
+        body,
+    )
+    delays = [0.2, 0.0]
+    bucket = SimpleNamespace(take=lambda amount: delays.pop(0) if delays else 0.0)
+    downloader = updater.Downloader()
+    monkeypatch.setattr(downloader, "_transfer_bucket", lambda: bucket)
+    monkeypatch.setattr(downloader, "_release_bucket", lambda bucket: None)
+    flow, native_io, _ = _flow(updater, downloader)
+
+    results = []
+    flow.download("1.0", results.append)
+    native_io.run()
+
+    # Токенов нет: чтение на паузе, продолжение — таймером цикла
+    assert results == []
+    delay, wait_tokens = native_io.timers.pop()
+    assert delay == 0.2
+    wait_tokens()
+    native_io.run()
+    assert results == [cache_dir / "chromium-gost-1.0-linux-amd64.deb"]
+    assert results[0].read_bytes() == body
+
+
+def test_state_file_and_part_io_run_in_task_pool(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    body = b"\x01" * (updater.MIN_ARTIFACT_SIZE * 3)
+    http_server.routes["/primary/version"] = (200, {}, b"1.0\n")
+    http_server.routes["/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"] = (
+        200,
+        {},
+        body,
+    )
+    flow, native_io, tasks = _flow(updater)
+    called_in = []
+
+    def tracking(fn):
+        def wrapper(*args, **kwargs):
+            called_in.append(tasks.running)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    # state.json (предохранители, статистика сети, зеркала) и работа с .part
+    for attr in ("load_state", "update_state", "_preallocate"):
+        monkeypatch.setattr(updater, attr, tracking(getattr(updater, attr)))
+    for attr in ("__init__", "open", "write", "finish", "close"):
+        method = getattr(updater._PartialDownload, attr)
+        monkeypatch.setattr(updater._PartialDownload, attr, tracking(method))
+
+    versions, results = [], []
+    flow.fetch_remote_version(versions.append)
+    native_io.run()
+    flow.download("1.0", results.append)
+    native_io.run()
+
+    assert versions == ["1.0"]
+    assert results == [cache_dir / "chromium-gost-1.0-linux-amd64.deb"]
+    assert called_in and None not in called_in
+    assert "native-write" in called_in
+
+
+class DeferredTasks:
+    """Пул задач, который выполняет накопленные задачи только по run()."""
+
+    def __init__(self):
+        self.queue = []
+
+    def submit(self, key, fn):
+        future = Future()
+        self.queue.append((fn, future))
+        return future
+
+    def run(self):
+        while self.queue:
+            fn, future = self.queue.pop(0)
+            future.set_result(fn())
+
+
+def test_reading_pauses_while_part_writes_lag_behind(
+    monkeypatch, updater, cache_dir, http_server
+):
+    _setup(monkeypatch, updater, cache_dir, http_server)
+    monkeypatch.setattr(
+        updater, "NATIVE_WRITE_BACKLOG_BYTES", updater.DOWNLOAD_CHUNK_SIZE * 2
+    )
+    body = bytes(range(256)) * (updater.DOWNLOAD_CHUNK_SIZE // 32)
+    http_server.routes["/primary/linux/amd64/chromium-gost-1.0-linux-amd64.deb"] = (
+        200,
+        {},
+        body,
+    )
+    native_io, tasks = FakeNativeIo(updater), DeferredTasks()
+    flow = updater.NativeUpdateFlow(native_io, updater.Downloader(), tasks.submit)
+    received = []
+    real_http_get = native_io.http_get
+
+    def http_get(url, headers, on_chunk, on_done):
+        def counting(data, response):
+            received.append(data)
+            return on_chunk(data, response)
+
+        return real_http_get(url, headers, counting, on_done)
+
+    monkeypatch.setattr(native_io, "http_get", http_get)
+
+    results = []
+    flow.download("1.0", results.append)
+    while not received:
+        tasks.run()
+        native_io.run()
+
+    # Шаги записи ещё не выполнены: чтение стоит, приняв не больше запаса
+    native_io.run()
+    assert sum(map(len, received)) <= updater.NATIVE_WRITE_BACKLOG_BYTES < len(body)
+
+    while not results:
+        tasks.run()
+        native_io.run()
+    assert results[0].read_bytes() == body
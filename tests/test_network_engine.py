@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+def test_engine_follows_redirects_and_decodes_chunked(updater, raw_server):
+    def handler(conn, request):
+        with conn:
+            if request.startswith(b"GET /old "):
+                conn.sendall(b"HTTP/1.1 302 Found\r\nLocation: /new\r\n\r\n")
+                return
+            conn.sendall(
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"4\r\n142.\r\n9;ext=1\r\n0.7444.17\r\n0\r\nX-Trailer: 1\r\n\r\n"
+            )
+
+    raw_server["handler"] = handler
+
+    async def fetch():
+        async with await updater.NETWORK_ENGINE.open(f"{raw_server['base_url']}/old") as r:
+            return r.url, await r.read_all()
+
+    url, body = updater.NETWORK_ENGINE.submit(fetch()).result(5)
+    assert url.endswith("/new")
+    assert body == b"142.0.7444.17"
+
+
+def test_shutdown_cancels_download_and_keeps_partial_file(
+    monkeypatch, updater, cache_dir, raw_server
+):
+    sent = threading.Event()
+
+    def handler(conn, request):
+        with conn:
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 10000000\r\n\r\n")
+            conn.sendall(b"\x00" * 200000)
+            sent.set()
+            time.sleep(10)
+
+    raw_server["handler"] = handler
+    monkeypatch.setattr(
+        updater.Downloader,
+        "_get_download_target",
+        lambda self, version, ext, base_url=None: (
+            f"{raw_server['base_url']}/pkg",
+            "chromium-gost-1.0-linux-amd64.deb",
+        ),
+    )
+    downloader = updater.Downloader()
+    threading.Thread(
+        target=lambda: sent.wait(5) and time.sleep(0.2) or downloader.shutdown()
+    ).start()
+
+    started = time.monotonic()
+    assert downloader.download_package("1.0") is None
+    assert time.monotonic() - started < 5
+    assert not (cache_dir / "chromium-gost-1.0-linux-amd64.deb").exists()
+    # Принятое остаётся для докачки; отмена при выходе не считается неудачной попыткой
+    part = cache_dir / "chromium-gost-1.0-linux-amd64.deb.part"
+    assert part.stat().st_size >= 200000
+    assert downloader._get_manifest_entry("1.0")["status"] == "partial"
+    assert downloader.get_failed_attempts("1.0") == 0
+
+
+def test_mirror_probes_run_concurrently_on_one_thread(
+    monkeypatch, updater, cache_dir, raw_server
+):
+    threads_seen = set()
+
+    def handler(conn, request):
+        with conn:
+            time.sleep(0.5)
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+
+    raw_server["handler"] = handler
+    base = raw_server["base_url"]
+    mirrors = [f"{base}/m{i}" for i in range(6)]
+    monkeypatch.setattr(updater.CONFIG, "mirror_urls", lambda: mirrors)
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", f"{base}/primary")
+    original_open = updater.NetworkEngine.open
+
+    async def tracking_open(self, *args, **kwargs):
+        threads_seen.add(threading.current_thread().name)
+        return await original_open(self, *args, **kwargs)
+
+    monkeypatch.setattr(updater.NetworkEngine, "open", tracking_open)
+
+    started = time.monotonic()
+    updater.Downloader().mirrors.ranked()
+
+    assert time.monotonic() - started < 2.5
+    assert threads_seen == {"network-loop"}
+    scores = updater.load_state()["mirrors"]
+    assert all(scores[url]["rtt"] >= 0.5 for url in mirrors)
+
+
+def test_state_file_and_partial_io_stay_off_the_loop_thread(
+    monkeypatch, updater, cache_dir, http_server
+):
+    threads_seen = []
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", f"{http_server.base_url}/primary")
+    monkeypatch.setattr(updater.CONFIG, "mirror_urls", lambda: [])
+    monkeypatch.setattr(updater, "validate_artifact", lambda *args: True)
+    monkeypatch.setattr(updater, "IS_WINDOWS", False)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+    name = "chromium-gost-1.0-linux-amd64.deb"
+    body = b"\x00" * (updater.MIN_ARTIFACT_SIZE * 2)
+    http_server.routes["/primary/version"] = (200, {}, b"1.0")
+    http_server.routes[f"/primary/linux/amd64/{name}"] = (200, {}, body)
+
+    def tracking(fn):
+        def wrapper(*args, **kwargs):
+            threads_seen.append(threading.current_thread().name)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    # state.json (предохранитель, статистика сети) и резерв места под .part
+    for attr in ("load_state", "update_state", "_preallocate", "_read_validator"):
+        monkeypatch.setattr(updater, attr, tracking(getattr(updater, attr)))
+
+    downloader = updater.Downloader()
+    assert downloader.get_remote_version() == "1.0"
+    path = downloader.download_package("1.0")
+
+    assert path is not None and path.read_bytes() == body
+    assert threads_seen
+    assert "network-loop" not in threads_seen
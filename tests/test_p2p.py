@@ -0,0 +1,123 @@
+import socket
+import threading
+
+import pytest
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def configure(monkeypatch, point_cache):
+    """configure(module, home, udp_port): машина с каталогом home в общей сети."""
+
+    def configure(module, home, udp_port):
+        cache_dir = point_cache(
+            module, home / "cache" / "packages", home / "state.json"
+        )
+        monkeypatch.setattr(module, "IS_WINDOWS", False)
+        monkeypatch.setattr(module, "validate_artifact", lambda *args: True)
+        monkeypatch.setattr(module.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+        monkeypatch.setattr(module.CONFIG, "p2p_enabled", lambda: True)
+        # Вместо multicast-группы — loopback: оба экземпляра на одной машине
+        monkeypatch.setattr(module.CONFIG, "p2p_group", lambda: "127.0.0.1")
+        monkeypatch.setattr(module.CONFIG, "p2p_port", lambda: udp_port)
+        monkeypatch.setattr(module.CONFIG, "p2p_discovery_timeout_ms", lambda: 300)
+        return cache_dir
+
+    return configure
+
+
+@pytest.fixture
+def seeder(peer_updater, tmp_path, configure):
+    udp_port = _free_udp_port()
+    cache_dir = configure(peer_updater, tmp_path / "seeder", udp_port)
+    downloader = peer_updater.Downloader()
+    artifact = cache_dir / "chromium-gost-1.0-linux-amd64.deb"
+    cache_dir.mkdir(parents=True)
+    artifact.write_bytes(b"\x01" * (peer_updater.MIN_ARTIFACT_SIZE * 2))
+    downloader._register_in_cache("1.0", artifact.name, artifact, "ok")
+
+    server = peer_updater.CacheServer(downloader, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    downloader.peers.start(server.address[1])
+    try:
+        yield downloader, artifact, udp_port
+    finally:
+        downloader.peers.stop()
+        server.shutdown()
+
+
+def test_download_from_peer_verifies_digest_with_origin(
+    monkeypatch, updater, tmp_path, http_server, seeder, configure
+):
+    _, artifact, udp_port = seeder
+    configure(updater, tmp_path / "client", udp_port)
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", http_server.base_url)
+    digest_path = f"/linux/amd64/{artifact.name}.sha256"
+    digest = updater._file_sha256(artifact)
+    http_server.routes[digest_path] = (200, {}, f"{digest}  {artifact.name}\n".encode())
+
+    downloader = updater.Downloader()
+    path = downloader.download_package("1.0")
+
+    assert path is not None and path.read_bytes() == artifact.read_bytes()
+    entry = downloader._get_manifest_entry("1.0")
+    assert entry["status"] == "ok"
+    assert entry["sha256"] == digest
+    # С сервера — только хеш, сам файл у соседа
+    assert http_server.requests == [digest_path]
+
+
+def test_peer_with_wrong_digest_falls_back_to_origin(
+    monkeypatch, updater, tmp_path, http_server, seeder, configure
+):
+    seeder_downloader, artifact, udp_port = seeder
+    manifest = seeder_downloader._load_cache_manifest()
+    manifest["packages"]["1.0"]["sha256"] = "0" * 64
+    seeder_downloader._save_cache_manifest(manifest)
+
+    configure(updater, tmp_path / "client", udp_port)
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", http_server.base_url)
+    # Даже с разрешением trust_peers доверенный хеш сервера главнее ответа соседа
+    monkeypatch.setattr(updater.CONFIG, "p2p_trust_peers", lambda: True)
+    origin_body = b"\x02" * (updater.MIN_ARTIFACT_SIZE * 2)
+    http_server.routes[f"/linux/amd64/{artifact.name}"] = (200, {}, origin_body)
+    http_server.routes[f"/linux/amd64/{artifact.name}.sha256"] = (
+        200,
+        {},
+        updater.hashlib.sha256(origin_body).hexdigest().encode(),
+    )
+
+    path = updater.Downloader().download_package("1.0")
+
+    assert path is not None and path.read_bytes() == origin_body
+    assert http_server.requests == [
+        f"/linux/amd64/{artifact.name}.sha256",
+        f"/linux/amd64/{artifact.name}",
+    ]
+
+
+def test_peers_need_opt_in_without_trusted_digest(
+    monkeypatch, updater, tmp_path, http_server, seeder, configure
+):
+    _, artifact, udp_port = seeder
+    configure(updater, tmp_path / "client", udp_port)
+    monkeypatch.setattr(updater, "REMOTE_BASE_URL", http_server.base_url)
+    origin_body = b"\x02" * (updater.MIN_ARTIFACT_SIZE * 2)
+    http_server.routes[f"/linux/amd64/{artifact.name}"] = (200, {}, origin_body)
+
+    # Сервер хешей не публикует: ответу соседа по умолчанию не верим
+    path = updater.Downloader().download_package("1.0")
+    assert path is not None and path.read_bytes() == origin_body
+
+    path.unlink()
+    updater.CACHE_MANIFEST_FILE.unlink()
+    http_server.requests.clear()
+    monkeypatch.setattr(updater.CONFIG, "p2p_trust_peers", lambda: True)
+    path = updater.Downloader().download_package("1.0")
+    assert path is not None and path.read_bytes() == artifact.read_bytes()
+    assert http_server.requests == [f"/linux/amd64/{artifact.name}.sha256"]
@@ -0,0 +1,72 @@
+import threading
+
+
+def test_decision_follows_schedule_rules(monkeypatch, updater):
+    policy = updater.DownloadPolicy()
+    Decision = updater.PolicyDecision
+
+    assert policy.decide({"load": 20.0, "pressure": 1.0}).action == Decision.ALLOW
+    metered = policy.decide({"metered": True, "on_battery": True})
+    assert metered.action == Decision.DEFER
+    assert metered.reasons == ["лимитное подключение"]
+    battery = policy.decide({"metered": False, "on_battery": True})
+    assert battery.action == Decision.SLOW
+    assert battery.rate == updater.CONFIG.schedule_slow_rate()
+    assert policy.decide({"load": 400.0}).reasons == ["высокая нагрузка"]
+    assert policy.decide({"pressure": 75.0}).action == Decision.SLOW
+
+    monkeypatch.setattr(updater.CONFIG, "schedule_metered", lambda: "allow")
+    monkeypatch.setattr(updater.CONFIG, "schedule_max_pressure", lambda: 0)
+    assert policy.decide({"metered": True, "pressure": 75.0}).action == Decision.ALLOW
+
+
+def test_download_pauses_and_resumes_with_conditions(monkeypatch, updater):
+    monkeypatch.setattr(updater.CONFIG, "schedule_recheck_interval", lambda: 0.05)
+    conditions = {"metered": True, "on_battery": False}
+    policy = updater.DownloadPolicy(
+        {
+            "metered": lambda: conditions["metered"],
+            "on_battery": lambda: conditions["on_battery"],
+            "load": lambda: None,
+            "pressure": lambda: None,
+        }
+    )
+    deferrals, rates, attempts = [], [], []
+
+    def on_defer(reason):
+        if not deferrals or deferrals[-1] != reason:
+            deferrals.append(reason)
+        # Отложено: условия меняются, пока ждём
+        if reason and not attempts:
+            conditions.update(metered=False, on_battery=True)
+        elif reason:
+            conditions["metered"] = False
+
+    def download(token):
+        attempts.append(token)
+        if len(attempts) == 1:
+            # Подключились к лимитной сети посреди скачивания
+            conditions["metered"] = True
+            assert token.wait(5)
+            return None
+        return "package"
+
+    result = policy.run(download, rates.append, updater.CancelToken(), on_defer)
+
+    assert result == "package"
+    assert len(attempts) == 2 and attempts[0].is_set()
+    assert deferrals == ["лимитное подключение", None, "лимитное подключение", None]
+    assert updater.CONFIG.schedule_slow_rate() in rates
+    assert rates[-1] is None
+
+
+def test_cancel_stops_waiting_for_conditions(updater):
+    policy = updater.DownloadPolicy({"metered": lambda: True})
+    cancel = updater.CancelToken()
+    timer = threading.Timer(0.2, cancel.cancel)
+    timer.start()
+
+    def download(token):
+        raise AssertionError("download must stay deferred")
+
+    assert policy.run(download, lambda rate: None, cancel) is None
@@ -0,0 +1,133 @@
+import gzip
+import io
+import struct
+import tarfile
+
+
+def _tar_gz(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _make_deb(path, version):
+    control = (
+        "Package: chromium-gost-stable\n"
+        f"Version: {version}\n"
+        "Architecture: amd64\n"
+        "Description: Chromium GOST\n"
+        " with GOST cryptography\n"
+    ).encode()
+    members = [
+        ("debian-binary", b"2.0\n"),
+        ("control.tar.gz", _tar_gz({"./control": control})),
+        ("data.tar.gz", _tar_gz({"./opt/file": b"x" * 333})),
+    ]
+    data = b"!<arch>\n"
+    for name, body in members:
+        header = f"{name:<16}{0:<12}{0:<6}{0:<6}{'100644':<8}{len(body):<10}`\n"
+        data += header.encode() + body + (b"\n" if len(body) % 2 else b"")
+    path.write_bytes(data)
+
+
+def _rpm_header(entries):
+    index, store = b"", b""
+    for tag, kind, value in entries:
+        if kind == 6:
+            raw, count = value.encode() + b"\0", 1
+        elif kind == 8:
+            raw, count = b"".join(v.encode() + b"\0" for v in value), len(value)
+        else:
+            while len(store) % 4:
+                store += b"\0"
+            raw, count = struct.pack(f">{len(value)}I", *value), len(value)
+        index += struct.pack(">iiii", tag, kind, len(store), count)
+        store += raw
+    intro = b"\x8e\xad\xe8\x01\0\0\0\0" + struct.pack(">II", len(entries), len(store))
+    return intro + index + store
+
+
+def _make_rpm(path, version):
+    lead = b"\xed\xab\xee\xdb" + b"\0" * 92
+    header = _rpm_header(
+        [
+            (1000, 6, "chromium-gost-stable"),
+            (1001, 6, version),
+            (1002, 6, "1"),
+            (1004, 6, "Chromium <GOST>"),
+            (1022, 6, "x86_64"),
+            (1049, 8, ["libc.so.6", "rpmlib(PayloadIsXz)"]),
+            (1048, 4, [0, 0]),
+            (1050, 8, ["", "5.2-1"]),
+            (1116, 4, [0]),
+            (1117, 8, ["chrome"]),
+            (1118, 8, ["/opt/chromium-gost/"]),
+        ]
+    )
+    path.write_bytes(lead + _rpm_header([]) + header + b"payload")
+
+
+def _setup(monkeypatch, updater, cache_dir):
+    cache_dir.mkdir(parents=True)
+    monkeypatch.setattr(updater.CONFIG, "repo_enabled", lambda: True)
+
+
+def test_apt_index_tracks_cache_incrementally(monkeypatch, updater, cache_dir):
+    _setup(monkeypatch, updater, cache_dir)
+    downloader = updater.Downloader()
+    for version in ("1.0", "2.0"):
+        path = cache_dir / f"chromium-gost-{version}-linux-amd64.deb"
+        _make_deb(path, version)
+        downloader._register_in_cache(version, path.name, path, "ok")
+
+    packages = (cache_dir / "Packages").read_text()
+    assert "Version: 1.0" in packages and "Version: 2.0" in packages
+    assert "Description: Chromium GOST\n with GOST cryptography" in packages
+    assert "Filename: ./chromium-gost-2.0-linux-amd64.deb" in packages
+    assert gzip.decompress((cache_dir / "Packages.gz").read_bytes()).decode() == packages
+    release = (cache_dir / "Release").read_text()
+    assert "Architectures: amd64" in release and " Packages.gz" in release
+
+    # Неизменившиеся файлы повторно не разбираются
+    parsed = []
+    original = updater.read_deb_control
+    monkeypatch.setattr(
+        updater, "read_deb_control", lambda p: parsed.append(p.name) or original(p)
+    )
+    path = cache_dir / "chromium-gost-3.0-linux-amd64.deb"
+    _make_deb(path, "3.0")
+    downloader._register_in_cache("3.0", path.name, path, "ok")
+    assert parsed == [path.name]
+
+    manifest = downloader._load_cache_manifest()
+    for version in ("1.0", "2.0"):
+        manifest["packages"][version]["downloaded_at"] = "2000-01-01T00:00:00"
+    downloader._save_cache_manifest(manifest)
+    downloader.cleanup_old_cache_files(max_age_days=1)
+    packages = (cache_dir / "Packages").read_text()
+    assert "Version: 3.0" in packages and "Version: 1.0" not in packages
+
+
+def test_yum_repodata_from_rpm_header(monkeypatch, updater, cache_dir):
+    _setup(monkeypatch, updater, cache_dir)
+    path = cache_dir / "chromium-gost-1.0-linux-amd64.rpm"
+    _make_rpm(path, "1.0")
+    updater.Downloader()._register_in_cache("1.0", path.name, path, "ok")
+
+    repomd = (cache_dir / "repodata" / "repomd.xml").read_text()
+    assert '<location href="repodata/primary.xml.gz"/>' in repomd
+    primary = gzip.decompress((cache_dir / "repodata" / "primary.xml.gz").read_bytes())
+    primary = primary.decode()
+    assert 'packages="1"' in primary
+    assert "<name>chromium-gost-stable</name>" in primary
+    assert '<version epoch="0" ver="1.0" rel="1"/>' in primary
+    assert "<summary>Chromium &lt;GOST&gt;</summary>" in primary
+    assert '<rpm:entry name="libc.so.6"/>' in primary
+    assert "rpmlib(" not in primary
+    assert f'<location href="{path.name}"/>' in primary
+    filelists = gzip.decompress((cache_dir / "repodata" / "filelists.xml.gz").read_bytes())
+    assert b"<file>/opt/chromium-gost/chrome</file>" in filelists
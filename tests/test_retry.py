@@ -0,0 +1,58 @@
+import random
+import threading
+import time
+
+
+def test_next_delay_uses_full_jitter_with_cap(updater):
+    scheduler = updater.RetryScheduler(2.0, 10.0, rng=random.Random(1))
+    for attempt in range(1, 10):
+        ceiling = min(10.0, 2.0 * 2 ** (attempt - 1))
+        for _ in range(50):
+            assert 0 <= scheduler.next_delay(attempt) <= ceiling
+
+
+def test_next_delay_honours_retry_after_up_to_max_delay(updater):
+    scheduler = updater.RetryScheduler(2.0, 300.0, rng=random.Random(1))
+    delay = scheduler.next_delay(1, retry_after=120)
+    assert 120 <= delay <= 122
+    # Retry-After больше retry_max_delay: ждём не дольше retry_max_delay
+    assert scheduler.next_delay(1, retry_after=86400) == 300.0
+
+
+def test_retry_after_parses_seconds_and_http_date(updater):
+    from email.utils import formatdate
+
+    def http_error(code, value):
+        return updater.HTTPError("http://x", code, "busy", {"Retry-After": value}, None)
+
+    assert updater._retry_after_seconds(http_error(503, "30")) == 30
+    future = formatdate(time.time() + 90, usegmt=True)
+    assert 80 <= updater._retry_after_seconds(http_error(429, future)) <= 91
+    assert updater._retry_after_seconds(http_error(500, "30")) is None
+    assert updater._retry_after_seconds(ValueError()) is None
+
+
+def test_wake_interrupts_wait(updater):
+    scheduler = updater.RetryScheduler(2.0, 10.0)
+    threading.Timer(0.05, scheduler.wake).start()
+    started = time.monotonic()
+    assert scheduler.wait(30) is True
+    assert time.monotonic() - started < 5
+
+
+def test_shutdown_interrupts_retry_after_wait(
+    monkeypatch, updater, cache_dir, http_server
+):
+    http_server.routes["/pkg"] = (503, {"Retry-After": "300"}, b"busy")
+    monkeypatch.setattr(
+        updater.Downloader,
+        "_get_download_target",
+        lambda self, version, ext, base_url=None: (f"{http_server.base_url}/pkg", "pkg.deb"),
+    )
+
+    downloader = updater.Downloader()
+    threading.Timer(0.3, downloader.shutdown).start()
+    started = time.monotonic()
+    assert downloader.download_package("1.0") is None
+    assert time.monotonic() - started < 5
+    assert http_server.requests == ["/pkg"]
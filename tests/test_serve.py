@@ -0,0 +1,86 @@
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+
+@pytest.fixture
+def cache_server(monkeypatch, updater, cache_dir):
+    downloader = updater.Downloader()
+    for version, size in (("1.0", 1000), ("1.10", 5000)):
+        path = cache_dir / f"chromium-gost-{version}-linux-amd64.deb"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(i % 251 for i in range(size)))
+        downloader._register_in_cache(version, path.name, path, "ok")
+    server = updater.CacheServer(downloader, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.base_url = "http://127.0.0.1:%d" % server.address[1]
+    try:
+        yield server
+    finally:
+        server.shutdown()
+
+
+def _get(url, headers=None, method=None):
+    with urlopen(Request(url, headers=headers or {}, method=method), timeout=5) as r:
+        return r.status, r.headers, r.read()
+
+
+def test_serves_version_and_artifact(cache_server):
+    status, _, body = _get(f"{cache_server.base_url}/version")
+    assert (status, body) == (200, b"1.10\n")
+
+    url = f"{cache_server.base_url}/linux/amd64/chromium-gost-1.10-linux-amd64.deb"
+    status, headers, body = _get(url)
+    assert status == 200
+    assert body == bytes(i % 251 for i in range(5000))
+    assert headers["Accept-Ranges"] == "bytes"
+
+    status, headers, body = _get(url, method="HEAD")
+    assert (status, headers["Content-Length"], body) == (200, "5000", b"")
+
+    with pytest.raises(HTTPError) as error:
+        _get(f"{cache_server.base_url}/linux/amd64/../cache.toml")
+    assert error.value.code == 404
+
+
+def test_serves_sha256_from_manifest(updater, cache_server):
+    name = "chromium-gost-1.10-linux-amd64.deb"
+    digest = updater.hashlib.sha256(bytes(i % 251 for i in range(5000))).hexdigest()
+
+    status, _, body = _get(f"{cache_server.base_url}/linux/amd64/{name}.sha256")
+    assert (status, body) == (200, f"{digest}  {name}\n".encode())
+
+    with pytest.raises(HTTPError) as error:
+        _get(f"{cache_server.base_url}/linux/amd64/missing.deb.sha256")
+    assert error.value.code == 404
+
+
+def test_serves_range_requests(cache_server):
+    url = f"{cache_server.base_url}/linux/amd64/chromium-gost-1.0-linux-amd64.deb"
+    expected = bytes(i % 251 for i in range(1000))
+
+    status, headers, body = _get(url, {"Range": "bytes=100-199"})
+    assert (status, body) == (206, expected[100:200])
+    assert headers["Content-Range"] == "bytes 100-199/1000"
+
+    status, _, body = _get(url, {"Range": "bytes=900-"})
+    assert (status, body) == (206, expected[900:])
+
+    status, _, body = _get(url, {"Range": "bytes=-10"})
+    assert (status, body) == (206, expected[-10:])
+
+    with pytest.raises(HTTPError) as error:
+        _get(url, {"Range": "bytes=5000-"})
+    assert error.value.code == 416
+
+    # If-Range: совпал Last-Modified — часть, иначе файл целиком
+    _, headers, _ = _get(url)
+    last_modified = headers["Last-Modified"]
+    status, _, body = _get(url, {"Range": "bytes=900-", "If-Range": last_modified})
+    assert (status, body) == (206, expected[900:])
+    status, _, body = _get(
+        url, {"Range": "bytes=900-", "If-Range": "Thu, 01 Jan 1970 00:00:00 GMT"}
+    )
+    assert (status, body) == (200, expected)
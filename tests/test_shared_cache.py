@@ -0,0 +1,224 @@
+import os
+import pwd
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def configure(monkeypatch, point_cache, http_server):
+    """configure(module, home, shared_dir): пользователь с домашним каталогом home."""
+
+    def configure(module, home, shared_dir):
+        cache_dir = point_cache(
+            module, home / "cache" / "packages", home / "state.json"
+        )
+        monkeypatch.setattr(module, "IS_WINDOWS", False)
+        monkeypatch.setattr(module, "REMOTE_BASE_URL", http_server.base_url)
+        monkeypatch.setattr(module, "validate_artifact", lambda *args: True)
+        monkeypatch.setattr(module.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+        monkeypatch.setattr(module, "SHARED_CACHE", module.SharedCache(shared_dir))
+        return cache_dir
+
+    return configure
+
+
+def _serve(updater, http_server):
+    name = "chromium-gost-1.0-linux-amd64.deb"
+    body = b"\x03" * (updater.MIN_ARTIFACT_SIZE * 2)
+    http_server.routes[f"/linux/amd64/{name}"] = (200, {}, body)
+    return name, body
+
+
+def test_download_is_published_and_linked_for_other_users(
+    monkeypatch, updater, tmp_path, http_server, configure
+):
+    shared_dir = tmp_path / "shared"
+    name, body = _serve(updater, http_server)
+
+    configure(updater, tmp_path / "alice", shared_dir)
+    first = updater.Downloader().download_package("1.0")
+    assert first is not None and (shared_dir / name).exists()
+    # Общий и личный файл — один inode только для чтения: группа общего кэша
+    # может заменить запись в каталоге, но не данные личной копии
+    published = (shared_dir / name).stat()
+    assert published.st_ino == first.stat().st_ino
+    assert published.st_mode & 0o777 == 0o644
+
+    bob_home = tmp_path / "bob"
+    bob_cache = configure(updater, bob_home, shared_dir)
+    second = updater.Downloader().get_valid_cached_package("1.0")
+
+    assert second == bob_cache / name
+    assert second.read_bytes() == body
+    assert second.stat().st_ino == (shared_dir / name).stat().st_ino
+    assert len(http_server.requests) == 1
+
+
+def test_concurrent_users_download_once(
+    monkeypatch, updater, peer_updater, tmp_path, http_server, configure
+):
+    shared_dir = tmp_path / "shared"
+    name, body = _serve(updater, http_server)
+    configure(updater, tmp_path / "alice", shared_dir)
+    configure(peer_updater, tmp_path / "bob", shared_dir)
+
+    results = {}
+
+    def run(key, module):
+        results[key] = module.Downloader().download_package("1.0")
+
+    threads = [
+        threading.Thread(target=run, args=("alice", updater)),
+        threading.Thread(target=run, args=("bob", peer_updater)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results["alice"].read_bytes() == body
+    assert results["bob"].read_bytes() == body
+    assert http_server.requests == [f"/linux/amd64/{name}"]
+    entry = updater.SHARED_CACHE._get_manifest_entry("1.0")
+    assert entry["status"] == "ok" and entry["sha256"]
+
+
+def test_package_modified_after_check_is_not_offered(
+    monkeypatch, updater, tmp_path, http_server, configure
+):
+    shared_dir = tmp_path / "shared"
+    name, body = _serve(updater, http_server)
+    configure(updater, tmp_path / "alice", shared_dir)
+    downloader = updater.Downloader()
+    package = downloader.download_package("1.0")
+    assert downloader.verify_package_digest(package)
+    assert downloader.verify_package_digest(shared_dir / name)
+
+    # Участник группы подменяет запись общего кэша файлом того же размера
+    tampered = shared_dir / name
+    tampered.unlink()
+    tampered.write_bytes(b"\x04" * len(body))
+    assert not downloader.verify_package_digest(tampered)
+    assert downloader.verify_package_digest(package)
+
+
+def test_reader_without_link_rights_uses_shared_file_in_place(
+    monkeypatch, updater, tmp_path, http_server, configure
+):
+    shared_dir = tmp_path / "shared"
+    name, body = _serve(updater, http_server)
+    configure(updater, tmp_path / "alice", shared_dir)
+    updater.Downloader().download_package("1.0")
+
+    # Как у другого пользователя при fs.protected_hardlinks=1 на ext4:
+    # чужой файл не связать, reflink не поддерживается
+    def no_link(src, dst):
+        raise PermissionError(1, "Operation not permitted")
+
+    def no_reflink(fd, request, arg=0):
+        raise OSError(95, "Operation not supported")
+
+    monkeypatch.setattr(updater.os, "link", no_link)
+    monkeypatch.setattr(updater.fcntl, "ioctl", no_reflink)
+    bob_cache = configure(updater, tmp_path / "bob", shared_dir)
+    downloader = updater.Downloader()
+
+    path = downloader.get_valid_cached_package("1.0")
+
+    assert path == shared_dir / name
+    assert downloader.verify_package_digest(path)
+    assert not (bob_cache / name).exists()
+    assert len(http_server.requests) == 1
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "geteuid") or os.geteuid() != 0,
+    reason="needs root to run the reader as another user",
+)
+def test_non_owner_reader_does_not_copy_shared_file(
+    monkeypatch, updater, http_server, configure
+):
+    if Path("/proc/sys/fs/protected_hardlinks").read_text().strip() != "1":
+        pytest.skip("fs.protected_hardlinks is off")
+    nobody = pwd.getpwnam("nobody")
+    python = _python_for(nobody)
+    if python is None:
+        pytest.skip("no Python interpreter available to the nobody user")
+    # tmp_path pytest доступен только root: общий каталог — в отдельном
+    root = Path(tempfile.mkdtemp())
+    try:
+        os.chmod(root, 0o755)
+        # Читатель — участник группы общего кэша, но не владелец файлов
+        shared_dir = root / "shared"
+        shared_dir.mkdir()
+        os.chown(shared_dir, -1, nobody.pw_gid)
+        os.chmod(shared_dir, 0o2775)
+        name, body = _serve(updater, http_server)
+        configure(updater, root / "alice", shared_dir)
+        assert updater.Downloader().download_package("1.0")
+
+        reader_home = root / "reader"
+        reader_home.mkdir()
+        os.chown(reader_home, nobody.pw_uid, nobody.pw_gid)
+        script = root / "chromium-gost-updater.py"
+        shutil.copyfile(updater.__file__, script)
+        reader = subprocess.run(
+            [python, "-c", _READER, str(script), str(shared_dir)],
+            env={"HOME": str(reader_home), "PATH": os.environ.get("PATH", "")},
+            capture_output=True,
+            text=True,
+            timeout=60,
+            user=nobody.pw_uid,
+            group=nobody.pw_gid,
+        )
+
+        assert reader.returncode == 0, reader.stderr
+        path, copies = reader.stdout.split()
+        assert Path(path) == shared_dir / name
+        assert copies == "0"
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _python_for(user) -> str | None:
+    """Интерпретатор (3.10+), который может запустить пользователь user."""
+    for python in (sys.executable, shutil.which("python3", path=os.defpath)):
+        if not python:
+            continue
+        try:
+            probe = subprocess.run(
+                [python, "-c", "import sys; assert sys.version_info >= (3, 10)"],
+                capture_output=True,
+                timeout=30,
+                user=user.pw_uid,
+                group=user.pw_gid,
+            )
+        except OSError:
+            continue
+        if probe.returncode == 0:
+            return python
+    return None
+
+
+# Читатель общего кэша в отдельном процессе (запускается от другого пользователя)
+_READER = """
+import importlib.util, sys
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location("reader", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+module.IS_WINDOWS = False
+module.validate_artifact = lambda *args: True
+module.PACKAGE_MANAGER.get_extension = lambda: "deb"
+module.SHARED_CACHE = module.SharedCache(Path(sys.argv[2]))
+path = module.Downloader().get_valid_cached_package("1.0")
+copies = len(list(module.CACHE_PACKAGES_DIR.glob("chromium-gost-*")))
+print(path, copies)
+"""
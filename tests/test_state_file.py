@@ -0,0 +1,45 @@
+import threading
+
+
+def test_update_state_serializes_processes(
+    monkeypatch, updater, peer_updater, tmp_path
+):
+    # Две копии модуля — как два процесса: у каждой свой _STATE_LOCK,
+    # общий только flock на state.json.lock
+    state_file = tmp_path / "state.json"
+    monkeypatch.setattr(updater, "STATE_FILE", state_file)
+    monkeypatch.setattr(peer_updater, "STATE_FILE", state_file)
+
+    def bump(module):
+        def mutate(state):
+            state["count"] = state.get("count", 0) + 1
+
+        for _ in range(50):
+            module.update_state(mutate)
+
+    workers = [
+        threading.Thread(target=bump, args=(module,))
+        for module in (updater, peer_updater)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+
+    assert updater.load_state() == {"count": 100}
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "state.json",
+        "state.json.lock",
+    ]
+
+
+def test_nested_update_state_does_not_deadlock(monkeypatch, updater, tmp_path):
+    monkeypatch.setattr(updater, "STATE_FILE", tmp_path / "state.json")
+
+    def outer(state):
+        updater.update_state(lambda inner: inner.update(inner=True))
+        state["outer"] = True
+
+    updater.update_state(outer)
+
+    assert updater.load_state() == {"outer": True}
@@ -0,0 +1,40 @@
+import threading
+import time
+
+
+def test_identical_tasks_coalesce_and_concurrency_is_bounded(updater):
+    runner = updater.TaskRunner(max_workers=2)
+    release = threading.Event()
+    lock = threading.Lock()
+    calls = {"check": 0}
+    running = {"now": 0, "max": 0}
+
+    def task(name):
+        def run():
+            with lock:
+                calls[name] = calls.get(name, 0) + 1
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            release.wait(5)
+            with lock:
+                running["now"] -= 1
+
+        return run
+
+    # Пять нажатий «Проверить сейчас» подряд — одна проверка
+    futures = [runner.submit("check", task("check")) for _ in range(5)]
+    assert len(set(futures)) == 1
+    others = [runner.submit(name, task(name)) for name in ("forum", "install")]
+    time.sleep(0.2)
+    assert running["max"] == 2
+
+    release.set()
+    for future in futures + others:
+        future.result(5)
+    assert calls == {"check": 1, "forum": 1, "install": 1}
+    assert running["max"] == 2
+
+    # После завершения тот же ключ снова запускается
+    runner.submit("check", task("check")).result(5)
+    assert calls["check"] == 2
+    runner.shutdown()
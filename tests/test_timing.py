@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+def test_timed_span_accumulates_wall_and_cpu(updater):
+    with updater.timed_span("unit_phase"):
+        sum(range(10000))
+    with updater.timed_span("unit_phase"):
+        pass
+
+    stats = updater.get_phase_timings()["unit_phase"]
+    assert stats["count"] == 2
+    assert stats["wall"] >= stats["max_wall"] >= 0
+    assert stats["cpu"] >= 0
+
+
+def test_timed_span_as_decorator_records_on_exception(updater):
+    @updater.timed_span("failing_phase")
+    def failing():
+        raise ValueError("boom")
+
+    for _ in range(2):
+        try:
+            failing()
+        except ValueError:
+            pass
+
+    assert updater.get_phase_timings()["failing_phase"]["count"] == 2
+
+
+def test_timing_summary_is_keyed_by_session_id(updater):
+    with updater.timed_span("summary_phase"):
+        pass
+
+    summary = updater.format_timing_summary()
+    assert summary.startswith(f"timing summary session={updater.SESSION_ID}:")
+    assert "summary_phase: n=1" in summary
+
+
+def test_run_main_dumps_profile_next_to_log_file(monkeypatch, updater, tmp_path):
+    log_file = tmp_path / "chromium-gost-updater.log"
+    calls = []
+    monkeypatch.setattr(updater, "LOG_FILE", log_file)
+    monkeypatch.setattr(updater, "main", lambda: calls.append("main"))
+    monkeypatch.setenv(updater.PROFILE_ENV_VAR, "1")
+
+    updater.run_main()
+
+    assert calls == ["main"]
+    assert (tmp_path / f"chromium-gost-updater-{updater.SESSION_ID}.prof").exists()
+
+
+def test_timed_span_excludes_cpu_of_other_threads(updater):
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=spin)
+    worker.start()
+    try:
+        with updater.timed_span("idle_phase"):
+            time.sleep(0.3)
+    finally:
+        stop.set()
+        worker.join()
+
+    # Соседний поток занят всё это время, но фаза сама только спала
+    assert updater.get_phase_timings()["idle_phase"]["cpu"] < 0.1
@@ -0,0 +1,119 @@
+import threading
+import time
+
+CLICK_BUDGET_SEC = 0.005
+
+
+def _slow(*args, **kwargs):
+    time.sleep(0.5)
+    raise AssertionError("blocking call from the GUI thread")
+
+
+def _setup(monkeypatch, updater, cache_dir):
+    monkeypatch.setattr(updater, "IS_WINDOWS", False)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_extension", lambda: "deb")
+
+    class FakeBackend(updater.GuiBackend):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def show_tray_if_hidden(self):
+            pass
+
+        def show_tray_message(self, message, timeout=3000):
+            self.calls.append(("message", message))
+
+        def show_install_dialog(self, updater_app):
+            self.calls.append(("install", self._build_install_dialog_message(updater_app)))
+
+        def update_install_menu_visibility(self, updater_app):
+            self.calls.append(("menu", updater_app.has_ready_package()))
+
+    backend = FakeBackend()
+    monkeypatch.setattr(updater, "GUI_BACKEND", backend)
+    return backend
+
+
+def _click(app):
+    started = time.perf_counter()
+    app.handle_left_or_double_click()
+    return time.perf_counter() - started
+
+
+def test_click_reads_state_without_blocking(monkeypatch, updater, cache_dir):
+    backend = _setup(monkeypatch, updater, cache_dir)
+    package = cache_dir / "chromium-gost-2.0-linux-amd64.deb"
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_local_version", lambda: "1.0")
+    monkeypatch.setattr(updater.DOWNLOADER, "get_remote_version", lambda: "2.0")
+    monkeypatch.setattr(
+        updater.DOWNLOADER, "get_valid_cached_package", lambda version: package
+    )
+    app = updater.UpdaterAppImpl()
+    # Фоновая проверка: здесь дистрибутив проверяется и попадает в UpdateState
+    app.check_package_versions()
+    assert app.update_state.ready_package() == package
+
+    # Клик только читает состояние: валидация и манифест недоступны
+    monkeypatch.setattr(updater, "validate_artifact", _slow)
+    monkeypatch.setattr(updater.DOWNLOADER, "get_valid_cached_package", _slow)
+    monkeypatch.setattr(updater.DOWNLOADER, "_load_cache_manifest", _slow)
+    # Сверка SHA-256 перед установкой идёт в фоне, не в обработчике клика
+    verified = threading.Event()
+
+    def verify_package_digest(path):
+        verified.set()
+        return True
+
+    monkeypatch.setattr(
+        updater.DOWNLOADER, "verify_package_digest", verify_package_digest
+    )
+    latencies = [_click(app) for _ in range(20)]
+    assert max(latencies) < CLICK_BUDGET_SEC
+    assert verified.wait(5)
+    for _ in range(100):
+        if backend.calls[-1][0] == "install":
+            break
+        time.sleep(0.01)
+    assert backend.calls[-1][0] == "install"
+    assert str(package) in backend.calls[-1][1]
+
+    # Идёт скачивание: клик показывает ход из состояния
+    app.update_state.set_ready_package(None, None)
+    app.update_state.status = updater.UpdateState.DOWNLOADING
+    app.update_state.progress = updater.DownloadProgress(1024, 2048, 512.0, 2.0)
+    assert _click(app) < CLICK_BUDGET_SEC
+    assert "Скачивается chromium-gost-2.0" in backend.calls[-1][1]
+
+
+def test_click_starts_download_in_background(monkeypatch, updater, cache_dir):
+    backend = _setup(monkeypatch, updater, cache_dir)
+    package = cache_dir / "chromium-gost-2.0-linux-amd64.deb"
+    release = threading.Event()
+    monkeypatch.setattr(updater, "validate_artifact", _slow)
+    monkeypatch.setattr(updater.DOWNLOADER, "get_valid_cached_package", _slow)
+
+    def download_package(version, force=False, progress_callback=None, cancel=None):
+        assert threading.current_thread() is not threading.main_thread()
+        release.wait(5)
+        return package
+
+    monkeypatch.setattr(updater.DOWNLOADER, "download_package", download_package)
+    idle = dict.fromkeys(("metered", "on_battery", "load", "pressure"), lambda: None)
+    monkeypatch.setattr(updater, "DOWNLOAD_POLICY", updater.DownloadPolicy(idle))
+    app = updater.UpdaterAppImpl()
+    app.current_package_versions.set_local("1.0")
+    app.current_package_versions.set_remote("2.0")
+
+    assert _click(app) < CLICK_BUDGET_SEC
+    assert app.update_state.downloading
+    assert _click(app) < CLICK_BUDGET_SEC
+    release.set()
+    for _ in range(100):
+        if not app.update_state.downloading:
+            break
+        time.sleep(0.05)
+
+    # Итог скачивания приходит в GUI через UpdateState
+    assert app.get_ready_package() == package
+    assert ("menu", True) in backend.calls
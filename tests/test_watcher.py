@@ -0,0 +1,51 @@
+import queue
+
+import pytest
+
+
+def test_watcher_debounces_and_filters_by_name(updater, tmp_path):
+    if updater.FileWatcher._libc() is None:
+        pytest.skip("inotify unavailable")
+    dpkg_dir, cache_dir = tmp_path / "dpkg", tmp_path / "cache"
+    dpkg_dir.mkdir()
+    cache_dir.mkdir()
+    changes = queue.Queue()
+    watcher = updater.FileWatcher(changes.put, debounce=0.2)
+    watcher.watch(dpkg_dir, "packages", lambda name: name.startswith("status"))
+    watcher.watch(cache_dir, "cache")
+    assert watcher.start()
+    try:
+        (dpkg_dir / "lock").write_text("")
+        with pytest.raises(queue.Empty):
+            changes.get(timeout=0.5)
+
+        # dpkg: status-new, затем переименование в status; плюс файл в кэше
+        (dpkg_dir / "status-new").write_text("Package: chromium-gost-stable\n")
+        (dpkg_dir / "status-new").rename(dpkg_dir / "status")
+        (cache_dir / "chromium-gost-2.0-linux-amd64.deb").write_bytes(b"x")
+
+        assert changes.get(timeout=3) == {"packages", "cache"}
+        with pytest.raises(queue.Empty):
+            changes.get(timeout=0.5)
+    finally:
+        watcher.stop()
+
+
+def test_package_install_clears_tray_error(monkeypatch, updater, cache_dir):
+    errors = []
+    monkeypatch.setattr(updater.GUI_BACKEND, "set_tray_error_state", errors.append)
+    monkeypatch.setattr(
+        updater.GUI_BACKEND, "update_install_menu_visibility", lambda app: None
+    )
+    monkeypatch.setattr(updater.DOWNLOADER, "get_valid_cached_package", lambda v: None)
+    monkeypatch.setattr(updater.PACKAGE_MANAGER, "get_local_version", lambda: "2.0")
+    app = updater.UpdaterAppImpl()
+    app.state["ignored_versions"] = ["2.0"]
+    app.current_package_versions.set_local("1.0")
+    app.current_package_versions.set_remote("2.0")
+
+    app._on_files_changed({"packages"})
+
+    assert app.current_package_versions.local() == "2.0"
+    assert app.state["ignored_versions"] == []
+    assert errors == [False]